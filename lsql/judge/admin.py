@@ -19,7 +19,7 @@ class SelectProblemAdmin(admin.ModelAdmin):
     fieldsets = [
         ('ZIP file (if present, it will overwrite the rest of fields)', {'fields': ['zipfile']}),
         ('Basic Information', {'fields': ['language', 'title_md', 'text_md', 'min_stmt', 'max_stmt', 'collection',
-                                          'position', 'check_order']}),
+                                          'position', 'check_order', 'plan_cost_factor']}),
         ('SQL', {'fields': ['create_sql', 'insert_sql', 'solution']}),
     ]
     list_display = ('pk', 'title_md', 'creation_date', 'collection', 'author')
@@ -39,7 +39,7 @@ class DMLProblemAdmin(admin.ModelAdmin):
     fieldsets = [
         ('ZIP file (if present, it will overwrite the rest of fields)', {'fields': ['zipfile']}),
         ('Basic Information', {'fields': ['language', 'title_md', 'text_md', 'min_stmt', 'max_stmt', 'collection',
-                                          'position', 'check_order']}),
+                                          'position', 'check_order', 'plan_cost_factor']}),
         ('SQL', {'fields': ['create_sql', 'insert_sql', 'solution']}),
     ]
     list_display = ('pk', 'title_md', 'creation_date', 'collection', 'author')
@@ -143,9 +143,9 @@ class CollectionAdmin(admin.ModelAdmin):
     fieldsets = [
         ('If provided, loads problems from ZIP file and add them to the collection',
          {'fields': ('zipfile', )}),
-        ('Collection data', {'fields': ('name_md', 'position', 'description_md', 'visible')})
+        ('Collection data', {'fields': ('name_md', 'position', 'description_md', 'visible', 'engine')})
     ]
-    list_display = ('pk', 'name_md', 'creation_date', 'author', 'visible')
+    list_display = ('pk', 'name_md', 'creation_date', 'author', 'visible', 'engine')
     list_filter = ['creation_date']
 
     def save_model(self, request, obj, form, change):
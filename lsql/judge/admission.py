@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright Enrique Martín <emartinm@ucm.es> 2020
+
+Admission control in front of the executors: submissions wait in a bounded queue until one of the judging slots is
+free, each user has at most one submission being judged, and the slots are given in turns to the users with waiting
+submissions (first the staff, then the students and finally the rejudges)
+"""
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+from contextlib import asynccontextmanager
+from enum import IntEnum
+import asyncio
+import math
+import os
+import threading
+import time
+
+from logzero import logger
+
+from .exceptions import AdmissionRejected
+
+
+class JudgePriority(IntEnum):
+    """Priority classes of the submissions, the greater the sooner they are judged"""
+    REJUDGE = 0
+    STUDENT = 1
+    STAFF = 2
+
+
+class Ticket:
+    """Submission waiting for a judging slot. 'grant' is completed when the slot is given to the submission"""
+    def __init__(self, user, priority):
+        self.user = user
+        self.priority = priority
+        self.grant = Future()
+        self.granted = False
+
+
+class AdmissionControl:
+    """Bounded queue of submissions with fair scheduling between users. It can be used from several threads and
+    event loops at the same time"""
+
+    def __init__(self, slots, max_queue, timeout_s):
+        self.slots = slots
+        self.max_queue = max_queue
+        self.timeout_s = timeout_s
+        self.lock = threading.Lock()
+        self.running = set()  # Users with a submission being judged
+        # For each priority, users with waiting submissions in the order of their next turn
+        self.waiting = {priority: OrderedDict() for priority in JudgePriority}
+        self.num_waiting = 0
+        self.avg_judge_s = 1.0  # Moving average of the time needed to judge a submission
+
+    def retry_after(self):
+        """Estimated seconds until the queue has room for another submission"""
+        return max(1, math.ceil(self.avg_judge_s * (self.num_waiting / self.slots + 1)))
+
+    def enqueue(self, user, priority):
+        """Puts a submission of 'user' in the queue, or raises AdmissionRejected if the queue is full"""
+        with self.lock:
+            if self.num_waiting >= self.max_queue:
+                logger.info('Admission queue full, rejecting submission of %s', user)
+                raise AdmissionRejected(self.retry_after())
+            ticket = Ticket(user, priority)
+            self.waiting[priority].setdefault(user, deque()).append(ticket)
+            self.num_waiting += 1
+            self.dispatch()
+            return ticket
+
+    def dispatch(self):
+        """Gives the free slots to the waiting submissions, taking turns between users. Needs self.lock"""
+        while len(self.running) < self.slots:
+            ticket = self.next_ticket()
+            if ticket is None:
+                return
+            if ticket.grant.set_running_or_notify_cancel():
+                ticket.granted = True
+                self.running.add(ticket.user)
+                ticket.grant.set_result(True)
+
+    def next_ticket(self):
+        """Removes from the queue the first submission of the next user without submissions being judged, starting by
+        the greatest priority. Needs self.lock"""
+        for priority in sorted(JudgePriority, reverse=True):
+            users = self.waiting[priority]
+            for user, tickets in users.items():
+                if user not in self.running:
+                    ticket = tickets.popleft()
+                    del users[user]
+                    if tickets:
+                        users[user] = tickets  # The user goes to the end of the turns
+                    self.num_waiting -= 1
+                    return ticket
+        return None
+
+    def cancel(self, ticket):
+        """Removes a submission that will not wait for its slot any longer, or releases the slot if it has been given
+        to the submission in the meantime"""
+        with self.lock:
+            if ticket.granted:
+                self.running.discard(ticket.user)
+            else:
+                tickets = self.waiting[ticket.priority].get(ticket.user)
+                if tickets is not None and ticket in tickets:
+                    tickets.remove(ticket)
+                    self.num_waiting -= 1
+                    if not tickets:
+                        del self.waiting[ticket.priority][ticket.user]
+            self.dispatch()
+
+    def release(self, ticket, elapsed_s):
+        """Frees the slot of a judged submission"""
+        with self.lock:
+            self.avg_judge_s = 0.9 * self.avg_judge_s + 0.1 * elapsed_s
+            self.running.discard(ticket.user)
+            self.dispatch()
+
+    @asynccontextmanager
+    async def admitted(self, user, priority=JudgePriority.STUDENT):
+        """Waits for a judging slot for a submission of 'user' and frees it when leaving the block. Raises
+        AdmissionRejected if the queue is full or the submission has waited more than self.timeout_s seconds"""
+        ticket = self.enqueue(user, priority)
+        try:
+            await asyncio.wait_for(asyncio.wrap_future(ticket.grant), self.timeout_s)
+        except asyncio.TimeoutError as excp:
+            self.cancel(ticket)
+            raise AdmissionRejected(self.retry_after()) from excp
+        except BaseException:
+            self.cancel(ticket)  # The request has been cancelled
+            raise
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(ticket, time.monotonic() - start)
+
+
+ADMISSION = None  # AdmissionControl of the process, created on first use
+
+
+def admission_control():
+    """AdmissionControl with JUDGE_ADMISSION_SLOTS slots, or None if JUDGE_ADMISSION_SLOTS is not greater than 0"""
+    global ADMISSION  # pylint: disable=global-statement
+    slots = int(os.environ.get('JUDGE_ADMISSION_SLOTS', 0))
+    if slots <= 0:
+        return None
+    if ADMISSION is None:
+        ADMISSION = AdmissionControl(slots, int(os.environ.get('JUDGE_ADMISSION_QUEUE', 100)),
+                                     float(os.environ.get('JUDGE_ADMISSION_TIMEOUT_S', 60)))
+    return ADMISSION
@@ -19,7 +19,7 @@ from django.core.mail import mail_admins
 
 import lsql.settings
 
-from .oracle_driver import clean_sql
+from .oracle_sql import clean_sql, cached_setup_plan
 from .exceptions import DESException
 from .types import DesMessageType
 
@@ -116,8 +116,9 @@ def create_des_input_select(create: str, insert: str, query: str) -> str:
     ## input_stream.write('/date_format DD/MM/YYYY\n')  # Same format as Oracle
     # des_input += '/sql\n'
     des_input = ''
-    create_statements = clean_sql(create)
-    insert_statements = clean_sql(insert)
+    plan = cached_setup_plan(create, insert)
+    create_statements = plan['create']
+    insert_statements = plan['insert']
     for stmt in create_statements + insert_statements:
         flat_stmt = stmt.strip().replace('\n', '')
         des_input += f"/tapi {flat_stmt}\n"
@@ -133,8 +134,9 @@ def create_des_input_dml(create: str, insert: str, dml: str) -> str:
     ##  input_stream.write('/date_format DD/MM/YYYY\n')  # Same format as Oracle
     #des_input += '/sql\n'
     des_input = ''
-    create_statements = clean_sql(create)
-    insert_statements = clean_sql(insert)
+    plan = cached_setup_plan(create, insert)
+    create_statements = plan['create']
+    insert_statements = plan['insert']
     for stmt in create_statements + insert_statements:
         flat_stmt = stmt.strip().replace('\n', '')
         des_input += f"/tapi {flat_stmt}\n"
@@ -250,8 +252,9 @@ class DesExecutor:
 
             output = execute_des_script(path)
 
-            create_statements = clean_sql(create)
-            insert_statements = clean_sql(insert)
+            plan = cached_setup_plan(create, insert)
+            create_statements = plan['create']
+            insert_statements = plan['insert']
             num_commands = len(create_statements) + len(insert_statements) + 1
             msgs = parse_tapi_commands(output, num_commands, pos=0)
             if not len(msgs) == num_commands:
@@ -290,8 +293,9 @@ class DesExecutor:
 
             output = execute_des_script(path)
 
-            create_statements = clean_sql(create)
-            insert_statements = clean_sql(insert)
+            plan = cached_setup_plan(create, insert)
+            create_statements = plan['create']
+            insert_statements = plan['insert']
             dml_statements = clean_sql(dml)
 
             num_commands = len(create_statements) + len(insert_statements) + len(dml_statements)
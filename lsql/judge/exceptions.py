@@ -27,3 +27,11 @@ class ExecutorException(Exception):
 
 class DESException(Exception):
     """ Error while invoking or parsing DES output """
+
+
+class AdmissionRejected(Exception):
+    """The queue of submissions waiting to be judged is full. 'retry_after' is the estimated number of seconds until
+    there is room again"""
+    def __init__(self, retry_after):
+        super().__init__(f'Submission rejected, retry after {retry_after} seconds')
+        self.retry_after = retry_after
@@ -7,6 +7,7 @@ Generation of feedback messages
 import re
 
 from django.template.loader import render_to_string
+from django.utils.html import escape
 from django.utils.translation import gettext_lazy as _
 from multiset import Multiset
 
@@ -221,6 +222,27 @@ def compare_db_results(expected_db, obtained_db):
     return verdict, feedback
 
 
+def compare_test_cases(names, expected_dbs, obtained_dbs):
+    """
+    Given the expected DBs and the obtained DBs after each test case of a problem, returns a verdict of the
+    comparison and its HTML feedback, that refers to the first incorrect test case
+    :param names: list with the name of each test case ('' if it has no name)
+    :param expected_dbs: list of dicts {table_name: dict}
+    :param obtained_dbs: list of dicts {table_name: dict}, None when the DB has the expected fingerprint
+    :return: (VerdictCode, str)
+    """
+    for name, expected_db, obtained_db in zip(names, expected_dbs, obtained_dbs):
+        if obtained_db is None:
+            continue
+        verdict, feedback = compare_db_results(expected_db, obtained_db)
+        if verdict != VerdictCode.AC:
+            if name:
+                feedback = _('<h4>Caso de prueba <code>{name}</code>:</h4>{feedback}').format(
+                    name=escape(name), feedback=feedback)
+            return verdict, feedback
+    return VerdictCode.AC, ''
+
+
 def compare_function_results(expected, obtained):
     """
     Given an expected DB and an obtained DB, returns a verdict of the comparison and its HTML feedback
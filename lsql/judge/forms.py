@@ -19,14 +19,15 @@ class FunctionProblemAdminForm(forms.ModelForm):
 
 class ProcProblemAdminForm(forms.ModelForm):
     """Customized form for ProcProblem in admin to have a better label"""
-    proc_call = forms.CharField(label='Procedure call to test (only one)',
+    proc_call = forms.CharField(label='Procedure call to test (several test cases starting with "-- CASE: name")',
                                 widget=forms.Textarea(attrs={'rows': 10, 'cols': 80}),
                                 required=False)
 
 
 class TriggerProblemAdminForm(forms.ModelForm):
     """Customized form for TriggerProblem in admin to have a better label"""
-    tests = forms.CharField(label='SQL statements to test the trigger (separated by ";" as usual)',
+    tests = forms.CharField(label='SQL statements to test the trigger (separated by ";" as usual, several test cases '
+                                  'starting with "-- CASE: name")',
                             widget=forms.Textarea(attrs={'rows': 10, 'cols': 80}),
                             required=False)
 
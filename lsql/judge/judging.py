@@ -0,0 +1,255 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright Enrique Martín <emartinm@ucm.es> 2020
+
+Judging of submissions, either directly in the view that receives them or by the workers of the persistent judge
+queue (see the judge_worker command)
+"""
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+import os
+import time
+
+from asgiref.sync import sync_to_async
+from logzero import logger
+from django.db import transaction, close_old_connections, OperationalError
+from django.template.loader import render_to_string
+from django.utils import translation, timezone
+from django.utils.translation import gettext_lazy as _
+
+from .exceptions import ExecutorException
+from .feedback import compile_error_to_html_table
+from .models import Problem, Submission, AchievementDefinition, NumSubmissionsProblemsAchievementDefinition, JudgeJob
+from .prescreen import prescreen
+from .types import VerdictCode, OracleStatusCode, ProblemType
+from .verdict_cache import verdict_cache
+
+
+def check_if_get_achievement(user, verdict):
+    """Check if the user get some achievement and return a list of obtained achievements"""
+    obtained_achievements = []
+    if verdict == VerdictCode.AC:
+        for ach in AchievementDefinition.objects.all().select_subclasses():
+            if ach.check_and_save(user):
+                obtained_achievements.append(ach)
+
+    # If the verdict != AC (correct) only can get a NumSubmissionsProblemsAchievementDefinition
+    else:
+        # pylint false positive E1133
+        for ach in NumSubmissionsProblemsAchievementDefinition.objects.all():  # pylint: disable=E1133
+            if ach.check_and_save(user):
+                obtained_achievements.append(ach)
+
+    return obtained_achievements
+
+
+def extend_dictionary_with_des(data, problem, code):
+    """ Extend the data that answers a submission with DES feedback (if needed) """
+    if problem.problem_type() in [ProblemType.SELECT, ProblemType.DML]:
+        messages_raw = problem.get_des_messages_solution(code)
+        # Extends the snippet to mark the position of the error and also extract line and column
+        messages = []
+        for (error_code, msg, snippet) in messages_raw:
+            if snippet and problem.problem_type() == ProblemType.SELECT:
+                len_last_line = len(snippet.strip().split('\n')[-1])
+                num_line = len(snippet.strip().split('\n'))
+                snippet += '.'*len_last_line + '^^^'
+                line_col = (num_line, len_last_line)
+            else:
+                line_col = None
+            messages.append((error_code, msg, snippet, line_col))
+        # We strip to avoid submitting empty strings
+        data['des'] = render_to_string('feedback_des.html', {'des_msgs': messages}).strip()
+
+
+def internal_error_data():
+    """Data that answers a submission that could not be judged"""
+    return {'verdict': VerdictCode.IE, 'title': VerdictCode.IE.label,
+            'message': VerdictCode.IE.message(), 'feedback': '', 'des': ''}
+
+
+# pylint does not understand the dynamic attributes in VerdictCode (TextChoices), so we need to disable
+# no-member warning in this specific function
+# pylint: disable=no-member
+def judge_code(problem, code):
+    """
+    Judges the code of a submission to a problem (an object of a subclass of Problem), or takes the answer from the
+    verdict cache (see verdict_cache) if it is enabled
+    :return: dict with the data that answers the submission: verdict, title, message, feedback and DES feedback, and
+             the position of the error for RE
+    """
+    cache = verdict_cache()
+    if cache is None:
+        return judge_code_uncached(problem, code)
+    data, same_code = cache.get(problem, code)
+    # The position of runtime errors and the DES snippets refer to the text of the code that was judged
+    if data is not None and (same_code or data['verdict'] != VerdictCode.RE):
+        logger.debug('Cached verdict for submission to problem PK=%s', problem.pk)
+        if not same_code:
+            extend_dictionary_with_des(data, problem, code)
+        return data
+    data = judge_code_uncached(problem, code)
+    cache.put(problem, code, data)
+    return data
+
+
+def judge_code_uncached(problem, code):
+    """Judges the code of a submission to a problem, see judge_code"""
+    data = internal_error_data()
+    try:
+        # AC or WA
+        logger.debug('Checking submission to problem PK=%s. Code: %s', problem.pk, code)
+        if int(os.environ.get('JUDGE_PRESCREEN', 0)) > 0:
+            prescreen(problem, code)  # Errors that do not need Oracle
+        data['verdict'], data['feedback'] = problem.judge(code, problem.executor())
+        data['title'] = data['verdict'].label
+        data['message'] = data['verdict'].message()
+        extend_dictionary_with_des(data, problem, code)  # Check DES if needed
+    except ExecutorException as excp:
+        # Exceptions when judging: RE, TLE, VE or IE
+        if excp.error_code == OracleStatusCode.EXECUTE_USER_CODE:
+            data['verdict'] = VerdictCode.RE
+            data['title'] = VerdictCode.RE.label
+            data['message'] = VerdictCode.RE.message()
+            data['feedback'] = (f'{excp.statement} --> {excp.message}'
+                                if problem.problem_type() == ProblemType.FUNCTION else excp.message)
+            data['position'] = excp.position
+            data['position_msg'] = _('Posición: línea {row}, columna {col}')\
+                .format(row=excp.position[0]+1, col=excp.position[1]+1)
+            extend_dictionary_with_des(data, problem, code)  # Check DES if needed
+        elif excp.error_code in (OracleStatusCode.TLE_USER_CODE, OracleStatusCode.TLE_PLAN_COST):
+            data['verdict'] = VerdictCode.TLE
+            data['title'] = VerdictCode.TLE.label
+            data['message'] = VerdictCode.TLE.message()
+            if excp.error_code == OracleStatusCode.TLE_PLAN_COST:
+                # The code has not been executed, the most expensive step of its plan explains why
+                data['feedback'] = _('El coste estimado de tu código es demasiado alto. Paso más costoso del plan '
+                                     'de ejecución: {step}').format(step=excp.message)
+            extend_dictionary_with_des(data, problem, code)  # Check DES if needed
+        elif excp.error_code == OracleStatusCode.NUMBER_STATEMENTS:
+            data['verdict'] = VerdictCode.VE
+            data['title'] = VerdictCode.VE.label
+            data['message'] = VerdictCode.VE.message(problem)
+            data['feedback'] = ''  # Feedback not needed
+        elif excp.error_code == OracleStatusCode.COMPILATION_ERROR:
+            data['verdict'] = VerdictCode.WA
+            data['title'] = VerdictCode.WA.label
+            data['message'] = VerdictCode.WA.message()
+            data['feedback'] = compile_error_to_html_table(excp.message)
+    return data
+
+
+JUDGE_THREADS = None  # Threads that judge the submissions received by the async view, created on first use
+
+
+def judge_threads():
+    """Pool of JUDGE_ASYNC_THREADS threads (by default 16) shared by all the submissions judged asynchronously"""
+    global JUDGE_THREADS  # pylint: disable=global-statement
+    if JUDGE_THREADS is None:
+        JUDGE_THREADS = ThreadPoolExecutor(max_workers=int(os.environ.get('JUDGE_ASYNC_THREADS', 16)),
+                                           thread_name_prefix='judge')
+    return JUDGE_THREADS
+
+
+async def judge_code_async(problem, code):
+    """
+    Judges the code of a submission without blocking the event loop: the executors and DES run in the threads of
+    judge_threads(), so an ASGI process keeps serving other requests while the submission waits for the database
+    :return: same dict as judge_code
+    """
+    def judge_in_thread():
+        close_old_connections()  # These threads are not finished by Django requests, so they close their connections
+        return judge_code(problem, code)
+    return await sync_to_async(judge_in_thread, thread_sensitive=False, executor=judge_threads())()
+
+
+def store_submission(user, problem, code, data):
+    """
+    Stores the submission with the verdict in 'data' and extends 'data' with the HTML notice of the achievements
+    obtained by the user
+    :return: Submission
+    """
+    submission = Submission(code=code[:5000], verdict_code=data['verdict'], verdict_message=data['message'],
+                            user=user, problem=problem)
+    submission.save()
+
+    # Look for obtained achievements
+    achievement_list = check_if_get_achievement(user, data['verdict'])
+    if achievement_list:
+        context = {'achievement_list': achievement_list, 'user': user.pk}
+        html = render_to_string('achievement_notice.html', context)
+        data['achievements'] = html
+    logger.debug('Stored submission %s', submission)
+    return submission
+
+
+def judge_job(job):
+    """
+    Judges a job claimed from the judge queue, stores its submission and marks it as done. If the job has been
+    claimed again by another worker in the meantime (because this one took too long), the result is discarded
+    :return: bool, the job has been completed by this worker
+    """
+    problem = Problem.objects.filter(pk=job.problem_id).select_subclasses().first()
+    with translation.override(job.language):  # Messages in the language of the user
+        try:
+            data = judge_code(problem, job.code)
+        except Exception:  # pylint: disable=broad-except
+            logger.exception('Unable to judge job %s', job.pk)
+            data = internal_error_data()
+        return store_job_result(job, problem, data)
+
+
+def store_job_result(job, problem, data):
+    """Stores the submission of a judged job and its result, unless the job has been claimed by another worker"""
+    with transaction.atomic():
+        current = JudgeJob.objects.select_for_update().get(pk=job.pk)
+        if current.state != JudgeJob.State.RUNNING or current.start_date != job.start_date:
+            logger.info('Job %s has been claimed by another worker', job.pk)
+            return False
+        job.submission = store_submission(job.user, problem, job.code, data)
+        job.result = data
+        job.state = JudgeJob.State.DONE
+        job.save(update_fields=['submission', 'result', 'state'])
+    return True
+
+
+def purge_done_jobs(retention_s):
+    """
+    Deletes the judged jobs started more than 'retention_s' seconds ago, as their users have already read their
+    status (their submissions are kept)
+    :return: number of jobs deleted
+    """
+    stale = timezone.now() - timedelta(seconds=retention_s)
+    deleted, _ = JudgeJob.objects.filter(state=JudgeJob.State.DONE, start_date__lt=stale).delete()
+    return deleted
+
+
+def run_worker(max_jobs=None):
+    """
+    Judges the jobs of the judge queue forever, waiting JUDGE_QUEUE_POLL_S seconds (by default 1) when the queue is
+    empty. If 'max_jobs' is not None, it stops after judging 'max_jobs' jobs or when the queue is empty. Running jobs
+    older than JUDGE_QUEUE_TIMEOUT_S seconds (by default 300) are judged again, as their worker has probably died,
+    and judged jobs older than JUDGE_QUEUE_RETENTION_S seconds (by default 3600) are deleted when the queue is empty.
+    Errors of the Django DB (for example, a restart of the DB server) are logged and the worker goes on
+    :return: number of jobs judged
+    """
+    poll_s = float(os.environ.get('JUDGE_QUEUE_POLL_S', 1))
+    timeout_s = int(os.environ.get('JUDGE_QUEUE_TIMEOUT_S', 300))
+    retention_s = int(os.environ.get('JUDGE_QUEUE_RETENTION_S', 3600))
+    judged = 0
+    while max_jobs is None or judged < max_jobs:
+        close_old_connections()  # The worker is not a request, so Django does not close broken or old connections
+        try:
+            job = JudgeJob.claim(timeout_s)
+            if job is None:
+                purge_done_jobs(retention_s)
+                if max_jobs is not None:
+                    break
+                time.sleep(poll_s)
+            else:
+                judge_job(job)
+                judged += 1
+        except OperationalError as excp:  # pragma: no cover
+            logger.error('Unable to access the judge queue (%s)', excp)
+            time.sleep(poll_s)
+    return judged
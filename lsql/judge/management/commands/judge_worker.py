@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright Enrique Martín <emartinm@ucm.es> 2020
+
+Command that judges the submissions of the persistent judge queue (see judging.run_worker). Several workers can run
+at the same time, in this machine or in others with access to the database of Django:
+
+    python manage.py judge_worker [--max-jobs N]
+"""
+from django.core.management.base import BaseCommand
+
+from judge.judging import run_worker
+
+
+class Command(BaseCommand):
+    """Worker of the judge queue"""
+    help = 'Judges the submissions of the judge queue'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--max-jobs', type=int, default=None,
+                            help='Stops after judging this number of jobs or when the queue is empty')
+
+    def handle(self, *args, **options):
+        judged = run_worker(options['max_jobs'])
+        self.stdout.write(f'{judged} jobs judged')
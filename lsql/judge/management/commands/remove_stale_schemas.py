@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright Enrique Martín <emartinm@ucm.es> 2020
+
+Command that removes the shared and master schemas of Oracle that no problem uses anymore, for example the schemas of
+old versions of edited problems (see OracleExecutor.remove_shared_schemas):
+
+    python manage.py remove_stale_schemas [--age SECONDS]
+"""
+from django.core.management.base import BaseCommand
+
+from judge.models import Problem
+from judge.oracle_driver import OracleExecutor
+from judge.oracle_sql import content_hash
+
+
+def live_hashes():
+    """Content hashes of the setup plans of all the problems, stored or computed from their scripts"""
+    hashes = set()
+    for problem in Problem.objects.select_subclasses():
+        hashes.update(plan['hash'] for plan in problem.setup_plans or [])
+        hashes.update(content_hash(problem.create_sql, insert_sql) for insert_sql in problem.setup_inserts())
+    return hashes
+
+
+class Command(BaseCommand):
+    """Sweep of stale shared schemas"""
+    help = 'Removes the shared and master schemas of Oracle that no problem uses'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--age', type=int, default=3600,
+                            help='Only removes the schemas created more than this number of seconds ago')
+
+    def handle(self, *args, **options):
+        OracleExecutor.get().remove_shared_schemas(live_hashes(), options['age'])
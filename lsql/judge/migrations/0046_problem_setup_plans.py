@@ -0,0 +1,19 @@
+# Generated by Django 6.0.3 on 2026-10-17 09:00
+
+import django.core.serializers.json
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('judge', '0045_alter_collection_options'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='problem',
+            name='setup_plans',
+            field=models.JSONField(blank=True, default=None, encoder=django.core.serializers.json.DjangoJSONEncoder, null=True),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 6.0.3 on 2026-10-17 10:00
+
+import django.core.serializers.json
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('judge', '0046_problem_setup_plans'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dmlproblem',
+            name='expected_fingerprint',
+            field=models.JSONField(blank=True, default=None, encoder=django.core.serializers.json.DjangoJSONEncoder, null=True),
+        ),
+        migrations.AddField(
+            model_name='procproblem',
+            name='expected_fingerprint',
+            field=models.JSONField(blank=True, default=None, encoder=django.core.serializers.json.DjangoJSONEncoder, null=True),
+        ),
+        migrations.AddField(
+            model_name='triggerproblem',
+            name='expected_fingerprint',
+            field=models.JSONField(blank=True, default=None, encoder=django.core.serializers.json.DjangoJSONEncoder, null=True),
+        ),
+    ]
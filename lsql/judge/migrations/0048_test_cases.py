@@ -0,0 +1,24 @@
+# Generated by Django 6.0.3 on 2026-10-17 11:00
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('judge', '0047_expected_fingerprint'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='procproblem',
+            name='proc_call',
+            field=models.TextField(blank=True, max_length=5000, validators=[django.core.validators.MinLengthValidator(1)]),
+        ),
+        migrations.AlterField(
+            model_name='triggerproblem',
+            name='tests',
+            field=models.TextField(blank=True, max_length=5000, validators=[django.core.validators.MinLengthValidator(1)]),
+        ),
+    ]
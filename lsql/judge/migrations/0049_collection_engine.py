@@ -0,0 +1,18 @@
+# Generated by Django 6.0.3 on 2026-10-17 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('judge', '0048_test_cases'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='collection',
+            name='engine',
+            field=models.CharField(choices=[('ORACLE', 'Oracle'), ('SQLITE', 'SQLite')], default='ORACLE', max_length=10),
+        ),
+    ]
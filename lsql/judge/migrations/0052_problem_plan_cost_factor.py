@@ -0,0 +1,18 @@
+# Generated by Django 6.0.3 on 2026-10-17 15:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('judge', '0051_judgejob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='problem',
+            name='plan_cost_factor',
+            field=models.FloatField(blank=True, default=None, null=True),
+        ),
+    ]
@@ -4,6 +4,9 @@ Copyright Enrique Martín <emartinm@ucm.es> 2020
 
 Models to store objects in the DB
 """
+import functools
+import os
+from datetime import timedelta
 from zipfile import ZipFile
 
 import markdown
@@ -14,19 +17,26 @@ from django.core.exceptions import ValidationError
 from django.core.mail import mail_admins
 from django.core.serializers.json import DjangoJSONEncoder
 from django.core.validators import MinLengthValidator
-from django.db import models
-from django.db.models import JSONField, Min
-from django.utils import timezone
-from django.utils import translation
+from django.db import models, transaction
+from django.db.models import JSONField, Min, Q
+from django.utils import timezone, translation
 from model_utils.managers import InheritanceManager
 
 from .des_driver import DesExecutor
 from .exceptions import ZipFileParsingException, DESException
-from .feedback import compare_select_results, compare_db_results, compare_function_results, compare_discriminant_db
+from .feedback import compare_select_results, compare_db_results, compare_function_results, compare_discriminant_db, \
+    compare_test_cases
 from .oracle_driver import OracleExecutor
+from .oracle_sql import compile_setup, content_hash, cached_setup_plan, split_test_cases
+from .sqlite_driver import SQLiteExecutor
+from .postgres_driver import PostgresExecutor
 from .parse import load_select_problem, load_dml_problem, load_function_problem, load_proc_problem, \
     load_trigger_problem, load_discriminant_problem, get_problem_type_from_zip
-from .types import VerdictCode, ProblemType, DesMessageType
+from .types import VerdictCode, ProblemType, DesMessageType, ExecutionEngine
+
+# Executor of each engine (see Problem.executor)
+EXECUTORS = {ExecutionEngine.ORACLE: OracleExecutor, ExecutionEngine.SQLITE: SQLiteExecutor,
+             ExecutionEngine.POSTGRES: PostgresExecutor}
 
 
 def markdown_to_html(markdown_text, remove_initial_p=False):
@@ -112,6 +122,8 @@ class Collection(models.Model):
     author = models.ForeignKey(settings.AUTH_USER_MODEL, null=True, on_delete=models.SET_NULL)
     creation_date = models.DateTimeField(auto_now_add=True)
     visible = models.BooleanField(default=True)
+    # DBMS that judges the problems, if their type supports it (see Problem.ENGINES)
+    engine = models.CharField(max_length=10, choices=ExecutionEngine.choices, default=ExecutionEngine.ORACLE)
     # (Dirty) trick to load problems from a ZIP fil by editing a collection using the standard admin interface of Django
     zipfile = models.FileField(upload_to='problem_zips/', default=None, blank=True, null=True)
 
@@ -119,7 +131,11 @@ class Collection(models.Model):
         ordering = ["name_html", "-creation_date"]
 
     def clean(self):
-        """ Loads and overwrite data from the ZIP file (if it is set) and creates HTML from markdown """
+        """ Loads and overwrite data from the ZIP file (if it is set) and creates HTML from markdown. The engine cannot
+            change if there are problems, as they have been validated and their results computed with it """
+        if self.pk is not None and self.problem_set.exists() and \
+                Collection.objects.filter(pk=self.pk).exclude(engine=self.engine).exists():
+            raise ValidationError('The engine of a collection with problems cannot be changed', code='engine_changed')
         try:
             if self.zipfile:
                 load_many_problems(self.zipfile, self)
@@ -220,18 +236,26 @@ class Problem(models.Model):
     create_sql = models.TextField(max_length=20000, blank=True)
     insert_sql = models.TextField(max_length=20000, blank=True)
     initial_db = JSONField(encoder=DjangoJSONEncoder, default=None, blank=True, null=True)
+    # Precompiled setup plans of the schemas used when judging (see oracle_sql.compile_setup)
+    setup_plans = JSONField(encoder=DjangoJSONEncoder, default=None, blank=True, null=True)
     min_stmt = models.PositiveIntegerField(default=1)
     max_stmt = models.PositiveIntegerField(default=1)
     collection = models.ForeignKey(Collection, on_delete=models.CASCADE)
     author = models.ForeignKey(settings.AUTH_USER_MODEL, null=True, on_delete=models.SET_NULL)
     creation_date = models.DateTimeField(auto_now_add=True)
     position = models.PositiveIntegerField(default=1, null=False)
+    # Submissions whose estimated cost is greater than this factor times the cost of the solution get TLE without
+    # executing them (only SELECT and DML problems judged in Oracle). If empty, ORACLE_PLAN_COST_FACTOR is used
+    plan_cost_factor = models.FloatField(default=None, blank=True, null=True)
     # (Dirty) trick to upload ZIP files using the standard admin interface of Django
     zipfile = models.FileField(upload_to='problem_zips/', default=None, blank=True, null=True)
 
     # To query Problem and obtain subclass objects with '.select_subclasses()'
     objects = InheritanceManager()
 
+    # Engines that can judge this type of problem
+    ENGINES = (ExecutionEngine.ORACLE,)
+
     def clean(self):
         """Check the number of statements and creates HTML versions from MarkDown"""
         super().clean()
@@ -241,11 +265,26 @@ class Problem(models.Model):
 
         self.title_html = markdown_to_html(self.title_md, remove_initial_p=True)
         self.text_html = markdown_to_html(self.text_md, remove_initial_p=False)
+        self.setup_plans = [compile_setup(self.create_sql, insert_sql) for insert_sql in self.setup_inserts()]
 
     def __str__(self):
         """String to show in the Admin interface"""
         return f'(PK {self.pk}) {self.title_md}'
 
+    def executor(self):
+        """Executor of the engine chosen in the collection of the problem, or Oracle if this type of problem does not
+        support it"""
+        engine = self.collection.engine if self.collection_id is not None else ExecutionEngine.ORACLE
+        if engine not in self.ENGINES:
+            engine = ExecutionEngine.ORACLE
+        return EXECUTORS[engine].get()
+
+    def plan_gate(self):
+        """Pair (solution, factor) to reject submissions whose estimated cost is greater than 'factor' times the
+        cost of the solution (see oracle_db.check_plan_cost), or None if there is no limit"""
+        factor = self.plan_cost_factor or float(os.environ.get('ORACLE_PLAN_COST_FACTOR', 0))
+        return (self.solution, factor) if factor > 0 else None
+
     def template(self):
         """Name of the HTML template used to show the problem"""
         raise NotImplementedError
@@ -315,12 +354,27 @@ class Problem(models.Model):
         """ List containing all sql inserts """
         return self.insert_sql.split(self.__INSERT_SEPARATION)
 
+    def setup_inserts(self):
+        """ List with the INSERT scripts used to set up the schemas of the problem """
+        return [self.insert_sql]
+
+    def setup_plan(self, insert_sql):
+        """ Setup plan of the schema with the CREATE script and 'insert_sql', precompiled when saving the problem.
+            Plans of problems saved before storing plans (or whose scripts have changed since) are taken from an
+            in-process LRU cache """
+        plan_hash = content_hash(self.create_sql, insert_sql)
+        for plan in self.setup_plans or []:
+            if plan['hash'] == plan_hash:
+                return plan
+        return cached_setup_plan(self.create_sql, insert_sql)
+
 
 class SelectProblem(Problem):
     """Problem that requires a SELECT statement as solution"""
     check_order = models.BooleanField(default=False)
     solution = models.TextField(max_length=5000, validators=[MinLengthValidator(1)], blank=True)
     expected_result = JSONField(encoder=DjangoJSONEncoder, default=None, blank=True, null=True)
+    ENGINES = (ExecutionEngine.ORACLE, ExecutionEngine.SQLITE, ExecutionEngine.POSTGRES)
 
     class Meta:
         """ Changes the name displayed in the admin interface"""
@@ -335,14 +389,13 @@ class SelectProblem(Problem):
                 self.zipfile.close()  # Avoids ResourceWarning in Django storage.py
                 self.zipfile = None  # Avoids storing the file in the filesystem
             super().clean()
-            self.expected_result = []
-            self.initial_db = []
-            executor = OracleExecutor.get()
-            for insert_sql in self.insert_sql_list():
-                res = executor.execute_select_test((self.create_sql, insert_sql),
-                                                   self.solution, output_db=True)
-                self.expected_result.append(res['result'])
-                self.initial_db.append(res['db'])
+            executor = self.executor()
+            results = executor.run_in_order(
+                [functools.partial(executor.execute_select_test, self.setup_plan(insert_sql), self.solution,
+                                   output_db=True)
+                 for insert_sql in self.insert_sql_list()])
+            self.expected_result = [res['result'] for res in results]
+            self.initial_db = [res['db'] for res in results]
             # self.validate_des(DesMessageType.ERROR)  # DES validation of new problems is disabled
         except Exception as excp:
             raise ValidationError(excp) from excp
@@ -350,29 +403,37 @@ class SelectProblem(Problem):
     def template(self):
         return 'problem_select.html'
 
+    def setup_inserts(self):
+        return self.insert_sql_list()
+
+    def reference(self, index):
+        """ Reference solution and header of the expected result in the index-th DB, so the executor can compare
+            the rows in Oracle (see oracle_db.compare_select_in_db). None if the order of rows is relevant """
+        return None if self.check_order else (self.solution, self.expected_result[index]['header'])
+
+    def judge_db(self, code, executor, index, language=None):
+        """ Judges the code in the index-th test database, returning (verdict, feedback). The feedback is generated
+            in 'language' (the evaluation can run in a different thread) """
+        with translation.override(language):
+            oracle_result = executor.execute_select_test(self.setup_plan(self.insert_sql_list()[index]), code,
+                                                         output_db=False, reference=self.reference(index),
+                                                         plan_gate=self.plan_gate())
+            if oracle_result['result'] is None:  # Same rows as the solution, compared in Oracle
+                return VerdictCode.AC, ''
+            # The feedback of the first db does not show the initial tables, as they are shown in the statement
+            initial_db = self.initial_db[index] if index > 0 else None
+            return compare_select_results(self.expected_result[index], oracle_result['result'], self.check_order,
+                                          initial_db)
+
     def judge(self, code, executor):
-        first_insert_sql = self.insert_sql_list()[0]
-        oracle_result = executor.execute_select_test((self.create_sql, first_insert_sql), code, output_db=False)
-        # Check first code with first db
-        verdict, feedback = compare_select_results(self.expected_result[0], oracle_result['result'], self.check_order)
-        if verdict != VerdictCode.AC:
-            return verdict, feedback
-        # Get results using secondary dbs
-        insert_sql_extra_list = self.insert_sql_list()[1:]
-        initial_db_count = 1
-        for insert_sql_extra in insert_sql_extra_list:
-            oracle_result_extra = executor.execute_select_test((self.create_sql, insert_sql_extra), code,
-                                                               output_db=False)
-            # Check secondary results
-            verdict_extra, feedback_extra = compare_select_results(self.expected_result[initial_db_count],
-                                                                   oracle_result_extra['result'],
-                                                                   self.check_order,
-                                                                   self.initial_db[initial_db_count])
-            if verdict_extra != VerdictCode.AC:
-                return verdict_extra, feedback_extra
-            initial_db_count += 1
+        # Checks the code with every db (concurrently if enabled), returning the result of the first incorrect one
+        language = translation.get_language()
+        results = executor.run_in_order(
+            [functools.partial(self.judge_db, code, executor, index, language)
+             for index in range(len(self.insert_sql_list()))],
+            failed=lambda result: result[0] != VerdictCode.AC)
         # If all results are correct then return the first one
-        return verdict, feedback
+        return results[-1] if results[-1][0] != VerdictCode.AC else results[0]
 
     def problem_type(self):
         return ProblemType.SELECT
@@ -418,6 +479,9 @@ class DMLProblem(Problem):
     check_order = models.BooleanField(default=False)
     solution = models.TextField(max_length=5000, validators=[MinLengthValidator(1)], blank=True)
     expected_result = JSONField(encoder=DjangoJSONEncoder, blank=True)
+    # Fingerprint of the expected DB (see oracle_db.get_db_fingerprint), or None
+    expected_fingerprint = JSONField(encoder=DjangoJSONEncoder, default=None, blank=True, null=True)
+    ENGINES = (ExecutionEngine.ORACLE, ExecutionEngine.SQLITE, ExecutionEngine.POSTGRES)
 
     class Meta:
         """ Changes the name displayed in the admin interface"""
@@ -433,9 +497,11 @@ class DMLProblem(Problem):
                 self.zipfile = None  # Avoids storing the file in the filesystem
 
             super().clean()
-            executor = OracleExecutor.get()
-            res = executor.execute_dml_test((self.create_sql, self.insert_sql), self.solution, pre_db=True)
+            executor = self.executor()
+            res = executor.execute_dml_test(self.setup_plan(self.insert_sql), self.solution, pre_db=True,
+                                            fingerprint=True)
             self.expected_result = [res['post']]
+            self.expected_fingerprint = res['fingerprint']
             self.initial_db = [res['pre']]
         except Exception as excp:
             raise ValidationError(excp) from excp
@@ -444,8 +510,12 @@ class DMLProblem(Problem):
         return 'problem_dml.html'
 
     def judge(self, code, executor):
-        oracle_result = executor.execute_dml_test((self.create_sql, self.insert_sql), code, pre_db=False,
-                                                  min_stmt=self.min_stmt, max_stmt=self.max_stmt)
+        oracle_result = executor.execute_dml_test(self.setup_plan(self.insert_sql), code, pre_db=False,
+                                                  min_stmt=self.min_stmt, max_stmt=self.max_stmt,
+                                                  expected_fingerprint=self.expected_fingerprint,
+                                                  plan_gate=self.plan_gate())
+        if oracle_result['post'] is None:  # The DB has the expected fingerprint
+            return VerdictCode.AC, ''
         return compare_db_results(self.expected_result[0], oracle_result['post'])
 
     def problem_type(self):
@@ -514,8 +584,8 @@ class FunctionProblem(Problem):
                 self.zipfile = None  # Avoids storing the file in the filesystem
 
             super().clean()
-            executor = OracleExecutor.get()
-            res = executor.execute_function_test((self.create_sql, self.insert_sql), self.solution, self.calls)
+            executor = self.executor()
+            res = executor.execute_function_test(self.setup_plan(self.insert_sql), self.solution, self.calls)
             self.expected_result = [res['results']]
             self.initial_db = [res['db']]
         except Exception as excp:
@@ -531,20 +601,36 @@ class FunctionProblem(Problem):
         return {'rows': rows, 'header': [('Llamada', None), ('Resultado', None)]}
 
     def judge(self, code, executor):
-        oracle_result = executor.execute_function_test((self.create_sql, self.insert_sql), code, self.calls)
+        oracle_result = executor.execute_function_test(self.setup_plan(self.insert_sql), code, self.calls)
         return compare_function_results(self.expected_result[0], oracle_result['results'])
 
     def problem_type(self):
         return ProblemType.FUNCTION
 
 
+def case_fingerprints(problem, num_cases):
+    """
+    Fingerprints of the expected DB after each test case of a ProcProblem or TriggerProblem, or None if they are not
+    available. Problems validated before supporting several test cases store only one fingerprint
+    """
+    fingerprints = problem.expected_fingerprint
+    if isinstance(fingerprints, dict):
+        fingerprints = [fingerprints]
+    if not isinstance(fingerprints, list) or len(fingerprints) != num_cases:
+        return None
+    return fingerprints
+
+
 class ProcProblem(Problem):
     """Problem that requires a procedure definition as solution"""
     # IMPORTANT: This problem does not support multiple initial db. It only uses the first db
     check_order = models.BooleanField(default=False)
     solution = models.TextField(max_length=5000, validators=[MinLengthValidator(1)], blank=True)
-    proc_call = models.TextField(max_length=1000, validators=[MinLengthValidator(1)], blank=True)
-    expected_result = JSONField(encoder=DjangoJSONEncoder, blank=True)
+    # Several named test cases, each one starting with a line '-- CASE: name' (see oracle_sql.split_test_cases)
+    proc_call = models.TextField(max_length=5000, validators=[MinLengthValidator(1)], blank=True)
+    expected_result = JSONField(encoder=DjangoJSONEncoder, blank=True)  # Expected DB after each test case
+    # Fingerprints of the expected DB after each test case (see oracle_db.get_db_fingerprint), or None
+    expected_fingerprint = JSONField(encoder=DjangoJSONEncoder, default=None, blank=True, null=True)
 
     class Meta:
         """ Changes the name displayed in the admin interface"""
@@ -553,6 +639,10 @@ class ProcProblem(Problem):
     def template(self):
         return 'problem_proc.html'
 
+    def test_cases(self):
+        """List of pairs (name, code) with the test cases of the problem"""
+        return split_test_cases(self.proc_call)
+
     def clean(self):
         """Executes the problem and stores the expected result"""
         try:
@@ -563,18 +653,21 @@ class ProcProblem(Problem):
                 self.zipfile = None  # Avoid saving the file to the filesystem
 
             super().clean()
-            executor = OracleExecutor.get()
-            res = executor.execute_proc_test((self.create_sql, self.insert_sql), self.solution, self.proc_call,
-                                             pre_db=True)
-            self.expected_result = [res['post']]
+            executor = self.executor()
+            calls = [call for _, call in self.test_cases()]
+            res = executor.execute_proc_cases(self.setup_plan(self.insert_sql), self.solution, calls,
+                                              pre_db=True, fingerprint=True)
+            self.expected_result = res['post']
+            self.expected_fingerprint = res['fingerprint']
             self.initial_db = [res['pre']]
         except Exception as excp:
             raise ValidationError(excp) from excp
 
     def judge(self, code, executor):
-        oracle_result = executor.execute_proc_test((self.create_sql, self.insert_sql), code, self.proc_call,
-                                                   pre_db=False)
-        return compare_db_results(self.expected_result[0], oracle_result['post'])
+        names, calls = zip(*self.test_cases())
+        oracle_result = executor.execute_proc_cases(self.setup_plan(self.insert_sql), code, calls, pre_db=False,
+                                                    expected_fingerprints=case_fingerprints(self, len(calls)))
+        return compare_test_cases(names, self.expected_result, oracle_result['post'])
 
     def problem_type(self):
         return ProblemType.PROC
@@ -585,8 +678,11 @@ class TriggerProblem(Problem):
     # IMPORTANT: This problem does not support multiple initial db. It only uses the first db
     check_order = models.BooleanField(default=False)
     solution = models.TextField(max_length=5000, validators=[MinLengthValidator(1)], blank=True)
-    tests = models.TextField(max_length=1000, validators=[MinLengthValidator(1)], blank=True)
-    expected_result = JSONField(encoder=DjangoJSONEncoder, blank=True)
+    # Several named test cases, each one starting with a line '-- CASE: name' (see oracle_sql.split_test_cases)
+    tests = models.TextField(max_length=5000, validators=[MinLengthValidator(1)], blank=True)
+    expected_result = JSONField(encoder=DjangoJSONEncoder, blank=True)  # Expected DB after each test case
+    # Fingerprints of the expected DB after each test case (see oracle_db.get_db_fingerprint), or None
+    expected_fingerprint = JSONField(encoder=DjangoJSONEncoder, default=None, blank=True, null=True)
 
     class Meta:
         """ Changes the name displayed in the admin interface"""
@@ -595,6 +691,10 @@ class TriggerProblem(Problem):
     def template(self):
         return 'problem_trigger.html'  # The same template works
 
+    def test_cases(self):
+        """List of pairs (name, statements) with the test cases of the problem"""
+        return split_test_cases(self.tests)
+
     def clean(self):
         """Executes the problem and stores the expected result"""
         try:
@@ -605,18 +705,22 @@ class TriggerProblem(Problem):
                 self.zipfile = None  # Avoids storing the file in the filesystem
 
             super().clean()
-            executor = OracleExecutor.get()
-            res = executor.execute_trigger_test((self.create_sql, self.insert_sql),
-                                                self.solution, self.tests, pre_db=True)
-            self.expected_result = [res['post']]
+            executor = self.executor()
+            test_cases = [tests for _, tests in self.test_cases()]
+            res = executor.execute_trigger_cases(self.setup_plan(self.insert_sql), self.solution, test_cases,
+                                                 pre_db=True, fingerprint=True)
+            self.expected_result = res['post']
+            self.expected_fingerprint = res['fingerprint']
             self.initial_db = [res['pre']]
         except Exception as excp:
             raise ValidationError(excp) from excp
 
     def judge(self, code, executor):
-        oracle_result = executor.execute_trigger_test((self.create_sql, self.insert_sql), code, self.tests,
-                                                      pre_db=False)
-        return compare_db_results(self.expected_result[0], oracle_result['post'])
+        names, test_cases = zip(*self.test_cases())
+        oracle_result = executor.execute_trigger_cases(self.setup_plan(self.insert_sql), code, test_cases,
+                                                       pre_db=False,
+                                                       expected_fingerprints=case_fingerprints(self, len(test_cases)))
+        return compare_test_cases(names, self.expected_result, oracle_result['post'])
 
     def problem_type(self):
         return ProblemType.TRIGGER
@@ -628,6 +732,7 @@ class DiscriminantProblem(Problem):
     correct_query = models.TextField(max_length=5000, validators=[MinLengthValidator(1)], blank=True)
     incorrect_query = models.TextField(max_length=5000, validators=[MinLengthValidator(1)], blank=True)
     expected_result = JSONField(encoder=DjangoJSONEncoder, default=None, blank=True, null=True)
+    ENGINES = (ExecutionEngine.ORACLE, ExecutionEngine.SQLITE, ExecutionEngine.POSTGRES)
 
     class Meta:
         """ Changes the name displayed in the admin interface"""
@@ -636,6 +741,9 @@ class DiscriminantProblem(Problem):
     def template(self):
         return 'problem_disc.html'
 
+    def setup_inserts(self):
+        return self.insert_sql_list()
+
     def clean(self):
         """Executes the problem and stores the expected result"""
         try:
@@ -646,21 +754,20 @@ class DiscriminantProblem(Problem):
                 self.zipfile = None  # Avoids storing the file in the filesystem
 
             super().clean()
-            executor = OracleExecutor.get()
-            self.expected_result = []
-            self.initial_db = []
+            executor = self.executor()
             # In this case (this type of problem) there are only one database
-            for insert_sql in self.insert_sql_list():
-                res = executor.execute_select_test((self.create_sql, insert_sql),
-                                                   self.incorrect_query, output_db=True)
-                self.expected_result.append(res['result'])
-                self.initial_db.append(res['db'])
+            results = executor.run_in_order(
+                [functools.partial(executor.execute_select_test, self.setup_plan(insert_sql), self.incorrect_query,
+                                   output_db=True)
+                 for insert_sql in self.insert_sql_list()])
+            self.expected_result = [res['result'] for res in results]
+            self.initial_db = [res['db'] for res in results]
         except Exception as excp:
             raise ValidationError(excp) from excp
 
     def judge(self, code, executor):
         insert_sql = self.insert_sql_list()[0]  # In this type of problem there is only one database
-        result = executor.execute_discriminant_test((self.create_sql, insert_sql), code,
+        result = executor.execute_discriminant_test(self.setup_plan(insert_sql), code,
                                                     (self.correct_query, self.incorrect_query))
         incorrect_result = result["result_incorrect"]
         correct_result = result["result_correct"]
@@ -691,6 +798,47 @@ class Submission(models.Model):
         return VerdictCode(self.verdict_code).html_short_name()
 
 
+class JudgeJob(models.Model):
+    """ A submission waiting in the persistent judge queue, consumed by the judge_worker command (see judging.py) """
+    class State(models.TextChoices):  # pylint: disable=too-many-ancestors
+        """State of a job in the queue"""
+        PENDING = 'PENDING', 'Pending'
+        RUNNING = 'RUNNING', 'Running'
+        DONE = 'DONE', 'Done'
+
+    creation_date = models.DateTimeField(auto_now_add=True, db_index=True)
+    start_date = models.DateTimeField(null=True, blank=True)
+    state = models.CharField(max_length=10, choices=State.choices, default=State.PENDING, db_index=True)
+    code = models.CharField(max_length=5000)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    problem = models.ForeignKey(Problem, on_delete=models.CASCADE)
+    language = models.CharField(max_length=10, default=settings.LANGUAGE_CODE)  # Language of the messages
+    # Data returned to the user once judged (see views.submit) and the submission stored
+    result = JSONField(encoder=DjangoJSONEncoder, null=True, blank=True)
+    submission = models.ForeignKey(Submission, on_delete=models.SET_NULL, null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.pk} - {self.user.email} - {self.state}"
+
+    @classmethod
+    def claim(cls, timeout):
+        """
+        Takes the oldest pending job, or a running job started more than 'timeout' seconds ago (its worker has
+        died), and marks it as running. Several workers can claim jobs at the same time, as locked jobs are skipped
+        :return: JudgeJob or None if there are no jobs to judge
+        """
+        stale = timezone.now() - timedelta(seconds=timeout)
+        with transaction.atomic():
+            job = (cls.objects.select_for_update(skip_locked=True)
+                   .filter(Q(state=cls.State.PENDING) | Q(state=cls.State.RUNNING, start_date__lt=stale))
+                   .order_by('creation_date').first())
+            if job is not None:
+                job.state = cls.State.RUNNING
+                job.start_date = timezone.now()
+                job.save(update_fields=['state', 'start_date'])
+        return job
+
+
 def default_json_lang():
     """ Default values for name and description attributes in AchievementDefinition """
     return {settings.LANGUAGE_CODE: ""}
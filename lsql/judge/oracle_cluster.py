@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright Enrique Martín <emartinm@ucm.es> 2020
+
+Several Oracle nodes that judge submissions with the same interface as one OracleExecutor
+"""
+
+import os
+import threading
+import time
+
+import oracledb
+from logzero import logger
+
+from .exceptions import ExecutorException
+from .types import OracleStatusCode
+
+
+class OracleCluster:
+    """
+    Several Oracle nodes with the same interface as OracleExecutor. Each call is routed to the node with the most
+    free connections in its admin pool (the connections not busy in this process). A node is quarantined for
+    ORACLE_NODE_QUARANTINE_S seconds (by default 60) after ORACLE_NODE_MAX_FAILURES consecutive calls (by default 3)
+    that cannot get an admin connection, and those calls are retried in the other nodes. Each node has its own
+    pools, resettable schemas and reaper, so dangling users are swept in every node. A node that cannot be reached
+    when the cluster is created starts quarantined, and its OracleExecutor is created on its first call after the
+    quarantine
+    """
+
+    def __init__(self, nodes, factory):
+        """
+        Creates the executors of the nodes. Raises the oracledb.DatabaseError of the last node if no node can be
+        reached
+        :param nodes: list of (server, port, sid), one for each node
+        :param factory: function that receives a node and returns its OracleExecutor
+        """
+        self.nodes = nodes
+        self.factory = factory
+        self.names = ['{}:{}/{}'.format(*node) for node in nodes]
+        self.max_failures = int(os.environ.get('ORACLE_NODE_MAX_FAILURES', 3))
+        self.quarantine_s = int(os.environ.get('ORACLE_NODE_QUARANTINE_S', 60))
+        self.running = [0] * len(nodes)  # Calls running in each node
+        self.failures = [0] * len(nodes)  # Consecutive calls of each node without admin connection
+        self.quarantined_until = [0.0] * len(nodes)
+        self.lock = threading.Lock()
+        self.build_locks = [threading.Lock() for _ in nodes]  # Held while the executor of each node is created
+        self.executors = [None] * len(nodes)  # OracleExecutor of each node, None if not created yet
+        error = None
+        for index in range(len(nodes)):
+            try:
+                self.node_executor(index)
+            except ExecutorException as excp:
+                error = excp.__cause__
+        if all(executor is None for executor in self.executors):
+            raise error
+        logger.debug('Created an OracleCluster with nodes %s', self.names)
+
+    def node_executor(self, index):
+        """
+        Returns the OracleExecutor of a node, creating it if the node could not be reached before. If it cannot be
+        created, the node is quarantined and an ExecutorException GET_ADMIN_CONNECTION is raised
+        """
+        with self.build_locks[index]:
+            if self.executors[index] is None:
+                try:
+                    self.executors[index] = self.factory(self.nodes[index])
+                except oracledb.DatabaseError as excp:
+                    with self.lock:
+                        self.quarantined_until[index] = time.time() + self.quarantine_s
+                    logger.error('Oracle node %s cannot be reached, quarantined for %s seconds: %s',
+                                 self.names[index], self.quarantine_s, excp)
+                    raise ExecutorException(OracleStatusCode.GET_ADMIN_CONNECTION, str(excp)) from excp
+            return self.executors[index]
+
+    def free_connections(self, index):
+        """Admin connections of a node not busy in this process. Nodes without executor yet are the least loaded"""
+        executor = self.executors[index]
+        if executor is None:
+            return float('inf')
+        return executor.connection_pool.max - executor.connection_pool.busy
+
+    def acquire_node(self, exclude=()):
+        """
+        Chooses the node for a call among the nodes not in 'exclude', and counts the call as running in it. If all
+        of them are quarantined, chooses the one whose quarantine ends first
+        :return: (int) index of the node
+        """
+        with self.lock:
+            now = time.time()
+            candidates = [i for i in range(len(self.executors)) if i not in exclude]
+            healthy = [i for i in candidates if self.quarantined_until[i] <= now]
+            if healthy:
+                index = max(healthy, key=lambda i: (self.free_connections(i), -self.running[i]))
+            else:
+                index = min(candidates, key=lambda i: self.quarantined_until[i])
+            self.running[index] += 1
+            return index
+
+    def release_node(self, index, healthy):
+        """Counts a call of a node as finished, quarantining the node if it has failed too many times in a row"""
+        with self.lock:
+            self.running[index] -= 1
+            if healthy:
+                self.failures[index] = 0
+                return
+            self.failures[index] += 1
+            if self.failures[index] >= self.max_failures:
+                self.failures[index] = 0
+                self.quarantined_until[index] = time.time() + self.quarantine_s
+                logger.error('Oracle node %s quarantined for %s seconds', self.names[index], self.quarantine_s)
+
+    def route(self, call):
+        """
+        Runs call(executor) in a node, retrying in the other nodes while the call cannot get an admin connection
+        :param call: function that receives an OracleExecutor
+        :return: the result of the call
+        """
+        tried = []
+        while True:
+            index = self.acquire_node(tried)
+            healthy = True
+            try:
+                return call(self.node_executor(index))
+            except ExecutorException as excp:
+                healthy = excp.error_code != OracleStatusCode.GET_ADMIN_CONNECTION
+                if healthy or len(tried) + 1 >= len(self.executors):
+                    raise
+                logger.info('Oracle node %s without admin connections, retrying in another node', self.names[index])
+                tried.append(index)
+            finally:
+                self.release_node(index, healthy)
+
+    def get_version(self):
+        """Returns the version of the Oracle server of one node"""
+        return self.route(lambda executor: executor.get_version())
+
+    def remove_dangling_users(self, age_seconds=60):
+        """Removes the dangling users of every node already reached (see OracleExecutor.remove_dangling_users)"""
+        for executor in self.executors:
+            if executor is not None:
+                executor.remove_dangling_users(age_seconds)
+
+    def get_number_dangling_users(self, age_seconds=60):
+        """Total number of dangling users in all the nodes, -1 if error in some node or some node cannot be
+        reached"""
+        numbers = [executor.get_number_dangling_users(age_seconds) if executor is not None else -1
+                   for executor in self.executors]
+        return -1 if -1 in numbers else sum(numbers)
+
+    def remove_shared_schemas(self, hashes=(), age_seconds=0):
+        """Removes the stale shared schemas of every node already reached (see OracleExecutor.remove_shared_schemas)"""
+        for executor in self.executors:
+            if executor is not None:
+                executor.remove_shared_schemas(hashes, age_seconds)
+
+    def execute_select_test(self, *args, **kwargs):
+        """Routes OracleExecutor.execute_select_test to a node"""
+        return self.route(lambda executor: executor.execute_select_test(*args, **kwargs))
+
+    def execute_dml_test(self, *args, **kwargs):
+        """Routes OracleExecutor.execute_dml_test to a node"""
+        return self.route(lambda executor: executor.execute_dml_test(*args, **kwargs))
+
+    def execute_function_test(self, *args, **kwargs):
+        """Routes OracleExecutor.execute_function_test to a node"""
+        return self.route(lambda executor: executor.execute_function_test(*args, **kwargs))
+
+    def execute_proc_test(self, *args, **kwargs):
+        """Routes OracleExecutor.execute_proc_test to a node"""
+        return self.route(lambda executor: executor.execute_proc_test(*args, **kwargs))
+
+    def execute_proc_cases(self, *args, **kwargs):
+        """Routes OracleExecutor.execute_proc_cases to a node"""
+        return self.route(lambda executor: executor.execute_proc_cases(*args, **kwargs))
+
+    def execute_trigger_test(self, *args, **kwargs):
+        """Routes OracleExecutor.execute_trigger_test to a node"""
+        return self.route(lambda executor: executor.execute_trigger_test(*args, **kwargs))
+
+    def execute_trigger_cases(self, *args, **kwargs):
+        """Routes OracleExecutor.execute_trigger_cases to a node"""
+        return self.route(lambda executor: executor.execute_trigger_cases(*args, **kwargs))
+
+    def execute_discriminant_test(self, *args, **kwargs):
+        """Routes OracleExecutor.execute_discriminant_test to a node"""
+        return self.route(lambda executor: executor.execute_discriminant_test(*args, **kwargs))
+
+    def run_in_order(self, tasks, failed=None):
+        """
+        Runs the tasks as OracleExecutor.run_in_order, using the threads of the first node already reached. Each task
+        routes its own calls, so the test databases of a problem can be evaluated in different nodes
+        """
+        executor = next(executor for executor in self.executors if executor is not None)
+        return executor.run_in_order(tasks, failed)
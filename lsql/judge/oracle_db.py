@@ -0,0 +1,623 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright Enrique Martín <emartinm@ucm.es> 2020
+
+Functions that execute code through an Oracle connection and read its results: tables and fingerprints of the
+DB, SELECT statements, estimated plans, transactions and setup plans
+"""
+
+import collections
+import os
+import re
+import secrets
+import threading
+
+import oracledb
+from logzero import logger
+
+from .exceptions import ExecutorException
+from .oracle_sql import MAX_PLSQL_STRING_BYTES, TEST_CASE_SAVEPOINT, clean_sql, content_hash, create_insert_all, \
+    execute_immediate_block, is_tle_exception, uniform_dict
+from .types import OracleStatusCode
+
+typenames_map = {
+    # Based on https://python-oracledb.readthedocs.io/en/latest/user_guide/appendix_a.html
+    #          https://python-oracledb.readthedocs.io/en/latest/api_manual/module.html#dbtypes
+    oracledb.DB_TYPE_BFILE: 'BFILE',
+    oracledb.DB_TYPE_BINARY_DOUBLE: 'DOUBLE',
+    oracledb.DB_TYPE_BINARY_FLOAT: 'FLOAT',
+    oracledb.DB_TYPE_BINARY_INTEGER: 'INTEGER',
+    oracledb.DB_TYPE_BLOB: 'BLOB',
+    oracledb.DB_TYPE_BOOLEAN: 'BOOLEAN',
+    oracledb.DB_TYPE_CHAR: 'CHAR',
+    oracledb.DB_TYPE_CLOB: 'CLOB',
+    oracledb.DB_TYPE_CURSOR: 'CURSOR',
+    oracledb.DB_TYPE_DATE: 'DATE',
+    oracledb.DB_TYPE_INTERVAL_DS: 'INTERVAL DAY TO SECOND',
+    oracledb.DB_TYPE_INTERVAL_YM: 'INTERVAL YEAR TO MONTH',
+    oracledb.DB_TYPE_JSON: 'JSON',
+    oracledb.DB_TYPE_LONG: 'LONG',
+    oracledb.DB_TYPE_LONG_RAW: 'LONG RAW',
+    oracledb.DB_TYPE_LONG_NVARCHAR: 'STRING',  # not a database type
+    oracledb.DB_TYPE_NCHAR: 'NCHAR',
+    oracledb.DB_TYPE_NCLOB: 'NCLOB',
+    oracledb.DB_TYPE_NUMBER: 'NUMBER',
+    oracledb.DB_TYPE_NVARCHAR: 'NVARCHAR',
+    oracledb.DB_TYPE_OBJECT: 'OBJECT',
+    oracledb.DB_TYPE_RAW: 'RAW',
+    oracledb.DB_TYPE_ROWID: 'ROWID',
+    oracledb.DB_TYPE_TIMESTAMP: 'TIMESTAMP',
+    oracledb.DB_TYPE_TIMESTAMP_LTZ: 'TIMESTAMP WITH LOCAL TIME ZONE',
+    oracledb.DB_TYPE_TIMESTAMP_TZ: 'TIMESTAMP WITH TIME ZONE',
+    oracledb.DB_TYPE_UNKNOWN: 'UNKNOWN',
+    oracledb.DB_TYPE_UROWID: 'UROWID',
+    oracledb.DB_TYPE_VARCHAR: 'VARCHAR',
+    oracledb.DB_TYPE_XMLTYPE: 'XMLTYPE',
+}
+
+
+def execute_insert_all(insert: str, conn):
+    """ From a sequence of 0 or more INSERT statements, translates them into INSERT ALL and
+        executes the generated statement"""
+    insert_all = create_insert_all(insert)
+    if insert_all is not None:
+        with conn.cursor() as cursor:
+            cursor.execute(insert_all)
+
+
+def get_sql_type_name(typename) -> str:
+    """
+    Get a simplified str representing an oracledb SQL data type
+    :param typename: object representing the Oracle datatype as in
+    https://python-oracledb.readthedocs.io/en/latest/user_guide/appendix_a.html#supported-oracle-database-data-types
+    :return: simplified str representing the typename
+    """
+    regex = r"<DbType DB_TYPE_(\w*)>"
+    m = re.search(regex, str(typename))
+    mini_name = 'ERROR_OBTAINING_TYPE'
+    if len(m.groups()) >= 1:
+        mini_name = m.groups()[0]
+    return typenames_map.get(typename, mini_name)
+
+
+def table_from_cursor(cursor, uniform=True):
+    """
+    Takes a cursor that has executed a SELECT statement and returns all the results
+    in a dictionary. It checks if the number of columns in the cursor exceeds
+    ORACLE_MAX_COLS or the number of rows exceeds ORACLE_MAX_ROWS. In those cases
+    raises an ExecutorException with status code OracleStatusCode.TLE_USER_CODE
+    :param cursor: DB cursor
+    :param uniform: represents the values with uniform_dict. Callers that build several tables can pass False and
+                    apply uniform_dict only once to the result
+    :return: a dictionary {'header':[[NAME:str, TYPE:str]], 'rows': [list]}
+    """
+    max_rows = int(os.environ['ORACLE_MAX_ROWS'])
+    max_cols = int(os.environ['ORACLE_MAX_COLS'])
+    table = {}
+
+    if cursor.description is None:
+        # It's the result of an SQL statement that do not return results (CREATE VIEW, for example)
+        table['header'] = []
+        table['rows'] = []
+        return table  # return empty table (no columns, no rows)
+
+    if len(cursor.description) > max_cols:
+        logger.debug('TLE caused by too many columns in cursor')
+        raise ExecutorException(OracleStatusCode.TLE_USER_CODE)
+    table['header'] = [[e[0], get_sql_type_name(e[1])] for e in cursor.description]
+
+    batch = cursor.fetchmany(numRows=max_rows)  # Takes MAX rows
+    if cursor.fetchone():  # There are more rows
+        logger.debug('TLE caused by too many rows in cursor')
+        raise ExecutorException(OracleStatusCode.TLE_USER_CODE)
+    table['rows'] = [list(e) for e in batch]
+
+    return uniform_dict(table) if uniform else table  # Represents datetime as uniform strings
+
+
+# PL/SQL block that returns the names of the user tables and the content of each one as implicit result sets
+ALL_TABLES_BLOCK = """
+DECLARE
+  tables SYS_REFCURSOR;
+  table_rows SYS_REFCURSOR;
+BEGIN
+  OPEN tables FOR SELECT table_name FROM user_tables ORDER BY table_name;
+  DBMS_SQL.RETURN_RESULT(tables);
+  FOR t IN (SELECT table_name FROM (SELECT table_name FROM user_tables ORDER BY table_name)
+            WHERE ROWNUM <= :max_tables) LOOP
+    OPEN table_rows FOR 'SELECT * FROM "' || t.table_name || '"';
+    DBMS_SQL.RETURN_RESULT(table_rows);
+  END LOOP;
+END;"""
+
+
+def get_all_tables(conn, bulk=None):
+    """
+    Returns a dictionary representing all the tables in the DB. It checks if the
+    number of tables owned by the user exceeds ORACLE_MAX_TABLES, and raises an
+    ExecutorException with status code OracleStatusCode.TLE_USER_CODE
+    :param conn: DB connection
+    :param bulk: takes the snapshot in one round trip (see get_all_tables_bulk). If None, it is enabled with the
+                 environment variable ORACLE_BULK_SNAPSHOT
+    :return: dictionary {table_name: TABLE}, where TABLE is the dictionary
+             generated by table_from_cursor
+    """
+    if bulk is None:
+        bulk = int(os.environ.get('ORACLE_BULK_SNAPSHOT', 0)) > 0
+    if bulk:
+        return get_all_tables_bulk(conn)
+
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT table_name FROM USER_TABLES")
+        tables = cursor.fetchmany(int(os.environ['ORACLE_MAX_TABLES']))
+        if cursor.fetchone():
+            logger.debug('Too many tables in user DB')
+            raise ExecutorException(OracleStatusCode.TLE_USER_CODE)
+        tb_names = [e[0] for e in tables]
+        db_dict = {}
+        for table_name in tb_names:
+            # https://docs.oracle.com/database/121/SQLRF/sql_elements008.htm#SQLRF51129
+            # Quoted names should be embedded with "..." in order to work.
+            # We try quoted versions, as USER_TABLES contain case sensitive names
+            # NOTE: table names cannot be bound to parameters, so we use f-strings and trust its content
+            # as they come directly from the schema
+            # https://python-oracledb.readthedocs.io/en/latest/user_guide/bind.html#binding-column-and-table-names
+            cursor.execute(f'SELECT * FROM "{table_name}"')  # nosec B608
+            # Quoted name, succeeds even with unquoted names
+            table = table_from_cursor(cursor, uniform=False)
+            db_dict[table_name] = table
+
+        return uniform_dict(db_dict)  # Represents datetime as uniform strings
+
+
+def get_all_tables_bulk(conn):
+    """
+    Same as get_all_tables, but executes only one PL/SQL block that returns the list of tables and the content of
+    each one as implicit result sets (Oracle 12c or later), instead of one query per table. Cursors fetch up to
+    ORACLE_MAX_ROWS + 1 rows in each call, so each table requires at most one fetch (none if the driver has
+    prefetched its rows along with the execution of the block)
+    :param conn: DB connection
+    :return: dictionary {table_name: TABLE}, where TABLE is the dictionary generated by table_from_cursor
+    """
+    max_tables = int(os.environ['ORACLE_MAX_TABLES'])
+    fetch_rows = int(os.environ['ORACLE_MAX_ROWS']) + 1
+    with conn.cursor() as cursor:
+        cursor.prefetchrows = fetch_rows
+        cursor.arraysize = fetch_rows
+        cursor.execute(ALL_TABLES_BLOCK, max_tables=max_tables)
+        names_cursor, *table_cursors = cursor.getimplicitresults()
+        tables = names_cursor.fetchmany(max_tables)
+        if names_cursor.fetchone():
+            logger.debug('Too many tables in user DB')
+            raise ExecutorException(OracleStatusCode.TLE_USER_CODE)
+        db_dict = {}
+        for (table_name,), table_cursor in zip(tables, table_cursors):
+            table_cursor.arraysize = fetch_rows
+            db_dict[table_name] = table_from_cursor(table_cursor, uniform=False)
+        return uniform_dict(db_dict)  # Represents datetime as uniform strings
+
+
+# Data types whose values can be hashed with STANDARD_HASH (LOBs, LONG and object types cannot)
+FINGERPRINT_TYPES = re.compile(r'(?:NUMBER|FLOAT|BINARY_FLOAT|BINARY_DOUBLE|N?VARCHAR2|N?CHAR|DATE|RAW|TIMESTAMP\b.*|'
+                               r'INTERVAL\b.*)')
+
+
+def get_db_fingerprint(conn):
+    """
+    Computes in Oracle an order-independent fingerprint of every table in the DB, so that two DBs can be compared
+    without fetching their rows. The fingerprint of a table combines its columns, its number of rows and the sum of
+    a 60-bit hash of each row (STANDARD_HASH of the internal representation of each value, Oracle 12c or later).
+    Equal fingerprints imply equal results in compare_db_results (except for hash collisions), but different
+    fingerprints do not imply different results (for example, the same instant in different time zones)
+    :param conn: DB connection
+    :return: dict {table_name: str} or None if some table cannot be fingerprinted (unsupported data types) or the
+             number of tables exceeds ORACLE_MAX_TABLES
+    """
+    with conn.cursor() as cursor:
+        cursor.execute('SELECT table_name, column_name, data_type FROM user_tab_columns '
+                       'WHERE table_name IN (SELECT table_name FROM user_tables) ORDER BY table_name, column_id')
+        columns = collections.defaultdict(list)
+        for table_name, column_name, data_type in cursor:
+            if not FINGERPRINT_TYPES.fullmatch(data_type):
+                return None
+            columns[table_name].append((column_name, data_type))
+        if len(columns) > int(os.environ['ORACLE_MAX_TABLES']):
+            return None
+        if not columns:
+            return {}
+
+        # NOTE: table and column names come directly from the schema (see get_all_tables)
+        queries = []
+        for i, table_name in enumerate(columns):
+            row = " || ',' || ".join(f"NVL(RAWTOHEX(STANDARD_HASH(\"{column_name}\", 'MD5')), '-')"
+                                     for column_name, _ in columns[table_name])
+            row_hash = f"TO_NUMBER(SUBSTR(RAWTOHEX(STANDARD_HASH({row}, 'MD5')), 1, 15), 'XXXXXXXXXXXXXXX')"
+            queries.append(f'SELECT {i}, COUNT(*), TO_CHAR(SUM({row_hash})) FROM "{table_name}"')  # nosec B608
+        cursor.execute(' UNION ALL '.join(queries))
+        table_names = list(columns)
+        fingerprint = {}
+        for i, num_rows, rows_hash in cursor:
+            table_name = table_names[i]
+            fingerprint[table_name] = content_hash(*[f'{name} {data_type}' for name, data_type in columns[table_name]],
+                                                   str(num_rows), rows_hash)
+        return fingerprint
+
+
+def get_post_tables(conn, fingerprint=False, expected_fingerprint=None):
+    """
+    Returns the state of the DB after executing the code of a submission. If the DB has the expected fingerprint
+    (see get_db_fingerprint), the tables are not fetched
+    :param conn: DB connection
+    :param fingerprint: computes the fingerprint of the DB
+    :param expected_fingerprint: fingerprint of the expected DB, or None
+    :return: pair (DB, fingerprint). DB is the dictionary generated by get_all_tables, or None if the DB has the
+             expected fingerprint. Fingerprint is None if it has not been computed
+    """
+    if not fingerprint and expected_fingerprint is None:
+        return get_all_tables(conn), None
+    db_fingerprint = get_db_fingerprint(conn)
+    if db_fingerprint is not None and db_fingerprint == expected_fingerprint:
+        return None, db_fingerprint
+    return get_all_tables(conn), db_fingerprint
+
+
+# Types of the columns that can be compared in Oracle with the same result as in compare_select_results (CHAR values
+# are padded to the length of the column, and different time zones or NaN values are equal in Oracle)
+IN_DB_COMPARABLE_TYPES = {'NUMBER', 'VARCHAR', 'NVARCHAR', 'DATE', 'TIMESTAMP', 'RAW', 'INTERVAL DAY TO SECOND',
+                          'INTERVAL YEAR TO MONTH'}
+# Only queries are parsed, as Oracle executes DDL statements when parsing them
+QUERY_START = re.compile(r'\s*(?:SELECT|WITH)\b', re.IGNORECASE)
+
+
+def compare_select_in_db(cursor, statement, reference):
+    """
+    Checks in Oracle whether a SELECT statement returns the same multiset of rows as the reference solution, without
+    fetching any row. The statement is only parsed to obtain its header, and if it is equal to the expected header a
+    query counts the rows whose number of appearances differs in both results (GROUP BY with the sum of +1 for the
+    rows of the statement and -1 for the rows of the solution)
+    :param cursor: DB cursor
+    :param statement: str with one SELECT statement
+    :param reference: pair (solution, header) with the reference solution and the header of its expected result
+    :return: True if both results have the same header and rows (not considering order), False if they are different
+             or cannot be compared in Oracle. Errors other than TLE are ignored, so they are reported when the
+             statement is executed as usual
+    """
+    solution, expected_header = reference
+    if not QUERY_START.match(statement):
+        return False
+    try:
+        cursor.parse(statement)
+        if cursor.description is None or len(cursor.description) > int(os.environ['ORACLE_MAX_COLS']):
+            return False
+        header = [[e[0], get_sql_type_name(e[1])] for e in cursor.description]
+        if header != expected_header or any(e[1] not in IN_DB_COMPARABLE_TYPES for e in header):
+            return False
+        columns = ', '.join(f'c{i}' for i in range(len(header)))
+        solution = clean_sql(solution)[0].strip()
+        cursor.execute(f"""WITH lsql_obtained ({columns}) AS ({statement}),
+                                lsql_expected ({columns}) AS ({solution})
+                           SELECT COUNT(*) FROM (
+                             SELECT {columns}
+                             FROM (SELECT {columns}, 1 AS lsql_side FROM lsql_obtained
+                                   UNION ALL
+                                   SELECT {columns}, -1 FROM lsql_expected)
+                             GROUP BY {columns}
+                             HAVING SUM(lsql_side) <> 0)""")  # nosec B608
+        return cursor.fetchone()[0] == 0
+    except oracledb.DatabaseError as excp:
+        if is_tle_exception(str(excp)):
+            raise
+        logger.debug('SELECT statement cannot be compared in Oracle: %s', excp)
+        return False
+
+
+def execute_select_statement(conn, statement, reference=None):
+    """
+    Given a connection to an Oracle database, executes a string containing exactly ONE statement
+    :param conn: Oracle connection
+    :param statement: String containing one SQL Select statement
+    :param reference: pair (solution, header) to compare the result in Oracle (see compare_select_in_db), or None
+    :return: List with the results of the SELECT statement, or None if it has been compared in Oracle with the
+             reference and it is equal. It raises an IncorrectNumberOfSentences
+             exception if 'statement' contains more than one SQL statement, and a
+             cx_Oracle.DatabaseError if the execution of the statements is not correct
+    """
+    statements = clean_sql(statement)
+    if len(statements) != 1:
+        logger.debug('User %s - <<%s>> contains more than one SQL statement',
+                     conn.username, statement)
+        raise ExecutorException(OracleStatusCode.NUMBER_STATEMENTS,
+                                f'The SQL query must have exactly one statement: <<{statement}>>')
+
+    with conn.cursor() as cursor:
+        if reference is not None and compare_select_in_db(cursor, statements[0], reference):
+            return None
+        cursor.execute(statements[0])
+        table = table_from_cursor(cursor)
+    return table
+
+
+# Steps of a plan stored in PLAN_TABLE by EXPLAIN PLAN, the first one is the whole statement
+PLAN_STEPS = """SELECT id, parent_id, TRIM(operation || ' ' || options || ' ' || object_name), cost, cardinality
+                FROM plan_table WHERE statement_id = :id ORDER BY id"""
+
+
+def explain_plan(cursor, statement):
+    """
+    Estimated plan of a statement, obtained with EXPLAIN PLAN without executing it
+    :return: list of steps (id, parent_id, description, cost, cardinality) ordered by id, or None if the statement
+             cannot be explained (its errors will be raised when executing it)
+    """
+    statement_id = secrets.token_hex(8)
+    try:
+        # NOTE: EXPLAIN PLAN cannot be bound by parameters, the statement id is random and the statement is executed
+        # later anyway
+        cursor.execute(f"EXPLAIN PLAN SET STATEMENT_ID = '{statement_id}' FOR {statement}")  # nosec B608
+        cursor.execute(PLAN_STEPS, id=statement_id)
+        steps = cursor.fetchall()
+        cursor.execute('DELETE FROM plan_table WHERE statement_id = :id', id=statement_id)
+    except oracledb.DatabaseError as excp:
+        logger.debug('Unable to explain <<%s>>: %s', statement, excp)
+        return None
+    return steps if steps else None
+
+
+def most_expensive_step(plans):
+    """Step of the plans with the greatest cost of its own, i.e., not counting the cost of its children"""
+    best, best_cost = None, -1
+    for steps in plans:
+        children_cost = collections.Counter()
+        for _, parent_id, _, cost, _ in steps:
+            children_cost[parent_id] += cost or 0
+        for step in steps:
+            own_cost = (step[3] or 0) - children_cost[step[0]]
+            if own_cost > best_cost:
+                best, best_cost = step, own_cost
+    return best
+
+
+# (setup plan hash, solution hash) -> estimated cost of the solution, least recently used first
+REFERENCE_COSTS = collections.OrderedDict()
+REFERENCE_COSTS_LOCK = threading.Lock()
+MAX_REFERENCE_COSTS = 256
+
+
+def reference_cost(cursor, solution, plan_hash=None):
+    """
+    Estimated cost of the solution of a problem, explained only once per setup plan and solution (the statistics
+    of the schema depend only on its setup scripts)
+    :param cursor: Oracle cursor in the DB of the problem
+    :param solution: (str) solution of the problem
+    :param plan_hash: (str) hash of the setup plan of the DB, or None to explain the solution without caching its cost
+    :return: (int) cost, or None if some statement of the solution cannot be explained
+    """
+    key = (plan_hash, content_hash(solution))
+    with REFERENCE_COSTS_LOCK:
+        if key in REFERENCE_COSTS:
+            REFERENCE_COSTS.move_to_end(key)
+            return REFERENCE_COSTS[key]
+    reference = [explain_plan(cursor, stmt) for stmt in clean_sql(solution)]
+    if None in reference:
+        return None
+    cost = sum(steps[0][3] or 0 for steps in reference)
+    if plan_hash is not None:
+        with REFERENCE_COSTS_LOCK:
+            REFERENCE_COSTS[key] = cost
+            if len(REFERENCE_COSTS) > MAX_REFERENCE_COSTS:
+                REFERENCE_COSTS.popitem(last=False)
+    return cost
+
+
+def check_plan_cost(conn, statements, plan_gate, plan_hash=None):
+    """
+    Compares the estimated cost of the statements of a submission with the cost of the solution before executing
+    them, so queries with a huge cost (for example a Cartesian product) do not run until the timeout. Raises an
+    ExecutorException with status TLE_PLAN_COST and the most expensive step of the plan as message if the cost is
+    greater than 'factor' times the cost of the solution. If some statement cannot be explained it does nothing
+    :param conn: Oracle connection with the DB of the problem
+    :param statements: list of statements of the submission (see clean_sql)
+    :param plan_gate: pair (solution, factor) (see Problem.plan_gate), or None to do nothing
+    :param plan_hash: (str) hash of the setup plan of the DB, used to cache the cost of the solution
+    :return: None
+    """
+    if plan_gate is None:
+        return
+    solution, factor = plan_gate
+    with conn.cursor() as cursor:
+        solution_cost = reference_cost(cursor, solution, plan_hash)
+        plans = [explain_plan(cursor, stmt) for stmt in statements]
+    if solution_cost is None or None in plans:
+        return
+    cost = sum(steps[0][3] or 0 for steps in plans)
+    if cost > factor * max(solution_cost, 1):
+        _, _, description, step_cost, cardinality = most_expensive_step(plans)
+        logger.info('Estimated cost %s greater than %s times the cost of the solution (%s)', cost, factor,
+                    solution_cost)
+        raise ExecutorException(OracleStatusCode.TLE_PLAN_COST,
+                                f'{description} (cost: {step_cost}, rows: {cardinality})',
+                                '\n'.join(statements))
+
+
+def execute_function_batch(cursor, statement, calls):
+    """
+    Executes the query that evaluates all the function calls (see batch_function_calls)
+    :param cursor: Oracle cursor
+    :param statement: query built by batch_function_calls
+    :param calls: list of function calls in the query
+    :return: list of pairs (result, type) with the result of each call, or None if the query raises an error or
+             it does not have one column per call. In that case the calls must be evaluated one by one
+    """
+    try:
+        cursor.execute(statement)
+        row = cursor.fetchone()
+    except oracledb.DatabaseError as excp:
+        logger.debug('Error when evaluating %d function calls in one query: %s', len(calls), excp)
+        return None
+    if len(cursor.description) != len(calls):
+        return None
+    return [(value, str(column[1])) for value, column in zip(row, cursor.description)]
+
+
+def execute_dml_statements(conn, dml, min_stmt=0, max_stmt=float("inf"), commit=True):
+    """
+    Given a connection to an Oracle database, executes a string containing DML statements
+    :param min_stmt:
+    :param max_stmt:
+    :param conn: Oracle connection
+    :param dml: String containing DML statements
+    :param commit: if False, the transaction is checked but not committed (see check_transaction)
+    :return: None
+    """
+    statements = clean_sql(dml, min_stmt, max_stmt)
+    with conn.cursor() as cursor:
+        for stmt in statements:
+            cursor.execute(stmt)
+    if commit:
+        conn.commit()
+    else:
+        check_transaction(conn)
+
+
+def rollback_test_case(cursor) -> bool:
+    """
+    Undoes the changes of a test case up to its savepoint (TEST_CASE_SAVEPOINT), and restores the initial mode of
+    the constraints: ROLLBACK TO SAVEPOINT does not undo SET CONSTRAINTS, so after a test case checked with
+    check_transaction (or that changes the mode itself) the deferrable constraints would be checked immediately in
+    the next test cases, unlike in a new transaction
+    :param cursor: Oracle cursor
+    :return: False if the savepoint does not exist anymore because the test case has committed (explicitly or
+             executing DDL), so the changes cannot be undone
+    """
+    try:
+        cursor.execute(f'ROLLBACK TO SAVEPOINT {TEST_CASE_SAVEPOINT}')
+        cursor.execute('ALTER SESSION SET CONSTRAINTS = DEFAULT')
+        return True
+    except oracledb.DatabaseError as excp:
+        if 'ORA-01086' in str(excp):  # Savepoint never established in this session or is invalid
+            return False
+        raise
+
+
+def check_transaction(conn):
+    """
+    Checks the deferred constraints of the pending transaction as a COMMIT would do, but without ending the
+    transaction, so it can still be rolled back. Raises a cx_Oracle.DatabaseError if some constraint is violated
+    :param conn: Oracle connection
+    :return: None
+    """
+    with conn.cursor() as cursor:
+        cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+
+
+def execute_sql_script(conn, script):
+    """
+    Given an Oracle connection, executes a script formed by one or more statements
+    :param conn: Oracle connection
+    :param script: String containing one or more SQL statements (DDL, DML, etc)
+    :return: None. It raises a cx_Oracle.DatabaseError if the execution of any of the
+             statements is not correct.
+    """
+    execute_statements(conn, clean_sql(script), commit=True)
+
+
+def execute_statements(conn, statements, commit=False):
+    """
+    Given an Oracle connection, executes a list of statements one by one
+    :param conn: Oracle connection
+    :param statements: list of SQL statements without the ending ';'
+    :param commit: commit after executing the statements (if there is any statement)
+    :return: None. It raises a cx_Oracle.DatabaseError if the execution of any of the
+             statements is not correct.
+    """
+    if len(statements) > 0:
+        with conn.cursor() as cursor:
+            for statement in statements:
+                cursor.execute(statement)
+            if commit:
+                conn.commit()
+
+
+def execute_setup(conn, plan):
+    """
+    Executes the creation statements and the INSERT ALL of a setup plan in one round trip using an anonymous
+    PL/SQL block. The block stops at the first statement that fails, and that statement and the rest are
+    returned as pending: executing them again one by one with execute_statements reports the error in the right
+    phase. As in execute_sql_script, the creation statements are committed
+    :param conn: Oracle connection
+    :param plan: setup plan (see compile_setup). If it contains the key 'copy' (see OracleExecutor.sandbox_plan),
+                 those statements are executed instead of the INSERT ALL
+    :return: pair (creation statements, insertion statements) pending to be executed, both empty if the block
+             has executed everything
+    """
+    creates = plan['create']
+    if 'copy' in plan:
+        inserts = plan['copy']
+    else:
+        inserts = [plan['insert_all']] if plan['insert_all'] is not None else []
+    statements = creates + inserts
+    # Strings longer than 32767 bytes cannot be bound to PL/SQL, so the block stops before the first of them
+    binds = {}
+    for i, stmt in enumerate(statements):
+        if len(stmt.encode('utf-8')) > MAX_PLSQL_STRING_BYTES:
+            break
+        binds[f's{i}'] = stmt
+    done = 0
+    if binds:
+        with conn.cursor() as cursor:
+            done_var = cursor.var(int)
+            cursor.execute(execute_immediate_block(len(binds), len(creates) if creates else None, catch_errors=True),
+                           done=done_var, **binds)
+            done = done_var.getvalue()
+    return creates[done:], statements[max(done, len(creates)):]
+
+
+def get_compilation_errors(conn):
+    """
+    Extracts compilation errors from table SYS.USER_ERRORS and returns
+    :param conn: Open Oracle connection
+    :return: dict representing the table
+    """
+    with conn.cursor() as cursor:
+        cursor.execute('''SELECT NAME "Nombre de procedimiento", LINE "Línea", POSITION "Posición",
+                                 TEXT "Error detectado", ATTRIBUTE "Criticidad" 
+                          FROM SYS.USER_ERRORS''')
+        return table_from_cursor(cursor)
+
+
+def offset_from_oracle_exception(excp: oracledb.DatabaseError) -> int:
+    """Extracts the offset from a DataBaseError"""
+    # pylint: disable = no-member
+    # Locally disabled member checks because pylint thinks oracle_error is str
+    oracle_error, = excp.args
+    return oracle_error.offset
+
+
+# Dropping users will automatically remove all their objects
+# I keep this function just in case is useful in the future
+# def empty_schema(conn):
+#     """
+#     Completely empties the current schema in the connection, i.e., drops all user objects.
+#     Captures any exception caused by any DROP statement or the SELECT used to find user objects
+#     :param conn: open connection to an Oracle DB
+#     :return: bool
+#     """
+#     init = time.time()
+#     correct = True
+#     try:
+#         sql = """
+#             select 'DROP '||object_type||' '|| object_name|| DECODE(OBJECT_TYPE,'TABLE',' CASCADE CONSTRAINTS','')
+#             from user_objects"""
+#         with conn.cursor() as cursor:
+#             cursor.execute(sql)
+#             drop_statements = [p[0] for p in cursor]
+#             for drop in drop_statements:
+#                 cursor.execute(drop)
+#     except cx_Oracle.DatabaseError:
+#         correct = False
+#
+#     if correct:
+#         logger.debug('User %s - Schema deleted in %s seconds',
+#                      conn.username, time.time() - init)
+#     else:
+#         logger.error('User %s - Unable to delete schema', conn.username)
+#     return correct
@@ -8,421 +8,99 @@ Class to connect to Oracle and execute the different types of problems
 
 # Requires Oracle Client 19 (LTS) to connect to Oracle Database 11.2 or later in oracledb "thick mode"
 
-import string
+import concurrent.futures
 import os
 import re
-import json
-from typing import Optional
-import secrets
+import threading
+
 import oracledb
 from logzero import logger
-import sqlparse
-
-
-from django.core.serializers.json import DjangoJSONEncoder
 
 from .exceptions import ExecutorException
+from .oracle_cluster import OracleCluster
+from .oracle_db import check_plan_cost, check_transaction, execute_dml_statements, execute_function_batch, \
+    execute_select_statement, execute_sql_script, execute_statements, get_all_tables, get_compilation_errors, \
+    get_post_tables, offset_from_oracle_exception, rollback_test_case
+from .oracle_pool import SandboxUserPool
+from .oracle_reaper import SandboxReaper
+from .oracle_reset import ResettableSchemas
+from .oracle_schemas import OracleSchemas
+from .oracle_sql import MAX_SELECT_COLUMNS, TEST_CASE_SAVEPOINT, batch_function_calls, clean_sql, is_tle_exception, \
+    line_col_from_offset, setup_plan
 from .types import OracleStatusCode
 
-typenames_map = {
-    # Based on https://python-oracledb.readthedocs.io/en/latest/user_guide/appendix_a.html
-    #          https://python-oracledb.readthedocs.io/en/latest/api_manual/module.html#dbtypes
-    oracledb.DB_TYPE_BFILE: 'BFILE',
-    oracledb.DB_TYPE_BINARY_DOUBLE: 'DOUBLE',
-    oracledb.DB_TYPE_BINARY_FLOAT: 'FLOAT',
-    oracledb.DB_TYPE_BINARY_INTEGER: 'INTEGER',
-    oracledb.DB_TYPE_BLOB: 'BLOB',
-    oracledb.DB_TYPE_BOOLEAN: 'BOOLEAN',
-    oracledb.DB_TYPE_CHAR: 'CHAR',
-    oracledb.DB_TYPE_CLOB: 'CLOB',
-    oracledb.DB_TYPE_CURSOR: 'CURSOR',
-    oracledb.DB_TYPE_DATE: 'DATE',
-    oracledb.DB_TYPE_INTERVAL_DS: 'INTERVAL DAY TO SECOND',
-    oracledb.DB_TYPE_INTERVAL_YM: 'INTERVAL YEAR TO MONTH',
-    oracledb.DB_TYPE_JSON: 'JSON',
-    oracledb.DB_TYPE_LONG: 'LONG',
-    oracledb.DB_TYPE_LONG_RAW: 'LONG RAW',
-    oracledb.DB_TYPE_LONG_NVARCHAR: 'STRING',  # not a database type
-    oracledb.DB_TYPE_NCHAR: 'NCHAR',
-    oracledb.DB_TYPE_NCLOB: 'NCLOB',
-    oracledb.DB_TYPE_NUMBER: 'NUMBER',
-    oracledb.DB_TYPE_NVARCHAR: 'NVARCHAR',
-    oracledb.DB_TYPE_OBJECT: 'OBJECT',
-    oracledb.DB_TYPE_RAW: 'RAW',
-    oracledb.DB_TYPE_ROWID: 'ROWID',
-    oracledb.DB_TYPE_TIMESTAMP: 'TIMESTAMP',
-    oracledb.DB_TYPE_TIMESTAMP_LTZ: 'TIMESTAMP WITH LOCAL TIME ZONE',
-    oracledb.DB_TYPE_TIMESTAMP_TZ: 'TIMESTAMP WITH TIME ZONE',
-    oracledb.DB_TYPE_UNKNOWN: 'UNKNOWN',
-    oracledb.DB_TYPE_UROWID: 'UROWID',
-    oracledb.DB_TYPE_VARCHAR: 'VARCHAR',
-    oracledb.DB_TYPE_XMLTYPE: 'XMLTYPE',
-}
-
-
-def create_insert_all(statements: str) -> Optional[str]:
-    """ Given 0 or more "INSERT INTO" statements, returns one "INSERT ALL" to insert all the
-        rows in a single statement. One "INSERT ALL" requires about 1/6 of the time of a sequence
-        of individual "INSERT INTO". *INSERT ALL statement is only valid in Oracle*
-
-        If no INSERT appears in statements returns None
-
-        Example:
-
-        INSERT INTO t VALUES (1,2);
-        INSERT INTO t2(id, age) VALUES (3,4);
-            ==>
-        INSERT ALL
-            INTO t VALUES(1, 2)
-            INTO t2(id, age) VALUES(3, 4)
-        SELECT 1 FROM DUAL;
-    """
-    stmts = sqlparse.parse(sqlparse.format(statements, strip_comments=True))  # Removes comments before parsing
-    if not stmts:
-        return None
-    insert_all = "INSERT ALL\n"
-    for stmt in stmts:
-        if stmt.get_type() != 'INSERT':
-            raise ValueError(f'Invalid INSERT statement: {stmt}')
-        parts = ['    INTO'] + [fragment.value for fragment in stmt.get_sublists()] + ['\n']
-        insert_code = ' '.join(parts)
-        insert_all += insert_code
-    insert_all += 'SELECT 1 FROM DUAL\n'  # statements sent to cx_Oracle cannot have ending ';'
-    return insert_all
-
-
-def execute_insert_all(insert: str, conn):
-    """ From a sequence of 0 or more INSERT statements, translates them into INSERT ALL and
-        executes the generated statement"""
-    insert_all = create_insert_all(insert)
-    if insert_all is not None:
-        with conn.cursor() as cursor:
-            cursor.execute(insert_all)
-
-
-def replace_rest_stmt_blanks(statements):
-    """ Given a list[str] of SQL statements extends every statement with as many spaces and newlines as the previous
-        and next statements. This way, executing each statement separately will produce the error in the same offset
-        position as the complete SQL block, so they could be shown correctly in the editor. For example:
-
-            'SELECT *\nFROM CLUB;\nSELECT *\nFROM CLUB;'          --> (Origina block code)
-           ['SELECT *\nFROM CLUB;', '\nSELECT *\nFROM CLUB;']     --> (Split statements)
-           ['SELECT *\nFROM CLUB;\n        \n          ',         --> (Split statements with equal length and \n)
-            '        \n          \nSELECT *\nFROM CLUB;'
-    """
-    num_stmt = len(statements)
-    result = []
-    for i in range(num_stmt):
-        pre = re.sub(r'\S', ' ', "".join(statements[:i]))
-        post = re.sub(r'\S', ' ', "".join(statements[i+1:]))
-        result.append(pre + statements[i] + post)
-    return result
-
-
-def clean_sql(code: str, min_stmt: int = None, max_stmt: int = None):
-    """
-    Parses SQL code into statements (removing comments and ';').
-    :param code: str containing SQL code
-    :param min_stmt: minimum number of statements
-    :param max_stmt: maximum number of statements
-    :return: [str] if code is a sequence between min_stmt and max_stmt correct SQL statements, otherwise None
-    """
-    if code is None:
-        code = ""
-    # Replaces every line comment by a sequence of spaces of the same length
-    code_no_comments = re.sub(r'--.*$', lambda match_obj: ' '*len(match_obj.group(0)), code, flags=re.MULTILINE)
-    # Splits statements and replaces \r by spaces (only \n for newline)
-    statements = [str(s).replace('\r', ' ') for s in sqlparse.parse(code_no_comments)]  # Uses only \n for newline
-    # Replaces the last ';' of each statement with spaces
-    statements = [re.sub(r';\s*$', lambda match_obj: ' '*len(match_obj.group(0)), s, flags=re.MULTILINE)
-                  for s in statements]
-    statements = replace_rest_stmt_blanks(statements)
-    num_sql = len(statements)
-    if (min_stmt and num_sql < min_stmt) or (max_stmt and num_sql > max_stmt):
-        statements = None
-    return statements
-
-
-def random_str(size=8):
-    """
-    Creates a random string of 2*n hexadecimal letters from
-    :param size: Length of the generated random string
-    :return: Random string of 2*n hexadecimal letters
-    """
-    return secrets.token_hex(size)
-
-
-def line_col_from_offset(code: str, offset: int):
-    """
-    Returns the line and columns of an offset in a code
-    :param offset:
-    :param code:
-    :return: pair (int, int) of (line, col)
-    """
-    line = 0
-    last_line_init = 0
-    for i in range(min(offset, len(code))):
-        # If the syntax error is at the end, the offset from Oracle is > length of code
-        if code[i] == '\n':
-            last_line_init = i+1
-            line += 1
-    col = offset - last_line_init
-    return line, col
-
-
-def uniform_dict(dictionary):
-    """
-    Uses DjangoJSONEncoder to represent as strings those values that are not directly serialized (like datetime)
-    :param dictionary: Python dictionary
-    :return: Python dictionary with all the fields uniformly represented
-    """
-    string_rep = json.dumps(dictionary, cls=DjangoJSONEncoder)
-    return json.loads(string_rep)
-
 
-def get_sql_type_name(typename) -> str:
+def run_sequentially(tasks, failed=None):
     """
-    Get a simplified str representing an oracledb SQL data type
-    :param typename: object representing the Oracle datatype as in
-    https://python-oracledb.readthedocs.io/en/latest/user_guide/appendix_a.html#supported-oracle-database-data-types
-    :return: simplified str representing the typename
+    Runs the tasks in sequence, stopping at the first task that fails
+    :param tasks: list of functions without arguments
+    :param failed: function that receives the result of a task and returns whether it has failed, or None if tasks
+                   only fail by raising exceptions
+    :return: list with the results of the tasks up to the first failed one (included)
     """
-    regex = r"<DbType DB_TYPE_(\w*)>"
-    m = re.search(regex, str(typename))
-    mini_name = 'ERROR_OBTAINING_TYPE'
-    if len(m.groups()) >= 1:
-        mini_name = m.groups()[0]
-    return typenames_map.get(typename, mini_name)
+    results = []
+    for task in tasks:
+        results.append(task())
+        if failed is not None and failed(results[-1]):
+            break
+    return results
 
 
-def table_from_cursor(cursor):
-    """
-    Takes a cursor that has executed a SELECT statement and returns all the results
-    in a dictionary. It checks if the number of columns in the cursor exceeds
-    ORACLE_MAX_COLS or the number of rows exceeds ORACLE_MAX_ROWS. In those cases
-    raises an ExecutorException with status code OracleStatusCode.TLE_USER_CODE
-    :param cursor: DB cursor
-    :return: a dictionary {'header':[[NAME:str, TYPE:str]], 'rows': [list]}
-    """
-    max_rows = int(os.environ['ORACLE_MAX_ROWS'])
-    max_cols = int(os.environ['ORACLE_MAX_COLS'])
-    table = {}
-
-    if cursor.description is None:
-        # It's the result of an SQL statement that do not return results (CREATE VIEW, for example)
-        table['header'] = []
-        table['rows'] = []
-        return table  # return empty table (no columns, no rows)
-
-    if len(cursor.description) > max_cols:
-        logger.debug('TLE caused by too many columns in cursor')
-        raise ExecutorException(OracleStatusCode.TLE_USER_CODE)
-    table['header'] = [[e[0], get_sql_type_name(e[1])] for e in cursor.description]
-
-    batch = cursor.fetchmany(numRows=max_rows)  # Takes MAX rows
-    if cursor.fetchone():  # There are more rows
-        logger.debug('TLE caused by too many rows in cursor')
-        raise ExecutorException(OracleStatusCode.TLE_USER_CODE)
-    table['rows'] = [list(e) for e in batch]
-
-    return uniform_dict(table)  # Represents datetime as uniform strings
-
-
-def get_all_tables(conn):
-    """
-    Returns a dictionary representing all the tables in the DB. It checks if the
-    number of tables owned by the user exceeds ORACLE_MAX_TABLES, and raises an
-    ExecutorException with status code OracleStatusCode.TLE_USER_CODE
-    :param conn: DB connection
-    :return: dictionary {table_name: TABLE}, where TABLE is the dictionary
-             generated by table_from_cursor
-    """
-    with conn.cursor() as cursor:
-        cursor.execute("SELECT table_name FROM USER_TABLES")
-        tables = cursor.fetchmany(int(os.environ['ORACLE_MAX_TABLES']))
-        if cursor.fetchone():
-            logger.debug('Too many tables in user DB')
-            raise ExecutorException(OracleStatusCode.TLE_USER_CODE)
-        tb_names = [e[0] for e in tables]
-        db_dict = {}
-        for table_name in tb_names:
-            # https://docs.oracle.com/database/121/SQLRF/sql_elements008.htm#SQLRF51129
-            # Quoted names should be embedded with "..." in order to work.
-            # We try quoted versions, as USER_TABLES contain case sensitive names
-            # NOTE: table names cannot be bound to parameters, so we use f-strings and trust its content
-            # as they come directly from the schema
-            # https://python-oracledb.readthedocs.io/en/latest/user_guide/bind.html#binding-column-and-table-names
-            cursor.execute(f'SELECT * FROM "{table_name}"')  # nosec B608
-            # Quoted name, succeeds even with unquoted names
-            table = table_from_cursor(cursor)
-            db_dict[table_name] = table
-
-        return db_dict
-
-
-def execute_select_statement(conn, statement):
-    """
-    Given a connection to an Oracle database, executes a string containing exactly ONE statement
-    :param conn: Oracle connection
-    :param statement: String containing one SQL Select statement
-    :return: List with the results of the SELECT statement. It raises an IncorrectNumberOfSentences
-             exception if 'statement' contains more than one SQL statement, and a
-             cx_Oracle.DatabaseError if the execution of the statements is not correct
-    """
-    statements = clean_sql(statement)
-    if len(statements) != 1:
-        logger.debug('User %s - <<%s>> contains more than one SQL statement',
-                     conn.username, statement)
-        raise ExecutorException(OracleStatusCode.NUMBER_STATEMENTS,
-                                f'The SQL query must have exactly one statement: <<{statement}>>')
+ORACLE_NODE = re.compile(r'^\s*([^\s:]+):(\d+)/(\S+?)\s*$')  # server:port/sid
 
-    with conn.cursor() as cursor:
-        cursor.execute(statements[0])
-        table = table_from_cursor(cursor)
-    return table
 
-
-def execute_dml_statements(conn, dml, min_stmt=0, max_stmt=float("inf")):
+def oracle_nodes():
     """
-    Given a connection to an Oracle database, executes a string containing DML statements
-    :param min_stmt:
-    :param max_stmt:
-    :param conn: Oracle connection
-    :param dml: String containing DML statements
-    :return: None
+    Oracle nodes that judge the submissions, from ORACLE_NODES: a comma-separated list of server:port/sid. All the
+    nodes share the admin user ORACLE_USER. Raises ValueError if some node is not valid
+    :return: list of (server, port, sid), or [None] (the node of ORACLE_SERVER, ORACLE_PORT and ORACLE_SID) if
+             ORACLE_NODES is not defined
     """
-    statements = clean_sql(dml, min_stmt, max_stmt)
-    with conn.cursor() as cursor:
-        for stmt in statements:
-            cursor.execute(stmt)
-        conn.commit()
+    nodes = []
+    for entry in os.environ.get('ORACLE_NODES', '').split(','):
+        if entry.strip():
+            match = ORACLE_NODE.match(entry)
+            if match is None:
+                raise ValueError(f'Invalid Oracle node in ORACLE_NODES: {entry}')
+            nodes.append((match.group(1), int(match.group(2)), match.group(3)))
+    return nodes or [None]
 
 
-def execute_sql_script(conn, script):
+def build_dsn_tns(pooled=False, node=None):
     """
-    Given an Oracle connection, executes a script formed by one or more statements
-    :param conn: Oracle connection
-    :param script: String containing one or more SQL statements (DDL, DML, etc)
-    :return: None. It raises a cx_Oracle.DatabaseError if the execution of any of the
-             statements is not correct.
+    Build a Data Source Name from values in the environment
+    :param pooled: (bool) connect to a pooled server of Database Resident Connection Pooling (DRCP)
+    :param node: (server, port, sid) of the Oracle node, by default ORACLE_SERVER, ORACLE_PORT and ORACLE_SID
     """
-    statements = clean_sql(script)
-    if len(statements) > 0:
-        with conn.cursor() as cursor:
-            for statement in statements:
-                cursor.execute(statement)
-            conn.commit()
-
-
-def get_compilation_errors(conn):
-    """
-    Extracts compilation errors from table SYS.USER_ERRORS and returns
-    :param conn: Open Oracle connection
-    :return: dict representing the table
-    """
-    with conn.cursor() as cursor:
-        cursor.execute('''SELECT NAME "Nombre de procedimiento", LINE "Línea", POSITION "Posición",
-                                 TEXT "Error detectado", ATTRIBUTE "Criticidad" 
-                          FROM SYS.USER_ERRORS''')
-        return table_from_cursor(cursor)
-
-
-def offset_from_oracle_exception(excp: oracledb.DatabaseError) -> int:
-    """Extracts the offset from a DataBaseError"""
-    # pylint: disable = no-member
-    # Locally disabled member checks because pylint thinks oracle_error is str
-    oracle_error, = excp.args
-    return oracle_error.offset
-
-
-def is_tle_exception(error_msg):
-    """ Decides if the error_message from the Oracle exception can represent a timeout """
-    return 'DPI-1067' in error_msg or 'DPI-1080' in error_msg or 'DPI-1010' in error_msg
-
-
-# Dropping users will automatically remove all their objects
-# I keep this function just in case is useful in the future
-# def empty_schema(conn):
-#     """
-#     Completely empties the current schema in the connection, i.e., drops all user objects.
-#     Captures any exception caused by any DROP statement or the SELECT used to find user objects
-#     :param conn: open connection to an Oracle DB
-#     :return: bool
-#     """
-#     init = time.time()
-#     correct = True
-#     try:
-#         sql = """
-#             select 'DROP '||object_type||' '|| object_name|| DECODE(OBJECT_TYPE,'TABLE',' CASCADE CONSTRAINTS','')
-#             from user_objects"""
-#         with conn.cursor() as cursor:
-#             cursor.execute(sql)
-#             drop_statements = [p[0] for p in cursor]
-#             for drop in drop_statements:
-#                 cursor.execute(drop)
-#     except cx_Oracle.DatabaseError:
-#         correct = False
-#
-#     if correct:
-#         logger.debug('User %s - Schema deleted in %s seconds',
-#                      conn.username, time.time() - init)
-#     else:
-#         logger.error('User %s - Unable to delete schema', conn.username)
-#     return correct
-
-
-def build_dsn_tns():
-    """Build a Data Source Name from values in the environment"""
-    dsn_tns = oracledb.makedsn(
-        os.environ['ORACLE_SERVER'],
-        int(os.environ['ORACLE_PORT']),
-        os.environ['ORACLE_SID'])  # SID=free in oracle-free Docker images
+    if node is None:
+        node = (os.environ['ORACLE_SERVER'], int(os.environ['ORACLE_PORT']), os.environ['ORACLE_SID'])
+    dsn_tns = oracledb.makedsn(*node)  # SID=free in oracle-free Docker images
+    if pooled:
+        dsn_tns = dsn_tns.replace('(CONNECT_DATA=', '(CONNECT_DATA=(SERVER=POOLED)')
     return dsn_tns
 
 
-class OracleExecutor:
-    """Class to connect to Oracle DB and execute problems"""
-
-    __USER_PREFIX = 'lsql_'
-    __ALPHABET = string.ascii_lowercase + string.digits
-    __CREATE_USER_SCRIPT = ('CREATE USER {} '
-                            'IDENTIFIED BY "{}" '
-                            'DEFAULT TABLESPACE {} '
-                            'TEMPORARY TABLESPACE TEMP QUOTA UNLIMITED ON {}')
-    __GRANT_USER_SCRIPT = ('GRANT create table, delete any table, select any dictionary, connect, create session , '
-                           'create synonym , create public synonym, create sequence, create view , '
-                           'create trigger, alter any trigger, drop any trigger, '
-                           'create procedure, alter any procedure, drop any procedure, execute any procedure '
-                           'TO {}')
-    __DROP_USER_SCRIPT = 'DROP USER {} CASCADE'
-    __USER_CONNECTIONS = """SELECT s.sid, s.serial#, s.username
-                                FROM   gv$session s
-                                       JOIN gv$process p ON p.addr = s.paddr AND p.inst_id = s.inst_id
-                                WHERE  s.username = :username"""
-    __DANGLING_USERS = """SELECT USERNAME, CREATED
-                          FROM all_users
-                          WHERE USERNAME LIKE 'LSQ_%' AND (SYSDATE-CREATED)*24*60*60 > :age_seconds
-                          ORDER BY CREATED ASC"""
-    __NUM_DANGLING_USERS = """SELECT COUNT(USERNAME)
-                              FROM all_users
-                              WHERE USERNAME LIKE 'LSQ_%' AND (SYSDATE-CREATED)*24*60*60 > :age_seconds"""
-    __KILL_SESSION = """ALTER SYSTEM KILL SESSION '{},{}'"""
+class OracleExecutor(OracleSchemas):
+    """Class to connect to Oracle DB and execute problems (see OracleSchemas for its users and schemas)"""
+
     __DB = None
 
     @classmethod
     def get(cls):
-        """Singleton DB"""
+        """Singleton DB: an OracleExecutor, or an OracleCluster if there are several nodes (see oracle_nodes)"""
         if cls.__DB is None:
-            cls.__DB = OracleExecutor()
+            cls.__DB = create_oracle_executor()
         return cls.__DB
 
-    def __init__(self):
+    def __init__(self, node=None):
         """
         Creates a pool of connections with the admin user, taking the details from
         the configuration file. Throws a cx_Oracle.DatabaseError if it is not
         possible to create the pool
+        :param node: (server, port, sid) of the Oracle node, by default the one in ORACLE_SERVER, ORACLE_PORT and
+                     ORACLE_SID
         """
-        self.dsn_tns = build_dsn_tns()
+        self.dsn_tns = build_dsn_tns(node=node)
         oracledb.init_oracle_client()  # To enable "thick mode"
         self.connection_pool = oracledb.create_pool(
             user=os.environ['ORACLE_USER'],
@@ -436,6 +114,56 @@ class OracleExecutor:
             wait_timeout=int(os.environ['ORACLE_GESTOR_POOL_TIMEOUT_MS'])
         )
         self.version = None
+        # Sandbox sessions are created through this pool with proxy authentication, so they reuse its network
+        # connections instead of opening a new one for each submission
+        self.sandbox_pool = None
+        if int(os.environ.get('ORACLE_SANDBOX_POOL_MAX', 0)) > 0:
+            self.sandbox_pool = oracledb.create_pool(
+                user=os.environ['ORACLE_USER'],
+                password=os.environ['ORACLE_PASS'],
+                dsn=self.dsn_tns,
+                homogeneous=False,
+                min=0,
+                max=int(os.environ['ORACLE_SANDBOX_POOL_MAX']) + int(os.environ.get('ORACLE_RESET_SCHEMAS', 0)),
+                increment=1,
+                getmode=oracledb.POOL_GETMODE_TIMEDWAIT,
+                wait_timeout=int(os.environ['ORACLE_GESTOR_POOL_TIMEOUT_MS'])
+            )
+        # Profile and consumer group of sandbox users, or None if their resources are not limited
+        self.sandbox_profile, self.consumer_group = None, None
+        self.user_quota = 'UNLIMITED'
+        if int(os.environ.get('ORACLE_SANDBOX_PROFILE', 0)) > 0:
+            self.create_sandbox_profile()
+        self.drcp = int(os.environ.get('ORACLE_DRCP', 0)) > 0
+        self.drcp_dsn_tns = build_dsn_tns(pooled=True, node=node)
+        self.user_pool = None
+        self.pool_max_idle = int(os.environ.get('ORACLE_USER_POOL_MAX_IDLE_S', 300))
+        if int(os.environ.get('ORACLE_USER_POOL_MAX', 0)) > 0:
+            self.user_pool = SandboxUserPool(self,
+                                             int(os.environ.get('ORACLE_USER_POOL_MIN', 0)),
+                                             int(os.environ['ORACLE_USER_POOL_MAX']),
+                                             self.pool_max_idle)
+        # Content hash -> (owner, reader) of the shared read-only schemas already built, or None if disabled
+        self.shared_schemas = {} if int(os.environ.get('ORACLE_SHARED_SCHEMAS', 0)) > 0 else None
+        self.shared_lock = threading.Lock()
+        # Content hash -> setup plan that copies the tables from its master schema (or None if the tables cannot be
+        # copied), or None if master schemas are disabled
+        self.master_schemas = {} if int(os.environ.get('ORACLE_MASTER_SCHEMAS', 0)) > 0 else None
+        self.reset_schemas = None
+        if int(os.environ.get('ORACLE_RESET_SCHEMAS', 0)) > 0:
+            self.reset_schemas = ResettableSchemas(self, int(os.environ['ORACLE_RESET_SCHEMAS']))
+        self.fingerprints = int(os.environ.get('ORACLE_FINGERPRINTS', 0)) > 0
+        self.select_in_db = int(os.environ.get('ORACLE_SELECT_IN_DB', 0)) > 0
+        # Threads to evaluate the test databases of a problem concurrently, or None to evaluate them in sequence
+        self.variant_pool = None
+        if int(os.environ.get('ORACLE_PARALLEL_DBS', 1)) > 1:
+            self.variant_pool = concurrent.futures.ThreadPoolExecutor(
+                max_workers=int(os.environ['ORACLE_PARALLEL_DBS']), thread_name_prefix='lsql_variant')
+        self.reaper = None
+        if int(os.environ.get('ORACLE_REAPER', 0)) > 0:
+            self.reaper = SandboxReaper(self,
+                                        int(os.environ.get('ORACLE_REAPER_SWEEP_INTERVAL_S', 300)),
+                                        int(os.environ.get('ORACLE_REAPER_SWEEP_AGE_S', 900)))
         logger.debug('Created an OracleExecutor to %s with a pool of %s connections with a timeout of %s ms',
                      self.dsn_tns,
                      int(os.environ['ORACLE_MAX_GESTOR_CONNECTIONS']),
@@ -450,141 +178,119 @@ class OracleExecutor:
             self.connection_pool.release(gestor)
         return self.version
 
-    def create_user(self, connection):
+    def execute_select_shared(self, schema, select, reference=None, plan_gate=None, plan_hash=None):
         """
-        Creates a new user in the local Oracle DB with a random name and password. The user
-        has acces to the TABLESPACE defined in the configuration file, and its username
-        starts with a given prefix defined in the configuration file
-        :param connection: Connection with privileges for creating users
-        :return: A pair (username, password) of the created user
-        """
-        user_name = f'{self.__USER_PREFIX}{random_str(8)}'
-        user_passwd = random_str(8)
-        create_script = self.__CREATE_USER_SCRIPT.format(
-            user_name,
-            user_passwd,
-            os.environ['ORACLE_TABLESPACE'],
-            os.environ['ORACLE_TABLESPACE']
-        )
-        grant_script = self.__GRANT_USER_SCRIPT.format(user_name)
-
-        with connection.cursor() as cursor:
-            cursor.execute(create_script)
-            cursor.execute(grant_script)
-        return user_name, user_passwd
-
-    def remove_dangling_users(self, age_seconds=60):
-        """
-        Removes all the LSQL_* users created more than 'age_seconds' ago
-        :param age_seconds: (int) number of seconds
-        :return: None
+        Executes a SELECT statement in a read-only transaction of the reader of a shared schema
+        :param schema: (str, str) Pair (owner, reader) returned by shared_schema
+        :param select: (str) One SELECT statement to execute
+        :param reference: (str, list) reference solution and expected header, as in execute_select_test
+        :param plan_gate: pair (solution, factor) to check the estimated cost, as in execute_select_test
+        :param plan_hash: (str) hash of the setup plan of the schema (see check_plan_cost)
+        :return: {"result": result, "db": None}, as in execute_select_test
         """
-        gestor = None
+        owner, reader = schema
+        conn, result, reuse = None, None, True
+        state = OracleStatusCode.GET_USER_CONNECTION
         try:
-            gestor = self.connection_pool.acquire()
-            with gestor.cursor() as cursor:
-                cursor.execute(self.__DANGLING_USERS, age_seconds=age_seconds)
-                users = cursor.fetchall()
-                for user in users:
-                    logger.info('Removing dangling user %s created at %s', user[0], user[1])
-                    cursor.execute(self.__USER_CONNECTIONS, username=user[0])
-                    connections = cursor.fetchall()
-                    # Kills all the possible connections of username
-                    for connection in connections:  # pragma: no cover
-                        cursor.execute(self.__KILL_SESSION.format(connection[0], connection[1]))
-                    self.drop_user(user[0], gestor)
-        except oracledb.DatabaseError as excp:  # pragma: no cover
-            logger.error('Unable to remove dangling users. Reason: %s', excp)
-        finally:
-            if gestor is not None:
-                self.connection_pool.release(gestor)
+            # Proxy authentication: the reader has no known password
+            if self.sandbox_pool is not None:
+                conn = self.sandbox_pool.acquire(user=reader)  # Reuses the idle sessions of the reader
+            else:
+                conn = oracledb.connect(user=f'{os.environ["ORACLE_USER"]}[{reader}]',
+                                        password=os.environ['ORACLE_PASS'], dsn=self.dsn_tns)
+            self.limit_session(conn)
+            conn.call_timeout = int(os.environ['ORACLE_STMT_TIMEOUT_MS'])
+            with conn.cursor() as cursor:
+                cursor.execute(f'ALTER SESSION SET CURRENT_SCHEMA = {owner}')
 
-    def get_number_dangling_users(self, age_seconds=60):
-        """
-        Returns the number of dangling users, i.e., users created more than 'age_seconds' ago
-        :param age_seconds: (int) number of seconds
-        :return: (int), -1 if error
-        """
-        gestor = None
-        num = -1
-        try:
-            gestor = self.connection_pool.acquire()
-            with gestor.cursor() as cursor:
-                cursor.execute(self.__NUM_DANGLING_USERS, age_seconds=age_seconds)
-                row = cursor.fetchone()
-                num = row[0]
-        except oracledb.DatabaseError as excp:  # pragma: no cover
-            logger.error('Unable to get number of dangling users. Reason: %s', excp)
+            state = OracleStatusCode.EXECUTE_USER_CODE
+            self.check_select_plan(conn, select, plan_gate, plan_hash)
+            conn.rollback()  # EXPLAIN PLAN writes in PLAN_TABLE, so it cannot run in the read-only transaction
+            with conn.cursor() as cursor:
+                cursor.execute('SET TRANSACTION READ ONLY')
+            result = execute_select_statement(conn, select, reference if self.select_in_db else None)
+            conn.rollback()
+            return {"result": result, "db": None}
+        except oracledb.DatabaseError as excp:
+            error_msg = str(excp)
+            logger.info('Error when testing SELECT statements in shared schema %s: %s - %s - %s',
+                        owner, state, excp, select)
+            if is_tle_exception(error_msg) and state == OracleStatusCode.EXECUTE_USER_CODE:
+                # Time limit exceeded, the session cannot be reused
+                reuse = False
+                raise ExecutorException(OracleStatusCode.TLE_USER_CODE, error_msg, select) from excp
+            pos = None
+            if state == OracleStatusCode.EXECUTE_USER_CODE:
+                pos = line_col_from_offset(select, offset_from_oracle_exception(excp))
+            raise ExecutorException(state, error_msg, select, pos) from excp
         finally:
-            if gestor is not None:
-                self.connection_pool.release(gestor)
-        return num
-
-    def drop_user(self, user_name, connection):
-        """
-        Removes a user from the Oracle local DB
-        :param user_name: Name of the user to remove
-        :param connection: Connection with priviledges to drop users
-        :return: None
-        """
-        with connection.cursor() as cursor:
-            drop_script = self.__DROP_USER_SCRIPT.format(user_name)
-            cursor.execute(drop_script)
+            if conn:
+                self.close_connection(conn, reuse=reuse)
 
-    def create_connection(self, user, passwd):
-        """
-        Creates an Oracle connection to localhost/xe using UTF-8
-        :param user: Name of the Oracle user
-        :param passwd: Password of the Oracle user
-        :return: Oracle connection
-        """
-        connection = oracledb.connect(user=user, password=passwd, dsn=self.dsn_tns)
-        return connection
+    @staticmethod
+    def check_select_plan(conn, select, plan_gate, plan_hash=None):
+        """Checks the estimated cost of a SELECT statement (see check_plan_cost). Wrong number of statements are left
+        to execute_select_statement"""
+        statements = clean_sql(select)
+        if len(statements) == 1:
+            check_plan_cost(conn, statements, plan_gate, plan_hash)
 
-    def execute_select_test(self, init_db, select, output_db=False):
+    def execute_select_test(self, init_db, select, output_db=False, reference=None, plan_gate=None):
         """
         Using a new fresh user, creates a set of tables ('creation) and inserts some data.
         Then, executes a correct SELECT statement and also a SELECT statement to test
         :param output_db:
         :param init_db: (str, str) Pair of statements (create, insert) to create the tables and inserting
-                                   initial data into tables from the program definition
+                                   initial data into tables from the program definition, or its setup plan
         :param select: (str) One SELECT statement to execute
-        :return: {"result": result, "db": db}. result is a dictionary representing the statement result, and db is a
-                 dictionary representing all the tables. In case of error, throws a ExecutorException
+        :param reference: (str, list) Pair (solution, header) with the reference solution and the header of its
+                          expected result. If the comparison in Oracle is enabled (ORACLE_SELECT_IN_DB), the rows of
+                          the SELECT statement are fetched only if they are different from the rows of the solution
+                          (not considering order, see compare_select_in_db)
+        :param plan_gate: (str, float) Pair (solution, factor). If present, the SELECT statement gets TLE without
+                          executing it if its estimated cost is greater than factor times the cost of the solution
+                          (see check_plan_cost)
+        :return: {"result": result, "db": db}. result is a dictionary representing the statement result (None if it
+                 is equal to the result of the reference solution), and db is a dictionary representing all the
+                 tables. In case of error, throws a ExecutorException
         """
-        creation, insertion = init_db
+        plan = setup_plan(init_db)
+        if not output_db and self.shared_schemas is not None:
+            # A SELECT statement cannot modify the DB, so it can run in the shared schema (if available)
+            schema = self.shared_schema(plan)
+            if schema is not None:
+                return self.execute_select_shared(schema, select, reference, plan_gate, plan.get('hash'))
+
         conn, gestor, result, user, db = None, None, None, None, None
         state = OracleStatusCode.GET_ADMIN_CONNECTION
         try:
             gestor = self.connection_pool.acquire()
 
             state = OracleStatusCode.CREATE_USER
-            user, passwd = self.create_user(gestor)
+            user, passwd = self.lease_user(gestor)
 
             state = OracleStatusCode.GET_USER_CONNECTION
             conn = self.create_connection(user, passwd)
 
             conn.call_timeout = int(os.environ['ORACLE_STMT_TIMEOUT_MS'])
             state = OracleStatusCode.EXECUTE_CREATE
-            execute_sql_script(conn, creation)
+            pending_create, pending_insert = self.load_setup(conn, user, plan)
+            execute_statements(conn, pending_create, commit=True)
 
             state = OracleStatusCode.EXECUTE_INSERT
-            execute_insert_all(insertion, conn)
+            execute_statements(conn, pending_insert)
 
             state = OracleStatusCode.EXECUTE_USER_CODE
-            result = execute_select_statement(conn, select)
+            self.check_select_plan(conn, select, plan_gate, plan.get('hash'))
+            result = execute_select_statement(conn, select, reference if self.select_in_db else None)
 
             state = OracleStatusCode.GET_ALL_TABLES
             if output_db:
                 db = get_all_tables(conn)
 
-            state = OracleStatusCode.CLOSE_USER_CONNECTION
-            conn.close()
-            conn = None
-
             state = OracleStatusCode.DROP_USER
-            self.drop_user(user, gestor)
-            user = None
+            self.release_user(user, conn, gestor)
+            conn, user = None, None
 
             state = OracleStatusCode.RELEASE_ADMIN_CONNECTION
             self.connection_pool.release(gestor)
@@ -601,49 +307,119 @@ class OracleExecutor:
                 pos = line_col_from_offset(select, offset_from_oracle_exception(excp))
             raise ExecutorException(state, error_msg, select, pos) from excp
         finally:
-            if conn:
-                conn.close()
-            if user:
-                try:
-                    # Sometimes when TLE, the connections can be closed but the user cannot be dropped because
-                    # "is currently connected". This looks like a bug or undocumented behavior of cx_Oracle
-                    # These users must be removed manually later
-                    self.drop_user(user, gestor)
-                except oracledb.DatabaseError as drop_except:  # pragma: no cover
-                    logger.error('Unable to drop user %s, REMOVE IT MANUALLY (%s)', user, drop_except)
+            self.discard_user(user, conn, gestor)
             if gestor:
                 self.connection_pool.release(gestor)
 
-    def execute_dml_test(self, init_db, dml, *, pre_db=True, min_stmt=0, max_stmt=float("inf")):
+    def run_in_order(self, tasks, failed=None):
         """
-        Using a new fresh user, creates a set of tables ('creation) and inserts some data.
+        Runs several tasks (for example, the evaluation of a problem in each test database) and returns their results
+        as if they were run in sequence, stopping at the first task that fails. If there is a variant pool
+        (ORACLE_PARALLEL_DBS > 1) the tasks run concurrently, and when one fails the later tasks that have not
+        started yet are cancelled (the ones already running finish, as Oracle calls are not interrupted)
+        :param tasks: list of functions without arguments
+        :param failed: function that receives the result of a task and returns whether it has failed, or None if
+                       tasks only fail by raising exceptions
+        :return: list with the results of the tasks up to the first failed one (included). If the first failed task
+                 has raised an exception, it is raised again
+        """
+        def has_failed(future):
+            return future.exception() is not None or (failed is not None and failed(future.result()))
+
+        if self.variant_pool is None or len(tasks) < 2:
+            return run_sequentially(tasks, failed)
+
+        futures = [self.variant_pool.submit(task) for task in tasks]
+
+        def cancel_later(index):
+            def callback(future):
+                if not future.cancelled() and has_failed(future):
+                    for later in futures[index + 1:]:
+                        later.cancel()
+            return callback
+
+        for index, future in enumerate(futures):
+            future.add_done_callback(cancel_later(index))
+        results = []
+        try:
+            for future in futures:
+                results.append(future.result())  # Raises the exception of the task
+                if failed is not None and failed(results[-1]):
+                    break
+        finally:
+            for future in futures:
+                future.cancel()
+        return results
+
+    def __post_tables(self, conn, fingerprint, expected_fingerprint):
+        """State of the DB after the code of a submission, using fingerprints if enabled (see get_post_tables)"""
+        if not self.fingerprints:
+            return get_post_tables(conn)
+        return get_post_tables(conn, fingerprint, expected_fingerprint)
+
+    def __run_cases(self, run, plan, code, cases, pre_db, fingerprint, expected_fingerprints):
+        """
+        Evaluates all the test cases of a problem with 'run' (__proc_cases or __trigger_cases), that evaluates in the
+        same user as many test cases as possible. If a test case commits its changes cannot be undone, so 'run' stops
+        after it and the rest of test cases are evaluated in a new user
+        :return: {'pre': DB, 'post': list, 'fingerprint': list} (see execute_proc_cases)
+        """
+        if expected_fingerprints is None:
+            expected_fingerprints = [None] * len(cases)
+        result = {'pre': None, 'post': [], 'fingerprint': []}
+        while len(result['post']) < len(cases):
+            done = len(result['post'])
+            res = run(plan, code, cases[done:], pre_db and done == 0, fingerprint, expected_fingerprints[done:])
+            if done == 0:
+                result['pre'] = res['pre']
+            result['post'].extend(res['post'])
+            result['fingerprint'].extend(res['fingerprint'])
+        return result
+
+    def execute_dml_test(self, init_db, dml, *, pre_db=True, min_stmt=0, max_stmt=float("inf"), fingerprint=False,
+                         expected_fingerprint=None, plan_gate=None):
+        """
+        Using a new fresh user (or a resettable schema, see ResettableSchemas), creates a set of tables ('creation)
+        and inserts some data.
         Then, executes some DML statements
         :param max_stmt:
         :param min_stmt:
         :param pre_db:
         :param init_db: (str, str) Pair of statements (create, insert) to create the tables and inserting
-                                   initial data into tables from the program definition
+                                   initial data into tables from the program definition, or its setup plan
         :param dml: (str) DML statements to execute (insert, delete, update)
-        :return: {'pre': DB, 'post': DB} dictionary containing the state of the DB before and after executing dml
+        :param fingerprint: computes the fingerprint of the DB after executing the code (see get_db_fingerprint)
+        :param expected_fingerprint: fingerprint of the expected DB. If the DB has it, the tables are not fetched
+        :param plan_gate: (str, float) Pair (solution, factor) to reject DML statements with a too high estimated cost
+                          without executing them (see check_plan_cost)
+        :return: {'pre': DB, 'post': DB, 'fingerprint': dict} dictionary containing the state of the DB before and
+                 after executing dml ('post' is None if the DB has the expected fingerprint), and the fingerprint
+                 of the DB after executing dml (None if not computed)
         """
-        creation, insertion = init_db
-        conn, gestor, user, post, stmt = None, None, None, None, None
+        plan = setup_plan(init_db)
+        conn, gestor, user, post, stmt, schema = None, None, None, None, None, None
         state = OracleStatusCode.GET_ADMIN_CONNECTION
         try:
-            gestor = self.connection_pool.acquire()
+            if self.reset_schemas is not None and self.reset_schemas.resettable(dml, dml=True):
+                schema = self.reset_schemas.lease(plan)
+            if schema is not None:
+                conn = schema.connection
+            else:
+                gestor = self.connection_pool.acquire()
 
-            state = OracleStatusCode.CREATE_USER
-            user, passwd = self.create_user(gestor)
+                state = OracleStatusCode.CREATE_USER
+                user, passwd = self.lease_user(gestor)
 
-            state = OracleStatusCode.GET_USER_CONNECTION
-            conn = self.create_connection(user, passwd)
+                state = OracleStatusCode.GET_USER_CONNECTION
+                conn = self.create_connection(user, passwd)
 
-            conn.call_timeout = int(os.environ['ORACLE_STMT_TIMEOUT_MS'])
-            state = OracleStatusCode.EXECUTE_CREATE
-            execute_sql_script(conn, creation)
+                conn.call_timeout = int(os.environ['ORACLE_STMT_TIMEOUT_MS'])
+                state = OracleStatusCode.EXECUTE_CREATE
+                pending_create, pending_insert = self.load_setup(conn, user, plan)
+                execute_statements(conn, pending_create, commit=True)
 
-            state = OracleStatusCode.EXECUTE_INSERT
-            execute_insert_all(insertion, conn)
+                state = OracleStatusCode.EXECUTE_INSERT
+                execute_statements(conn, pending_insert)
 
             pre = {}
             if pre_db:
@@ -656,27 +432,34 @@ class OracleExecutor:
                 raise ExecutorException(OracleStatusCode.NUMBER_STATEMENTS,
                                         f'The SQL code must have between {min_stmt} and {max_stmt} statements:'
                                         f'<<dml>>')
+            if schema is not None:
+                self.reset_schemas.begin(schema)
+            check_plan_cost(conn, statements, plan_gate, plan.get('hash'))
             with conn.cursor() as cursor:
                 for stmt in statements:
                     cursor.execute(stmt)
+            if schema is not None:
+                check_transaction(conn)  # The changes will be rolled back when resetting the schema
+            else:
                 conn.commit()
 
             state = OracleStatusCode.GET_ALL_TABLES
-            post = get_all_tables(conn)
-
-            state = OracleStatusCode.CLOSE_USER_CONNECTION
-            conn.close()
-            conn = None
+            post, post_fingerprint = self.__post_tables(conn, fingerprint, expected_fingerprint)
 
             state = OracleStatusCode.DROP_USER
-            self.drop_user(user, gestor)
-            user = None
+            if schema is not None:
+                self.reset_schemas.release(schema)
+                schema = None
+            else:
+                self.release_user(user, conn, gestor)
+            conn, user = None, None
 
             state = OracleStatusCode.RELEASE_ADMIN_CONNECTION
-            self.connection_pool.release(gestor)
+            if gestor:
+                self.connection_pool.release(gestor)
             gestor = None
 
-            return {'pre': pre, 'post': post}
+            return {'pre': pre, 'post': post, 'fingerprint': post_fingerprint}
         except oracledb.DatabaseError as excp:
             error_msg = str(excp)
             logger.info('Error when testing DML statements: %s - %s - %s', state, excp, stmt)
@@ -685,16 +468,10 @@ class OracleExecutor:
                 raise ExecutorException(OracleStatusCode.TLE_USER_CODE, error_msg, stmt) from excp
             raise ExecutorException(state, error_msg, stmt) from excp
         finally:
-            if conn:
-                conn.close()
-            if user:
-                try:
-                    # Sometimes when TLE, the connections can be closed but the user cannot be dropped because
-                    # "is currently connected". This looks like a bug or undocumented behavior of cx_Oracle
-                    # These users must be removed manually later
-                    self.drop_user(user, gestor)
-                except oracledb.DatabaseError as drop_except:  # pragma: no cover
-                    logger.error('Unable to drop user %s, REMOVE IT MANUALLY (%s)', user, drop_except)
+            if schema is not None:
+                self.reset_schemas.release(schema)
+                conn = None
+            self.discard_user(user, conn, gestor)
             if gestor:
                 self.connection_pool.release(gestor)
 
@@ -705,29 +482,30 @@ class OracleExecutor:
         :param tests: (str) function calls separated by new lines
         :param func_creation:
         :param init_db: (str, str) Pair of statements (create, insert) to create the tables and inserting
-                                   initial data into tables from the program definition
+                                   initial data into tables from the program definition, or its setup plan
 
         :return: {'pre': DB, 'results': dict} dictionary containing the initial state of the DB and a dictionary
                  {call: (result, type)} with the different calls, the result and the type of the result
         """
-        creation, insertion = init_db
+        plan = setup_plan(init_db)
         conn, gestor, user, stmt = None, None, None, None
         state = OracleStatusCode.GET_ADMIN_CONNECTION
         try:
             gestor = self.connection_pool.acquire()
 
             state = OracleStatusCode.CREATE_USER
-            user, passwd = self.create_user(gestor)
+            user, passwd = self.lease_user(gestor)
 
             state = OracleStatusCode.GET_USER_CONNECTION
             conn = self.create_connection(user, passwd)
 
             conn.call_timeout = int(os.environ['ORACLE_STMT_TIMEOUT_MS'])
             state = OracleStatusCode.EXECUTE_CREATE
-            execute_sql_script(conn, creation)
+            pending_create, pending_insert = self.load_setup(conn, user, plan)
+            execute_statements(conn, pending_create, commit=True)
 
             state = OracleStatusCode.EXECUTE_INSERT
-            execute_insert_all(insertion, conn)
+            execute_statements(conn, pending_insert)
 
             state = OracleStatusCode.GET_ALL_TABLES
             db = get_all_tables(conn)
@@ -750,21 +528,22 @@ class OracleExecutor:
 
                 results = {}
                 tests = [s.strip() for s in tests.split('\n') if len(s.strip()) > 0]
-                for stmt in tests:
-                    # NOTE:# Function calls cannot be bound by parameters, so we use f-strings and trust its content
-                    func_call = f'SELECT {stmt} FROM DUAL'  # nosec B608
-                    cursor.execute(func_call)
-                    res_type = str(cursor.description[0][1])
-                    row = cursor.fetchone()
-                    results[stmt] = (row[0], res_type)
-
-            state = OracleStatusCode.CLOSE_USER_CONNECTION
-            conn.close()
-            conn = None
+                for start in range(0, len(tests), MAX_SELECT_COLUMNS):
+                    block = tests[start:start + MAX_SELECT_COLUMNS]
+                    stmt = batch_function_calls(block)
+                    block_results = execute_function_batch(cursor, stmt, block)
+                    if block_results is None:
+                        # Some call raises (or returns more than one column): evaluates the calls one by one
+                        # so the failing call is the one reported
+                        block_results = []
+                        for stmt in block:
+                            cursor.execute(batch_function_calls([stmt]))
+                            block_results.append((cursor.fetchone()[0], str(cursor.description[0][1])))
+                    results.update(zip(block, block_results))
 
             state = OracleStatusCode.DROP_USER
-            self.drop_user(user, gestor)
-            user = None
+            self.release_user(user, conn, gestor)
+            conn, user = None, None
 
             state = OracleStatusCode.RELEASE_ADMIN_CONNECTION
             self.connection_pool.release(gestor)
@@ -779,50 +558,71 @@ class OracleExecutor:
                 raise ExecutorException(OracleStatusCode.TLE_USER_CODE, excp, stmt) from excp
             raise ExecutorException(state, excp, stmt) from excp
         finally:
-            if conn:
-                conn.close()
-            if user:
-                try:
-                    # Sometimes when TLE, the connections can be closed but the user cannot be dropped because
-                    # "is currently connected". This looks like a bug or undocumented behavior of cx_Oracle
-                    # These users must be removed manually later
-                    self.drop_user(user, gestor)
-                except oracledb.DatabaseError as drop_except:  # pragma: no cover
-                    logger.error('Unable to drop user %s, REMOVE IT MANUALLY (%s)', user, drop_except)
+            self.discard_user(user, conn, gestor)
             if gestor:
                 self.connection_pool.release(gestor)
 
-    def execute_proc_test(self, init_db, proc_creation, proc_call, pre_db=True):
+    def execute_proc_test(self, init_db, proc_creation, proc_call, pre_db=True, fingerprint=False,
+                          expected_fingerprint=None):
         """
-        Using a new fresh user, creates a set of tables ('creation) and inserts some data.
+        Using a new fresh user (or a resettable schema, see ResettableSchemas), creates a set of tables ('creation)
+        and inserts some data.
         Then, creates a PROCEDURE defined in proc_creation and invokes the call in proc_call
         :param pre_db:
         :param proc_call:
         :param proc_creation:
         :param init_db: (str, str) Pair of statements (create, insert) to create the tables and inserting
-                                   initial data into tables from the program definition
+                                   initial data into tables from the program definition, or its setup plan
+        :param fingerprint: computes the fingerprint of the DB after executing the code (see get_db_fingerprint)
+        :param expected_fingerprint: fingerprint of the expected DB. If the DB has it, the tables are not fetched
+
+        :return: {'pre': DB, 'post': DB, 'fingerprint': dict} dictionary containing the state of the DB before
+                   defining the procedure and after invoking the procedure, and the fingerprint of the DB after
+                   invoking it (see execute_dml_test)
+        """
+        res = self.execute_proc_cases(init_db, proc_creation, [proc_call], pre_db, fingerprint,
+                                      [expected_fingerprint])
+        return {'pre': res['pre'], 'post': res['post'][0], 'fingerprint': res['fingerprint'][0]}
 
-        :return: {'pre': DB, 'post': DB} dictionary containing the state of the DB before defining the procedure
-                   and after invoking the procedure
+    def execute_proc_cases(self, init_db, proc_creation, proc_calls, pre_db=True, fingerprint=False,
+                           expected_fingerprints=None):
+        """
+        Like execute_proc_test, but invoking several test cases (see split_test_cases) after creating the tables and
+        the PROCEDURE only once. The changes of each test case are undone with ROLLBACK TO SAVEPOINT before the next
+        one, and the test cases after one that commits are invoked in a new user (see __run_cases)
+        :param proc_calls: list with the code of each test case
+        :param expected_fingerprints: list with the fingerprint of the expected DB of each test case, or None
+        :return: {'pre': DB, 'post': list, 'fingerprint': list} dictionary containing the state of the DB before
+                 defining the procedure, and the state and fingerprint of the DB after invoking each test case
         """
-        creation, insertion = init_db
-        conn, gestor, user, post, stmt = None, None, None, None, None
+        return self.__run_cases(self.__proc_cases, setup_plan(init_db), proc_creation, proc_calls, pre_db,
+                                fingerprint, expected_fingerprints)
+
+    def __proc_cases(self, plan, proc_creation, proc_calls, pre_db, fingerprint, expected_fingerprints):
+        """Invokes the test cases of execute_proc_cases in one user until one of them commits"""
+        conn, gestor, user, stmt, schema = None, None, None, None, None
         state = OracleStatusCode.GET_ADMIN_CONNECTION
         try:
-            gestor = self.connection_pool.acquire()
+            if self.reset_schemas is not None and self.reset_schemas.resettable(proc_creation):
+                schema = self.reset_schemas.lease(plan)
+            if schema is not None:
+                conn = schema.connection
+            else:
+                gestor = self.connection_pool.acquire()
 
-            state = OracleStatusCode.CREATE_USER
-            user, passwd = self.create_user(gestor)
+                state = OracleStatusCode.CREATE_USER
+                user, passwd = self.lease_user(gestor)
 
-            state = OracleStatusCode.GET_USER_CONNECTION
-            conn = self.create_connection(user, passwd)
+                state = OracleStatusCode.GET_USER_CONNECTION
+                conn = self.create_connection(user, passwd)
 
-            conn.call_timeout = int(os.environ['ORACLE_STMT_TIMEOUT_MS'])
-            state = OracleStatusCode.EXECUTE_CREATE
-            execute_sql_script(conn, creation)
+                conn.call_timeout = int(os.environ['ORACLE_STMT_TIMEOUT_MS'])
+                state = OracleStatusCode.EXECUTE_CREATE
+                pending_create, pending_insert = self.load_setup(conn, user, plan)
+                execute_statements(conn, pending_create, commit=True)
 
-            state = OracleStatusCode.EXECUTE_INSERT
-            execute_insert_all(insertion, conn)
+                state = OracleStatusCode.EXECUTE_INSERT
+                execute_statements(conn, pending_insert)
 
             db = None
             if pre_db:
@@ -845,25 +645,38 @@ class OracleExecutor:
                 if len(errors['rows']) > 0:
                     raise ExecutorException(OracleStatusCode.COMPILATION_ERROR, message=errors, statement=stmt)
 
-                stmt = proc_call.strip()  # Must include "DECLARE ... BEGIN .. END;", can contain several calls
-                cursor.execute(stmt)
-
-            state = OracleStatusCode.GET_ALL_TABLES
-            post = get_all_tables(conn)
+                if schema is not None:
+                    self.reset_schemas.begin(schema)
+                posts, post_fingerprints = [], []
+                for index, proc_call in enumerate(proc_calls):
+                    last = index == len(proc_calls) - 1
+                    state = OracleStatusCode.EXECUTE_USER_CODE
+                    stmt = proc_call.strip()  # Must include "DECLARE ... BEGIN .. END;", can contain several calls
+                    if not last:
+                        cursor.execute(f'SAVEPOINT {TEST_CASE_SAVEPOINT}')
+                    cursor.execute(stmt)
 
-            state = OracleStatusCode.CLOSE_USER_CONNECTION
-            conn.close()
-            conn = None
+                    state = OracleStatusCode.GET_ALL_TABLES
+                    post, post_fingerprint = self.__post_tables(conn, fingerprint, expected_fingerprints[index])
+                    posts.append(post)
+                    post_fingerprints.append(post_fingerprint)
+                    if not last and not rollback_test_case(cursor):
+                        break  # The test case has committed, so the rest are invoked in a new user
 
             state = OracleStatusCode.DROP_USER
-            self.drop_user(user, gestor)
-            user = None
+            if schema is not None:
+                self.reset_schemas.release(schema)
+                schema = None
+            else:
+                self.release_user(user, conn, gestor)
+            conn, user = None, None
 
             state = OracleStatusCode.RELEASE_ADMIN_CONNECTION
-            self.connection_pool.release(gestor)
+            if gestor:
+                self.connection_pool.release(gestor)
             gestor = None
 
-            return {'pre': db, 'post': post}
+            return {'pre': db, 'post': posts, 'fingerprint': post_fingerprints}
         except oracledb.DatabaseError as excp:
             error_msg = str(excp)
             logger.info('Error when testing procedure creation and call: %s - %s - %s', state, excp, stmt)
@@ -872,50 +685,74 @@ class OracleExecutor:
                 raise ExecutorException(OracleStatusCode.TLE_USER_CODE, error_msg, stmt) from excp
             raise ExecutorException(state, error_msg, stmt) from excp
         finally:
-            if conn:
-                conn.close()
-            if user:
-                try:
-                    # Sometimes when TLE, the connections can be closed but the user cannot be dropped because
-                    # "is currently connected". This looks like a bug or undocumented behavior of cx_Oracle
-                    # These users must be removed manually later
-                    self.drop_user(user, gestor)
-                except oracledb.DatabaseError as drop_except:  # pragma: no cover
-                    logger.error('Unable to drop user %s, REMOVE IT MANUALLY (%s)', user, drop_except)
+            if schema is not None:
+                self.reset_schemas.release(schema)
+                conn = None
+            self.discard_user(user, conn, gestor)
             if gestor:
                 self.connection_pool.release(gestor)
 
-    def execute_trigger_test(self, init_db, trigger_definition, tests, pre_db=True):
+    def execute_trigger_test(self, init_db, trigger_definition, tests, pre_db=True, fingerprint=False,
+                             expected_fingerprint=None):
         """
-        Using a new fresh user, creates a set of tables ('creation) and inserts some data.
+        Using a new fresh user (or a resettable schema, see ResettableSchemas), creates a set of tables ('creation)
+        and inserts some data.
         Then, creates a PROCEDURE defined in proc_creation and invokes the call in proc_call
         :param pre_db:
         :param tests: (str) 1 or more DML statements that should invoke the trigger
         :param trigger_definition:
         :param init_db: (str, str) Pair of statements (create, insert) to create the tables and inserting
-                                   initial data into tables from the program definition
+                                   initial data into tables from the program definition, or its setup plan
+        :param fingerprint: computes the fingerprint of the DB after executing the code (see get_db_fingerprint)
+        :param expected_fingerprint: fingerprint of the expected DB. If the DB has it, the tables are not fetched
+
+        :return: {'pre': DB, 'post': DB, 'fingerprint': dict} dictionary containing the state of the DB before
+                   defining the trigger and after executing the tests, and the fingerprint of the DB after
+                   executing the tests (see execute_dml_test)
+        """
+        res = self.execute_trigger_cases(init_db, trigger_definition, [tests], pre_db, fingerprint,
+                                         [expected_fingerprint])
+        return {'pre': res['pre'], 'post': res['post'][0], 'fingerprint': res['fingerprint'][0]}
 
-        :return: {'pre': DB, 'post': DB} dictionary containing the state of the DB before defining the trigger
-                   and after executing the tests
+    def execute_trigger_cases(self, init_db, trigger_definition, test_cases, pre_db=True, fingerprint=False,
+                              expected_fingerprints=None):
         """
-        creation, insertion = init_db
-        conn, gestor, user, post, stmt = None, None, None, None, None
+        Like execute_trigger_test, but executing several test cases (see split_test_cases) after creating the tables
+        and the TRIGGER only once. The changes of each test case are undone with ROLLBACK TO SAVEPOINT before the
+        next one, and the test cases after one that commits are executed in a new user (see __run_cases)
+        :param test_cases: list with the DML statements of each test case
+        :param expected_fingerprints: list with the fingerprint of the expected DB of each test case, or None
+        :return: {'pre': DB, 'post': list, 'fingerprint': list} dictionary containing the state of the DB before
+                 defining the trigger, and the state and fingerprint of the DB after executing each test case
+        """
+        return self.__run_cases(self.__trigger_cases, setup_plan(init_db), trigger_definition, test_cases, pre_db,
+                                fingerprint, expected_fingerprints)
+
+    def __trigger_cases(self, plan, trigger_definition, test_cases, pre_db, fingerprint, expected_fingerprints):
+        """Executes the test cases of execute_trigger_cases in one user until one of them commits"""
+        conn, gestor, user, stmt, schema = None, None, None, None, None
         state = OracleStatusCode.GET_ADMIN_CONNECTION
         try:
-            gestor = self.connection_pool.acquire()
+            if self.reset_schemas is not None and self.reset_schemas.resettable(trigger_definition):
+                schema = self.reset_schemas.lease(plan)
+            if schema is not None:
+                conn = schema.connection
+            else:
+                gestor = self.connection_pool.acquire()
 
-            state = OracleStatusCode.CREATE_USER
-            user, passwd = self.create_user(gestor)
+                state = OracleStatusCode.CREATE_USER
+                user, passwd = self.lease_user(gestor)
 
-            state = OracleStatusCode.GET_USER_CONNECTION
-            conn = self.create_connection(user, passwd)
+                state = OracleStatusCode.GET_USER_CONNECTION
+                conn = self.create_connection(user, passwd)
 
-            conn.call_timeout = int(os.environ['ORACLE_STMT_TIMEOUT_MS'])
-            state = OracleStatusCode.EXECUTE_CREATE
-            execute_sql_script(conn, creation)
+                conn.call_timeout = int(os.environ['ORACLE_STMT_TIMEOUT_MS'])
+                state = OracleStatusCode.EXECUTE_CREATE
+                pending_create, pending_insert = self.load_setup(conn, user, plan)
+                execute_statements(conn, pending_create, commit=True)
 
-            state = OracleStatusCode.EXECUTE_INSERT
-            execute_insert_all(insertion, conn)
+                state = OracleStatusCode.EXECUTE_INSERT
+                execute_statements(conn, pending_insert)
 
             db = None
             if pre_db:
@@ -933,24 +770,38 @@ class OracleExecutor:
             # cx_Oracle does not seem to compile trigger at this point. Syntax error in the trigger will be detected
             # when firing the trigger
 
-            execute_dml_statements(conn, tests)
-
-            state = OracleStatusCode.GET_ALL_TABLES
-            post = get_all_tables(conn)
-
-            state = OracleStatusCode.CLOSE_USER_CONNECTION
-            conn.close()
-            conn = None
+            if schema is not None:
+                self.reset_schemas.begin(schema)
+            posts, post_fingerprints = [], []
+            with conn.cursor() as cursor:
+                for index, tests in enumerate(test_cases):
+                    last = index == len(test_cases) - 1
+                    state = OracleStatusCode.EXECUTE_USER_CODE
+                    if not last:
+                        cursor.execute(f'SAVEPOINT {TEST_CASE_SAVEPOINT}')
+                    execute_dml_statements(conn, tests, commit=schema is None and last)
+
+                    state = OracleStatusCode.GET_ALL_TABLES
+                    post, post_fingerprint = self.__post_tables(conn, fingerprint, expected_fingerprints[index])
+                    posts.append(post)
+                    post_fingerprints.append(post_fingerprint)
+                    if not last and not rollback_test_case(cursor):
+                        break  # The test case has committed, so the rest are executed in a new user
 
             state = OracleStatusCode.DROP_USER
-            self.drop_user(user, gestor)
-            user = None
+            if schema is not None:
+                self.reset_schemas.release(schema)
+                schema = None
+            else:
+                self.release_user(user, conn, gestor)
+            conn, user = None, None
 
             state = OracleStatusCode.RELEASE_ADMIN_CONNECTION
-            self.connection_pool.release(gestor)
+            if gestor:
+                self.connection_pool.release(gestor)
             gestor = None
 
-            return {'pre': db, 'post': post}
+            return {'pre': db, 'post': posts, 'fingerprint': post_fingerprints}
         except oracledb.DatabaseError as excp:
             error_msg = str(excp)
             logger.info('Error when testing trigger creation and call: %s - %s - %s', state, excp, stmt)
@@ -963,16 +814,10 @@ class OracleExecutor:
                 raise ExecutorException(OracleStatusCode.COMPILATION_ERROR, message=errors, statement=stmt) from excp
             raise ExecutorException(state, error_msg, stmt) from excp
         finally:
-            if conn:
-                conn.close()
-            if user:
-                try:
-                    # Sometimes when TLE, the connections can be closed but the user cannot be dropped because
-                    # "is currently connected". This looks like a bug or undocumented behavior of cx_Oracle
-                    # These users must be removed manually later
-                    self.drop_user(user, gestor)
-                except oracledb.DatabaseError as drop_except:  # pragma: no cover
-                    logger.error('Unable to drop user %s, REMOVE IT MANUALLY (%s)', user, drop_except)
+            if schema is not None:
+                self.reset_schemas.release(schema)
+                conn = None
+            self.discard_user(user, conn, gestor)
             if gestor:
                 self.connection_pool.release(gestor)
 
@@ -982,7 +827,7 @@ class OracleExecutor:
         and also the INSERT sentences from the user. Then, executes a correct and wrong SELECT statements, returning
         both results in a dictionary
         :param init_db: (str, str) Pair of statements (create, insert) to create the tables and inserting
-                                   initial data into tables from the program definition
+                                   initial data into tables from the program definition, or its setup plan
         :param insertion_user: (str) Statements to insert data into tables from the user submission
         :param select_stmts: (str, str) Pair (correct, incorrect) SQL statements to run in the DB. The first one
                                         should return correct results, and the second one incorrect results
@@ -990,7 +835,7 @@ class OracleExecutor:
                  statement result of a query (in this case, select_correct and select_incorrect)
                  In case of error, throws a ExecutorException
         """
-        creation, insertion_base = init_db
+        plan = setup_plan(init_db)
         select_correct, select_incorrect = select_stmts
         conn, gestor, result_correct, result_incorrect, user = None, None, None, None, None
         state = OracleStatusCode.GET_ADMIN_CONNECTION
@@ -998,17 +843,18 @@ class OracleExecutor:
             gestor = self.connection_pool.acquire()
 
             state = OracleStatusCode.CREATE_USER
-            user, passwd = self.create_user(gestor)
+            user, passwd = self.lease_user(gestor)
 
             state = OracleStatusCode.GET_USER_CONNECTION
             conn = self.create_connection(user, passwd)
 
             conn.call_timeout = int(os.environ['ORACLE_STMT_TIMEOUT_MS'])
             state = OracleStatusCode.EXECUTE_CREATE
-            execute_sql_script(conn, creation)
+            pending_create, pending_insert = self.load_setup(conn, user, plan)
+            execute_statements(conn, pending_create, commit=True)
 
             state = OracleStatusCode.EXECUTE_INSERT
-            execute_insert_all(insertion_base, conn)
+            execute_statements(conn, pending_insert)
 
             state = OracleStatusCode.EXECUTE_USER_CODE
             execute_sql_script(conn, insertion_user)
@@ -1019,13 +865,9 @@ class OracleExecutor:
             state = OracleStatusCode.EXECUTE_DISCRIMINANT_SELECT
             result_incorrect = execute_select_statement(conn, select_incorrect)
 
-            state = OracleStatusCode.CLOSE_USER_CONNECTION
-            conn.close()
-            conn = None
-
             state = OracleStatusCode.DROP_USER
-            self.drop_user(user, gestor)
-            user = None
+            self.release_user(user, conn, gestor)
+            conn, user = None, None
 
             state = OracleStatusCode.RELEASE_ADMIN_CONNECTION
             self.connection_pool.release(gestor)
@@ -1045,15 +887,18 @@ class OracleExecutor:
                 pos = line_col_from_offset(insertion_user, offset_from_oracle_exception(excp))
             raise ExecutorException(state, error_msg, insertion_user, pos) from excp
         finally:
-            if conn:
-                conn.close()
-            if user:
-                try:
-                    # Sometimes when TLE, the connections can be closed but the user cannot be dropped because
-                    # "is currently connected". This looks like a bug or undocumented behavior of cx_Oracle
-                    # These users must be removed manually later
-                    self.drop_user(user, gestor)
-                except oracledb.DatabaseError as drop_except:  # pragma: no cover
-                    logger.error('Unable to drop user %s, REMOVE IT MANUALLY (%s)', user, drop_except)
+            self.discard_user(user, conn, gestor)
             if gestor:
                 self.connection_pool.release(gestor)
+
+
+def create_oracle_executor():
+    """
+    Creates the executor of the Oracle nodes (see oracle_nodes). In a cluster, the nodes that cannot be reached start
+    quarantined instead of raising an error
+    :return: OracleExecutor if there is one node, otherwise OracleCluster
+    """
+    nodes = oracle_nodes()
+    if len(nodes) == 1:
+        return OracleExecutor(nodes[0])
+    return OracleCluster(nodes, OracleExecutor)
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright Enrique Martín <emartinm@ucm.es> 2020
+
+Pool of Oracle sandbox users already created, to judge submissions without waiting for CREATE USER
+"""
+
+import collections
+import threading
+import time
+
+import oracledb
+from logzero import logger
+
+
+class SandboxUserPool:
+    """
+    Pool of sandbox users that have been already created and granted, so that judging a submission does not
+    need to wait for CREATE USER + GRANT. A background thread keeps the number of idle users between the low
+    and high watermarks, and drops idle users older than 'max_idle' seconds. Pooled users have their own prefix,
+    so the sweep of dangling users of any process only removes them when they are older than the maximum idle time
+    plus the age of the sweep, i.e., when the process that created them has died
+    """
+    PREFIX = 'lpol_'
+
+    def __init__(self, executor, low, high, max_idle=300):
+        """
+        Creates the pool and starts the refill thread
+        :param executor: OracleExecutor used to create and drop users
+        :param low: (int) when the number of idle users is below this value the pool is refilled
+        :param high: (int) maximum number of idle users
+        :param max_idle: (int) seconds an idle user can stay in the pool before being dropped
+        """
+        self.executor = executor
+        self.low = low
+        self.high = max(low, high)
+        self.max_idle = max_idle
+        self.users = collections.deque()  # (username, password, creation time) ordered by creation time
+        self.expired = []  # Expired users found when leasing, pending to be dropped
+        self.cond = threading.Condition()
+        self.closed = False
+        self.thread = threading.Thread(target=self.__refill_loop, name='lsql_user_pool', daemon=True)
+        self.thread.start()
+        logger.debug('Created a pool of sandbox users with watermarks (%s, %s)', self.low, self.high)
+
+    def size(self):
+        """Number of idle users in the pool"""
+        with self.cond:
+            return len(self.users)
+
+    def idle_users(self):
+        """Set with the (uppercase) names of the idle users in the pool"""
+        with self.cond:
+            return {user.upper() for user, _, _ in self.users}
+
+    def lease(self):
+        """
+        Takes an idle user from the pool, waking up the refill thread if the pool goes under the low watermark
+        :return: pair (username, password), or None if there is no idle user available
+        """
+        with self.cond:
+            user = None
+            while self.users and user is None:
+                name, passwd, created = self.users.popleft()
+                if time.time() - created < self.max_idle:
+                    user = (name, passwd)
+                else:
+                    self.expired.append(name)  # The refill thread will drop it
+            if len(self.users) < self.low or self.expired:
+                self.cond.notify()
+        return user
+
+    def close(self):
+        """Stops the refill thread and drops all the idle users"""
+        with self.cond:
+            self.closed = True
+            self.cond.notify()
+        self.thread.join()
+        with self.cond:
+            users = [user for user, _, _ in self.users]
+            self.users.clear()
+        self.__drop_users(users)
+
+    def __expired_users(self):
+        """Removes the expired users from the pool and returns their names"""
+        with self.cond:
+            expired = self.expired
+            self.expired = []
+            while self.users and time.time() - self.users[0][2] >= self.max_idle:
+                expired.append(self.users.popleft()[0])
+        return expired
+
+    def __drop_users(self, users):
+        """Drops a list of users using an admin connection"""
+        if not users:
+            return
+        gestor = None
+        try:
+            gestor = self.executor.connection_pool.acquire()
+            for user in users:
+                self.executor.drop_user(user, gestor)
+        except oracledb.DatabaseError as excp:  # pragma: no cover
+            logger.error('Unable to drop idle users from the pool %s (%s)', users, excp)
+        finally:
+            if gestor is not None:
+                self.executor.connection_pool.release(gestor)
+
+    def __refill(self):
+        """Creates new users until reaching the high watermark"""
+        gestor = None
+        try:
+            gestor = self.executor.connection_pool.acquire()
+            while not self.closed and self.size() < self.high:
+                user, passwd = self.executor.create_user(gestor, prefix=self.PREFIX)
+                with self.cond:
+                    self.users.append((user, passwd, time.time()))
+        except oracledb.DatabaseError as excp:  # pragma: no cover
+            logger.error('Unable to refill the pool of sandbox users (%s)', excp)
+        finally:
+            if gestor is not None:
+                self.executor.connection_pool.release(gestor)
+
+    def __refill_loop(self):
+        """Body of the refill thread: waits until the pool is under the low watermark or some user expires"""
+        while True:
+            with self.cond:
+                if not self.closed and len(self.users) >= self.low and not self.expired:
+                    self.cond.wait(timeout=self.max_idle / 2)
+                if self.closed:
+                    return
+            self.__drop_users(self.__expired_users())
+            if self.size() < self.low:
+                self.__refill()
@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright Enrique Martín <emartinm@ucm.es> 2020
+
+Background teardown of the Oracle sandbox users used to judge submissions
+"""
+
+import queue
+import threading
+import time
+
+import oracledb
+from logzero import logger
+
+
+class SandboxReaper:
+    """
+    Background teardown of sandbox users: closes their connections, kills their remaining sessions and drops them
+    in batches, retrying failed drops (for example, users "currently connected" after a TLE). It also sweeps
+    periodically the dangling users left by any process
+    """
+    __BATCH_SIZE = 20
+    __MAX_RETRIES = 5
+    __RETRY_DELAY_S = 5
+
+    def __init__(self, executor, sweep_interval=300, sweep_age=900):
+        """
+        Creates the reaper and starts its thread
+        :param executor: OracleExecutor used to kill sessions and drop users
+        :param sweep_interval: (int) seconds between two sweeps of dangling users (0 to disable sweeps)
+        :param sweep_age: (int) users created more than 'sweep_age' seconds ago are considered dangling
+        """
+        self.executor = executor
+        self.sweep_interval = sweep_interval
+        self.sweep_age = sweep_age
+        self.last_sweep = time.time()
+        self.queue = queue.Queue()  # (username, connection, number of retries, earliest time to retry)
+        self.closed = False
+        self.thread = threading.Thread(target=self.__reap_loop, name='lsql_reaper', daemon=True)
+        self.thread.start()
+        logger.debug('Created a reaper of sandbox users with sweeps every %s seconds', sweep_interval)
+
+    def reap(self, user_name, connection=None):
+        """Hands a user (and its open connection, if any) to the reaper"""
+        self.queue.put((user_name, connection, 0, 0))
+
+    def pending(self):
+        """Approximate number of users waiting to be removed"""
+        return self.queue.qsize()
+
+    def close(self):
+        """Removes all the pending users (without retries) and stops the reaper thread"""
+        self.closed = True
+        self.thread.join()
+        self.__reap_batch(self.__next_batch(block=False), retry=False)
+
+    def __next_batch(self, block=True):
+        """Takes the next batch of users from the queue, waiting at most 1 second for the first one"""
+        batch = []
+        try:
+            batch.append(self.queue.get(block=block, timeout=1 if block else None))
+            while len(batch) < self.__BATCH_SIZE:
+                batch.append(self.queue.get_nowait())
+        except queue.Empty:
+            pass
+        return batch
+
+    def __reap_batch(self, batch, retry=True):
+        """Kills the sessions and drops the users in the batch using one admin connection"""
+        if retry:
+            now = time.time()
+            postponed = [entry for entry in batch if entry[3] > now]
+            batch = [entry for entry in batch if entry[3] <= now]
+            for entry in postponed:
+                self.queue.put(entry)
+            if postponed and not batch:
+                time.sleep(1)  # Only users waiting for a retry, avoids busy waiting
+        if not batch:
+            return
+        for _, connection, _, _ in batch:
+            try:
+                if connection:
+                    self.executor.close_connection(connection)
+            except oracledb.Error:  # pragma: no cover
+                pass  # The connection was broken (TLE), its session will be killed
+        gestor = None
+        try:
+            gestor = self.executor.connection_pool.acquire()
+            for user_name, _, retries, _ in batch:
+                try:
+                    self.executor.kill_user_sessions(user_name, gestor)
+                    self.executor.drop_user(user_name, gestor)
+                except oracledb.DatabaseError as excp:  # pragma: no cover
+                    if 'ORA-01918' in str(excp):
+                        continue  # User does not exist: already dropped
+                    if retry and retries < self.__MAX_RETRIES:
+                        self.queue.put((user_name, None, retries + 1, time.time() + self.__RETRY_DELAY_S))
+                    else:
+                        logger.error('Unable to drop user %s after %s retries, it will be removed as dangling user '
+                                     '(%s)', user_name, retries, excp)
+        except oracledb.DatabaseError as excp:  # pragma: no cover
+            # Unable to get an admin connection, retry the whole batch later
+            logger.error('Reaper unable to get an admin connection (%s)', excp)
+            for user_name, _, retries, _ in batch:
+                self.queue.put((user_name, None, retries, time.time() + self.__RETRY_DELAY_S))
+        finally:
+            if gestor is not None:
+                self.executor.connection_pool.release(gestor)
+
+    def __sweep(self):
+        """Hands the dangling users to the reaper"""
+        self.last_sweep = time.time()
+        try:
+            for user_name, created in self.executor.get_dangling_users(self.sweep_age):
+                logger.info('Reaping dangling user %s created at %s', user_name, created)
+                self.reap(user_name)
+        except oracledb.DatabaseError as excp:  # pragma: no cover
+            logger.error('Unable to sweep dangling users. Reason: %s', excp)
+
+    def __reap_loop(self):
+        """Body of the reaper thread"""
+        while not self.closed:
+            self.__reap_batch(self.__next_batch())
+            if 0 < self.sweep_interval <= time.time() - self.last_sweep:
+                self.__sweep()
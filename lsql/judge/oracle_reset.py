@@ -0,0 +1,251 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright Enrique Martín <emartinm@ucm.es> 2020
+
+Oracle schemas reused by several submissions to mutating problems, reset after each one
+"""
+
+import os
+import re
+import threading
+
+import oracledb
+from logzero import logger
+
+from .exceptions import ExecutorException
+from .oracle_db import execute_statements
+from .oracle_sql import clean_sql
+
+
+class ResettableSchema:
+    """Schema of a sandbox user loaded with the tables of a problem, leased to judge one submission"""
+
+    def __init__(self, key, user, connection, scn, objects):
+        """
+        :param key: (str) content hash of the (create, insert) scripts loaded in the schema
+        :param user: (str) name of the owner of the schema
+        :param connection: open connection of the owner
+        :param scn: (int) SCN where the tables contain the initial data
+        :param objects: (set) objects in the schema after loading the scripts
+        """
+        self.key = key
+        self.user = user
+        self.connection = connection
+        self.scn = scn
+        self.objects = objects
+        self.txid = None  # Transaction of the submission, see ResettableSchemas.begin
+
+
+class ResettableSchemas:
+    """
+    Schemas loaded with the tables of mutating problems (DML, procedures and triggers) that are reused by several
+    submissions instead of creating a new user for each one. A schema is used by one submission at a time and
+    reset afterward: pending changes are rolled back, tables are flashed back to their initial SCN if the
+    submission committed (explicitly or with DDL) and the objects created by the submission are dropped. If the
+    schema cannot be reset to its initial objects, it is dropped. Idle schemas keep their connection open, so
+    schemas without sessions are dangling users left by dead processes
+    """
+    __PREFIX = 'lrst_'
+    __DML_KEYWORDS = {'INSERT', 'UPDATE', 'DELETE', 'MERGE', 'SELECT', 'WITH'}
+    __DROPPABLE_TYPES = {'PROCEDURE', 'FUNCTION', 'TRIGGER', 'PACKAGE', 'TYPE', 'VIEW', 'SYNONYM'}
+    __AUTONOMOUS = re.compile(r'PRAGMA\s+AUTONOMOUS_TRANSACTION', re.IGNORECASE)
+    __FIRST_WORD = re.compile(r'[\s(]*(\w+)')
+    # Tables and their dependent objects are restored by FLASHBACK TABLE, which can change their DDL time
+    __OBJECTS = """SELECT object_name, object_type,
+                          DECODE(object_type, 'TABLE', NULL, 'INDEX', NULL, 'LOB', NULL, last_ddl_time)
+                   FROM user_objects"""
+    __TABLES = 'SELECT table_name FROM user_tables'
+    __CURRENT_SCN = 'SELECT current_scn FROM v$database'
+    __TRANSACTION_ID = 'BEGIN :txid := DBMS_TRANSACTION.LOCAL_TRANSACTION_ID({}); END;'
+
+    def __init__(self, executor, max_idle):
+        """
+        :param executor: OracleExecutor used to create and drop users
+        :param max_idle: (int) maximum number of idle schemas, the least recently used ones are dropped
+        """
+        self.executor = executor
+        self.max_idle = max_idle
+        self.idle = []  # ResettableSchema ordered from least to most recently used
+        self.unsupported = set()  # Content hashes of scripts whose schemas cannot be reset
+        self.lock = threading.Lock()
+        logger.debug('Created resettable schemas with at most %s idle schemas', max_idle)
+
+    def resettable(self, code, dml=False):
+        """
+        Decides if a submission can be judged in a resettable schema. Autonomous transactions commit changes that
+        cannot be detected, and DML submissions must contain only DML statements (other statements like DDL or
+        COMMIT end the transaction)
+        :param code: (str) code of the submission
+        :param dml: (bool) the code is a sequence of DML statements
+        :return: bool
+        """
+        if self.__AUTONOMOUS.search(code):
+            return False
+        if dml:
+            try:
+                statements = clean_sql(code)
+            except ExecutorException:  # pragma: no cover
+                return False
+            for stmt in statements:
+                match = self.__FIRST_WORD.match(stmt)
+                if match is None or match.group(1).upper() not in self.__DML_KEYWORDS:
+                    return False
+        return True
+
+    def size(self):
+        """Number of idle schemas"""
+        with self.lock:
+            return len(self.idle)
+
+    def idle_users(self):
+        """Set with the (uppercase) names of the owners of the idle schemas"""
+        with self.lock:
+            return {schema.user.upper() for schema in self.idle}
+
+    def lease(self, plan):
+        """
+        Takes an idle schema loaded with the scripts of a setup plan, or builds a new one
+        :param plan: setup plan (see compile_setup)
+        :return: ResettableSchema, or None if the scripts cannot be loaded in a resettable schema
+        """
+        key = plan['hash']
+        if key in self.unsupported:
+            return None
+        while True:
+            with self.lock:
+                pos = next((i for i in range(len(self.idle) - 1, -1, -1) if self.idle[i].key == key), None)
+                schema = self.idle.pop(pos) if pos is not None else None
+            if schema is None:
+                return self.__build(key, plan)
+            try:
+                schema.connection.ping()
+                return schema
+            except oracledb.Error:  # pragma: no cover
+                self.__drop(schema)  # The session has been killed, try with another one
+
+    def begin(self, schema):
+        """Starts the transaction of the submission, must be invoked just before executing the code to judge"""
+        with schema.connection.cursor() as cursor:
+            txid = cursor.var(str)
+            cursor.execute(self.__TRANSACTION_ID.format('TRUE'), txid=txid)
+            schema.txid = txid.getvalue()
+
+    def release(self, schema):
+        """
+        Resets a schema once the submission has been judged and makes it idle, dropping the least recently used
+        idle schema if there are too many. If the schema cannot be reset it is dropped
+        :param schema: ResettableSchema returned by lease
+        :return: None
+        """
+        try:
+            reset = self.__reset(schema)
+        except oracledb.Error as excp:
+            logger.info('Unable to reset schema %s: %s', schema.user, excp)
+            reset = False
+        if not reset:
+            self.__drop(schema)
+            return
+        with self.lock:
+            self.idle.append(schema)
+            evicted = self.idle.pop(0) if len(self.idle) > self.max_idle else None
+        if evicted is not None:
+            self.__drop(evicted)
+
+    def close(self):
+        """Drops all the idle schemas"""
+        with self.lock:
+            schemas = self.idle
+            self.idle = []
+        for schema in schemas:
+            self.__drop(schema)
+
+    def __objects(self, cursor):
+        """Set of objects in the schema of the cursor"""
+        cursor.execute(self.__OBJECTS)
+        return set(cursor.fetchall())
+
+    def __current_scn(self):
+        """Current SCN of the database, read with an admin connection (sandbox users cannot read v$database)"""
+        gestor = self.executor.connection_pool.acquire()
+        try:
+            with gestor.cursor() as cursor:
+                cursor.execute(self.__CURRENT_SCN)
+                return cursor.fetchone()[0]
+        finally:
+            self.executor.connection_pool.release(gestor)
+
+    def __reset(self, schema):
+        """Restores the schema to its initial state, returns False if it is not possible"""
+        with schema.connection.cursor() as cursor:
+            committed = False
+            if schema.txid is not None:
+                txid = cursor.var(str)
+                cursor.execute(self.__TRANSACTION_ID.format('FALSE'), txid=txid)
+                committed = txid.getvalue() != schema.txid
+                schema.txid = None
+            schema.connection.rollback()
+            for name, obj_type, _ in self.__objects(cursor) - schema.objects:
+                if obj_type in self.__DROPPABLE_TYPES:
+                    # Names come directly from the schema
+                    cursor.execute(f'DROP {obj_type} "{name}"')
+            if committed:
+                cursor.execute(self.__TABLES)
+                tables = ', '.join(f'"{row[0]}"' for row in cursor.fetchall())
+                if tables:
+                    cursor.execute(f'FLASHBACK TABLE {tables} TO SCN {int(schema.scn)}')
+                schema.scn = self.__current_scn()
+            return self.__objects(cursor) == schema.objects
+
+    def __build(self, key, plan):
+        """Creates a new user and loads the scripts in its schema. Returns a ResettableSchema or None"""
+        gestor, user, conn = None, None, None
+        try:
+            gestor = self.executor.connection_pool.acquire()
+            user, passwd = self.executor.create_user(gestor, self.__PREFIX)
+            conn = self.executor.create_connection(user, passwd)
+            conn.call_timeout = int(os.environ['ORACLE_STMT_TIMEOUT_MS'])
+            pending_create, pending_insert = self.executor.load_setup(conn, user, plan)
+            execute_statements(conn, pending_create, commit=True)
+            execute_statements(conn, pending_insert)
+            conn.commit()
+            with conn.cursor() as cursor:
+                objects = self.__objects(cursor)
+                if any(obj_type == 'SEQUENCE' for _, obj_type, _ in objects):
+                    # Sequences (also those of identity columns) are restored neither by rollbacks nor flashbacks
+                    self.unsupported.add(key)
+                    return None
+                cursor.execute(self.__TABLES)
+                for (table,) in cursor.fetchall():
+                    cursor.execute(f'ALTER TABLE "{table}" ENABLE ROW MOVEMENT')  # Needed by FLASHBACK TABLE
+            scn = self.__current_scn()
+            schema = ResettableSchema(key, user, conn, scn, objects)
+            user, conn = None, None
+            logger.debug('Built resettable schema %s', schema.user)
+            return schema
+        except (oracledb.DatabaseError, ExecutorException) as excp:
+            # The error will be reported when executing the scripts in a new user
+            logger.info('Unable to build resettable schema: %s', excp)
+            return None
+        finally:
+            if user is not None:
+                self.executor.discard_user(user, conn, gestor)
+            if gestor is not None:
+                self.executor.connection_pool.release(gestor)
+
+    def __drop(self, schema):
+        """Closes the connection of a schema and drops its owner"""
+        gestor = None
+        try:
+            if self.executor.reaper is None:
+                gestor = self.executor.connection_pool.acquire()
+            self.executor.discard_user(schema.user, schema.connection, gestor)
+        except oracledb.Error as excp:  # pragma: no cover
+            # Without sessions, the schema will be removed as a dangling user
+            logger.error('Unable to drop resettable schema %s (%s)', schema.user, excp)
+            try:
+                self.executor.close_connection(schema.connection)
+            except oracledb.Error:
+                pass
+        finally:
+            if gestor is not None:
+                self.executor.connection_pool.release(gestor)
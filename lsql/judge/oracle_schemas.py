@@ -0,0 +1,553 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright Enrique Martín <emartinm@ucm.es> 2020
+
+Users and schemas of an Oracle node where the code of problems and submissions is executed
+"""
+
+import os
+import string
+
+import oracledb
+from logzero import logger
+
+from .oracle_db import execute_setup, execute_statements
+from .oracle_sql import copied_tables, execute_immediate_block, random_str
+
+
+class OracleSchemas:
+    """
+    Management of the Oracle users where the code is executed: sandbox users (limited with a profile), shared
+    read-only schemas and master schemas. Base class of OracleExecutor, which creates the pools and settings used here
+    """
+
+    __USER_PREFIX = 'lsql_'
+    __ALPHABET = string.ascii_lowercase + string.digits
+    __CREATE_USER_SCRIPT = ('CREATE USER {} '
+                            'IDENTIFIED BY "{}" '
+                            'DEFAULT TABLESPACE {} '
+                            'TEMPORARY TABLESPACE TEMP QUOTA {} ON {}')
+    # Resource limits of sandbox users (see create_sandbox_profile)
+    __SANDBOX_PROFILE = 'LSQL_SANDBOX'
+    __SANDBOX_MODULE = 'LSQL_SANDBOX'
+    __PROFILE_LIMITS = 'LIMIT CPU_PER_CALL {} LOGICAL_READS_PER_CALL {} SESSIONS_PER_USER UNLIMITED'
+    __CONSUMER_GROUP_SCRIPT = """
+        BEGIN
+            DBMS_RESOURCE_MANAGER.CREATE_PENDING_AREA();
+            BEGIN
+                DBMS_RESOURCE_MANAGER.CREATE_CONSUMER_GROUP(consumer_group => :consumer_group,
+                                                            comment => 'LearnSQL sandbox users');
+            EXCEPTION
+                WHEN OTHERS THEN
+                    IF SQLCODE != -29357 THEN  -- The consumer group already exists
+                        RAISE;
+                    END IF;
+            END;
+            DBMS_RESOURCE_MANAGER.SET_CONSUMER_GROUP_MAPPING(DBMS_RESOURCE_MANAGER.MODULE_NAME, :module,
+                                                             :consumer_group);
+            DBMS_RESOURCE_MANAGER.SUBMIT_PENDING_AREA();
+        END;"""
+    # Only privileges on their own schema: shared, resettable and master schemas outlive the submissions, so they
+    # must not be reachable from other users (no ANY privileges nor access to the whole data dictionary)
+    __GRANT_USER_SCRIPT = ('GRANT create table, connect, create session , '
+                           'create synonym , create public synonym, create sequence, create view , '
+                           'create trigger, create procedure '
+                           'TO {}')
+    __DROP_USER_SCRIPT = 'DROP USER {} CASCADE'
+    __PROXY_USER_SCRIPT = 'ALTER USER {} GRANT CONNECT THROUGH {}'
+    __USER_CONNECTIONS = """SELECT s.sid, s.serial#, s.username
+                                FROM   gv$session s
+                                       JOIN gv$process p ON p.addr = s.paddr AND p.inst_id = s.inst_id
+                                WHERE  s.username = :username"""
+    __DANGLING_USERS = """SELECT USERNAME, CREATED
+                          FROM all_users
+                          WHERE USERNAME LIKE 'LSQ_%' AND (SYSDATE-CREATED)*24*60*60 > :age_seconds
+                          ORDER BY CREATED ASC"""
+    __NUM_DANGLING_USERS = """SELECT COUNT(USERNAME)
+                              FROM all_users
+                              WHERE USERNAME LIKE 'LSQ_%' AND (SYSDATE-CREATED)*24*60*60 > :age_seconds"""
+    __KILL_SESSION = """ALTER SYSTEM KILL SESSION '{},{}'"""
+    # Resettable schemas keep their sessions open while they are alive
+    __ORPHAN_RESET_USERS = """SELECT u.username, u.created
+                              FROM all_users u
+                              WHERE u.username LIKE 'LRST\\_%' ESCAPE '\\'
+                                    AND (SYSDATE-u.created)*24*60*60 > :age_seconds
+                                    AND NOT EXISTS (SELECT 1 FROM gv$session s WHERE s.username = u.username)
+                              ORDER BY u.created ASC"""
+    # Pooled users stay idle up to the maximum idle time of the pool, and then are used by one submission
+    __ORPHAN_POOL_USERS = """SELECT username, created
+                             FROM all_users
+                             WHERE username LIKE 'LPOL\\_%' ESCAPE '\\'
+                                   AND (SYSDATE-created)*24*60*60 > :age_seconds + :max_idle
+                             ORDER BY created ASC"""
+    # Shared read-only schemas for SELECT problems. Their names do not match LSQ_% so they are never
+    # considered dangling users
+    __SHARED_PREFIX = 'lshr_'
+    __SHARED_BUILD_TIMEOUT_S = 300
+    __SHARED_USER_STATUS = """SELECT account_status, (SYSDATE-created)*24*60*60
+                              FROM dba_users
+                              WHERE username = :username"""
+    __SHARED_USERS = """SELECT username
+                         FROM all_users
+                         WHERE username LIKE 'LSHR\\_%' ESCAPE '\\' AND (SYSDATE-created)*24*60*60 >= :age_seconds"""
+    __CREATE_READER_SCRIPT = 'CREATE USER {} IDENTIFIED BY "{}"{}'
+    __GRANT_READER_SCRIPT = 'GRANT create session TO {}'
+    __LOCK_USER_SCRIPT = 'ALTER USER {} ACCOUNT LOCK'
+    # Master schemas: shared schemas whose tables are copied into the sandboxes (see sandbox_plan)
+    __MASTER_UNSUPPORTED = """SELECT COUNT(*)
+                              FROM dba_objects
+                              WHERE owner = :owner AND object_type IN ('SEQUENCE', 'TRIGGER')"""
+    __MASTER_COLUMNS = """SELECT c.table_name, c.column_name
+                          FROM dba_tab_cols c JOIN dba_tables t ON t.owner = c.owner AND t.table_name = c.table_name
+                          WHERE c.owner = :owner AND c.virtual_column = 'NO' AND c.user_generated = 'YES'
+                          ORDER BY c.table_name, c.column_id"""
+    __SHARED_OBJECTS = """SELECT object_name, object_type
+                          FROM user_objects
+                          WHERE object_type IN ('TABLE', 'VIEW', 'SEQUENCE', 'FUNCTION', 'PROCEDURE',
+                                                'PACKAGE', 'TYPE')"""
+
+    def create_sandbox_profile(self):
+        """
+        Creates (or updates) the profile that limits the CPU time (ORACLE_PROFILE_CPU_PER_CALL, in hundredths of
+        second, by default ORACLE_STMT_TIMEOUT_MS) and logical reads (ORACLE_PROFILE_LOGICAL_READS_PER_CALL, by default
+        1000000) of every call of sandbox users, so code that keeps running in the server after the call timeout is
+        also stopped. Sandbox users are created with this profile and a quota of ORACLE_USER_QUOTA_MB megabytes (by
+        default 50). If ORACLE_CONSUMER_GROUP is defined, also creates that Resource Manager consumer group and maps
+        the sessions of sandbox users to it (the active resource plan must have a directive for the group). If the
+        profile cannot be created, sandbox users are created without limits
+        :return: None
+        """
+        default_cpu = int(os.environ['ORACLE_STMT_TIMEOUT_MS']) // 10
+        cpu_per_call = int(os.environ.get('ORACLE_PROFILE_CPU_PER_CALL', default_cpu))
+        logical_reads = int(os.environ.get('ORACLE_PROFILE_LOGICAL_READS_PER_CALL', 1000000))
+        limits = self.__PROFILE_LIMITS.format(max(cpu_per_call, 1), logical_reads)
+        consumer_group = os.environ.get('ORACLE_CONSUMER_GROUP')
+        gestor = self.connection_pool.acquire()
+        try:
+            with gestor.cursor() as cursor:
+                try:
+                    cursor.execute(f'CREATE PROFILE {self.__SANDBOX_PROFILE} {limits}')
+                except oracledb.DatabaseError as excp:
+                    if 'ORA-02379' not in str(excp):  # Profile already exists
+                        raise
+                    cursor.execute(f'ALTER PROFILE {self.__SANDBOX_PROFILE} {limits}')
+                if consumer_group:
+                    cursor.execute(self.__CONSUMER_GROUP_SCRIPT, consumer_group=consumer_group,
+                                   module=self.__SANDBOX_MODULE)
+            self.sandbox_profile, self.consumer_group = self.__SANDBOX_PROFILE, consumer_group or None
+            self.user_quota = f'{int(os.environ.get("ORACLE_USER_QUOTA_MB", 50))}M'
+        except oracledb.DatabaseError as excp:
+            logger.error('Unable to limit the resources of sandbox users: %s', excp)
+        finally:
+            self.connection_pool.release(gestor)
+
+    def create_user_script(self, user_name, user_passwd):
+        """CREATE USER statement of a sandbox user (or the owner of a shared schema), with the quota and profile of
+        sandbox users"""
+        script = self.__CREATE_USER_SCRIPT.format(user_name, user_passwd, os.environ['ORACLE_TABLESPACE'],
+                                                  self.user_quota, os.environ['ORACLE_TABLESPACE'])
+        if self.sandbox_profile is not None:
+            script += f' PROFILE {self.sandbox_profile}'
+        return script
+
+    def limit_session(self, connection):
+        """Sets the module of a session of a sandbox user, so Resource Manager maps it to the consumer group of
+        sandbox users (if any)"""
+        if self.consumer_group is not None:
+            connection.module = self.__SANDBOX_MODULE
+        return connection
+
+    def create_user(self, connection, prefix=None):
+        """
+        Creates a new user in the local Oracle DB with a random name and password. The user
+        has acces to the TABLESPACE defined in the configuration file, and its username
+        starts with a given prefix defined in the configuration file
+        :param connection: Connection with privileges for creating users
+        :param prefix: Prefix of the username, by default the prefix of sandbox users
+        :return: A pair (username, password) of the created user
+        """
+        user_name = f'{prefix or self.__USER_PREFIX}{random_str(8)}'
+        user_passwd = random_str(8)
+        create_script = self.create_user_script(user_name, user_passwd)
+        grant_script = self.__GRANT_USER_SCRIPT.format(user_name)
+
+        statements = [create_script, grant_script]
+        if self.sandbox_pool is not None:
+            statements.append(self.__PROXY_USER_SCRIPT.format(user_name, os.environ['ORACLE_USER']))
+        with connection.cursor() as cursor:
+            # One round trip
+            cursor.execute(execute_immediate_block(len(statements)), done=cursor.var(int),
+                           **{f's{i}': stmt for i, stmt in enumerate(statements)})
+        return user_name, user_passwd
+
+    def lease_user(self, connection):
+        """
+        Returns a fresh user to judge a submission, taking it from the pool of sandbox users if it is enabled
+        and has idle users. Otherwise, creates a new user
+        :param connection: Connection with privileges for creating users
+        :return: A pair (username, password) of the user
+        """
+        user = self.user_pool.lease() if self.user_pool is not None else None
+        if user is None:
+            user = self.create_user(connection)
+        return user
+
+    def get_dangling_users(self, age_seconds=60):
+        """
+        Returns the names of the LSQL_* users created more than 'age_seconds' ago, the resettable schemas without
+        sessions and the pooled users older than 'age_seconds' plus the maximum idle time of the pool (excluding the
+        idle users in the pool of this process)
+        :param age_seconds: (int) number of seconds
+        :return: list of (username, creation date)
+        """
+        gestor = None
+        try:
+            gestor = self.connection_pool.acquire()
+            with gestor.cursor() as cursor:
+                cursor.execute(self.__DANGLING_USERS, age_seconds=age_seconds)
+                users = cursor.fetchall()
+                cursor.execute(self.__ORPHAN_RESET_USERS, age_seconds=age_seconds)
+                users.extend(cursor.fetchall())
+                cursor.execute(self.__ORPHAN_POOL_USERS, age_seconds=age_seconds, max_idle=self.pool_max_idle)
+                users.extend(cursor.fetchall())
+            pooled = self.user_pool.idle_users() if self.user_pool is not None else set()
+            return [user for user in users if user[0] not in pooled]
+        finally:
+            if gestor is not None:
+                self.connection_pool.release(gestor)
+
+    def kill_user_sessions(self, user_name, connection):
+        """
+        Kills all the open sessions of a user
+        :param user_name: Name of the user
+        :param connection: Connection with privileges to kill sessions
+        :return: None
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(self.__USER_CONNECTIONS, username=user_name.upper())
+            sessions = cursor.fetchall()
+            for session in sessions:  # pragma: no cover
+                cursor.execute(self.__KILL_SESSION.format(session[0], session[1]))
+
+    def remove_dangling_users(self, age_seconds=60):
+        """
+        Removes all the LSQL_* users created more than 'age_seconds' ago
+        :param age_seconds: (int) number of seconds
+        :return: None
+        """
+        gestor = None
+        try:
+            users = self.get_dangling_users(age_seconds)
+            gestor = self.connection_pool.acquire()
+            for user in users:
+                logger.info('Removing dangling user %s created at %s', user[0], user[1])
+                self.kill_user_sessions(user[0], gestor)
+                self.drop_user(user[0], gestor)
+        except oracledb.DatabaseError as excp:  # pragma: no cover
+            logger.error('Unable to remove dangling users. Reason: %s', excp)
+        finally:
+            if gestor is not None:
+                self.connection_pool.release(gestor)
+
+    def get_number_dangling_users(self, age_seconds=60):
+        """
+        Returns the number of dangling users, i.e., users created more than 'age_seconds' ago
+        :param age_seconds: (int) number of seconds
+        :return: (int), -1 if error
+        """
+        gestor = None
+        num = -1
+        try:
+            gestor = self.connection_pool.acquire()
+            with gestor.cursor() as cursor:
+                cursor.execute(self.__NUM_DANGLING_USERS, age_seconds=age_seconds)
+                row = cursor.fetchone()
+                num = row[0]
+        except oracledb.DatabaseError as excp:  # pragma: no cover
+            logger.error('Unable to get number of dangling users. Reason: %s', excp)
+        finally:
+            if gestor is not None:
+                self.connection_pool.release(gestor)
+        return num
+
+    def drop_user(self, user_name, connection):
+        """
+        Removes a user from the Oracle local DB
+        :param user_name: Name of the user to remove
+        :param connection: Connection with priviledges to drop users
+        :return: None
+        """
+        with connection.cursor() as cursor:
+            drop_script = self.__DROP_USER_SCRIPT.format(user_name)
+            cursor.execute(drop_script)
+
+    def release_user(self, user_name, connection, gestor):
+        """
+        Closes the connection of a sandbox user and drops the user once the submission has been judged. If the
+        reaper is enabled both tasks are handed to it, so the verdict does not wait for them
+        :param user_name: Name of the user to remove
+        :param connection: Open connection of the user (or None)
+        :param gestor: Connection with privileges to drop users
+        :return: None
+        """
+        if self.reaper is not None:
+            self.reaper.reap(user_name, connection)
+            return
+        if connection:
+            self.close_connection(connection)
+        self.drop_user(user_name, gestor)
+
+    def discard_user(self, user_name, connection, gestor):
+        """
+        Like release_user, but used when judging has failed: it never raises exceptions because the
+        original error must be reported
+        :param user_name: Name of the user to remove (or None)
+        :param connection: Open connection of the user (or None)
+        :param gestor: Connection with privileges to drop users
+        :return: None
+        """
+        if user_name and self.reaper is not None:
+            self.reaper.reap(user_name, connection)
+            return
+        if connection:
+            try:
+                self.close_connection(connection)
+            except oracledb.Error as close_except:  # pragma: no cover
+                logger.error('Unable to close connection of user %s (%s)', user_name, close_except)
+        if user_name:
+            try:
+                # Sometimes when TLE, the connections can be closed but the user cannot be dropped because
+                # "is currently connected". This looks like a bug or undocumented behavior of cx_Oracle
+                # These users will be removed later as dangling users
+                self.drop_user(user_name, gestor)
+            except oracledb.DatabaseError as drop_except:  # pragma: no cover
+                logger.error('Unable to drop user %s, REMOVE IT MANUALLY (%s)', user_name, drop_except)
+
+    def create_connection(self, user, passwd):
+        """
+        Creates an Oracle connection to localhost/xe using UTF-8. If the pool of sandbox sessions is enabled, the
+        session is created through the pool using proxy authentication (the password is not needed). Otherwise,
+        it is a standalone connection (to a pooled server if DRCP is enabled)
+        :param user: Name of the Oracle user
+        :param passwd: Password of the Oracle user
+        :return: Oracle connection, that must be closed with close_connection
+        """
+        if self.sandbox_pool is not None:
+            return self.limit_session(self.sandbox_pool.acquire(user=user))
+        if self.drcp:
+            return self.limit_session(oracledb.connect(user=user, password=passwd, dsn=self.drcp_dsn_tns,
+                                                       cclass='LSQL', purity=oracledb.PURITY_NEW))
+        connection = oracledb.connect(user=user, password=passwd, dsn=self.dsn_tns)
+        return self.limit_session(connection)
+
+    def close_connection(self, connection, reuse=False):
+        """
+        Closes a connection returned by create_connection. Sessions from the pool of sandbox sessions are dropped
+        from the pool, as their users are going to be dropped, unless 'reuse' is True
+        :param connection: Oracle connection
+        :param reuse: (bool) the session can be reused by another connection of the same user
+        :return: None
+        """
+        if self.sandbox_pool is not None and not reuse:
+            self.sandbox_pool.drop(connection)
+        else:
+            connection.close()
+
+    def shared_schema(self, plan):
+        """
+        Returns the shared read-only schema for the (create, insert) scripts, building it if it does not exist.
+        Shared schemas are identified by the hash of their scripts, so every process and every problem
+        with the same scripts use the same schema. The owner of the schema is locked once the schema is
+        completely built, and submissions are executed by a reader user with only SELECT and EXECUTE grants
+        :param plan: setup plan (see compile_setup)
+        :return: pair (owner, reader) of user names, or None if the schema is not available (it is being built
+                 by another process or the scripts cannot be executed)
+        """
+        key = plan['hash']
+        if self.shared_schemas is not None and key in self.shared_schemas:
+            return self.shared_schemas[key]
+        owner = f'{self.__SHARED_PREFIX}{key[:16]}'
+        reader = f'{owner}_r'
+        schema = None
+        with self.shared_lock:
+            gestor = None
+            try:
+                gestor = self.connection_pool.acquire()
+                with gestor.cursor() as cursor:
+                    cursor.execute(self.__SHARED_USER_STATUS, username=owner.upper())
+                    status = cursor.fetchone()
+                if status is not None and 'LOCKED' in status[0]:
+                    schema = (owner, reader)
+                elif status is None or status[1] > self.__SHARED_BUILD_TIMEOUT_S:
+                    # Not built, or the process building it died
+                    if status is not None:
+                        self.drop_shared_schema(owner, reader, gestor)
+                    self.__build_shared_schema(owner, reader, plan, gestor)
+                    schema = (owner, reader)
+            except oracledb.DatabaseError as excp:
+                # ORA-01920: the owner has been just created by another process that is building the schema
+                if gestor is not None and 'ORA-01920' not in str(excp):
+                    logger.error('Unable to build shared schema %s: %s', owner, excp)
+                    self.drop_shared_schema(owner, reader, gestor)
+            finally:
+                if gestor is not None:
+                    self.connection_pool.release(gestor)
+        if schema is not None and self.shared_schemas is not None:
+            self.shared_schemas[key] = schema
+        return schema
+
+    def __build_shared_schema(self, owner, reader, plan, gestor):
+        """
+        Creates the owner and the reader users of a shared schema, runs the scripts as the owner, grants SELECT
+        or EXECUTE on all the objects to the reader and finally locks the owner, marking the schema as built
+        """
+        passwd = random_str(8)
+        with gestor.cursor() as cursor:
+            cursor.execute(self.create_user_script(owner, passwd))
+            cursor.execute(self.__GRANT_USER_SCRIPT.format(owner))
+            if self.sandbox_pool is not None:
+                cursor.execute(self.__PROXY_USER_SCRIPT.format(owner, os.environ['ORACLE_USER']))
+            profile = f' PROFILE {self.sandbox_profile}' if self.sandbox_profile is not None else ''
+            cursor.execute(self.__CREATE_READER_SCRIPT.format(reader, random_str(8), profile))
+            cursor.execute(self.__GRANT_READER_SCRIPT.format(reader))
+            cursor.execute(self.__PROXY_USER_SCRIPT.format(reader, os.environ['ORACLE_USER']))
+        conn = self.create_connection(owner, passwd)
+        try:
+            pending_create, pending_insert = execute_setup(conn, plan)
+            execute_statements(conn, pending_create, commit=True)
+            execute_statements(conn, pending_insert)
+            conn.commit()
+            with conn.cursor() as cursor:
+                cursor.execute(self.__SHARED_OBJECTS)
+                objects = cursor.fetchall()
+                for name, obj_type in objects:
+                    privilege = 'SELECT' if obj_type in ('TABLE', 'VIEW', 'SEQUENCE') else 'EXECUTE'
+                    # Names come directly from the schema
+                    cursor.execute(f'GRANT {privilege} ON "{name}" TO {reader}')
+        finally:
+            self.close_connection(conn)
+        with gestor.cursor() as cursor:
+            cursor.execute(self.__LOCK_USER_SCRIPT.format(owner))
+        logger.debug('Built shared schema %s', owner)
+
+    def drop_shared_schema(self, owner, reader, gestor):
+        """Drops the owner and reader of a shared schema, ignoring errors"""
+        for user in [reader, owner]:
+            try:
+                self.kill_user_sessions(user, gestor)
+                self.drop_user(user, gestor)
+            except oracledb.DatabaseError:  # pragma: no cover
+                pass  # The user was not created
+
+    def remove_shared_schemas(self, hashes=(), age_seconds=0):
+        """
+        Removes the shared schemas (also the master schemas, see sandbox_plan) whose content hash is not in 'hashes',
+        for example the schemas of old versions of problems that have been edited (see remove_stale_schemas command)
+        :param hashes: content hashes of the setup plans whose schemas are kept
+        :param age_seconds: (int) only schemas created more than 'age_seconds' ago are removed, so schemas being
+                            built for problems not saved yet are kept
+        :return: None
+        """
+        kept = {f'{self.__SHARED_PREFIX}{key[:16]}'.upper() for key in hashes}
+        gestor = None
+        try:
+            gestor = self.connection_pool.acquire()
+            with gestor.cursor() as cursor:
+                cursor.execute(self.__SHARED_USERS, age_seconds=age_seconds)
+                users = [row[0] for row in cursor.fetchall()]
+            removed = {user for user in users if not user.endswith('_R') and user not in kept}
+            for owner in removed:
+                logger.info('Removing shared schema %s', owner)
+                self.drop_shared_schema(owner, f'{owner}_R', gestor)
+            for schemas in (self.shared_schemas, self.master_schemas):
+                for key in [key for key in schemas or {} if f'{self.__SHARED_PREFIX}{key[:16]}'.upper() in removed]:
+                    del schemas[key]
+        except oracledb.DatabaseError as excp:  # pragma: no cover
+            logger.error('Unable to remove shared schemas. Reason: %s', excp)
+        finally:
+            if gestor is not None:
+                self.connection_pool.release(gestor)
+
+    def sandbox_plan(self, plan):
+        """
+        Setup plan to load the tables of a problem in a sandbox. If master schemas are enabled, the data is loaded
+        only once in the shared schema of the scripts (the master schema), and sandboxes execute the CREATE
+        statements and then copy the rows from the master schema with INSERT ... SELECT, instead of parsing a big
+        INSERT ALL in every submission. Scripts whose master schema contains sequences or triggers (the copied rows
+        could be different from the inserted ones) and scripts not supported by copied_tables are loaded with the
+        INSERT ALL
+        :param plan: setup plan (see compile_setup)
+        :return: setup plan, with the INSERT ... SELECT statements in the key 'copy' and the pair (owner, tables) of
+                 the master schema in the key 'master' if the rows can be copied
+        """
+        key = plan['hash']
+        if self.master_schemas is None or plan['insert_all'] is None:
+            return plan
+        if key in self.master_schemas:
+            return self.master_schemas[key] or plan
+        tables = copied_tables(plan)
+        if tables is None:
+            self.master_schemas[key] = None
+            return plan
+        schema = self.shared_schema(plan)
+        if schema is None:
+            return plan  # Being built by another process
+        owner = schema[0].upper()
+        master_plan, gestor = None, None
+        try:
+            gestor = self.connection_pool.acquire()
+            with gestor.cursor() as cursor:
+                cursor.execute(self.__MASTER_UNSUPPORTED, owner=owner)
+                unsupported = cursor.fetchone()[0] > 0
+                cursor.execute(self.__MASTER_COLUMNS, owner=owner)
+                columns = {}
+                for table, column in cursor.fetchall():
+                    columns.setdefault(table, []).append(f'"{column}"')
+                if not unsupported and all(table in columns for table in tables):
+                    copy = []
+                    for table in tables:
+                        # Names come directly from the schema
+                        names = ', '.join(columns[table])
+                        copy.append(f'INSERT INTO "{table}" ({names}) SELECT {names} FROM {owner}."{table}"')
+                    master_plan = dict(plan, insert_all=None, copy=copy, master=(owner, tables))
+        except oracledb.DatabaseError as excp:  # pragma: no cover
+            logger.error('Unable to use master schema %s: %s', owner, excp)
+        finally:
+            if gestor is not None:
+                self.connection_pool.release(gestor)
+        self.master_schemas[key] = master_plan
+        return master_plan or plan
+
+    def grant_master(self, plan, user, grant=True):
+        """Grants (or revokes) SELECT on the tables of the master schema of a setup plan returned by sandbox_plan to
+        a sandbox user, in one round trip"""
+        owner, tables = plan['master']
+        # Names come directly from the schema
+        statements = [f'GRANT SELECT ON {owner}."{table}" TO {user}' if grant
+                      else f'REVOKE SELECT ON {owner}."{table}" FROM {user}' for table in tables]
+        gestor = self.connection_pool.acquire()
+        try:
+            with gestor.cursor() as cursor:
+                cursor.execute(execute_immediate_block(len(statements)), done=cursor.var(int),
+                               **{f's{i}': stmt for i, stmt in enumerate(statements)})
+        finally:
+            self.connection_pool.release(gestor)
+
+    def load_setup(self, conn, user, plan):
+        """
+        Executes the setup plan (see execute_setup) in the schema of a sandbox user, copying the rows from the master
+        schema if possible (see sandbox_plan). The user can only read the master schema while its rows are being
+        copied, as master schemas contain the hidden test databases of the problems
+        :return: pair (creation statements, insertion statements) pending to be executed, as in execute_setup
+        """
+        plan = self.sandbox_plan(plan)
+        if 'copy' not in plan:
+            return execute_setup(conn, plan)
+        self.grant_master(plan, user)
+        try:
+            pending_create, pending_insert = execute_setup(conn, plan)
+            execute_statements(conn, pending_create, commit=True)
+            execute_statements(conn, pending_insert)
+        finally:
+            self.grant_master(plan, user, grant=False)
+        return [], []
@@ -0,0 +1,332 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright Enrique Martín <emartinm@ucm.es> 2020
+
+Processing of the Oracle SQL code of problems and submissions that does not need a connection to Oracle:
+splitting scripts in statements, setup plans of the schemas, named test cases and anonymous PL/SQL blocks
+"""
+
+import functools
+import hashlib
+import json
+import re
+import secrets
+from typing import Optional
+
+import sqlparse
+from django.core.serializers.json import DjangoJSONEncoder
+
+
+def create_insert_all(statements: str) -> Optional[str]:
+    """ Given 0 or more "INSERT INTO" statements, returns one "INSERT ALL" to insert all the
+        rows in a single statement. One "INSERT ALL" requires about 1/6 of the time of a sequence
+        of individual "INSERT INTO". *INSERT ALL statement is only valid in Oracle*
+
+        If no INSERT appears in statements returns None
+
+        Example:
+
+        INSERT INTO t VALUES (1,2);
+        INSERT INTO t2(id, age) VALUES (3,4);
+            ==>
+        INSERT ALL
+            INTO t VALUES(1, 2)
+            INTO t2(id, age) VALUES(3, 4)
+        SELECT 1 FROM DUAL;
+    """
+    stmts = sqlparse.parse(sqlparse.format(statements, strip_comments=True))  # Removes comments before parsing
+    if not stmts:
+        return None
+    insert_all = "INSERT ALL\n"
+    for stmt in stmts:
+        if stmt.get_type() != 'INSERT':
+            raise ValueError(f'Invalid INSERT statement: {stmt}')
+        parts = ['    INTO'] + [fragment.value for fragment in stmt.get_sublists()] + ['\n']
+        insert_code = ' '.join(parts)
+        insert_all += insert_code
+    insert_all += 'SELECT 1 FROM DUAL\n'  # statements sent to cx_Oracle cannot have ending ';'
+    return insert_all
+
+
+# Tokens that can change the meaning of a ';' (comments, strings and quoted identifiers), statement terminators
+# and '/' alone in a line (the SQL*Plus terminator of PL/SQL units)
+SQL_SPECIAL_TOKEN = re.compile(r"--|/\*|(?<![\w$#])[nN]?[qQ]'|'|\"|;|^[ \t]*/[ \t]*$", re.MULTILINE)
+# Blanks and comments before the first token of a statement
+SQL_LEADING_BLANKS = re.compile(r'(?:\s|--[^\n]*|/\*.*?(?:\*/|\Z))*', re.DOTALL)
+# Beginning of a PL/SQL unit, whose ';' do not terminate the statement
+PLSQL_UNIT_START = re.compile(r'(?:CREATE\s+(?:OR\s+REPLACE\s+)?(?:(?:NON)?EDITIONABLE\s+)?'
+                              r'(?:FUNCTION|PROCEDURE|PACKAGE|TRIGGER|TYPE\s+BODY)|DECLARE|BEGIN)\b', re.IGNORECASE)
+# Table of an INSERT INTO statement, not qualified
+INSERT_TABLE = re.compile(r'INSERT\s+INTO\s+("[^"]+"|[A-Za-z][\w$#]*)(?=[\s(])', re.IGNORECASE)
+# Statements of creation scripts that only define the schema, and fragments of them that create rows or temporary
+# tables (CREATE TABLE ... AS SELECT)
+SCHEMA_DEFINITION = re.compile(r'(?:CREATE|ALTER|COMMENT)\b', re.IGNORECASE)
+ROWS_IN_CREATION = re.compile(r'\bGLOBAL\s+TEMPORARY\b|\bTABLE\b[^;]*\bAS\s*\(?\s*(?:SELECT|WITH)\b',
+                              re.IGNORECASE)
+Q_QUOTE_CLOSING = {'[': ']', '{': '}', '(': ')', '<': '>'}
+
+
+def split_sql(code: str):
+    """
+    Splits SQL code into statements in a single pass, following the rules of SQL*Plus: statements end with ';'
+    or with a line containing only '/', and ';' inside comments, strings (including q'[...]' strings), quoted
+    identifiers and PL/SQL units (CREATE FUNCTION, PROCEDURE, PACKAGE, TRIGGER, TYPE BODY and anonymous blocks)
+    do not end a statement. PL/SQL units only end with '/' or at the end of the code
+    :param code: str containing SQL code
+    :return: pair (masked, spans): masked is the code with line comments, ending ';' and '/' replaced by spaces,
+             and spans is a list of pairs (start, end) with the position of every statement in masked
+    """
+    masked = []  # Fragments of the masked code
+    spans = []
+    last = 0  # Position of code already copied into masked
+    start = None  # Start of the current statement, None if it has not begun
+    plsql = False
+    pos = 0
+    while True:
+        if start is None:
+            start = SQL_LEADING_BLANKS.match(code, pos).end()
+            if start == len(code):
+                break
+            plsql = PLSQL_UNIT_START.match(code, start) is not None
+        match = SQL_SPECIAL_TOKEN.search(code, pos)
+        if match is None:
+            spans.append((start, len(code)))
+            break
+        token = match.group(0)
+        end = match.end()
+        if token == '--':
+            end = code.find('\n', end)
+            end = len(code) if end < 0 else end
+        elif token == '/*':
+            end = code.find('*/', end)
+            end = len(code) if end < 0 else end + 2
+        elif token in ("'", '"'):
+            end = code.find(token, end)
+            end = len(code) if end < 0 else end + 1
+        elif token.endswith("'"):  # q'[...]'
+            closing = Q_QUOTE_CLOSING.get(code[end:end + 1], code[end:end + 1]) + "'"
+            end = code.find(closing, end + 1)
+            end = len(code) if end < 0 else end + 2
+        elif token == ';' and plsql:
+            pass
+        else:  # ';' or '/' terminating the statement (empty statements are discarded)
+            if match.start() > start:
+                spans.append((start, match.start()))
+            start = None
+        if token == '--' or (token == ';' and not plsql) or token.strip() == '/':
+            masked.append(code[last:match.start()])
+            masked.append(' ' * (end - match.start()))
+            last = end
+        pos = end
+    masked.append(code[last:])
+    return ''.join(masked), spans
+
+
+def clean_sql(code: str, min_stmt: int = None, max_stmt: int = None):
+    """
+    Parses SQL code into statements (removing line comments and ';'). Every statement is extended with the blanks
+    of the rest of the code (the rest of characters are replaced by spaces), so executing each statement separately
+    will produce the error in the same offset position as the complete SQL block, so they could be shown correctly
+    in the editor. For example:
+
+        'SELECT *\nFROM CLUB;\nSELECT *\nFROM CLUB;'          --> (Original block code)
+        ['SELECT *\nFROM CLUB \n        \n         ',         --> (Statements with equal length and \n)
+         '        \n          \nSELECT *\nFROM CLUB ']
+
+    :param code: str containing SQL code
+    :param min_stmt: minimum number of statements
+    :param max_stmt: maximum number of statements
+    :return: [str] if code is a sequence between min_stmt and max_stmt correct SQL statements, otherwise None
+    """
+    if code is None:
+        code = ""
+    code = code.replace('\r', ' ')  # Uses only \n for newline
+    masked, spans = split_sql(code)
+    blanks = re.sub(r'\S', ' ', code)
+    statements = [blanks[:start] + masked[start:end] + blanks[end:] for start, end in spans]
+    num_sql = len(statements)
+    if (min_stmt and num_sql < min_stmt) or (max_stmt and num_sql > max_stmt):
+        statements = None
+    return statements
+
+
+def content_hash(*texts) -> str:
+    """
+    Returns a hash that identifies the content of several texts (for example, the creation and insertion
+    scripts of a problem)
+    :param texts: str or None
+    :return: str with 64 hexadecimal letters
+    """
+    digest = hashlib.sha256()
+    for text in texts:
+        digest.update((text or '').encode('utf-8'))
+        digest.update(b'\0')  # Separator, so that ('ab', 'c') and ('a', 'bc') have different hashes
+    return digest.hexdigest()
+
+
+def random_str(size=8):
+    """
+    Creates a random string of 2*n hexadecimal letters from
+    :param size: Length of the generated random string
+    :return: Random string of 2*n hexadecimal letters
+    """
+    return secrets.token_hex(size)
+
+
+def line_col_from_offset(code: str, offset: int):
+    """
+    Returns the line and columns of an offset in a code
+    :param offset:
+    :param code:
+    :return: pair (int, int) of (line, col)
+    """
+    line = 0
+    last_line_init = 0
+    for i in range(min(offset, len(code))):
+        # If the syntax error is at the end, the offset from Oracle is > length of code
+        if code[i] == '\n':
+            last_line_init = i+1
+            line += 1
+    col = offset - last_line_init
+    return line, col
+
+
+def uniform_dict(dictionary):
+    """
+    Uses DjangoJSONEncoder to represent as strings those values that are not directly serialized (like datetime)
+    :param dictionary: Python dictionary
+    :return: Python dictionary with all the fields uniformly represented
+    """
+    string_rep = json.dumps(dictionary, cls=DjangoJSONEncoder)
+    return json.loads(string_rep)
+
+
+MAX_SELECT_COLUMNS = 1000  # Maximum number of columns in a SELECT in Oracle
+
+
+def batch_function_calls(calls) -> str:
+    """
+    Builds a query that evaluates all the function calls in one row, one column per call. Each call ends with a
+    newline before the comma that separates it from the next one, as it can end with a comment
+    """
+    # NOTE: Function calls cannot be bound by parameters, so we use f-strings and trust its content
+    return 'SELECT {}\nFROM DUAL'.format('\n, '.join(calls))  # nosec B608
+
+
+TEST_CASE_START = re.compile(r'^[ \t]*--[ \t]*CASE:[ \t]*(.*?)[ \t]*$', re.MULTILINE)
+TEST_CASE_SAVEPOINT = 'lsql_test_case'  # Savepoint before each test case but the last one
+
+
+def split_test_cases(code: str):
+    """
+    Splits the tests of a PROCEDURE or TRIGGER problem in named test cases. Every test case starts with a line
+    '-- CASE: name', and the code before the first one (if not blank) is a test case without name
+    :param code: (str) tests of the problem
+    :return: list of pairs (name, code) with the test cases, [('', code)] if there are no named test cases
+    """
+    starts = list(TEST_CASE_START.finditer(code))
+    if not starts:
+        return [('', code)]
+    cases = [('', code[:starts[0].start()])] if code[:starts[0].start()].strip() else []
+    for start, end in zip(starts, starts[1:] + [None]):
+        cases.append((start.group(1), code[start.end():end.start() if end else len(code)]))
+    return cases
+
+
+MAX_PLSQL_STRING_BYTES = 32767  # Maximum length of strings bound to PL/SQL
+
+
+def execute_immediate_block(statements, commit_after=None, catch_errors=False):
+    """
+    Builds an anonymous PL/SQL block that executes the statements bound to :s0, :s1... with EXECUTE IMMEDIATE,
+    so all of them are sent in one round trip. The bind variable :done contains the number of statements
+    executed successfully
+    :param statements: (int) number of statements
+    :param commit_after: (int) the block commits after this number of statements (None for no commit)
+    :param catch_errors: (bool) the block stops silently in the first statement that fails
+    :return: (str) PL/SQL code
+    """
+    lines = ['BEGIN', '  :done := 0;']
+    for i in range(statements):
+        if i == commit_after:
+            lines.append('  COMMIT;')
+        lines.append(f'  EXECUTE IMMEDIATE :s{i};')
+        lines.append(f'  :done := {i + 1};')
+    if statements == commit_after:
+        lines.append('  COMMIT;')
+    if catch_errors:
+        lines.append('EXCEPTION WHEN OTHERS THEN NULL;')
+    lines.append('END;')
+    return '\n'.join(lines)
+
+
+def compile_setup(creation: str, insertion: str) -> dict:
+    """
+    Precompiles the scripts that set up the schema of a problem, so they are parsed only once (when the problem
+    is saved) instead of in every submission
+    :param creation: String containing the CREATE statements
+    :param insertion: String containing the INSERT statements
+    :return: setup plan, a dict {'hash': content hash of both scripts, 'create': [CREATE statements],
+             'insert': [INSERT statements], 'insert_all': INSERT ALL statement or None}. Statements are stripped and
+             do not contain the ending ';'. It raises a ValueError if the insertion contains other statements
+    """
+    return {
+        'hash': content_hash(creation, insertion),
+        'create': [stmt.strip() for stmt in clean_sql(creation)],
+        'insert': [stmt.strip() for stmt in clean_sql(insertion)],
+        'insert_all': create_insert_all(insertion or ''),
+    }
+
+
+def copied_tables(plan):
+    """
+    Tables whose rows can be copied from a master schema instead of executing the INSERT statements of a setup plan
+    (see OracleExecutor.sandbox_plan): the creation script must only define the schema, without creating rows or
+    temporary tables, and every INSERT statement must insert into a table of the schema by its name
+    :param plan: setup plan (see compile_setup)
+    :return: list of table names as stored in the dictionary, in order of first insertion, or None if the rows
+             cannot be copied
+    """
+    for stmt in plan['create']:
+        if not SCHEMA_DEFINITION.match(stmt, SQL_LEADING_BLANKS.match(stmt).end()) or ROWS_IN_CREATION.search(stmt):
+            return None
+    tables = []
+    for stmt in plan['insert']:
+        match = INSERT_TABLE.match(stmt, SQL_LEADING_BLANKS.match(stmt).end())
+        if match is None:
+            return None
+        name = match.group(1)[1:-1] if match.group(1).startswith('"') else match.group(1).upper()
+        if name not in tables:
+            tables.append(name)
+    return tables
+
+
+@functools.lru_cache(maxsize=256)
+def cached_setup_plan(creation: str, insertion: str) -> dict:
+    """Setup plan of the scripts (see compile_setup) from an in-process LRU cache. The plan must not be modified"""
+    return compile_setup(creation, insertion)
+
+
+def setup_plan(init_db) -> dict:
+    """
+    Returns the setup plan of a schema
+    :param init_db: setup plan returned by compile_setup, or pair (create, insert) of scripts. The plans of pairs
+                    are taken from the in-process LRU cache (for example, problems saved before storing plans)
+    :return: setup plan
+    """
+    if isinstance(init_db, dict):
+        return init_db
+    return cached_setup_plan(*init_db)
+
+
+# Errors raised when the code exceeds the resources of sandbox users (see OracleExecutor.create_sandbox_profile): CPU
+# and logical reads per call or session, tablespace quota, temporary space and Resource Manager limits
+RESOURCE_LIMIT_ERRORS = ('ORA-02392', 'ORA-02393', 'ORA-02394', 'ORA-02395', 'ORA-01536', 'ORA-01652',
+                         'ORA-00040', 'ORA-56720', 'ORA-56735')
+
+
+def is_tle_exception(error_msg):
+    """ Decides if the error_message from the Oracle exception can represent a timeout, or that the code has
+        exceeded the resources of sandbox users """
+    return 'DPI-1067' in error_msg or 'DPI-1080' in error_msg or 'DPI-1010' in error_msg \
+        or any(code in error_msg for code in RESOURCE_LIMIT_ERRORS)
@@ -0,0 +1,457 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright Enrique Martín <emartinm@ucm.es> 2020
+
+Class to execute SELECT, DML and discriminant problems in PostgreSQL. The Oracle SQL code of problems and
+submissions is transpiled to PostgreSQL with sqlglot
+"""
+
+from contextlib import contextmanager
+import atexit
+import collections
+import decimal
+import os
+import threading
+
+import psycopg2
+from psycopg2 import sql
+import sqlglot
+from sqlglot import ErrorLevel, exp
+from django.core.exceptions import ImproperlyConfigured
+from logzero import logger
+
+from .exceptions import ExecutorException
+from .oracle_driver import run_sequentially
+from .oracle_sql import clean_sql, random_str, setup_plan, uniform_dict
+from .sqlite_driver import ANSI_ESCAPE, transpile
+from .types import OracleStatusCode
+
+# Statements that would end the transaction of a sandbox (so its changes could not be rolled back) or change its
+# session. They are rejected to keep sandboxes reusable: the safety of the server relies on the sandbox user having
+# no privileges (see PostgresExecutor.check_roles)
+FORBIDDEN_STATEMENTS = (exp.Commit, exp.Rollback, exp.Transaction, exp.Set, exp.Command, exp.Copy)
+# Attributes of a role that would allow it to go beyond its own databases
+PRIVILEGED_ROLE = """SELECT r.rolsuper OR r.rolcreatedb OR r.rolcreaterole OR r.rolreplication OR r.rolbypassrls
+                                 OR EXISTS (SELECT 1 FROM pg_auth_members m WHERE m.member = r.oid)
+                          FROM pg_roles r WHERE r.rolname = current_user"""
+SUPERUSER_ROLE = 'SELECT rolsuper FROM pg_roles WHERE rolname = current_user'
+USER_TABLES = """SELECT table_name FROM information_schema.tables
+                 WHERE table_schema = 'public' AND table_type = 'BASE TABLE' AND table_name <> 'dual'
+                 ORDER BY table_name"""
+TABLE_COLUMNS = """SELECT column_name, data_type FROM information_schema.columns
+                   WHERE table_schema = 'public' AND table_name = %s
+                   ORDER BY ordinal_position"""
+
+
+def transpile_user_statement(statement: str) -> str:
+    """
+    Translates one Oracle SQL statement of the user code to PostgreSQL. Raises an ExecutorException if it is a
+    statement that could modify the sandbox beyond its transaction (see FORBIDDEN_STATEMENTS), or a
+    sqlglot.errors.SqlglotError if it cannot be translated
+    """
+    expressions = [expression for expression in sqlglot.parse(statement, read='oracle') if expression is not None]
+    if any(isinstance(expression, FORBIDDEN_STATEMENTS) for expression in expressions):
+        raise ExecutorException(OracleStatusCode.EXECUTE_USER_CODE,
+                                f'Statement not allowed in PostgreSQL problems: <<{statement}>>', statement)
+    return ';\n'.join(expression.sql(dialect='postgres', unsupported_level=ErrorLevel.RAISE)
+                      for expression in expressions)
+
+
+def postgres_value(value):
+    """Represents a value returned by PostgreSQL as Oracle: NUMERIC values as integers or floats and BYTEA values
+    as hexadecimal strings"""
+    if isinstance(value, decimal.Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    if isinstance(value, memoryview):
+        return value.hex().upper()
+    return value
+
+
+def table_from_cursor(cursor, type_names, header=None):
+    """
+    Takes a cursor that has executed a SELECT statement in PostgreSQL and returns all the results in a dictionary,
+    like oracle_db.table_from_cursor: raises an ExecutorException with status code OracleStatusCode.TLE_USER_CODE
+    if the number of columns exceeds ORACLE_MAX_COLS or the number of rows exceeds ORACLE_MAX_ROWS
+    :param cursor: psycopg2 cursor
+    :param type_names: dict {type OID: type name} of the server
+    :param header: header of the table, by default the names of the columns with the names of their types
+    :return: a dictionary {'header':[[NAME:str, TYPE:str]], 'rows': [list]}
+    """
+    max_rows = int(os.environ['ORACLE_MAX_ROWS'])
+    max_cols = int(os.environ['ORACLE_MAX_COLS'])
+    if cursor.description is None:
+        return {'header': [], 'rows': []}
+    if len(cursor.description) > max_cols:
+        logger.debug('TLE caused by too many columns in cursor')
+        raise ExecutorException(OracleStatusCode.TLE_USER_CODE)
+    if header is None:
+        header = [[column.name.upper(), type_names.get(column.type_code, str(column.type_code))]
+                  for column in cursor.description]
+
+    batch = cursor.fetchmany(max_rows)
+    if cursor.fetchone():  # There are more rows
+        logger.debug('TLE caused by too many rows in cursor')
+        raise ExecutorException(OracleStatusCode.TLE_USER_CODE)
+    return uniform_dict({'header': header, 'rows': [[postgres_value(value) for value in row] for row in batch]})
+
+
+def get_all_tables(conn):
+    """
+    Returns the contents of all the tables of the public schema as oracle_db.get_all_tables. The type of each
+    column is its data type in the information schema
+    :param conn: psycopg2 connection
+    :return: dict {table_name: {'header': list, 'rows': list}}
+    """
+    max_tables = int(os.environ['ORACLE_MAX_TABLES'])
+    tables = {}
+    with conn.cursor() as cursor:
+        cursor.execute(USER_TABLES)
+        for (table_name,) in cursor.fetchall():
+            if len(tables) >= max_tables:
+                logger.debug('TLE caused by too many tables')
+                raise ExecutorException(OracleStatusCode.TLE_USER_CODE)
+            cursor.execute(TABLE_COLUMNS, (table_name,))
+            header = [[name.upper(), data_type.upper()] for name, data_type in cursor.fetchall()]
+            cursor.execute(sql.SQL('SELECT * FROM {}').format(sql.Identifier(table_name)))
+            tables[table_name.upper()] = table_from_cursor(cursor, {}, header)
+    return tables
+
+
+@contextmanager
+def cancel_after(conn, timeout_ms):
+    """Cancels the statement running in the connection if it lasts more than timeout_ms, even if the user code has
+    changed its statement_timeout"""
+    timer = threading.Timer(timeout_ms / 1000, conn.cancel)
+    timer.start()
+    try:
+        yield
+    finally:
+        timer.cancel()
+
+
+def execute_select_statement(conn, statement, type_names, timeout_ms):
+    """
+    Executes a string containing exactly ONE SELECT statement in Oracle SQL (see
+    oracle_db.execute_select_statement), cancelling it after timeout_ms
+    :return: dictionary representing the result of the SELECT statement
+    """
+    statements = clean_sql(statement)
+    if len(statements) != 1:
+        raise ExecutorException(OracleStatusCode.NUMBER_STATEMENTS,
+                                f'The SQL query must have exactly one statement: <<{statement}>>')
+    with conn.cursor() as cursor:
+        with cancel_after(conn, timeout_ms):
+            cursor.execute(transpile_user_statement(statements[0]))
+        return table_from_cursor(cursor, type_names)
+
+
+def execute_user_statements(conn, statements, timeout_ms):
+    """Executes Oracle SQL statements of the user code, already split by clean_sql, cancelling each one after
+    timeout_ms"""
+    with conn.cursor() as cursor:
+        for stmt in statements:
+            code = transpile_user_statement(stmt)
+            with cancel_after(conn, timeout_ms):
+                cursor.execute(code)
+
+
+class PostgresExecutor:
+    """
+    Class to execute problems in PostgreSQL with the same interface as OracleExecutor. The database of each problem
+    is built once as a template database, and submissions run in sandbox databases cloned from it with
+    CREATE DATABASE ... TEMPLATE. Sandboxes are pooled: every submission runs inside one transaction that is rolled
+    back afterwards (DDL is transactional in PostgreSQL), so the sandbox can be reused by the next submission.
+    Databases are created by the judge user, and the tables and the user code belong to a sandbox user without
+    privileges
+    """
+    __DB = None  # Singleton object for PostgresExecutor
+
+    @classmethod
+    def get(cls):
+        """Singleton DB"""
+        if cls.__DB is None:
+            cls.__DB = PostgresExecutor()
+        return cls.__DB
+
+    def __init__(self):
+        """
+        Takes the configuration from environment variables: POSTGRES_JUDGE_SERVER, POSTGRES_JUDGE_PORT,
+        POSTGRES_JUDGE_USER and POSTGRES_JUDGE_PASS (by default the PostgreSQL server of Django), POSTGRES_CACHED_DBS
+        (number of template databases, by default 64), POSTGRES_SANDBOXES (idle sandboxes kept for each template,
+        by default 4), POSTGRES_STMT_TIMEOUT_MS (by default ORACLE_STMT_TIMEOUT_MS) and POSTGRES_SANDBOX_USER and
+        POSTGRES_SANDBOX_PASS (user that executes the code, by default lsql_sandbox). Raises ImproperlyConfigured if
+        the roles are too privileged (see check_roles)
+        """
+        self.connection_params = {
+            'host': os.environ.get('POSTGRES_JUDGE_SERVER', os.environ.get('PG_SERVER', 'localhost')),
+            'port': os.environ.get('POSTGRES_JUDGE_PORT', os.environ.get('PG_PORT', 9000)),
+            'user': os.environ.get('POSTGRES_JUDGE_USER', os.environ.get('PG_USER', 'postgres')),
+            'password': os.environ.get('POSTGRES_JUDGE_PASS', os.environ.get('PG_PASS', '')),
+        }
+        self.sandbox_params = dict(self.connection_params,
+                                   user=os.environ.get('POSTGRES_SANDBOX_USER', 'lsql_sandbox'),
+                                   password=os.environ.get('POSTGRES_SANDBOX_PASS', ''))
+        self.maintenance_db = os.environ.get('PG_DB', 'postgres')
+        self.max_templates = int(os.environ.get('POSTGRES_CACHED_DBS', 64))
+        self.max_sandboxes = int(os.environ.get('POSTGRES_SANDBOXES', 4))
+        self.stmt_timeout = int(os.environ.get('POSTGRES_STMT_TIMEOUT_MS', os.environ['ORACLE_STMT_TIMEOUT_MS']))
+        # Databases of different processes must not collide, so their names include a random prefix
+        self.prefix = f'lsql_{random_str(4)}_'
+        self.templates = collections.OrderedDict()  # Setup plan hash -> {'hash', 'name', 'idle'}, in LRU order
+        self.type_names = None  # Type OID -> type name, read from the server when building the first template
+        self.lock = threading.Lock()
+        self.build_locks = {}  # Setup plan hash -> lock held while its template is being built
+        self.check_roles()
+        atexit.register(self.close)
+
+    def connect(self, dbname, sandbox=False):
+        """New connection to a database of the judge server, as the judge user or as the sandbox user"""
+        return psycopg2.connect(dbname=dbname, **(self.sandbox_params if sandbox else self.connection_params))
+
+    def check_roles(self):
+        """
+        Raises ImproperlyConfigured unless the judge user is neither a superuser nor the user of Django (PG_USER),
+        and the sandbox user is a different user without attributes (superuser, CREATEDB, CREATEROLE...) nor
+        membership in other roles
+        """
+        judge_user, sandbox_user = self.connection_params['user'], self.sandbox_params['user']
+        if judge_user == os.environ.get('PG_USER', 'postgres') or judge_user == sandbox_user:
+            raise ImproperlyConfigured('POSTGRES_JUDGE_USER must be different from PG_USER and POSTGRES_SANDBOX_USER')
+        for sandbox, query in [(False, SUPERUSER_ROLE), (True, PRIVILEGED_ROLE)]:
+            conn = self.connect(self.maintenance_db, sandbox)
+            try:
+                with conn.cursor() as cursor:
+                    cursor.execute(query)
+                    if cursor.fetchone()[0]:
+                        user = sandbox_user if sandbox else judge_user
+                        raise ImproperlyConfigured(f'The PostgreSQL user {user} has too many privileges to judge')
+            finally:
+                conn.close()
+
+    def admin(self, statement, *names):
+        """Executes a statement like CREATE DATABASE (that cannot run in a transaction) with the database names
+        as identifiers"""
+        conn = self.connect(self.maintenance_db)
+        try:
+            conn.autocommit = True
+            with conn.cursor() as cursor:
+                cursor.execute(sql.SQL(statement).format(*map(sql.Identifier, names)))
+        finally:
+            conn.close()
+
+    def build_template(self, plan):
+        """
+        Creates a template database with the tables and rows of a setup plan, and the table DUAL of Oracle
+        :return: dict {'hash': hash of the plan, 'name': name of the template, 'idle': list of idle sandboxes
+                 (name, psycopg2 connection)}
+        """
+        name = f'{self.prefix}{plan["hash"][:16]}'
+        self.admin('CREATE DATABASE {}', name)
+        conn = self.connect(name)
+        state, stmt = OracleStatusCode.EXECUTE_CREATE, None
+        try:
+            # The tables belong to the sandbox user, so the user code can also modify or drop them
+            with conn.cursor() as cursor:
+                cursor.execute(sql.SQL('GRANT CREATE ON SCHEMA public TO {}').format(
+                    sql.Identifier(self.sandbox_params['user'])))
+            conn.commit()
+            conn.close()
+            conn = self.connect(name, sandbox=True)
+            with conn.cursor() as cursor:
+                cursor.execute('CREATE TABLE dual (dummy VARCHAR(1))')
+                cursor.execute("INSERT INTO dual VALUES ('X')")
+                for stmt in plan['create']:
+                    cursor.execute(transpile(stmt, 'postgres'))
+                state = OracleStatusCode.EXECUTE_INSERT
+                for stmt in plan['insert']:
+                    cursor.execute(transpile(stmt, 'postgres'))
+                if self.type_names is None:
+                    cursor.execute('SELECT oid, UPPER(typname) FROM pg_type')
+                    self.type_names = dict(cursor.fetchall())
+            conn.commit()
+        except (psycopg2.Error, sqlglot.errors.SqlglotError) as excp:
+            conn.close()
+            self.admin('DROP DATABASE IF EXISTS {}', name)
+            logger.info('Error when creating PostgreSQL template database: %s - %s - %s', state, excp, stmt)
+            raise self.executor_exception(state, excp, stmt) from excp
+        conn.close()  # CREATE DATABASE ... TEMPLATE needs that there are no connections to the template
+        return {'hash': plan['hash'], 'name': name, 'idle': []}
+
+    def lease(self, init_db):
+        """
+        Returns a sandbox database with the tables and rows of the problem, inside a transaction with the statement
+        timeout of the judge. Idle sandboxes whose connection has been closed are dropped
+        :param init_db: (str, str) Pair of statements (create, insert) or setup plan (see oracle_sql.setup_plan)
+        :return: (template, (sandbox name, psycopg2 connection))
+        """
+        plan = setup_plan(init_db)
+        key = plan['hash']
+        template, evicted, sandbox = None, None, None
+        while template is None:
+            with self.lock:
+                template = self.templates.pop(key, None)
+                if template is not None:
+                    self.templates[key] = template
+                    if len(self.templates) > self.max_templates:
+                        evicted = self.templates.popitem(last=False)[1]
+                    sandbox = template['idle'].pop() if template['idle'] else None
+                    continue
+                build_lock = self.build_locks.setdefault(key, threading.Lock())
+            # Only one thread builds each template, and the sandboxes of other problems can be leased in the meantime
+            with build_lock:
+                try:
+                    with self.lock:
+                        built = key in self.templates  # Built by another thread while waiting
+                    if not built:
+                        new_template = self.build_template(plan)
+                        with self.lock:
+                            self.templates[key] = new_template
+                finally:
+                    with self.lock:
+                        self.build_locks.pop(key, None)
+        if evicted is not None:
+            self.drop_template(evicted)
+        if sandbox is not None and sandbox[1].closed:
+            self.drop_sandbox(sandbox)
+            sandbox = None
+        if sandbox is None:
+            name = f'{template["name"]}_{random_str(4)}'
+            self.admin('CREATE DATABASE {} TEMPLATE {}', name, template['name'])
+            sandbox = (name, self.connect(name, sandbox=True))
+        with sandbox[1].cursor() as cursor:
+            cursor.execute('SET LOCAL statement_timeout = %s', (self.stmt_timeout,))
+        return template, sandbox
+
+    def release(self, template, sandbox):
+        """Rolls back the changes of a submission in a sandbox and returns it to the pool, or drops it if the pool of
+        its template is full or the template has been evicted"""
+        try:
+            sandbox[1].rollback()
+            reusable = not sandbox[1].closed
+        except psycopg2.Error:
+            reusable = False
+        with self.lock:
+            current = self.templates.get(template['hash']) is template
+            if reusable and current and len(template['idle']) < self.max_sandboxes:
+                template['idle'].append(sandbox)
+                return
+        self.drop_sandbox(sandbox)
+
+    def drop_sandbox(self, sandbox):
+        """Closes the connection to a sandbox and drops its database"""
+        name, conn = sandbox
+        conn.close()
+        self.admin('DROP DATABASE IF EXISTS {}', name)
+
+    def drop_template(self, template):
+        """Drops a template database and its idle sandboxes"""
+        for sandbox in template['idle']:
+            self.drop_sandbox(sandbox)
+        template['idle'] = []
+        self.admin('DROP DATABASE IF EXISTS {}', template['name'])
+
+    def close(self):
+        """Drops all the databases of the executor"""
+        with self.lock:
+            templates = list(self.templates.values())
+            self.templates.clear()
+        for template in templates:
+            try:
+                self.drop_template(template)
+            except psycopg2.Error as excp:
+                logger.warning('Error when dropping PostgreSQL template database %s: %s', template['name'], excp)
+
+    @staticmethod
+    def executor_exception(state, excp, code):
+        """ExecutorException for an error of PostgreSQL or sqlglot when executing code in the given state"""
+        message = ANSI_ESCAPE.sub('', str(excp))
+        if isinstance(excp, psycopg2.errors.QueryCanceled):  # pylint: disable=no-member
+            return ExecutorException(OracleStatusCode.TLE_USER_CODE, message, code)
+        position = (0, 0)
+        if isinstance(excp, sqlglot.errors.ParseError) and excp.errors and state == OracleStatusCode.EXECUTE_USER_CODE:
+            # Statements from clean_sql keep the offsets of the code
+            position = (excp.errors[0]['line'] - 1, max(excp.errors[0]['col'] - 1, 0))
+        return ExecutorException(state, message, code, position)
+
+    def execute_select_test(self, init_db, select, output_db=False, reference=None,  # pylint: disable=unused-argument
+                            plan_gate=None):
+        """
+        Executes a SELECT statement in a sandbox (see OracleExecutor.execute_select_test)
+        :param reference: not used, the rows are always fetched
+        :param plan_gate: not used, estimated costs are only checked in Oracle
+        :return: {"result": result, "db": db}
+        """
+        template, sandbox = self.lease(init_db)
+        conn = sandbox[1]
+        state = OracleStatusCode.EXECUTE_USER_CODE
+        try:
+            result = execute_select_statement(conn, select, self.type_names, self.stmt_timeout)
+            db = None
+            if output_db:
+                state = OracleStatusCode.GET_ALL_TABLES
+                db = get_all_tables(conn)
+            return {"result": result, "db": db}
+        except (psycopg2.Error, sqlglot.errors.SqlglotError) as excp:
+            logger.info('Error when testing SELECT statements in PostgreSQL: %s - %s - %s', state, excp, select)
+            raise self.executor_exception(state, excp, select) from excp
+        finally:
+            self.release(template, sandbox)
+
+    def execute_dml_test(self, init_db, dml, *, pre_db=True, min_stmt=0, max_stmt=float("inf"),
+                         fingerprint=False, expected_fingerprint=None,  # pylint: disable=unused-argument
+                         plan_gate=None):  # pylint: disable=unused-argument
+        """
+        Executes DML statements in a sandbox (see OracleExecutor.execute_dml_test). Fingerprints are not supported,
+        so the tables after executing the statements are always fetched
+        :return: {'pre': DB, 'post': DB, 'fingerprint': None}
+        """
+        template, sandbox = self.lease(init_db)
+        conn = sandbox[1]
+        state = OracleStatusCode.GET_ALL_TABLES
+        try:
+            pre = get_all_tables(conn) if pre_db else {}
+
+            state = OracleStatusCode.EXECUTE_USER_CODE
+            statements = clean_sql(dml, min_stmt, max_stmt)
+            if not statements:
+                raise ExecutorException(OracleStatusCode.NUMBER_STATEMENTS,
+                                        f'The SQL code must have between {min_stmt} and {max_stmt} statements:'
+                                        f'<<dml>>')
+            execute_user_statements(conn, statements, self.stmt_timeout)
+
+            state = OracleStatusCode.GET_ALL_TABLES
+            return {'pre': pre, 'post': get_all_tables(conn), 'fingerprint': None}
+        except (psycopg2.Error, sqlglot.errors.SqlglotError) as excp:
+            logger.info('Error when testing DML statements in PostgreSQL: %s - %s - %s', state, excp, dml)
+            raise self.executor_exception(state, excp, dml) from excp
+        finally:
+            self.release(template, sandbox)
+
+    def execute_discriminant_test(self, init_db, insertion_user, select_stmts):
+        """
+        Inserts the rows of the user in a sandbox and executes the correct and incorrect SELECT statements
+        (see OracleExecutor.execute_discriminant_test)
+        :return: {"result_correct": result, "result_incorrect": result}
+        """
+        select_correct, select_incorrect = select_stmts
+        template, sandbox = self.lease(init_db)
+        conn = sandbox[1]
+        state = OracleStatusCode.EXECUTE_USER_CODE
+        try:
+            execute_user_statements(conn, clean_sql(insertion_user), self.stmt_timeout)
+
+            state = OracleStatusCode.EXECUTE_DISCRIMINANT_SELECT
+            result_correct = execute_select_statement(conn, select_correct, self.type_names, self.stmt_timeout)
+            result_incorrect = execute_select_statement(conn, select_incorrect, self.type_names, self.stmt_timeout)
+            return {"result_correct": result_correct, "result_incorrect": result_incorrect}
+        except (psycopg2.Error, sqlglot.errors.SqlglotError) as excp:
+            logger.info('Error when testing DISCRIMINANT problem in PostgreSQL: %s - %s - %s', state, excp,
+                        insertion_user)
+            raise self.executor_exception(state, excp, insertion_user) from excp
+        finally:
+            self.release(template, sandbox)
+
+    @staticmethod
+    def run_in_order(tasks, failed=None):
+        """Runs the tasks in sequence, stopping at the first task that fails (see oracle_driver.run_sequentially)"""
+        return run_sequentially(tasks, failed)
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright Enrique Martín <emartinm@ucm.es> 2020
+
+Local pre-screening of submissions with sqlglot before judging them in Oracle. It only detects errors that Oracle
+would surely raise: wrong number of statements and references to tables or columns that do not exist in the schema
+of the problem. Any doubt (code that cannot be parsed, views or tables created by the code, views or synonyms created
+by the problem, data dictionary, etc.) leaves the submission to Oracle
+"""
+import functools
+
+import sqlglot
+from sqlglot import exp, ErrorLevel
+from sqlglot.optimizer.scope import traverse_scope
+
+from .exceptions import ExecutorException
+from .oracle_sql import clean_sql, line_col_from_offset
+from .types import OracleStatusCode, ProblemType, ExecutionEngine
+
+# Public synonyms of the data dictionary that can be used as tables
+DICTIONARY_TABLES = {'DUAL', 'DICT', 'DICTIONARY', 'TAB', 'TABS', 'CAT', 'COLS', 'IND', 'OBJ', 'SEQ', 'SYN', 'CLU'}
+DICTIONARY_PREFIXES = ('USER_', 'ALL_', 'DBA_', 'V$', 'GV$')
+# Identifiers that Oracle accepts as columns in any query
+PSEUDO_COLUMNS = {'ROWNUM', 'ROWID', 'LEVEL', 'USER', 'UID', 'SYSDATE', 'SYSTIMESTAMP', 'ORA_ROWSCN',
+                  'CONNECT_BY_ISLEAF', 'CONNECT_BY_ISCYCLE', 'CURRENT_DATE', 'CURRENT_TIMESTAMP', 'LOCALTIMESTAMP',
+                  'SESSIONTIMEZONE', 'DBTIMEZONE', 'NULL', 'DUMMY', 'COLUMN_VALUE', 'OBJECT_VALUE'}
+
+
+def oracle_name(identifier):
+    """Name of an identifier in the Oracle dictionary: unquoted identifiers are stored in uppercase"""
+    return identifier.name if identifier.quoted else identifier.name.upper()
+
+
+def invalid_reference(code, identifier, message):
+    """ExecutorException of Oracle for a reference to an unknown table or column, pointing to 'identifier'"""
+    position = line_col_from_offset(code, identifier.meta.get('start', 0))
+    return ExecutorException(OracleStatusCode.EXECUTE_USER_CODE, message, code, position)
+
+
+@functools.lru_cache(maxsize=256)
+def only_tables(create_sql):
+    """True if 'create_sql' does not create other objects than tables, so the initial DB contains everything that the
+    code can reference. Views, synonyms, sequences, triggers or statements that sqlglot cannot parse return False"""
+    try:
+        statements = [stmt for stmt in sqlglot.parse(create_sql, read='oracle', error_level=ErrorLevel.RAISE) if stmt]
+    except sqlglot.errors.SqlglotError:
+        return False
+    return not any(isinstance(stmt, exp.Command) or isinstance(stmt, exp.Create) and stmt.kind != 'TABLE'
+                   for stmt in statements)
+
+
+def check_tables(code, statement, schema):
+    """Raises ORA-00942 if 'statement' uses a table that is not in the schema, a CTE or the data dictionary"""
+    ctes = {oracle_name(cte.args['alias'].this) for cte in statement.find_all(exp.CTE)}
+    for table in statement.find_all(exp.Table):
+        if not isinstance(table.this, exp.Identifier) or table.args.get('db') or table.args.get('catalog'):
+            continue
+        name = oracle_name(table.this)
+        if name not in schema and name not in ctes and name not in DICTIONARY_TABLES \
+                and not name.startswith(DICTIONARY_PREFIXES):
+            raise invalid_reference(code, table.this, 'ORA-00942: table or view does not exist')
+
+
+def check_columns(code, query, schema):
+    """Raises ORA-00904 if 'query' uses a column that does not exist. Qualified columns are checked against the table
+    of their alias, and unqualified columns against all the columns of the schema (only if the query does not use
+    other tables, as the data dictionary)"""
+    all_columns = {column for columns in schema.values() for column in columns}
+    aliases = {oracle_name(alias.args['alias']) for alias in query.find_all(exp.Alias)
+               if isinstance(alias.args.get('alias'), exp.Identifier)}
+    aliases.update(oracle_name(column) for table_alias in query.find_all(exp.TableAlias)
+                   for column in table_alias.columns if isinstance(column, exp.Identifier))
+    ctes = {oracle_name(cte.args['alias'].this) for cte in query.find_all(exp.CTE)}
+    other_tables = any(not isinstance(table.this, exp.Identifier)
+                       or oracle_name(table.this) not in set(schema) | ctes | {'DUAL'}
+                       for table in query.find_all(exp.Table))
+    scopes = traverse_scope(query)
+    tables = {}  # Alias -> columns of its table, only for aliases defined once in the whole query
+    for scope in scopes:
+        for alias, source in scope.sources.items():
+            known = isinstance(source, exp.Table) and isinstance(source.this, exp.Identifier) \
+                and oracle_name(source.this) in schema
+            tables[alias.upper()] = schema[oracle_name(source.this)] \
+                if known and alias.upper() not in tables else None
+    for scope in scopes:
+        for column in scope.columns:
+            if column.args.get('db') or not isinstance(column.this, exp.Identifier):
+                continue
+            name = oracle_name(column.this)
+            if column.table:
+                columns = tables.get(column.table.upper())
+                if columns is not None and name not in columns | PSEUDO_COLUMNS:
+                    table_name = oracle_name(column.args['table'])
+                    raise invalid_reference(code, column.args['table'],
+                                            f'ORA-00904: "{table_name}"."{name}": invalid identifier')
+            elif not other_tables and name not in all_columns | aliases | PSEUDO_COLUMNS:
+                raise invalid_reference(code, column.this, f'ORA-00904: "{name}": invalid identifier')
+
+
+def prescreen(problem, code):
+    """
+    Checks the code of a submission to a SELECT, DML or discriminant problem judged in Oracle without connecting to
+    Oracle, using the tables and columns of its initial DB. Raises the same ExecutorException as the executor for wrong
+    number of statements (VE) and for unknown tables or columns (RE), and returns None in any other case (also if
+    sqlglot fails when parsing or analyzing the code)
+    """
+    problem_type = problem.problem_type()
+    if problem_type not in (ProblemType.SELECT, ProblemType.DML, ProblemType.DISC) or not problem.initial_db:
+        return
+    engine = problem.collection.engine if problem.collection_id is not None else ExecutionEngine.ORACLE
+    if engine != ExecutionEngine.ORACLE and engine in problem.ENGINES:
+        return  # Messages of other engines are different
+
+    if problem_type == ProblemType.SELECT and len(clean_sql(code)) != 1 \
+            or problem_type == ProblemType.DML and not clean_sql(code, problem.min_stmt, problem.max_stmt):
+        raise ExecutorException(OracleStatusCode.NUMBER_STATEMENTS,
+                                f'Wrong number of statements: <<{code}>>', code)
+
+    if not only_tables(problem.create_sql or ''):
+        return  # The code can use objects that are not in the initial DB
+
+    schema = {name: {column for column, _ in table['header']} for name, table in problem.initial_db[0].items()}
+    try:
+        statements = [stmt for stmt in sqlglot.parse(code, read='oracle', error_level=ErrorLevel.RAISE) if stmt]
+        # Statements that modify the schema can create the tables or columns used by the next ones
+        if any(isinstance(stmt, (exp.Command, exp.Create, exp.Drop, exp.Alter)) for stmt in statements):
+            return
+        # Only the first statement, as Oracle could raise other errors when executing it
+        if statements:
+            check_tables(code, statements[0], schema)
+            if isinstance(statements[0], exp.Query):
+                check_columns(code, statements[0], schema)
+    except ExecutorException:
+        raise
+    except Exception:  # pylint: disable=broad-except
+        return  # Code that sqlglot cannot parse or analyze is left to Oracle
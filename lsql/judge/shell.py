@@ -8,18 +8,15 @@ For example: create a group of users from a CSV list of students
 
 import csv
 import datetime
-import secrets
 from collections.abc import Callable
 
 import sqlglot
-from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import Group
 from django.db.models import Q, Count, Min, Max
-from django.test import Client
-from django.urls import reverse
 from django.utils import timezone
 
+from .judging import judge_code
 from .models import Problem, Submission
 from .types import ProblemType
 
@@ -118,53 +115,37 @@ def adapt_db_result_to_list():
         prob.save()
 
 
-def rejudge(verdict_code, filename='rejudge.txt', tests=False,
+def rejudge(verdict_code, filename='rejudge.txt',
             start=datetime.datetime(1970, 1, 1).astimezone(),
             end=timezone.now()):
     """ Judges again all the submission in the period [start, end] with some verdict_code. For each submission,
-        submit the code, compares the verdict, and stores detailed information in the 'filename'.
-        Use tests=False for Django tests, tests=True for normal use
+        judges the code directly (without the judge queue nor the admission control of the submit view), compares
+        the verdict, and stores detailed information in the 'filename'
     """
-    username = f'rejudge_user_test_{secrets.token_hex(nbytes=8)}'
-    passwd = secrets.token_hex(nbytes=16)
-    user = None
-
-    try:
-        subs = Submission.objects.filter(verdict_code=verdict_code, creation_date__gte=start, creation_date__lte=end)
-        rejudge_users = get_user_model().objects.filter(username=username)
-        # In case the user was not deleted in a previous execution
-        user = (rejudge_users[0] if len(rejudge_users) == 1 else
-                get_user_model().objects.create_user(username=username, password=passwd))
-        client = Client()
-        client.login(username=username, password=passwd)
-
-        changes = {}
-        with open(filename, 'w', encoding='utf8') as report:
-            for sub in subs:
-                submit_url = reverse('judge:submit', args=[sub.problem.pk])
-                # Using Client outside the Django testing command requires adjustment in the HTTP Host header
-                http_host = '127.0.0.1' if settings.DEBUG else 'learn.fdi.ucm.es'
-                response = client.post(submit_url, {'code': sub.code}, HTTP_HOST=http_host, follow=True) if not tests \
-                    else client.post(submit_url, {'code': sub.code}, follow=True)
-                report.write(f'Submission #{sub.pk}\n')
-                report.write('----------------------------\n')
-                report.write(f'Problem: {sub.problem.pk}\n')
-                report.write(f'User: {sub.user}\n')
-                report.write(f'Date: {sub.creation_date}\n')
-                report.write(f'Code ({len(sub.code)} chars):\n{sub.code}\n')
-                response_json = response.json()
-                verdict_change = f'{sub.verdict_code} --> {response_json["verdict"]}'
-                report.write(f'Verdict: {verdict_change}\n')
-                report.write(f'New feedback: {response_json["feedback"]}\n')
-                report.write('\n\n')
-                changes[verdict_change] = changes.get(verdict_change, 0) + 1
-
-            client.logout()
-            report.write(f'\n\nSummary of changes in verdicts (see {filename} for details):')
-            report.write(str(changes))
-    finally:
-        if user is not None:
-            user.delete()
+    subs = Submission.objects.filter(verdict_code=verdict_code, creation_date__gte=start, creation_date__lte=end)
+    problems = {}  # Problem PK -> object of its subclass
+    changes = {}
+    with open(filename, 'w', encoding='utf8') as report:
+        for sub in subs:
+            problem = problems.get(sub.problem_id)
+            if problem is None:
+                problem = Problem.objects.filter(pk=sub.problem_id).select_subclasses().first()
+                problems[sub.problem_id] = problem
+            data = judge_code(problem, sub.code)
+            report.write(f'Submission #{sub.pk}\n')
+            report.write('----------------------------\n')
+            report.write(f'Problem: {sub.problem.pk}\n')
+            report.write(f'User: {sub.user}\n')
+            report.write(f'Date: {sub.creation_date}\n')
+            report.write(f'Code ({len(sub.code)} chars):\n{sub.code}\n')
+            verdict_change = f'{sub.verdict_code} --> {data["verdict"]}'
+            report.write(f'Verdict: {verdict_change}\n')
+            report.write(f'New feedback: {data["feedback"]}\n')
+            report.write('\n\n')
+            changes[verdict_change] = changes.get(verdict_change, 0) + 1
+
+        report.write(f'\n\nSummary of changes in verdicts (see {filename} for details):')
+        report.write(str(changes))
 
 
 def extended_submissions(filename: str) -> None:
@@ -0,0 +1,336 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright Enrique Martín <emartinm@ucm.es> 2020
+
+Class to execute SELECT, DML and discriminant problems in-process using SQLite. The Oracle SQL code of problems and
+submissions is transpiled to SQLite with sqlglot
+"""
+
+import collections
+import os
+import re
+import sqlite3
+import threading
+import time
+
+import sqlglot
+from sqlglot import ErrorLevel, exp
+from logzero import logger
+
+from .exceptions import ExecutorException
+from .oracle_driver import run_sequentially
+from .oracle_sql import clean_sql, setup_plan, uniform_dict
+from .types import OracleStatusCode
+
+# SQLite does not know the type of the columns of a query, so all of them have the same type in the results
+RESULT_COLUMN_TYPE = 'ANY'
+DECLARED_TYPE_SIZE = re.compile(r'\s*\(.*\)')  # Size of declared types like TEXT(40)
+ANSI_ESCAPE = re.compile(r'\x1b\[\d+m')  # sqlglot underlines the wrong fragment of the code in its messages
+PROGRESS_HANDLER_STEPS = 10000  # Number of SQLite virtual machine instructions between timeout checks
+USER_TABLES = """SELECT name FROM sqlite_master
+                 WHERE type = 'table' AND name NOT LIKE 'sqlite_%' AND name <> 'DUAL'
+                 ORDER BY name"""
+# Statements of the user code that could access files of the server or change the configuration of the database.
+# sqlglot parses the statements that it does not know (like VACUUM INTO) as commands that are passed through
+FORBIDDEN_STATEMENTS = (exp.Command, exp.Pragma, exp.Attach, exp.Detach)
+ALLOWED_PRAGMAS = {'table_info'}  # Read-only PRAGMA used by get_all_tables
+
+
+def transpile(statement: str, dialect: str = 'sqlite') -> str:
+    """
+    Translates one Oracle SQL statement to another dialect of sqlglot (SQLite by default). Raises a
+    sqlglot.errors.SqlglotError if the statement is not correct or it uses features of Oracle without translation
+    """
+    return ';\n'.join(sqlglot.transpile(statement, read='oracle', write=dialect,
+                                        unsupported_level=ErrorLevel.RAISE))
+
+
+def transpile_user_statement(statement: str) -> str:
+    """
+    Translates one Oracle SQL statement of the user code to SQLite. Raises an ExecutorException if it is a statement
+    that could access the server beyond its in-memory database (see FORBIDDEN_STATEMENTS), or a
+    sqlglot.errors.SqlglotError if it cannot be translated
+    """
+    expressions = [expression for expression in sqlglot.parse(statement, read='oracle') if expression is not None]
+    if any(isinstance(expression, FORBIDDEN_STATEMENTS) for expression in expressions):
+        raise ExecutorException(OracleStatusCode.EXECUTE_USER_CODE,
+                                f'Statement not allowed in SQLite problems: <<{statement}>>', statement)
+    return ';\n'.join(expression.sql(dialect='sqlite', unsupported_level=ErrorLevel.RAISE)
+                      for expression in expressions)
+
+
+def authorizer(action, arg1, *_):
+    """Authorizer of SQLite connections: denies attaching databases (also used by VACUUM INTO to write files) and
+    PRAGMA statements other than ALLOWED_PRAGMAS, even if they get through transpile_user_statement"""
+    if action in (sqlite3.SQLITE_ATTACH, sqlite3.SQLITE_DETACH) \
+            or action == sqlite3.SQLITE_PRAGMA and arg1 not in ALLOWED_PRAGMAS:
+        return sqlite3.SQLITE_DENY
+    return sqlite3.SQLITE_OK
+
+
+def sqlite_value(value):
+    """Represents a value returned by SQLite as Oracle: integral numbers (like 3.0 in REAL columns) as integers, and
+    BLOB values as hexadecimal strings"""
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    if isinstance(value, bytes):
+        return value.hex().upper()
+    return value
+
+
+def table_from_cursor(cursor, header=None):
+    """
+    Takes a cursor that has executed a SELECT statement in SQLite and returns all the results in a dictionary, like
+    oracle_db.table_from_cursor: raises an ExecutorException with status code OracleStatusCode.TLE_USER_CODE if
+    the number of columns exceeds ORACLE_MAX_COLS or the number of rows exceeds ORACLE_MAX_ROWS
+    :param cursor: SQLite cursor
+    :param header: header of the table, by default the names of the columns with type RESULT_COLUMN_TYPE
+    :return: a dictionary {'header':[[NAME:str, TYPE:str]], 'rows': [list]}
+    """
+    max_rows = int(os.environ['ORACLE_MAX_ROWS'])
+    max_cols = int(os.environ['ORACLE_MAX_COLS'])
+    if cursor.description is None:
+        return {'header': [], 'rows': []}
+    if len(cursor.description) > max_cols:
+        logger.debug('TLE caused by too many columns in cursor')
+        raise ExecutorException(OracleStatusCode.TLE_USER_CODE)
+    if header is None:
+        header = [[column[0].upper(), RESULT_COLUMN_TYPE] for column in cursor.description]
+
+    batch = cursor.fetchmany(max_rows)
+    if cursor.fetchone():  # There are more rows
+        logger.debug('TLE caused by too many rows in cursor')
+        raise ExecutorException(OracleStatusCode.TLE_USER_CODE)
+    return uniform_dict({'header': header, 'rows': [[sqlite_value(value) for value in row] for row in batch]})
+
+
+def get_all_tables(conn):
+    """
+    Returns the contents of all the tables of a SQLite database as oracle_db.get_all_tables. The type of each
+    column is its declared type without size
+    :param conn: SQLite connection
+    :return: dict {table_name: {'header': list, 'rows': list}}
+    """
+    max_tables = int(os.environ['ORACLE_MAX_TABLES'])
+    tables = {}
+    for (table_name,) in conn.execute(USER_TABLES).fetchall():
+        if len(tables) >= max_tables:
+            logger.debug('TLE caused by too many tables')
+            raise ExecutorException(OracleStatusCode.TLE_USER_CODE)
+        header = [[name.upper(), DECLARED_TYPE_SIZE.sub('', decl_type).upper()]
+                  for _, name, decl_type, *_ in conn.execute(f'PRAGMA table_info("{table_name}")')]
+        tables[table_name.upper()] = table_from_cursor(conn.execute(f'SELECT * FROM "{table_name}"'), header)
+    return tables
+
+
+def execute_user_statement(conn, statement, timeout):
+    """
+    Executes a transpiled statement of the user code. SQLite interrupts the statement (and the fetch of its rows)
+    if it runs for more than 'timeout' seconds, raising a sqlite3.OperationalError 'interrupted'
+    :return: SQLite cursor
+    """
+    deadline = time.monotonic() + timeout
+    conn.set_progress_handler(lambda: time.monotonic() > deadline, PROGRESS_HANDLER_STEPS)
+    return conn.execute(statement)
+
+
+def execute_select_statement(conn, statement, timeout):
+    """
+    Executes a string containing exactly ONE SELECT statement in Oracle SQL (see
+    oracle_db.execute_select_statement)
+    :return: dictionary representing the result of the SELECT statement
+    """
+    statements = clean_sql(statement)
+    if len(statements) != 1:
+        raise ExecutorException(OracleStatusCode.NUMBER_STATEMENTS,
+                                f'The SQL query must have exactly one statement: <<{statement}>>')
+    return table_from_cursor(execute_user_statement(conn, transpile_user_statement(statements[0]), timeout))
+
+
+class SQLiteExecutor:
+    """
+    Class to execute problems in SQLite with the same interface as OracleExecutor. The database of each problem is
+    built once in an in-memory image, and every submission runs in a copy of it made with the backup API
+    """
+    __DB = None  # Singleton object for SQLiteExecutor
+
+    @classmethod
+    def get(cls):
+        """Singleton DB"""
+        if cls.__DB is None:
+            cls.__DB = SQLiteExecutor()
+        return cls.__DB
+
+    def __init__(self):
+        """
+        Takes the configuration from environment variables: SQLITE_CACHED_DBS (number of database images in the
+        cache, by default 64) and SQLITE_STMT_TIMEOUT_MS (by default ORACLE_STMT_TIMEOUT_MS)
+        """
+        self.max_images = int(os.environ.get('SQLITE_CACHED_DBS', 64))
+        self.stmt_timeout = int(os.environ.get('SQLITE_STMT_TIMEOUT_MS', os.environ['ORACLE_STMT_TIMEOUT_MS'])) / 1000
+        self.images = collections.OrderedDict()  # Setup plan hash -> SQLite connection, in LRU order
+        self.lock = threading.Lock()
+        self.build_locks = {}  # Setup plan hash -> lock held while its image is being built
+
+    @staticmethod
+    def connect():
+        """New in-memory SQLite database in autocommit mode, that can be used from any thread and cannot attach
+        other databases (see authorizer)"""
+        conn = sqlite3.connect(':memory:', check_same_thread=False, isolation_level=None)
+        conn.execute('PRAGMA foreign_keys = ON')
+        conn.set_authorizer(authorizer)
+        return conn
+
+    def build_image(self, plan):
+        """
+        Creates an in-memory database with the tables and rows of a setup plan, and the table DUAL of Oracle
+        :return: SQLite connection to the database
+        """
+        conn = self.connect()
+        state, stmt = OracleStatusCode.EXECUTE_CREATE, None
+        try:
+            conn.execute('CREATE TABLE DUAL (DUMMY TEXT)')
+            conn.execute("INSERT INTO DUAL VALUES ('X')")
+            for stmt in plan['create']:
+                conn.execute(transpile(stmt))
+            state = OracleStatusCode.EXECUTE_INSERT
+            conn.execute('BEGIN')
+            for stmt in plan['insert']:
+                conn.execute(transpile(stmt))
+            conn.execute('COMMIT')
+            return conn
+        except (sqlite3.Error, sqlglot.errors.SqlglotError) as excp:
+            conn.close()
+            logger.info('Error when creating SQLite database: %s - %s - %s', state, excp, stmt)
+            raise self.executor_exception(state, excp, stmt) from excp
+
+    def new_database(self, init_db):
+        """
+        Returns a new database with the tables and rows of the problem, copied from its cached image
+        :param init_db: (str, str) Pair of statements (create, insert) or setup plan (see oracle_sql.setup_plan)
+        :return: SQLite connection
+        """
+        plan = setup_plan(init_db)
+        key = plan['hash']
+        with self.lock:
+            if key in self.images:
+                return self.__copy_image(key, self.images[key])
+            build_lock = self.build_locks.setdefault(key, threading.Lock())
+        # Only one thread builds each image, and the images of other problems can be copied in the meantime
+        with build_lock:
+            with self.lock:
+                if key in self.images:  # Built by another thread while waiting
+                    return self.__copy_image(key, self.images[key])
+            try:
+                image = self.build_image(plan)
+                with self.lock:
+                    return self.__copy_image(key, image)
+            finally:
+                with self.lock:
+                    self.build_locks.pop(key, None)
+
+    def __copy_image(self, key, image):
+        """New database copied from an image, that becomes the most recently used one. Must hold self.lock"""
+        self.images[key] = image
+        self.images.move_to_end(key)
+        if len(self.images) > self.max_images:
+            self.images.popitem(last=False)[1].close()
+        conn = self.connect()
+        image.backup(conn)
+        return conn
+
+    @staticmethod
+    def executor_exception(state, excp, code):
+        """ExecutorException for an error of SQLite or sqlglot when executing code in the given state"""
+        message = ANSI_ESCAPE.sub('', str(excp))
+        if isinstance(excp, sqlite3.OperationalError) and message == 'interrupted':
+            return ExecutorException(OracleStatusCode.TLE_USER_CODE, message, code)
+        position = (0, 0)
+        if isinstance(excp, sqlglot.errors.ParseError) and excp.errors and state == OracleStatusCode.EXECUTE_USER_CODE:
+            # Statements from clean_sql keep the offsets of the code
+            position = (excp.errors[0]['line'] - 1, max(excp.errors[0]['col'] - 1, 0))
+        return ExecutorException(state, message, code, position)
+
+    def execute_select_test(self, init_db, select, output_db=False, reference=None,  # pylint: disable=unused-argument
+                            plan_gate=None):
+        """
+        Executes a SELECT statement in a new database (see OracleExecutor.execute_select_test)
+        :param reference: not used, the rows are always fetched
+        :param plan_gate: not used, estimated costs are only checked in Oracle
+        :return: {"result": result, "db": db}
+        """
+        conn = self.new_database(init_db)
+        state = OracleStatusCode.EXECUTE_USER_CODE
+        try:
+            result = execute_select_statement(conn, select, self.stmt_timeout)
+            conn.set_progress_handler(None, 0)
+            db = None
+            if output_db:
+                state = OracleStatusCode.GET_ALL_TABLES
+                db = get_all_tables(conn)
+            return {"result": result, "db": db}
+        except (sqlite3.Error, sqlglot.errors.SqlglotError) as excp:
+            logger.info('Error when testing SELECT statements in SQLite: %s - %s - %s', state, excp, select)
+            raise self.executor_exception(state, excp, select) from excp
+        finally:
+            conn.close()
+
+    def execute_dml_test(self, init_db, dml, *, pre_db=True, min_stmt=0, max_stmt=float("inf"),
+                         fingerprint=False, expected_fingerprint=None,  # pylint: disable=unused-argument
+                         plan_gate=None):  # pylint: disable=unused-argument
+        """
+        Executes DML statements in a new database (see OracleExecutor.execute_dml_test). Fingerprints are not
+        supported, so the tables after executing the statements are always fetched
+        :return: {'pre': DB, 'post': DB, 'fingerprint': None}
+        """
+        conn = self.new_database(init_db)
+        state, stmt = OracleStatusCode.GET_ALL_TABLES, None
+        try:
+            pre = get_all_tables(conn) if pre_db else {}
+
+            state = OracleStatusCode.EXECUTE_USER_CODE
+            statements = clean_sql(dml, min_stmt, max_stmt)
+            if not statements:
+                raise ExecutorException(OracleStatusCode.NUMBER_STATEMENTS,
+                                        f'The SQL code must have between {min_stmt} and {max_stmt} statements:'
+                                        f'<<dml>>')
+            for stmt in statements:
+                execute_user_statement(conn, transpile_user_statement(stmt), self.stmt_timeout)
+            conn.set_progress_handler(None, 0)
+
+            state = OracleStatusCode.GET_ALL_TABLES
+            return {'pre': pre, 'post': get_all_tables(conn), 'fingerprint': None}
+        except (sqlite3.Error, sqlglot.errors.SqlglotError) as excp:
+            logger.info('Error when testing DML statements in SQLite: %s - %s - %s', state, excp, stmt)
+            raise self.executor_exception(state, excp, stmt) from excp
+        finally:
+            conn.close()
+
+    def execute_discriminant_test(self, init_db, insertion_user, select_stmts):
+        """
+        Inserts the rows of the user in a new database and executes the correct and incorrect SELECT statements
+        (see OracleExecutor.execute_discriminant_test)
+        :return: {"result_correct": result, "result_incorrect": result}
+        """
+        select_correct, select_incorrect = select_stmts
+        conn = self.new_database(init_db)
+        state = OracleStatusCode.EXECUTE_USER_CODE
+        try:
+            for stmt in clean_sql(insertion_user):
+                execute_user_statement(conn, transpile_user_statement(stmt), self.stmt_timeout)
+
+            state = OracleStatusCode.EXECUTE_DISCRIMINANT_SELECT
+            result_correct = execute_select_statement(conn, select_correct, self.stmt_timeout)
+            result_incorrect = execute_select_statement(conn, select_incorrect, self.stmt_timeout)
+            return {"result_correct": result_correct, "result_incorrect": result_incorrect}
+        except (sqlite3.Error, sqlglot.errors.SqlglotError) as excp:
+            logger.info('Error when testing DISCRIMINANT problem in SQLite: %s - %s - %s', state, excp,
+                        insertion_user)
+            raise self.executor_exception(state, excp, insertion_user) from excp
+        finally:
+            conn.close()
+
+    @staticmethod
+    def run_in_order(tasks, failed=None):
+        """Runs the tasks in sequence, stopping at the first task that fails (see oracle_driver.run_sequentially)"""
+        return run_sequentially(tasks, failed)
@@ -99,7 +99,8 @@ function send_solution() {
     };
     fetch(endpoint, config)
       .then(function(response) {
-          if (response.ok) {
+          // 429: too many submissions waiting to be judged, the answer explains when to retry
+          if (response.ok || response.status === 429) {
               return response.json(); // Returns a new Promise, that can be chained
           } else {
               throw response;
@@ -107,16 +108,63 @@ function send_solution() {
       })
       .then(function(myJson) {
           console.log(myJson);
-          mark_solved(myJson);
-          show_feedback(myJson.feedback);
-          show_des_feedback(myJson.des);
-          select_error_in_editor(myJson);
-          hide_hint_message();
-          // Scroll to the position of the button, to see the possible feedback
-          let scroll_pos = $('#submit_button').offset().top;
-          $("html, body").stop().animate({scrollTop:$(document).height()}, 500, 'swing');
-          show_modal(myJson.title, myJson.message, myJson.achievements);
+          if (myJson.job) {
+              // The submission is waiting in the judge queue
+              poll_submission_status(myJson.status);
+          } else if (myJson.retry_after) {
+              // The submission has not been judged
+              show_modal(myJson.title, myJson.message);
+              update_page_submission_received();
+          } else {
+              show_verdict(myJson);
+          }
+      }).catch(function(e) {
+          console.log(e);
+          show_error_modal();
           update_page_submission_received();
+      });
+}
+
+// Shows the verdict of a judged submission
+function show_verdict(myJson) {
+    mark_solved(myJson);
+    show_feedback(myJson.feedback);
+    show_des_feedback(myJson.des);
+    select_error_in_editor(myJson);
+    hide_hint_message();
+    // Scroll to the position of the button, to see the possible feedback
+    let scroll_pos = $('#submit_button').offset().top;
+    $("html, body").stop().animate({scrollTop:$(document).height()}, 500, 'swing');
+    show_modal(myJson.title, myJson.message, myJson.achievements);
+    update_page_submission_received();
+}
+
+// Polls the status of a submission in the judge queue until it is judged
+function poll_submission_status(endpoint) {
+    const config = {
+        method: 'GET',
+        mode: 'same-origin',
+        cache: 'no-cache',
+        credentials: 'same-origin',
+        redirect: 'follow',
+        referrerPolicy: 'same-origin'
+    };
+    fetch(endpoint, config)
+      .then(function(response) {
+          if (response.ok) {
+              return response.json();
+          } else {
+              throw response;
+          }
+      })
+      .then(function(myJson) {
+          if (myJson.state) {
+              // Not judged yet
+              setTimeout(function() { poll_submission_status(endpoint); }, 1000);
+          } else {
+              console.log(myJson);
+              show_verdict(myJson);
+          }
       }).catch(function(e) {
           console.log(e);
           show_error_modal();
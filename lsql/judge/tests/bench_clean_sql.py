@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright Enrique Martín <emartinm@ucm.es> 2020
+
+Benchmark of clean_sql against the previous implementation based on sqlparse, using the SQL scripts of the
+problems in the test fixtures. It also checks that both implementations return the same statements in the same
+offsets. Run it from the project folder:
+
+    python -m judge.tests.bench_clean_sql [repetitions]
+"""
+import io
+import os
+import re
+import sys
+import timeit
+import zipfile
+
+import sqlparse
+
+from judge.oracle_sql import clean_sql
+
+ZIP_FOLDER = os.path.join(os.path.dirname(__file__), 'zip_files')
+SCRIPTS = ('create.sql', 'insert.sql', 'solution.sql', 'tests.sql')
+
+
+def legacy_replace_rest_stmt_blanks(statements):
+    """ Previous version of the extension of statements with the blanks of the rest of the code """
+    num_stmt = len(statements)
+    result = []
+    for i in range(num_stmt):
+        pre = re.sub(r'\S', ' ', "".join(statements[:i]))
+        post = re.sub(r'\S', ' ', "".join(statements[i+1:]))
+        result.append(pre + statements[i] + post)
+    return result
+
+
+def legacy_clean_sql(code: str):
+    """ Previous version of clean_sql, based on sqlparse """
+    if code is None:
+        code = ""
+    code_no_comments = re.sub(r'--.*$', lambda match_obj: ' '*len(match_obj.group(0)), code, flags=re.MULTILINE)
+    statements = [str(s).replace('\r', ' ') for s in sqlparse.parse(code_no_comments)]
+    statements = [re.sub(r';\s*$', lambda match_obj: ' '*len(match_obj.group(0)), s, flags=re.MULTILINE)
+                  for s in statements]
+    return legacy_replace_rest_stmt_blanks(statements)
+
+
+def fixture_scripts(zfile, name):
+    """ Generator of pairs (name, SQL code) with the scripts in a ZIP file, including nested ZIP files """
+    for info in zfile.infolist():
+        if info.filename.endswith('.zip'):
+            with zipfile.ZipFile(io.BytesIO(zfile.read(info))) as inner:
+                yield from fixture_scripts(inner, f'{name}/{info.filename}')
+        elif os.path.basename(info.filename) in SCRIPTS:
+            try:
+                yield f'{name}/{info.filename}', zfile.read(info).decode('utf-8')
+            except UnicodeDecodeError:  # Fixtures with decoding errors on purpose
+                pass
+
+
+def main(repetitions=5):
+    """ Compares both implementations on every fixture script and prints the time of each one """
+    scripts = []
+    for filename in sorted(os.listdir(ZIP_FOLDER)):
+        try:
+            with zipfile.ZipFile(os.path.join(ZIP_FOLDER, filename)) as zfile:
+                scripts.extend(fixture_scripts(zfile, filename))
+        except zipfile.BadZipFile:  # Fixtures with broken ZIP files on purpose
+            pass
+
+    different = 0
+    total_legacy = total_new = 0.0
+    print(f'{"script":<60} {"bytes":>8} {"stmts":>6} {"legacy ms":>10} {"new ms":>8} {"speedup":>8}')
+    for name, code in scripts:
+        # Blanks after the last statement are irrelevant (sqlparse discards some of them)
+        legacy = [stmt.rstrip() for stmt in legacy_clean_sql(code)]
+        new = [stmt.rstrip() for stmt in clean_sql(code)]
+        if legacy != new:
+            different += 1
+            print(f'DIFFERENT STATEMENTS: {name}')
+        time_legacy = min(timeit.repeat(lambda code=code: legacy_clean_sql(code), number=1, repeat=repetitions))
+        time_new = min(timeit.repeat(lambda code=code: clean_sql(code), number=1, repeat=repetitions))
+        total_legacy += time_legacy
+        total_new += time_new
+        print(f'{name[-60:]:<60} {len(code):>8} {len(new):>6} {time_legacy * 1000:>10.2f} {time_new * 1000:>8.2f} '
+              f'{time_legacy / max(time_new, 1e-9):>7.1f}x')
+    print(f'{len(scripts)} scripts, {different} with different statements. Total: legacy {total_legacy:.3f} s, '
+          f'new {total_new:.3f} s ({total_legacy / max(total_new, 1e-9):.1f}x)')
+    return different
+
+
+if __name__ == '__main__':
+    sys.exit(main(*map(int, sys.argv[1:])))
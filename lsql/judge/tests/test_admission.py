@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright Enrique Martín <emartinm@ucm.es> 2020
+
+Unit tests for the admission control of submissions
+"""
+import asyncio
+import datetime
+import os
+from tempfile import mkstemp
+
+from django.conf import settings
+from django.test import TestCase, Client
+from django.urls import reverse
+
+from judge.admission import AdmissionControl, JudgePriority, admission_control
+from judge.exceptions import AdmissionRejected
+from judge.models import Submission
+from judge.shell import rejudge
+from judge.tests.test_common import create_collection, create_user, create_select_problem
+from judge.types import VerdictCode
+import judge.admission
+
+
+class AdmissionTest(TestCase):
+    """Tests for module admission"""
+
+    def test_fair_scheduling(self):
+        """Slots are given by priority and in turns between users, with one submission per user at most"""
+        control = AdmissionControl(slots=1, max_queue=4, timeout_s=1)
+        running_a = control.enqueue('a', JudgePriority.STUDENT)
+        self.assertTrue(running_a.grant.done())
+        waiting = [control.enqueue(*args) for args in [('a', JudgePriority.STUDENT), ('a', JudgePriority.STUDENT),
+                                                       ('b', JudgePriority.STUDENT), ('c', JudgePriority.STAFF)]]
+        self.assertFalse(any(ticket.grant.done() for ticket in waiting))
+        with self.assertRaises(AdmissionRejected) as ctx:
+            control.enqueue('d', JudgePriority.REJUDGE)
+        self.assertGreaterEqual(ctx.exception.retry_after, 1)
+
+        order = []
+        ticket = running_a
+        for _ in waiting:
+            control.release(ticket, 0.5)
+            ticket = next(ticket for ticket in waiting if ticket.grant.done() and ticket not in order)
+            order.append(ticket)
+        self.assertEqual([ticket.user for ticket in order], ['c', 'a', 'b', 'a'])
+        control.release(ticket, 0.5)
+        self.assertEqual((control.running, control.num_waiting), (set(), 0))
+
+        # A user with a submission being judged waits even if there are free slots
+        control.slots = 2
+        first = control.enqueue('a', JudgePriority.STUDENT)
+        second = control.enqueue('a', JudgePriority.STUDENT)
+        self.assertTrue(first.grant.done())
+        self.assertFalse(second.grant.done())
+        control.cancel(second)
+        control.cancel(first)
+        self.assertEqual((control.running, control.num_waiting), (set(), 0))
+
+    def test_admitted(self):
+        """Submissions wait for their slot and are rejected after the timeout"""
+        control = AdmissionControl(slots=1, max_queue=10, timeout_s=0.2)
+
+        async def judge(user, delay):
+            async with control.admitted(user):
+                await asyncio.sleep(delay)
+                return user
+
+        async def judge_all():
+            return await asyncio.gather(judge('a', 0.05), judge('b', 0.05), judge('c', 1), judge('d', 0),
+                                        return_exceptions=True)
+
+        results = asyncio.run(judge_all())
+        self.assertEqual(results[:3], ['a', 'b', 'c'])
+        self.assertIsInstance(results[3], AdmissionRejected)
+        self.assertEqual((control.running, control.num_waiting), (set(), 0))
+
+        # Cancelled requests leave the queue
+        async def cancelled():
+            waiting = asyncio.ensure_future(judge('e', 0))
+            async with control.admitted('f'):
+                await asyncio.sleep(0.01)
+                waiting.cancel()
+            return await asyncio.gather(waiting, return_exceptions=True)
+
+        self.assertIsInstance(asyncio.run(cancelled())[0], asyncio.CancelledError)
+        self.assertEqual((control.running, control.num_waiting), (set(), 0))
+
+    def test_submit_rejected(self):
+        """The submit view answers 429 with a retry hint when the queue is full"""
+        client = Client()
+        collection = create_collection('Colleccion de prueba XYZ')
+        problem = create_select_problem(collection, 'SelectProblem ABC DEF')
+        user = create_user('5555', 'tamara')
+        client.login(username='tamara', password='5555')  # nosec B106
+        submit_url = reverse('judge:submit', args=[problem.pk])
+        self.assertIsNone(admission_control())
+        try:
+            os.environ['JUDGE_ADMISSION_SLOTS'] = '1'
+            control = admission_control()
+            self.assertIs(control, admission_control())
+            response = client.post(submit_url, {'code': problem.solution}, headers={'X-Judge-Priority': 'rejudge'})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(control.running, set())
+
+            control.max_queue = 0
+            response = client.post(submit_url, {'code': problem.solution})
+            self.assertEqual(response.status_code, 429)
+            self.assertEqual(response['Retry-After'], str(response.json()['retry_after']))
+            self.assertEqual(Submission.objects.filter(user=user).count(), 1)
+            client.cookies.load({settings.LANGUAGE_COOKIE_NAME: 'en'})
+            response = client.post(submit_url, {'code': problem.solution})
+            self.assertEqual(response.json()['title'], 'Too many submissions')
+            self.assertIn(f"again in {response.json()['retry_after']} seconds", response.json()['message'])
+        finally:
+            del os.environ['JUDGE_ADMISSION_SLOTS']
+            judge.admission.ADMISSION = None
+
+    def test_rejudge(self):
+        """Rejudges are not affected by the admission control, even if its queue is full"""
+        collection = create_collection('Colleccion de prueba XYZ')
+        problem = create_select_problem(collection, 'SelectProblem ABC DEF')
+        user = create_user('5555', 'tamara')
+        sub = Submission(code=problem.solution, verdict_code=VerdictCode.IE, user=user, problem=problem)
+        sub.save()
+        sub.creation_date = datetime.datetime(2020, 9, 15).astimezone()
+        sub.save()
+        file_desc, filename = mkstemp('_rejudge')
+        os.close(file_desc)
+        try:
+            os.environ['JUDGE_ADMISSION_SLOTS'] = '1'
+            admission_control().max_queue = 0
+            rejudge(VerdictCode.IE, filename)
+            with open(filename, 'r', encoding='utf-8') as summary_file:
+                self.assertIn("{'IE --> AC': 1}", summary_file.read())
+        finally:
+            del os.environ['JUDGE_ADMISSION_SLOTS']
+            judge.admission.ADMISSION = None
+            os.remove(filename)
@@ -12,6 +12,15 @@ from django.contrib.auth.models import Group
 from judge.models import Hint, UsedHint, Submission, DiscriminantProblem, SelectProblem, DMLProblem, Collection
 
 
+# Query that exceeds the time limit of Oracle
+SELECT_TLE = '''
+        SELECT a, AVG(b), MAX(b), AVG(c), AVG(d)
+        FROM (select 8 AS a, sqrt(8) as b from dual connect by level <= 15000)
+             CROSS JOIN
+             (select 8 as c, sqrt(8) as d from dual connect by level <= 15000)
+        GROUP BY a;'''
+
+
 class TestPaths:  # pylint: disable=too-few-public-methods
     """ Class only to store paths for testing files """
     ZIP_FOLDER = 'zip_files'
@@ -8,7 +8,7 @@ Unit tests for the feedback module
 from django.test import TestCase
 
 from judge.feedback import pretty_type, header_to_str, compare_select_results, compare_db_results, \
-    compare_function_results, compare_discriminant_db
+    compare_function_results, compare_discriminant_db, compare_test_cases
 from judge.types import VerdictCode
 
 
@@ -175,6 +175,22 @@ class FeedbackTest(TestCase):
         # Number and types of tables correct, but one differs in order
         self.assertEqual(compare_db_results(expected, obtained4)[0], VerdictCode.AC)
 
+    def test_compare_test_cases(self):
+        """Tests for compare_test_cases"""
+        table1 = {'header': [['ID', "<class 'cx_Oracle.NUMBER'>"]], 'rows': [[1], [2]]}
+        table2 = {'header': [['ID', "<class 'cx_Oracle.NUMBER'>"]], 'rows': [[1]]}
+        expected = [{'T': table1}, {'T': table2}]
+
+        self.assertEqual(compare_test_cases(['uno', 'dos'], expected, expected), (VerdictCode.AC, ''))
+        # Test cases with the expected fingerprint are not compared
+        self.assertEqual(compare_test_cases(['uno', 'dos'], expected, [None, {'T': table2}]), (VerdictCode.AC, ''))
+        # The feedback refers to the first incorrect test case
+        verdict, feedback = compare_test_cases(['uno', '<dos>'], expected, [{'T': table1}, {'T': table1}])
+        self.assertEqual(verdict, VerdictCode.WA)
+        self.assertIn('&lt;dos&gt;', feedback)
+        verdict, feedback = compare_test_cases([''], expected[:1], [{'T': table2}])
+        self.assertEqual((verdict, feedback), compare_db_results({'T': table1}, {'T': table2}))
+
     def test_compare_function(self):
         """Tests for compare_function_results"""
         expected = {'fun(1)': (3, '<cx_Oracle.DbType DB_TYPE_NUMBER>'),
@@ -4,6 +4,7 @@ Copyright Enrique Martín <emartinm@ucm.es> 2020
 
 Unit tests for models
 """
+import concurrent.futures
 import os
 from bs4 import BeautifulSoup
 
@@ -16,6 +17,7 @@ from django.conf import settings
 from judge.oracle_driver import OracleExecutor
 from judge.models import SelectProblem, Collection, Submission, Problem, DiscriminantProblem, default_json_lang
 from judge.types import VerdictCode
+from judge.exceptions import ExecutorException
 
 
 class ModelsTest(TestCase):
@@ -187,6 +189,37 @@ class ModelsTest(TestCase):
         self.assertEqual(len(tab_club.find('tbody').find_all('tr')), 4)
         self.assertEqual(len(tab_persona.find('tbody').find_all('tr')), 2)
 
+    def test_judge_multiple_db_parallel(self):
+        """Test databases evaluated concurrently produce the same verdicts as in sequence"""
+        curr_path = os.path.dirname(__file__)
+        zip_select_multiple_db_path = os.path.join(curr_path, self.ZIP_FOLDER, self.SELECT_MULTIPLE_DB_OK)
+        codes = [
+            "SELECT Sede, Nombre FROM Club WHERE CIF = '11111111X' and Nombre ='Madrid';",  # AC
+            "SELECT Sede, Nombre FROM Club;",  # WA in the second and third db
+            "SELECT Sede, Nombre FROM Club WHERE Nombre ='Madrid';",  # WA in the third db
+            "SELECT Sede FROM Club;",  # WA in the first db
+        ]
+        oracle = OracleExecutor.get()
+        previous_pool = oracle.variant_pool
+        pool = concurrent.futures.ThreadPoolExecutor(max_workers=3)
+        try:
+            oracle.variant_pool = None
+            sequential = SelectProblem(zipfile=zip_select_multiple_db_path)
+            sequential.clean()
+            verdicts = [sequential.judge(code, oracle) for code in codes]
+
+            oracle.variant_pool = pool
+            problem = SelectProblem(zipfile=zip_select_multiple_db_path)
+            problem.clean()
+            self.assertEqual(problem.expected_result, sequential.expected_result)
+            self.assertEqual(problem.initial_db, sequential.initial_db)
+            self.assertEqual([problem.judge(code, oracle) for code in codes], verdicts)
+            with self.assertRaises(ExecutorException):
+                problem.judge('SELECT * FROM tabla_inexistente', oracle)
+        finally:
+            oracle.variant_pool = previous_pool
+            pool.shutdown()
+
     def test_podium(self):
         """Test the correct performance of the podium"""
         collection = Collection(name_md='ABC', description_md='blablabla')
@@ -321,6 +354,27 @@ class ModelsTest(TestCase):
                                 solution=solution)
         self.assertRaises(ValidationError, problem.clean)
 
+    def test_setup_plans(self):
+        """Setup plans are precompiled when cleaning and reused when judging"""
+        collection = Collection()
+        collection.save()
+        create = 'CREATE TABLE arg (n NUMBER);'
+        insert = "INSERT INTO arg VALUES (88);\n-- @new data base@\nINSERT INTO arg VALUES (99);"
+        problem = SelectProblem(title_md='Test', text_md='Simple Table',
+                                create_sql=create, insert_sql=insert, collection=collection,
+                                solution='SELECT * FROM arg')
+        problem.clean()
+        self.assertEqual(len(problem.setup_plans), 2)
+        self.assertEqual(problem.setup_plans[0]['create'], ['CREATE TABLE arg (n NUMBER)'])
+        for insert_sql, plan in zip(problem.insert_sql_list(), problem.setup_plans):
+            self.assertIs(problem.setup_plan(insert_sql), plan)
+
+        # Plans not stored (or outdated) are compiled on demand
+        problem.setup_plans = None
+        plan = problem.setup_plan(problem.insert_sql_list()[1])
+        self.assertEqual(plan['insert'], ['INSERT INTO arg VALUES (99)'])
+        self.assertEqual(problem.judge('SELECT * FROM arg', OracleExecutor.get())[0], VerdictCode.AC)
+
     def test_failure_insert_discriminant(self):
         """ Test for check if discriminant clean raise ValidationError because the table test_table_1 does
             not exist
@@ -4,23 +4,20 @@ Copyright Enrique Martín <emartinm@ucm.es> 2020
 
 Unit tests for the connection and execution of statements using the Oracle DB
 """
+import concurrent.futures
 import os
 import time
 
 from django.test import TestCase
 
-from judge.oracle_driver import OracleExecutor, clean_sql, line_col_from_offset, create_insert_all
+from judge.oracle_db import get_all_tables, execute_sql_script
+from judge.oracle_driver import OracleExecutor
+from judge.oracle_sql import clean_sql, line_col_from_offset, create_insert_all, split_test_cases
 from judge.models import SelectProblem, Collection, DMLProblem, FunctionProblem, ProcProblem, TriggerProblem, \
     DiscriminantProblem
 from judge.types import VerdictCode, OracleStatusCode
 from judge.exceptions import ExecutorException
-
-SELECT_TLE = '''
-        SELECT a, AVG(b), MAX(b), AVG(c), AVG(d)
-        FROM (select 8 AS a, sqrt(8) as b from dual connect by level <= 15000)
-             CROSS JOIN
-             (select 8 as c, sqrt(8) as d from dual connect by level <= 15000)
-        GROUP BY a;'''
+from judge.tests.test_common import SELECT_TLE
 
 
 class OracleTest(TestCase):
@@ -56,6 +53,16 @@ class OracleTest(TestCase):
               '\n           \n                  ',
               '\n         \n  \n           \n           \n                                \n   \n \n          '
               '\nUPDATE Club\nSET Atletas = 107 ']),
+            # ';' and '--' inside strings, q-quoted strings, quoted identifiers and hints do not split statements
+            ("INSERT INTO t VALUES ('a;--b', q'[c;']', nq'{';}');-- c\nINSERT INTO \"t;\" VALUES ('It''s;');",
+             ["INSERT INTO t VALUES ('a;--b', q'[c;']', nq'{';}')     \n                                   ",
+              "                                                       \nINSERT INTO \"t;\" VALUES ('It''s;') "]),
+            ('SELECT /*+ hint; */ * FROM t;;\r\n', ['SELECT /*+ hint; */ * FROM t   \n']),
+            # PL/SQL units keep their ';' and end with '/'
+            ('CREATE OR REPLACE FUNCTION f RETURN NUMBER IS\nBEGIN\n  RETURN 1;\nEND;\n/\nSELECT f FROM dual',
+             ['CREATE OR REPLACE FUNCTION f RETURN NUMBER IS\nBEGIN\n  RETURN 1;\nEND;\n \n                  ',
+              '                                             \n     \n           \n    \n \nSELECT f FROM dual']),
+            ('BEGIN\n  p(1);\nEND;', ['BEGIN\n  p(1);\nEND;']),
         ]
         for code, clean in codes:
             cleaned = clean_sql(code)
@@ -64,6 +71,10 @@ class OracleTest(TestCase):
                 # Every extended statement must have the same length as the original complete code
                 self.assertEqual(len(code), len(stmt))
 
+        # Unterminated strings and comments extend to the end of the code
+        for code in ["SELECT 'a; FROM t", "SELECT q'[a;] FROM t", 'SELECT "a; FROM t', 'SELECT a /* b; FROM t']:
+            self.assertEqual(clean_sql(code), [code])
+
     def test_select(self):
         """Tests for SelectProblem.judge()"""
         collection = Collection()
@@ -637,6 +648,296 @@ END;"""
         after = oracle.get_number_dangling_users(age_seconds=1)
         self.assertGreater(before, after)  # There are less dangling users (we cannot assure all have dissapear )
 
+    def test_bulk_snapshot(self):
+        """The snapshot of all the tables taken in one round trip is equal to the one taken table by table"""
+        oracle = OracleExecutor.get()
+        gestor = oracle.connection_pool.acquire()
+        user, passwd = oracle.create_user(gestor)
+        conn = oracle.create_connection(user, passwd)
+        try:
+            self.assertEqual(get_all_tables(conn, bulk=True), {})
+            creation = """CREATE TABLE t(n NUMBER, d DATE, s VARCHAR2(10));
+                          CREATE TABLE "Otra tabla"(x NUMBER(3,1));
+                          CREATE TABLE vacia(n NUMBER);"""
+            insertion = """INSERT INTO t VALUES (1, DATE '2020-02-29', 'uno');
+                           INSERT INTO t VALUES (2, NULL, NULL);
+                           INSERT INTO "Otra tabla" VALUES (1.5);"""
+            execute_sql_script(conn, creation)
+            execute_sql_script(conn, insertion)
+            snapshot = get_all_tables(conn, bulk=True)
+            self.assertEqual(snapshot, get_all_tables(conn, bulk=False))
+            self.assertEqual(set(snapshot), {'T', 'Otra tabla', 'VACIA'})
+            self.assertEqual(snapshot['VACIA']['rows'], [])
+
+            # Too many rows in one table
+            nrows = int(os.environ['ORACLE_MAX_ROWS']) + 1
+            execute_sql_script(conn, f'INSERT INTO vacia SELECT level FROM dual CONNECT BY level <= {nrows}')
+            with self.assertRaises(ExecutorException) as ctx:
+                get_all_tables(conn, bulk=True)
+            self.assertEqual(ctx.exception.error_code, OracleStatusCode.TLE_USER_CODE)
+
+            # Too many tables
+            ntables = int(os.environ['ORACLE_MAX_TABLES'])
+            execute_sql_script(conn, ';'.join(f'CREATE TABLE extra{i}(n NUMBER)' for i in range(ntables)))
+            with self.assertRaises(ExecutorException) as ctx:
+                get_all_tables(conn, bulk=True)
+            self.assertEqual(ctx.exception.error_code, OracleStatusCode.TLE_USER_CODE)
+        finally:
+            oracle.discard_user(user, conn, gestor)
+            oracle.connection_pool.release(gestor)
+
+    def test_fingerprints(self):
+        """DBs with the expected fingerprint are accepted without fetching their tables"""
+        collection = Collection()
+        collection.save()
+        create = """CREATE TABLE Club(
+                        CIF CHAR(9) PRIMARY KEY,
+                        Nombre VARCHAR2(40) NOT NULL UNIQUE,
+                        Fundacion DATE,
+                        Num_Socios NUMBER(10,0) NOT NULL);"""
+        insert = """INSERT INTO Club VALUES ('11111111X', 'Real Madrid CF', DATE '1902-03-06', 70000);
+                    INSERT INTO Club VALUES ('11111113X', 'PSG', NULL, 1000);"""
+        oracle = OracleExecutor.get()
+        previous_fingerprints = oracle.fingerprints
+        oracle.fingerprints = True
+        try:
+            dml = DMLProblem(title_md='Fingerprint', text_md='Fingerprint', create_sql=create, insert_sql=insert,
+                             collection=collection, min_stmt=1, max_stmt=2,
+                             solution="UPDATE Club SET Num_Socios = Num_Socios + 1")
+            dml.clean()
+            self.assertEqual(set(dml.expected_fingerprint), {'CLUB'})
+
+            # Same rows in a different order and with different statements
+            same = ("UPDATE Club SET Num_Socios = 1001 WHERE Num_Socios = 1000; "
+                    "UPDATE Club SET Num_Socios = 70001 WHERE Num_Socios = 70000")
+            result = oracle.execute_dml_test(dml.setup_plan(insert), same, pre_db=False,
+                                             expected_fingerprint=dml.expected_fingerprint)
+            self.assertIsNone(result['post'])
+            self.assertEqual(dml.judge(same, oracle)[0], VerdictCode.AC)
+
+            # Different DBs are compared as usual to generate the feedback
+            for wrong in ["UPDATE Club SET Num_Socios = Num_Socios + 2",
+                          "UPDATE Club SET Fundacion = NULL, Num_Socios = Num_Socios + 1",
+                          "DELETE FROM Club WHERE Num_Socios < 5000"]:
+                result = oracle.execute_dml_test(dml.setup_plan(insert), wrong, pre_db=False,
+                                                 expected_fingerprint=dml.expected_fingerprint)
+                self.assertIsNotNone(result['post'])
+                self.assertNotEqual(result['fingerprint'], dml.expected_fingerprint)
+                self.assertEqual(dml.judge(wrong, oracle)[0], VerdictCode.WA)
+
+            # Tables with LOBs cannot be fingerprinted
+            lob = DMLProblem(title_md='LOB', text_md='LOB', create_sql='CREATE TABLE t(c CLOB);',
+                             insert_sql="INSERT INTO t VALUES ('a');", collection=collection, min_stmt=1, max_stmt=1,
+                             solution="UPDATE t SET c = 'b'")
+            lob.clean()
+            self.assertIsNone(lob.expected_fingerprint)
+            self.assertEqual(lob.judge(lob.solution, oracle)[0], VerdictCode.AC)
+
+            # Fingerprints are not computed if disabled
+            oracle.fingerprints = False
+            self.assertIsNone(oracle.execute_dml_test((create, insert), 'DELETE FROM Club',
+                                                      fingerprint=True)['fingerprint'])
+        finally:
+            oracle.fingerprints = previous_fingerprints
+
+    def test_select_in_db(self):
+        """SELECT results equal to the result of the solution are checked in Oracle without fetching their rows"""
+        collection = Collection()
+        collection.save()
+        create = """CREATE TABLE Club(
+                        CIF CHAR(9) PRIMARY KEY,
+                        Nombre VARCHAR2(40) NOT NULL UNIQUE,
+                        Num_Socios NUMBER(10,0) NOT NULL);"""
+        insert = """INSERT INTO Club VALUES ('11111111X', 'Real Madrid CF', 70000);
+                    INSERT INTO Club VALUES ('11111112X', 'Futbol Club Barcelona', 80000);
+                    INSERT INTO Club VALUES ('11111113X', 'PSG', 1000);"""
+        problem = SelectProblem(title_md='In DB', text_md='In DB', create_sql=create, insert_sql=insert,
+                                collection=collection, check_order=False,
+                                solution='SELECT Nombre, Num_Socios FROM Club WHERE Num_Socios > 5000;')
+        problem.clean()
+        oracle = OracleExecutor.get()
+        previous_select_in_db = oracle.select_in_db
+        oracle.select_in_db = True
+        try:
+            plan = problem.setup_plan(insert)
+            correct = """WITH grandes AS (SELECT * FROM Club WHERE Num_Socios >= 70000)
+                         SELECT Nombre, Num_Socios FROM grandes ORDER BY Nombre DESC"""
+            self.assertIsNone(oracle.execute_select_test(plan, correct, reference=problem.reference(0))['result'])
+            self.assertEqual(problem.judge(correct, oracle), (VerdictCode.AC, ''))
+
+            # Different rows (or duplicated rows) and different headers are fetched to generate the feedback
+            for wrong in ['SELECT Nombre, Num_Socios FROM Club',
+                          'SELECT Nombre, Num_Socios FROM Club WHERE Num_Socios > 5000 UNION ALL '
+                          "SELECT Nombre, Num_Socios FROM Club WHERE Nombre = 'PSG'",
+                          'SELECT Nombre AS Club, Num_Socios FROM Club WHERE Num_Socios > 5000',
+                          'SELECT Nombre FROM Club WHERE Num_Socios > 5000']:
+                self.assertIsNotNone(oracle.execute_select_test(plan, wrong, reference=problem.reference(0))['result'])
+                self.assertEqual(problem.judge(wrong, oracle)[0], VerdictCode.WA)
+
+            # Columns that cannot be compared in Oracle and errors are handled as usual
+            problem_char = SelectProblem(title_md='In DB', text_md='In DB', create_sql=create, insert_sql=insert,
+                                         collection=collection, check_order=False,
+                                         solution='SELECT CIF FROM Club')
+            problem_char.clean()
+            self.assertIsNotNone(oracle.execute_select_test(plan, 'SELECT CIF FROM Club',
+                                                            reference=problem_char.reference(0))['result'])
+            self.assertEqual(problem_char.judge('SELECT CIF FROM Club', oracle)[0], VerdictCode.AC)
+            self.assert_executor_exception(lambda: problem.judge('SELECT Nombre, FROM Club', oracle),
+                                           OracleStatusCode.EXECUTE_USER_CODE)
+            self.assert_executor_exception(lambda: problem.judge(SELECT_TLE, oracle), OracleStatusCode.TLE_USER_CODE)
+
+            # The order of rows is compared in Python
+            problem.check_order = True
+            self.assertIsNone(problem.reference(0))
+        finally:
+            oracle.select_in_db = previous_select_in_db
+
+    def test_run_in_order(self):
+        """Concurrent tasks return the same results as in sequence, stopping at the first failed task"""
+        def task(value, delay=0.0):
+            def run():
+                time.sleep(delay)
+                if isinstance(value, Exception):
+                    raise value
+                return value
+            return run
+
+        oracle = OracleExecutor.get()
+        previous_pool = oracle.variant_pool
+        pools = [None, concurrent.futures.ThreadPoolExecutor(max_workers=2)]
+        try:
+            for pool in pools:
+                oracle.variant_pool = pool
+                self.assertEqual(oracle.run_in_order([task(1, 0.2), task(2), task(3)]), [1, 2, 3])
+                # The first failed task in order is returned, even if a later one fails before
+                self.assertEqual(oracle.run_in_order([task(1, 0.2), task(-2, 0.1), task(-3), task(4)],
+                                                     failed=lambda result: result < 0), [1, -2])
+                with self.assertRaises(ValueError):
+                    oracle.run_in_order([task(1, 0.1), task(ValueError()), task(KeyError())])
+                self.assertEqual(oracle.run_in_order([task(-1, 0.2), task(KeyError())],
+                                                     failed=lambda result: result < 0), [-1])
+            # Tasks not started when a previous one fails are cancelled
+            executed = []
+            oracle.run_in_order([task(-1, 0.1), task(2, 0.5), lambda: executed.append(3) or 3],
+                                failed=lambda result: result < 0)
+            time.sleep(0.5)
+            self.assertEqual(executed, [])
+        finally:
+            oracle.variant_pool = previous_pool
+            pools[1].shutdown()
+
+    def test_split_test_cases(self):
+        """Tests of PROCEDURE and TRIGGER problems are split in named test cases"""
+        self.assertEqual(split_test_cases('BEGIN p(1); END;'), [('', 'BEGIN p(1); END;')])
+        code = """
+            -- CASE: Primer caso
+            BEGIN p(1); END;
+            --CASE:Segundo   
+            BEGIN p(2); END;"""
+        self.assertEqual([(name, stmt.strip()) for name, stmt in split_test_cases(code)],
+                         [('Primer caso', 'BEGIN p(1); END;'), ('Segundo', 'BEGIN p(2); END;')])
+        code = """INSERT INTO t VALUES (1);
+            -- CASE: Borrado
+            DELETE FROM t;"""
+        self.assertEqual([(name, stmt.strip()) for name, stmt in split_test_cases(code)],
+                         [('', 'INSERT INTO t VALUES (1);'), ('Borrado', 'DELETE FROM t;')])
+
+    def test_test_cases(self):
+        """Several test cases are evaluated in one user, using a new one after test cases that commit"""
+        collection = Collection()
+        collection.save()
+        create = 'CREATE TABLE Club(Nombre VARCHAR2(40) PRIMARY KEY, Socios NUMBER NOT NULL);'
+        insert = "INSERT INTO Club VALUES ('A', 10);"
+        solution = """
+            CREATE OR REPLACE PROCEDURE inserta(nombre VARCHAR2, socios NUMBER) IS
+            BEGIN
+                INSERT INTO Club VALUES (nombre, socios);
+            END;"""
+        calls = """-- CASE: Club B
+            BEGIN inserta('B', 20); END;
+            -- CASE: Club C
+            BEGIN inserta('C', 30); END;
+            -- CASE: Club B otra vez
+            BEGIN inserta('B', 40); END;"""
+        committing = """
+            CREATE OR REPLACE PROCEDURE inserta(nombre VARCHAR2, socios NUMBER) IS
+            BEGIN
+                INSERT INTO Club VALUES (nombre, socios);
+                COMMIT;
+            END;"""
+        wrong_answer = """
+            CREATE OR REPLACE PROCEDURE inserta(nombre VARCHAR2, socios NUMBER) IS
+            BEGIN
+                INSERT INTO Club VALUES (nombre, CASE WHEN nombre = 'C' THEN 0 ELSE socios END);
+            END;"""
+        oracle = OracleExecutor.get()
+        problem = ProcProblem(title_md='Test cases', text_md='bla bla bla', create_sql=create, insert_sql=insert,
+                              collection=collection, author=None, solution=solution, proc_call=calls)
+        problem.clean()
+        problem.save()
+
+        # The changes of each test case are undone before the next one
+        self.assertEqual(len(problem.expected_result), 3)
+        self.assertEqual(len(problem.expected_fingerprint), 3)
+        self.assertEqual([sorted(row[0] for row in db['CLUB']['rows']) for db in problem.expected_result],
+                         [['A', 'B'], ['A', 'C'], ['A', 'B']])
+
+        self.assertEqual(problem.judge(solution, oracle), (VerdictCode.AC, ''))
+        # Test cases after one that commits are evaluated in a new user
+        self.assertEqual(problem.judge(committing, oracle), (VerdictCode.AC, ''))
+        res = oracle.execute_proc_cases(problem.setup_plan(insert), committing,
+                                        [call for _, call in problem.test_cases()])
+        self.assertEqual(res['post'], problem.expected_result)
+        # The feedback refers to the first incorrect test case
+        verdict, feedback = problem.judge(wrong_answer, oracle)
+        self.assertEqual(verdict, VerdictCode.WA)
+        self.assertIn('Club C', feedback)
+
+        # Problems validated before supporting test cases store one fingerprint
+        problem.proc_call = 'BEGIN inserta(\'B\', 20); END;'
+        problem.clean()
+        problem.expected_fingerprint = problem.expected_fingerprint[0]
+        self.assertEqual(problem.judge(solution, oracle), (VerdictCode.AC, ''))
+
+        tests = """-- CASE: Inserción
+            INSERT INTO Club VALUES ('B', 20);
+            -- CASE: Borrado
+            DELETE FROM Club;"""
+        trigger = """
+            CREATE OR REPLACE TRIGGER duplica
+            BEFORE INSERT ON Club FOR EACH ROW
+            BEGIN
+                :new.Socios := :new.Socios * 2;
+            END;"""
+        problem = TriggerProblem(title_md='Test cases', text_md='bla bla bla', create_sql=create, insert_sql=insert,
+                                 collection=collection, author=None, solution=trigger, tests=tests)
+        problem.clean()
+        problem.save()
+        self.assertEqual([sorted(db['CLUB']['rows']) for db in problem.expected_result], [[['A', 10], ['B', 40]], []])
+        self.assertEqual(problem.judge(trigger, oracle), (VerdictCode.AC, ''))
+
+        # Deferred constraints are checked at the end of every test case, not at the end of each statement
+        create = """CREATE TABLE Club(Nombre VARCHAR2(40) PRIMARY KEY);
+                    CREATE TABLE Socio(Nombre VARCHAR2(40) PRIMARY KEY,
+                                       Club VARCHAR2(40) REFERENCES Club DEFERRABLE INITIALLY DEFERRED);"""
+        tests = """-- CASE: Club A
+            INSERT INTO Socio VALUES ('Ana', 'A');
+            INSERT INTO Club VALUES ('A');
+            -- CASE: Club B
+            INSERT INTO Socio VALUES ('Berta', 'B');
+            INSERT INTO Club VALUES ('B');"""
+        trigger = """
+            CREATE OR REPLACE TRIGGER mayusculas
+            BEFORE INSERT ON Club FOR EACH ROW
+            BEGIN
+                :new.Nombre := UPPER(:new.Nombre);
+            END;"""
+        problem = TriggerProblem(title_md='Deferred', text_md='bla bla bla', create_sql=create, insert_sql='',
+                                 collection=collection, author=None, solution=trigger, tests=tests)
+        problem.clean()
+        self.assertEqual([db['SOCIO']['rows'] for db in problem.expected_result], [[['Ana', 'A']], [['Berta', 'B']]])
+        self.assertEqual(problem.judge(trigger, oracle), (VerdictCode.AC, ''))
+
     def test_pos_from_offset(self):
         """Test the extraction of line-col from offset"""
         code = """SELECT cif, sede
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright Enrique Martín <emartinm@ucm.es> 2020
+
+Unit tests for the execution in several Oracle nodes
+"""
+import os
+import time
+
+import oracledb
+from django.test import TestCase
+
+from judge.oracle_cluster import OracleCluster
+from judge.oracle_driver import oracle_nodes, create_oracle_executor
+from judge.types import OracleStatusCode
+from judge.exceptions import ExecutorException
+
+
+class OracleClusterTest(TestCase):
+    """Tests for module oracle_cluster"""
+
+    def assert_executor_exception(self, function, status_code):
+        """Checks if executing the nullary function raises an ExecutorException with the expected status_code"""
+        with self.assertRaises(ExecutorException) as ctx:
+            function()
+        self.assertEqual(ctx.exception.error_code, status_code)
+
+    def test_cluster(self):
+        """Calls are routed to the least loaded Oracle node, and nodes without admin connections are quarantined"""
+        node = f"{os.environ['ORACLE_SERVER']}:{os.environ['ORACLE_PORT']}/{os.environ['ORACLE_SID']}"
+        try:
+            os.environ['ORACLE_NODES'] = f'{node}, {node}'  # Two nodes in the same server
+            cluster = create_oracle_executor()
+            os.environ['ORACLE_NODES'] = 'server_without_port'
+            with self.assertRaises(ValueError):
+                oracle_nodes()
+        finally:
+            del os.environ['ORACLE_NODES']
+        self.assertEqual(oracle_nodes(), [None])
+        self.assertIsInstance(cluster, OracleCluster)
+        first, second = cluster.executors
+        # The node with the most free admin connections is chosen
+        busy = [first.connection_pool.acquire() for _ in range(first.connection_pool.max)]
+        self.assertIs(cluster.route(lambda executor: executor), second)
+        for gestor in busy:
+            first.connection_pool.release(gestor)
+
+        # Every kind of problem can be judged in the cluster
+        init_db = ('CREATE TABLE t (a NUMBER);', 'INSERT INTO t VALUES (1);')
+        self.assertTrue(cluster.get_version().startswith('Oracle'))
+        self.assertEqual(cluster.execute_select_test(init_db, 'SELECT * FROM t')['result']['rows'], [[1]])
+        self.assertEqual(cluster.execute_dml_test(init_db, 'DELETE FROM t')['post']['T']['rows'], [])
+        self.assertEqual(cluster.execute_discriminant_test(init_db, 'INSERT INTO t VALUES (2)',
+                                                           ('SELECT * FROM t', 'SELECT * FROM t WHERE a > 1'))
+                         ['result_incorrect']['rows'], [[2]])
+        func = 'CREATE OR REPLACE FUNCTION f(x NUMBER) RETURN NUMBER IS BEGIN RETURN x + 1; END;'
+        self.assertEqual(cluster.execute_function_test(init_db, func, 'f(1)')['results']['f(1)'][0], 2)
+        proc = 'CREATE OR REPLACE PROCEDURE p(x NUMBER) IS BEGIN INSERT INTO t VALUES (x); END;'
+        self.assertEqual(len(cluster.execute_proc_test(init_db, proc, 'BEGIN p(2); END;')['post']['T']['rows']), 2)
+        self.assertEqual([len(db['T']['rows']) for db in
+                          cluster.execute_proc_cases(init_db, proc, ['BEGIN p(2); END;', 'BEGIN NULL; END;'])['post']],
+                         [2, 1])
+        trigger = 'CREATE OR REPLACE TRIGGER tr BEFORE INSERT ON t FOR EACH ROW BEGIN :NEW.a := :NEW.a * 10; END;'
+        self.assertEqual(sorted(cluster.execute_trigger_test(init_db, trigger, 'INSERT INTO t VALUES (2);')
+                                ['post']['T']['rows']), [[1], [20]])
+        self.assertEqual([len(db['T']['rows']) for db in
+                          cluster.execute_trigger_cases(init_db, trigger, ['INSERT INTO t VALUES (2);',
+                                                                           'DELETE FROM t;'])['post']],
+                         [2, 0])
+        self.assertEqual(cluster.run_in_order([lambda: 1, lambda: -2, lambda: 3], failed=lambda res: res < 0),
+                         [1, -2])
+        cluster.remove_dangling_users(age_seconds=1)
+        self.assertGreaterEqual(cluster.get_number_dangling_users(age_seconds=1), 0)
+
+        def without_admin_connection(executor):
+            if executor is first:
+                raise ExecutorException(OracleStatusCode.GET_ADMIN_CONNECTION)
+            return executor
+
+        # Calls without admin connection are retried in another node, and the node is quarantined
+        cluster.max_failures = 2
+        self.assertIs(cluster.route(without_admin_connection), second)
+        self.assertEqual(cluster.failures, [1, 0])
+        self.assertIs(cluster.route(without_admin_connection), second)
+        self.assertGreater(cluster.quarantined_until[0], time.time())
+        self.assertIs(cluster.route(lambda executor: executor), second)
+        # If all the nodes are quarantined, the one whose quarantine ends first is used
+        cluster.quarantined_until[1] = cluster.quarantined_until[0] + 1
+        self.assertIs(cluster.route(lambda executor: executor), first)
+        self.assert_executor_exception(lambda: cluster.route(lambda executor: without_admin_connection(first)),
+                                       OracleStatusCode.GET_ADMIN_CONNECTION)
+
+        def tle(executor):  # pylint: disable=unused-argument
+            raise ExecutorException(OracleStatusCode.TLE_USER_CODE)
+
+        # Other errors are not retried
+        self.assert_executor_exception(lambda: cluster.route(tle), OracleStatusCode.TLE_USER_CODE)
+        self.assertEqual(cluster.running, [0, 0])
+
+    def test_cluster_node_down(self):
+        """Nodes that cannot be reached at startup are quarantined, and their executor is created on their first call
+        after the quarantine"""
+        server, sid = os.environ['ORACLE_SERVER'], os.environ['ORACLE_SID']
+        node = f"{server}:{os.environ['ORACLE_PORT']}/{sid}"
+        try:
+            os.environ['ORACLE_NODES'] = f'{node}, {server}:1/{sid}'  # Nothing listens in port 1
+            cluster = create_oracle_executor()
+            os.environ['ORACLE_NODES'] = f'{server}:1/{sid}, {server}:2/{sid}'
+            with self.assertRaises(oracledb.DatabaseError):  # No node can be reached
+                create_oracle_executor()
+        finally:
+            del os.environ['ORACLE_NODES']
+        first = cluster.executors[0]
+        self.assertIsNone(cluster.executors[1])
+        self.assertGreater(cluster.quarantined_until[1], time.time())
+        self.assertIs(cluster.route(lambda executor: executor), first)
+        self.assertEqual(cluster.get_number_dangling_users(age_seconds=1), -1)
+        cluster.remove_dangling_users(age_seconds=1)
+        self.assertEqual(cluster.run_in_order([lambda: 1, lambda: 2]), [1, 2])
+        cluster.remove_shared_schemas(age_seconds=10 ** 9)
+
+        # After the quarantine, the node is tried first. If it is still down, it is quarantined again and the call is
+        # retried in another node
+        cluster.quarantined_until[1] = 0
+        self.assertIs(cluster.route(lambda executor: executor), first)
+        self.assertIsNone(cluster.executors[1])
+        self.assertGreater(cluster.quarantined_until[1], time.time())
+
+        # When the node is back, its executor is created on its first call
+        cluster.nodes[1] = (server, int(os.environ['ORACLE_PORT']), sid)
+        cluster.quarantined_until[1] = 0
+        second = cluster.route(lambda executor: executor)
+        self.assertIs(cluster.executors[1], second)
+        self.assertIsNot(second, first)
+        self.assertEqual(cluster.running, [0, 0])
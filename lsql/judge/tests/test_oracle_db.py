@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright Enrique Martín <emartinm@ucm.es> 2020
+
+Unit tests for the functions that execute code through an Oracle connection
+"""
+import os
+
+import oracledb
+from django.test import TestCase
+from django.utils import translation
+
+from judge.oracle_db import execute_setup, execute_statements, most_expensive_step, REFERENCE_COSTS, reference_cost, \
+    execute_function_batch
+from judge.oracle_driver import OracleExecutor
+from judge.oracle_sql import setup_plan, compile_setup, content_hash, batch_function_calls
+from judge.models import SelectProblem, Collection, DMLProblem
+from judge.types import VerdictCode, OracleStatusCode
+from judge.exceptions import ExecutorException
+from judge.judging import judge_code
+
+
+class OracleDBTest(TestCase):
+    """Tests for module oracle_db"""
+
+    def assert_executor_exception(self, function, status_code):
+        """Checks if executing the nullary function raises an ExecutorException with the expected status_code"""
+        with self.assertRaises(ExecutorException) as ctx:
+            function()
+        self.assertEqual(ctx.exception.error_code, status_code)
+
+    def test_execute_setup(self):
+        """The schema is set up in one round trip, leaving the statement that fails and the rest as pending"""
+        oracle = OracleExecutor.get()
+        gestor = oracle.connection_pool.acquire()
+        user, passwd = oracle.create_user(gestor)
+        conn = oracle.create_connection(user, passwd)
+        try:
+            creation = 'CREATE TABLE t(n NUMBER); CREATE TABLE u(n NUMBER PRIMARY KEY);'
+            insertion = 'INSERT INTO t VALUES (1); INSERT INTO u VALUES (2);'
+            self.assertEqual(execute_setup(conn, compile_setup(creation, insertion)), ([], []))
+            with conn.cursor() as cursor:
+                cursor.execute('SELECT COUNT(*) FROM u')
+                self.assertEqual(cursor.fetchone()[0], 1)
+
+            # Table t already exists
+            pending_create, pending_insert = execute_setup(
+                conn, setup_plan(('CREATE TABLE v(n NUMBER); CREATE TABLE t(n NUMBER);', 'INSERT INTO v VALUES (1);')))
+            self.assertEqual(len(pending_create), 1)
+            self.assertEqual('CREATE TABLE t(n NUMBER)', pending_create[0])
+            self.assertEqual(len(pending_insert), 1)
+            with self.assertRaises(oracledb.DatabaseError) as ctx:
+                execute_statements(conn, pending_create)
+            self.assertIn('ORA-00955', str(ctx.exception))
+
+            # Duplicated key
+            pending_create, pending_insert = execute_setup(conn, setup_plan(('', 'INSERT INTO u VALUES (2);')))
+            self.assertEqual((len(pending_create), len(pending_insert)), (0, 1))
+
+            # Statements too long to be bound in PL/SQL are executed one by one
+            long_insert = 'INSERT INTO t VALUES (1);' * 2000
+            pending_create, pending_insert = execute_setup(conn, setup_plan(('CREATE TABLE w(n NUMBER);', long_insert)))
+            self.assertEqual((len(pending_create), len(pending_insert)), (0, 1))
+            execute_statements(conn, pending_insert)
+        finally:
+            oracle.discard_user(user, conn, gestor)
+            oracle.connection_pool.release(gestor)
+
+        # Errors are reported in the right phase
+        self.assert_executor_exception(
+            lambda: oracle.execute_select_test(('CREATE TABLE t(n NUMBER); CREATE TABLE t(n NUMBER);', ''),
+                                               'SELECT * FROM t'),
+            OracleStatusCode.EXECUTE_CREATE)
+        self.assert_executor_exception(
+            lambda: oracle.execute_select_test(('CREATE TABLE t(n NUMBER PRIMARY KEY);',
+                                                'INSERT INTO t VALUES (1); INSERT INTO t VALUES (1);'),
+                                               'SELECT * FROM t'),
+            OracleStatusCode.EXECUTE_INSERT)
+
+    def test_function_batch(self):
+        """All the function calls are evaluated in one query, falling back to one call at a time on errors"""
+        oracle = OracleExecutor.get()
+        func = """
+            CREATE OR REPLACE FUNCTION inverso(n NUMBER) RETURN NUMBER IS
+            BEGIN
+                RETURN 1 / n;
+            END;"""
+        calls = """
+            inverso(2)
+            TO_CHAR(inverso(4)) -- Comments at the end of calls do not hide the following calls
+            inverso(2)
+            SYSDATE - SYSDATE
+            """
+        results = oracle.execute_function_test(('', ''), func, calls)['results']
+        self.assertEqual(list(results), ['inverso(2)', 'TO_CHAR(inverso(4)) -- Comments at the end of calls do not '
+                                         'hide the following calls', 'SYSDATE - SYSDATE'])
+        self.assertEqual(results['inverso(2)'][0], 0.5)
+        self.assertIn('NUMBER', results['inverso(2)'][1])
+        self.assertEqual(results['SYSDATE - SYSDATE'][0], 0)
+        self.assertIn('VARCHAR', list(results.values())[1][1])
+
+        # Calls ending with a comment are evaluated in one query, without falling back to one call at a time
+        calls = ['1 + 1 -- Comentario, con coma', "'a' -- Otro comentario"]
+        gestor = oracle.connection_pool.acquire()
+        with gestor.cursor() as cursor:
+            results = execute_function_batch(cursor, batch_function_calls(calls), calls)
+        oracle.connection_pool.release(gestor)
+        self.assertEqual([value for value, _ in results], [2, 'a'])
+
+        # The failing call is the one reported
+        with self.assertRaises(ExecutorException) as ctx:
+            oracle.execute_function_test(('', ''), func, 'inverso(2)\ninverso(0)\ninverso(4)')
+        self.assertEqual(ctx.exception.error_code, OracleStatusCode.EXECUTE_USER_CODE)
+        self.assertIn('inverso(0)', ctx.exception.statement)
+        self.assertNotIn('inverso(4)', ctx.exception.statement)
+
+    def test_plan_cost(self):
+        """Submissions with a huge estimated cost get TLE without executing them"""
+        collection = Collection()
+        collection.save()
+        create = """CREATE TABLE Club(
+                        CIF CHAR(9) PRIMARY KEY,
+                        Nombre VARCHAR2(40) NOT NULL UNIQUE,
+                        Num_Socios NUMBER(10,0) NOT NULL);"""
+        insert = """INSERT INTO Club VALUES ('11111111X', 'Real Madrid CF', 70000);
+                    INSERT INTO Club VALUES ('11111112X', 'Futbol Club Barcelona', 80000);
+                    INSERT INTO Club VALUES ('11111113X', 'PSG', 1000);"""
+        cartesian = 'SELECT a.* FROM Club a, Club b, Club c, Club d, Club e, Club f'
+        oracle = OracleExecutor.get()
+        problem = SelectProblem(title_md='Cost', text_md='Cost', create_sql=create, insert_sql=insert,
+                                collection=collection, solution='SELECT * FROM Club', plan_cost_factor=2)
+        problem.clean()
+        self.assertEqual(problem.judge(problem.solution, oracle)[0], VerdictCode.AC)
+        self.assert_executor_exception(lambda: problem.judge(cartesian, oracle), OracleStatusCode.TLE_PLAN_COST)
+        data = judge_code(problem, cartesian)
+        self.assertEqual(data['verdict'], VerdictCode.TLE)
+        self.assertIn('(cost: ', data['feedback'])
+        with translation.override('en'):
+            data = judge_code(problem, cartesian)
+        self.assertIn('Most expensive step of the execution plan: ', data['feedback'])
+        # The cost of the solution is explained only once per setup plan
+        key = (problem.setup_plans[0]['hash'], content_hash(problem.solution))
+        self.assertIn(key, REFERENCE_COSTS)
+        REFERENCE_COSTS[key] = 10 ** 9
+        try:
+            self.assertEqual(problem.judge(cartesian, oracle)[0], VerdictCode.WA)
+        finally:
+            del REFERENCE_COSTS[key]
+        gestor = oracle.connection_pool.acquire()
+        with gestor.cursor() as cursor:
+            self.assertIsNone(reference_cost(cursor, 'SELECT * FROM Nada', key[0]))
+        oracle.connection_pool.release(gestor)
+        # Code that cannot be explained is executed to obtain its error
+        self.assert_executor_exception(lambda: problem.judge('SELECT * FROM Nada', oracle),
+                                       OracleStatusCode.EXECUTE_USER_CODE)
+        self.assert_executor_exception(lambda: problem.judge(f'{cartesian}; {cartesian}', oracle),
+                                       OracleStatusCode.NUMBER_STATEMENTS)
+
+        # The factor is taken from ORACLE_PLAN_COST_FACTOR if the problem does not define it
+        problem.plan_cost_factor = None
+        self.assertIsNone(problem.plan_gate())
+        try:
+            os.environ['ORACLE_PLAN_COST_FACTOR'] = '3'
+            self.assertEqual(problem.plan_gate(), (problem.solution, 3))
+        finally:
+            del os.environ['ORACLE_PLAN_COST_FACTOR']
+
+        # Also in shared schemas
+        previous_schemas, oracle.shared_schemas = oracle.shared_schemas, {}
+        try:
+            problem.plan_cost_factor = 2
+            self.assertEqual(problem.judge(problem.solution, oracle)[0], VerdictCode.AC)
+            self.assert_executor_exception(lambda: problem.judge(cartesian, oracle), OracleStatusCode.TLE_PLAN_COST)
+        finally:
+            oracle.remove_shared_schemas()
+            oracle.shared_schemas = previous_schemas
+
+        problem = DMLProblem(title_md='Cost', text_md='Cost', create_sql=create, insert_sql=insert,
+                             collection=collection, solution='DELETE FROM Club WHERE Num_Socios < 5000',
+                             plan_cost_factor=2)
+        problem.clean()
+        self.assertEqual(problem.judge(problem.solution, oracle)[0], VerdictCode.AC)
+        self.assert_executor_exception(
+            lambda: problem.judge(f'DELETE FROM Club WHERE Num_Socios < (SELECT COUNT(*) FROM ({cartesian}))', oracle),
+            OracleStatusCode.TLE_PLAN_COST)
+
+        # The step with the greatest cost of its own
+        plan = [(0, None, 'SELECT STATEMENT', 100, 10), (1, 0, 'MERGE JOIN CARTESIAN', 100, 10),
+                (2, 1, 'TABLE ACCESS FULL CLUB', 2, 3), (3, 1, 'BUFFER SORT', 98, 9)]
+        self.assertEqual(most_expensive_step([plan])[2], 'BUFFER SORT')
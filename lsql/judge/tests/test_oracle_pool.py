@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright Enrique Martín <emartinm@ucm.es> 2020
+
+Unit tests for the pools of sandbox users and sandbox sessions in Oracle
+"""
+import collections
+import os
+import time
+
+import oracledb
+from django.test import TestCase
+
+from judge.oracle_driver import OracleExecutor
+from judge.oracle_pool import SandboxUserPool
+from judge.models import SelectProblem, Collection, DMLProblem
+from judge.types import VerdictCode, OracleStatusCode
+from judge.exceptions import ExecutorException
+from judge.tests.test_common import SELECT_TLE
+
+
+class OraclePoolTest(TestCase):
+    """Tests for module oracle_pool and the pool of sandbox sessions"""
+
+    def assert_executor_exception(self, function, status_code):
+        """Checks if executing the nullary function raises an ExecutorException with the expected status_code"""
+        with self.assertRaises(ExecutorException) as ctx:
+            function()
+        self.assertEqual(ctx.exception.error_code, status_code)
+
+    def test_user_pool(self):
+        """Sandbox users are leased from a pool that is refilled in background"""
+        def wait_pool_size(pool, size):
+            for _ in range(100):
+                if pool.size() >= size:
+                    break
+                time.sleep(0.1)
+
+        oracle = OracleExecutor.get()
+        pool = SandboxUserPool(oracle, low=2, high=3, max_idle=60)
+        try:
+            wait_pool_size(pool, 3)
+            self.assertEqual(pool.size(), 3)
+            oracle.remove_dangling_users(age_seconds=0)  # Idle users in the pool are not dangling
+            self.assertEqual(pool.size(), 3)
+
+            user, passwd = pool.lease()
+            self.assertTrue(user.startswith(SandboxUserPool.PREFIX))
+            self.assertNotIn(user.upper(), pool.idle_users())
+            oracle.remove_dangling_users(age_seconds=0)  # Leased users are not dangling before the maximum idle time
+            conn = oracle.create_connection(user, passwd)
+            conn.close()
+            gestor = oracle.connection_pool.acquire()
+            oracle.drop_user(user, gestor)
+            oracle.connection_pool.release(gestor)
+
+            # The executor leases users from its pool when judging
+            previous_pool, oracle.user_pool = oracle.user_pool, pool
+            wait_pool_size(pool, 3)
+            collection = Collection()
+            collection.save()
+            problem = SelectProblem(title_md='Pool', text_md='Pool', create_sql='CREATE TABLE t(n NUMBER);',
+                                    insert_sql='INSERT INTO t VALUES (1);', collection=collection,
+                                    solution='SELECT * FROM t')
+            problem.clean()
+            self.assertEqual(problem.judge('SELECT n FROM t', oracle)[0], VerdictCode.AC)
+            oracle.user_pool = previous_pool
+        finally:
+            pool.close()
+        self.assertEqual(pool.size(), 0)
+
+        # Expired idle users are never leased
+        pool = SandboxUserPool(oracle, low=1, high=1, max_idle=60)
+        try:
+            wait_pool_size(pool, 1)
+            with pool.cond:
+                pool.users = collections.deque((user, passwd, created - 3600) for user, passwd, created in pool.users)
+            self.assertIsNone(pool.lease())
+        finally:
+            pool.close()
+
+        # Pooled users left by dead processes are dangling after the maximum idle time of the pool
+        gestor = oracle.connection_pool.acquire()
+        orphan, _ = oracle.create_user(gestor, prefix=SandboxUserPool.PREFIX)
+        oracle.connection_pool.release(gestor)
+        self.assertNotIn(orphan.upper(), [name for name, _ in oracle.get_dangling_users(age_seconds=0)])
+        previous_max_idle, oracle.pool_max_idle = oracle.pool_max_idle, 0
+        try:
+            time.sleep(2)
+            self.assertIn(orphan.upper(), [name for name, _ in oracle.get_dangling_users(age_seconds=0)])
+            oracle.remove_dangling_users(age_seconds=0)
+            self.assertNotIn(orphan.upper(), [name for name, _ in oracle.get_dangling_users(age_seconds=0)])
+        finally:
+            oracle.pool_max_idle = previous_max_idle
+
+    def test_sandbox_pool(self):
+        """Sandbox sessions are created through a pool with proxy authentication"""
+        collection = Collection()
+        collection.save()
+        problem = SelectProblem(title_md='Proxy', text_md='Proxy', create_sql='CREATE TABLE t(n NUMBER);',
+                                insert_sql='INSERT INTO t VALUES (1);', collection=collection,
+                                solution='SELECT * FROM t')
+        dml = DMLProblem(title_md='Proxy', text_md='Proxy', create_sql='CREATE TABLE t(n NUMBER);',
+                         insert_sql='INSERT INTO t VALUES (1);', collection=collection,
+                         solution='INSERT INTO t VALUES (2)')
+        oracle = OracleExecutor.get()
+        previous_pool, previous_schemas = oracle.sandbox_pool, oracle.shared_schemas
+        oracle.sandbox_pool = oracledb.create_pool(user=os.environ['ORACLE_USER'], password=os.environ['ORACLE_PASS'],
+                                                   dsn=oracle.dsn_tns, homogeneous=False, min=0, max=2, increment=1)
+        try:
+            problem.clean()
+            dml.clean()
+            self.assertEqual(problem.judge(problem.solution, oracle)[0], VerdictCode.AC)
+            self.assertEqual(dml.judge(dml.solution, oracle)[0], VerdictCode.AC)
+            self.assert_executor_exception(lambda: problem.judge('SELECT * FROM u', oracle),
+                                           OracleStatusCode.EXECUTE_USER_CODE)
+            self.assert_executor_exception(lambda: problem.judge(SELECT_TLE, oracle), OracleStatusCode.TLE_USER_CODE)
+            # Sessions of sandbox users are dropped from the pool with their users
+            self.assertEqual(oracle.sandbox_pool.opened, 0)
+
+            # Sessions of the readers of shared schemas are reused
+            oracle.shared_schemas = {}
+            self.assertEqual(problem.judge(problem.solution, oracle)[0], VerdictCode.AC)
+            self.assertEqual(problem.judge(problem.solution, oracle)[0], VerdictCode.AC)
+            self.assertEqual(oracle.sandbox_pool.opened, 1)
+        finally:
+            oracle.sandbox_pool.close(force=True)
+            oracle.remove_shared_schemas()
+            oracle.sandbox_pool, oracle.shared_schemas = previous_pool, previous_schemas
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright Enrique Martín <emartinm@ucm.es> 2020
+
+Unit tests for the background teardown of Oracle sandbox users
+"""
+import time
+
+from django.test import TestCase
+
+from judge.oracle_driver import OracleExecutor
+from judge.oracle_reaper import SandboxReaper
+from judge.models import SelectProblem, Collection
+from judge.types import VerdictCode, OracleStatusCode
+from judge.exceptions import ExecutorException
+
+
+class OracleReaperTest(TestCase):
+    """Tests for module oracle_reaper"""
+
+    def assert_executor_exception(self, function, status_code):
+        """Checks if executing the nullary function raises an ExecutorException with the expected status_code"""
+        with self.assertRaises(ExecutorException) as ctx:
+            function()
+        self.assertEqual(ctx.exception.error_code, status_code)
+
+    def test_reaper(self):
+        """Sandbox users are removed in background by the reaper, which also sweeps dangling users"""
+        oracle = OracleExecutor.get()
+        gestor = oracle.connection_pool.acquire()
+        user, passwd = oracle.create_user(gestor)
+        dangling, dangling_passwd = oracle.create_user(gestor)
+        oracle.connection_pool.release(gestor)
+        conn = oracle.create_connection(user, passwd)
+        oracle.create_connection(dangling, dangling_passwd)
+        time.sleep(2)
+
+        reaper = SandboxReaper(oracle, sweep_interval=1, sweep_age=1)
+        previous_reaper, oracle.reaper = oracle.reaper, reaper
+        try:
+            reaper.reap(user, conn)
+            # The verdict does not depend on the reaper
+            collection = Collection()
+            collection.save()
+            problem = SelectProblem(title_md='Reaper', text_md='Reaper', create_sql='CREATE TABLE t(n NUMBER);',
+                                    insert_sql='INSERT INTO t VALUES (1);', collection=collection,
+                                    solution='SELECT * FROM t')
+            problem.clean()
+            self.assertEqual(problem.judge('SELECT n FROM t', oracle)[0], VerdictCode.AC)
+            self.assert_executor_exception(lambda: problem.judge('SELECT * FROM', oracle),
+                                           OracleStatusCode.EXECUTE_USER_CODE)
+            time.sleep(3)  # At least one sweep
+        finally:
+            oracle.reaper = previous_reaper
+            reaper.close()
+        self.assertEqual(reaper.pending(), 0)
+        remaining = [name for name, _ in oracle.get_dangling_users(age_seconds=0)]
+        self.assertNotIn(user.upper(), remaining)
+        self.assertNotIn(dangling.upper(), remaining)
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright Enrique Martín <emartinm@ucm.es> 2020
+
+Unit tests for the resettable schemas of Oracle
+"""
+
+from django.test import TestCase
+
+from judge.oracle_driver import OracleExecutor
+from judge.oracle_reset import ResettableSchemas
+from judge.models import Collection, DMLProblem, ProcProblem, TriggerProblem
+from judge.types import VerdictCode, OracleStatusCode
+from judge.exceptions import ExecutorException
+
+
+class OracleResetTest(TestCase):
+    """Tests for module oracle_reset"""
+
+    def assert_executor_exception(self, function, status_code):
+        """Checks if executing the nullary function raises an ExecutorException with the expected status_code"""
+        with self.assertRaises(ExecutorException) as ctx:
+            function()
+        self.assertEqual(ctx.exception.error_code, status_code)
+
+    def test_reset_schemas(self):
+        """Mutating problems are judged in schemas that are reset after each submission"""
+        collection = Collection()
+        collection.save()
+        create = '''CREATE TABLE Club(
+                        CIF CHAR(9) PRIMARY KEY,
+                        Nombre VARCHAR2(40) NOT NULL UNIQUE,
+                        Num_Socios NUMBER(10,0) NOT NULL);'''
+        insert = """INSERT INTO Club VALUES ('11111111X', 'Real Madrid CF', 70000);
+                    INSERT INTO Club VALUES ('11111113X', 'PSG', 1000);"""
+        dml = DMLProblem(title_md='Reset', text_md='Reset', create_sql=create, insert_sql=insert,
+                         collection=collection, min_stmt=1, max_stmt=3,
+                         solution="UPDATE Club SET Num_Socios = Num_Socios + 1")
+        proc = ProcProblem(title_md='Reset', text_md='Reset', create_sql=create, insert_sql=insert,
+                           collection=collection, proc_call='BEGIN borra(1000); END;',
+                           solution="""CREATE OR REPLACE PROCEDURE borra(x NUMBER) IS
+                                       BEGIN
+                                           DELETE FROM Club WHERE Num_Socios <= x;
+                                       END;""")
+        trigger = TriggerProblem(title_md='Reset', text_md='Reset', create_sql=create, insert_sql=insert,
+                                 collection=collection,
+                                 tests="INSERT INTO Club VALUES ('22222222X', 'Betis', 50);",
+                                 solution="""CREATE OR REPLACE TRIGGER Duplica
+                                             BEFORE INSERT ON Club FOR EACH ROW
+                                             BEGIN
+                                                 :NEW.Num_Socios := :NEW.Num_Socios * 2;
+                                             END;""")
+        commit_proc = """CREATE OR REPLACE PROCEDURE borra(x NUMBER) IS
+                         BEGIN
+                             DELETE FROM Club WHERE Num_Socios <= x;
+                             COMMIT;
+                         END;"""
+        ddl_proc = """CREATE OR REPLACE PROCEDURE borra(x NUMBER) IS
+                      BEGIN
+                          EXECUTE IMMEDIATE 'CREATE TABLE Otra(n NUMBER)';
+                          DELETE FROM Club WHERE Num_Socios <= x;
+                      END;"""
+        oracle = OracleExecutor.get()
+        previous_schemas = oracle.reset_schemas
+        reset_schemas = ResettableSchemas(oracle, 2)
+        oracle.reset_schemas = reset_schemas
+        try:
+            for problem in [dml, proc, trigger]:
+                problem.clean()
+            self.assertEqual(reset_schemas.size(), 1)  # The three problems share the same scripts
+            owner = reset_schemas.idle_users()
+            for _ in range(2):
+                self.assertEqual(dml.judge(dml.solution, oracle)[0], VerdictCode.AC)
+                self.assertEqual(dml.judge("DELETE FROM Club", oracle)[0], VerdictCode.WA)
+                self.assert_executor_exception(lambda: dml.judge("UPDATE Club SET Nombre = NULL", oracle),
+                                               OracleStatusCode.EXECUTE_USER_CODE)
+                self.assertEqual(proc.judge(proc.solution, oracle)[0], VerdictCode.AC)
+                self.assertEqual(trigger.judge(trigger.solution, oracle)[0], VerdictCode.AC)
+            self.assertEqual(reset_schemas.idle_users(), owner)
+
+            # Committed changes are flashed back
+            self.assertEqual(proc.judge(commit_proc, oracle)[0], VerdictCode.AC)
+            self.assertEqual(dml.judge(dml.solution, oracle)[0], VerdictCode.AC)
+            # Statements that are not DML are judged in a new user
+            self.assertEqual(dml.judge(f"{dml.solution}; COMMIT", oracle)[0], VerdictCode.AC)
+            self.assertEqual(reset_schemas.idle_users(), owner)
+            # Schemas with new tables cannot be reset
+            self.assertEqual(proc.judge(ddl_proc, oracle)[0], VerdictCode.WA)
+            self.assertEqual(reset_schemas.size(), 0)
+            self.assertEqual(dml.judge(dml.solution, oracle)[0], VerdictCode.AC)
+            self.assertEqual(reset_schemas.size(), 1)
+            self.assertNotEqual(reset_schemas.idle_users(), owner)
+
+            # Resettable schemas in use are not dangling users
+            self.assertTrue(reset_schemas.idle_users().isdisjoint(
+                {user for user, _ in oracle.get_dangling_users(0)}))
+        finally:
+            reset_schemas.close()
+            oracle.reset_schemas = previous_schemas
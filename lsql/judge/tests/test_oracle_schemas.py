@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright Enrique Martín <emartinm@ucm.es> 2020
+
+Unit tests for the shared, master and profiled schemas of Oracle
+"""
+import os
+
+from django.core.management import call_command
+from django.test import TestCase
+
+from judge.oracle_driver import OracleExecutor
+from judge.oracle_sql import setup_plan, compile_setup, is_tle_exception, copied_tables
+from judge.models import SelectProblem, Collection, DMLProblem
+from judge.types import VerdictCode, OracleStatusCode
+from judge.exceptions import ExecutorException
+from judge.tests.test_common import SELECT_TLE
+
+
+class OracleSchemasTest(TestCase):
+    """Tests for module oracle_schemas"""
+
+    def assert_executor_exception(self, function, status_code):
+        """Checks if executing the nullary function raises an ExecutorException with the expected status_code"""
+        with self.assertRaises(ExecutorException) as ctx:
+            function()
+        self.assertEqual(ctx.exception.error_code, status_code)
+
+    def test_shared_schema(self):
+        """SELECT submissions are judged in a shared read-only schema built only once"""
+        collection = Collection()
+        collection.save()
+        create = '''CREATE TABLE "Nombre Club" (
+                        CIF CHAR(9) PRIMARY KEY,
+                        Nombre VARCHAR2(40) NOT NULL UNIQUE,
+                        Num_Socios NUMBER(10,0) NOT NULL);
+                    CREATE VIEW Grandes AS SELECT * FROM "Nombre Club" WHERE Num_Socios > 5000;'''
+        insert = '''INSERT INTO "Nombre Club" VALUES ('11111111X', 'Real Madrid CF', 70000);
+                    INSERT INTO "Nombre Club" VALUES ('11111113X', 'PSG', 1000);'''
+        solution = 'SELECT * FROM "Nombre Club"'
+        problem = SelectProblem(title_md='Shared', text_md='Shared', create_sql=create, insert_sql=insert,
+                                collection=collection, solution=solution)
+        problem.clean()
+        oracle = OracleExecutor.get()
+        previous_schemas, oracle.shared_schemas = oracle.shared_schemas, {}
+        try:
+            self.assertEqual(problem.judge(solution, oracle)[0], VerdictCode.AC)
+            self.assertEqual(len(oracle.shared_schemas), 1)
+            self.assertEqual(problem.judge('SELECT * FROM "Nombre Club" ORDER BY Nombre', oracle)[0],
+                             VerdictCode.AC)
+            self.assertEqual(problem.judge('SELECT * FROM Grandes', oracle)[0], VerdictCode.WA)
+            self.assert_executor_exception(lambda: problem.judge(SELECT_TLE, oracle), OracleStatusCode.TLE_USER_CODE)
+            self.assert_executor_exception(lambda: problem.judge('SELECT * FROM Club', oracle),
+                                           OracleStatusCode.EXECUTE_USER_CODE)
+            self.assert_executor_exception(lambda: problem.judge(f'{solution}; {solution}', oracle),
+                                           OracleStatusCode.NUMBER_STATEMENTS)
+            # The schema is read-only
+            self.assert_executor_exception(lambda: problem.judge('DELETE FROM "Nombre Club"', oracle),
+                                           OracleStatusCode.EXECUTE_USER_CODE)
+            # Schemas built by other processes are reused
+            oracle.shared_schemas.clear()
+            self.assertEqual(problem.judge(solution, oracle)[0], VerdictCode.AC)
+            # Sandboxes of other problems cannot modify the shared schema
+            owner = oracle.shared_schema(setup_plan((create, insert)))[0]
+            dml = DMLProblem(title_md='Shared', text_md='Shared', create_sql=create, insert_sql=insert,
+                             collection=collection, solution='DELETE FROM "Nombre Club"')
+            dml.clean()
+            self.assert_executor_exception(lambda: dml.judge(f'DELETE FROM {owner}."Nombre Club"', oracle),
+                                           OracleStatusCode.EXECUTE_USER_CODE)
+            self.assertEqual(problem.judge(solution, oracle)[0], VerdictCode.AC)
+            # Scripts that cannot be executed do not generate a shared schema
+            self.assertIsNone(oracle.shared_schema(('CREATE TABLE t(', '')))
+        finally:
+            oracle.remove_shared_schemas()
+            oracle.shared_schemas = previous_schemas
+
+    def test_remove_stale_schemas(self):
+        """The shared and master schemas of old versions of edited problems are removed"""
+        collection = Collection()
+        collection.save()
+        problem = SelectProblem(title_md='Stale', text_md='Stale', collection=collection,
+                                create_sql='CREATE TABLE Club(CIF CHAR(9) PRIMARY KEY, Num_Socios NUMBER);',
+                                insert_sql="INSERT INTO Club VALUES ('11111111X', 100);",
+                                solution='SELECT * FROM Club')
+        problem.clean()
+        problem.save()
+        oracle = OracleExecutor.get()
+        previous = oracle.shared_schemas, oracle.master_schemas
+        oracle.shared_schemas, oracle.master_schemas = {}, {}
+        try:
+            old_plan = problem.setup_plans[0]
+            self.assertIn('copy', oracle.sandbox_plan(old_plan))  # Builds the master schema
+            old_owner = oracle.shared_schemas[old_plan['hash']][0]
+            problem.insert_sql = "INSERT INTO Club VALUES ('11111112X', 200);"
+            problem.clean()
+            problem.save()
+            new_plan = problem.setup_plans[0]
+            new_owner = oracle.shared_schema(new_plan)[0]
+
+            call_command('remove_stale_schemas', age=0)
+            gestor = oracle.connection_pool.acquire()
+            with gestor.cursor() as cursor:
+                cursor.execute("SELECT username FROM all_users WHERE username LIKE 'LSHR%'")
+                users = {row[0] for row in cursor.fetchall()}
+            oracle.connection_pool.release(gestor)
+            self.assertEqual(users, {new_owner.upper(), f'{new_owner}_r'.upper()})
+            self.assertNotIn(old_owner.upper(), users)
+            self.assertEqual(list(oracle.shared_schemas), [new_plan['hash']])
+            self.assertEqual(oracle.master_schemas, {})
+            self.assertEqual(problem.judge(problem.solution, oracle)[0], VerdictCode.AC)
+        finally:
+            oracle.remove_shared_schemas()
+            oracle.shared_schemas, oracle.master_schemas = previous
+
+    def test_master_schemas(self):
+        """Sandboxes copy the rows of the tables from a master schema loaded only once"""
+        collection = Collection()
+        collection.save()
+        create = '''CREATE TABLE Club(
+                        CIF CHAR(9) PRIMARY KEY,
+                        Nombre VARCHAR2(40) NOT NULL UNIQUE,
+                        Num_Socios NUMBER(10,0) NOT NULL,
+                        Grande NUMBER(1) AS (CASE WHEN Num_Socios > 5000 THEN 1 ELSE 0 END));
+                    CREATE TABLE "Jugador"(
+                        Nombre VARCHAR2(40) PRIMARY KEY,
+                        Club CHAR(9) REFERENCES Club);'''
+        insert = '''INSERT INTO Club(CIF, Nombre, Num_Socios) VALUES ('11111111X', 'Real Madrid CF', 70000);
+                    INSERT INTO "Jugador" VALUES ('Raúl', '11111111X');
+                    INSERT INTO Club(CIF, Nombre, Num_Socios) VALUES ('11111113X', 'PSG', 1000);'''
+        select = SelectProblem(title_md='Master', text_md='Master', create_sql=create, insert_sql=insert,
+                               collection=collection, solution='SELECT * FROM Club NATURAL JOIN "Jugador"')
+        dml = DMLProblem(title_md='Master', text_md='Master', create_sql=create, insert_sql=insert,
+                         collection=collection, solution='DELETE FROM Club WHERE Num_Socios < 5000')
+        key = compile_setup(create, insert)['hash']
+        self.assertEqual(copied_tables(compile_setup(create, insert)), ['CLUB', 'Jugador'])
+        self.assertIsNone(copied_tables(compile_setup(f'{create} CREATE TABLE t AS SELECT * FROM Club;', insert)))
+
+        oracle = OracleExecutor.get()
+        previous = oracle.master_schemas
+        try:
+            oracle.master_schemas = {}
+            select.clean()
+            dml.clean()
+            self.assertEqual(select.judge(select.solution, oracle)[0], VerdictCode.AC)
+            self.assertEqual(len(oracle.master_schemas[key]['copy']), 2)
+            # Sandboxes can only read the master schema while copying its rows
+            owner = oracle.master_schemas[key]['master'][0]
+            self.assert_executor_exception(
+                lambda: dml.judge(f'DELETE FROM "Jugador" WHERE Club IN (SELECT CIF FROM {owner}.Club)', oracle),
+                OracleStatusCode.EXECUTE_USER_CODE)
+            self.assertEqual(select.judge('SELECT * FROM Club', oracle)[0], VerdictCode.WA)
+            self.assertEqual(dml.judge(dml.solution, oracle)[0], VerdictCode.AC)
+            self.assertEqual(dml.judge('DELETE FROM "Jugador"', oracle)[0], VerdictCode.WA)
+            self.assert_executor_exception(lambda: dml.judge('DELETE FROM Club', oracle),
+                                           OracleStatusCode.EXECUTE_USER_CODE)
+
+            # Masters built by other processes are reused
+            oracle.master_schemas.clear()
+            self.assertEqual(dml.judge(dml.solution, oracle)[0], VerdictCode.AC)
+            self.assertIn('copy', oracle.master_schemas[key])
+
+            # Tables with sequences or triggers are loaded with INSERT ALL
+            trigger = f'''{create}
+                CREATE OR REPLACE TRIGGER Socios BEFORE INSERT ON Club FOR EACH ROW
+                BEGIN
+                    :new.Num_Socios := :new.Num_Socios + 1;
+                END;'''
+            dml.create_sql = trigger
+            dml.clean()
+            self.assertEqual(dml.judge(dml.solution, oracle)[0], VerdictCode.AC)
+            self.assertIsNone(oracle.master_schemas[compile_setup(trigger, insert)['hash']])
+            # Scripts that create rows or cannot be executed are loaded as usual
+            plan = compile_setup(f'{create} CREATE TABLE t AS SELECT * FROM Club;', insert)
+            self.assertIs(oracle.sandbox_plan(plan), plan)
+            plan = compile_setup('CREATE TABLE t(', 'INSERT INTO t VALUES (1);')
+            self.assertIs(oracle.sandbox_plan(plan), plan)
+        finally:
+            oracle.remove_shared_schemas()
+            oracle.master_schemas = previous
+
+    def test_sandbox_profile(self):
+        """Sandbox users are created with a profile and a quota, and exceeding their resources is a TLE"""
+        collection = Collection()
+        collection.save()
+        problem = DMLProblem(title_md='Profile', text_md='Profile', create_sql='CREATE TABLE t(n NUMBER);',
+                             insert_sql='INSERT INTO t VALUES (1);', collection=collection,
+                             solution='INSERT INTO t VALUES (2)')
+        huge_insert = "INSERT INTO t SELECT LEVEL FROM DUAL CONNECT BY LEVEL <= 5000000"
+        oracle = OracleExecutor.get()
+        previous = (oracle.sandbox_profile, oracle.consumer_group, oracle.user_quota)
+        try:
+            os.environ['ORACLE_USER_QUOTA_MB'] = '1'
+            oracle.create_sandbox_profile()
+            oracle.create_sandbox_profile()  # The profile already exists
+            self.assertEqual((oracle.sandbox_profile, oracle.user_quota), ('LSQL_SANDBOX', '1M'))
+            self.assertTrue(oracle.create_user_script('u', 'p').endswith('QUOTA 1M ON '
+                                                                        f'{os.environ["ORACLE_TABLESPACE"]} '
+                                                                        'PROFILE LSQL_SANDBOX'))
+            problem.clean()
+            self.assertEqual(problem.judge(problem.solution, oracle)[0], VerdictCode.AC)
+            oracle.consumer_group = 'LSQL_TEST'  # Sessions are identified by their module
+            self.assertEqual(problem.judge(problem.solution, oracle)[0], VerdictCode.AC)
+            self.assert_executor_exception(lambda: problem.judge(huge_insert, oracle),
+                                           OracleStatusCode.TLE_USER_CODE)
+
+            # Without limits if the consumer group cannot be created
+            oracle.sandbox_profile, oracle.user_quota = None, 'UNLIMITED'
+            os.environ['ORACLE_CONSUMER_GROUP'] = 'G' * 200
+            oracle.create_sandbox_profile()
+            self.assertIsNone(oracle.sandbox_profile)
+            self.assertNotIn('PROFILE', oracle.create_user_script('u', 'p'))
+        finally:
+            os.environ.pop('ORACLE_USER_QUOTA_MB', None)
+            os.environ.pop('ORACLE_CONSUMER_GROUP', None)
+            oracle.sandbox_profile, oracle.consumer_group, oracle.user_quota = previous
+
+        self.assertTrue(is_tle_exception('ORA-01536: space quota exceeded for tablespace'))
+        self.assertTrue(is_tle_exception('ORA-02393: exceeded call limit on CPU usage'))
+        self.assertTrue(is_tle_exception('DPI-1067: call timeout of 1000 ms exceeded'))
+        self.assertFalse(is_tle_exception('ORA-00942: table or view does not exist'))
@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright Enrique Martín <emartinm@ucm.es> 2020
+
+Unit tests for the PostgreSQL executor
+"""
+from concurrent.futures import ThreadPoolExecutor
+import os
+
+from django.core.exceptions import ImproperlyConfigured
+from django.test import TestCase
+
+from judge.postgres_driver import PostgresExecutor, postgres_value
+from judge.models import Collection, SelectProblem, DMLProblem, DiscriminantProblem
+from judge.types import VerdictCode, OracleStatusCode, ExecutionEngine
+from judge.exceptions import ExecutorException
+
+
+class PostgresTest(TestCase):
+    """Tests for module postgres_driver"""
+    CREATE = """CREATE TABLE Club(
+                    CIF CHAR(9) PRIMARY KEY,
+                    Nombre VARCHAR2(40) NOT NULL UNIQUE,
+                    Num_Socios NUMBER(10,0) NOT NULL,
+                    CONSTRAINT NumSociosPositivos CHECK (Num_Socios >= 0)
+                );
+                CREATE TABLE Jugador(
+                    ID NUMBER PRIMARY KEY,
+                    Club CHAR(9) REFERENCES Club,
+                    Sueldo NUMBER(8,2)
+                );"""
+    INSERT = """INSERT INTO Club VALUES ('11111111X', 'Real Madrid CF', 70000);
+                INSERT INTO Club VALUES ('11111112X', 'Futbol Club Barcelona', 80000);
+                INSERT INTO Jugador VALUES (1, '11111111X', 1000.5);"""
+
+    def assert_executor_exception(self, function, status_code):
+        """Checks if executing the nullary function raises an ExecutorException with the expected status_code"""
+        with self.assertRaises(ExecutorException) as ctx:
+            function()
+        self.assertEqual(ctx.exception.error_code, status_code)
+        return ctx.exception
+
+    def test_select(self):
+        """SELECT statements are transpiled from Oracle and executed in a sandbox cloned from the template"""
+        executor = PostgresExecutor.get()
+        init_db = (self.CREATE, self.INSERT)
+        res = executor.execute_select_test(init_db, "SELECT Nombre, NVL(Num_Socios, 0) AS socios FROM Club "
+                                                    "WHERE Num_Socios > 1000 ORDER BY socios DESC", output_db=True)
+        self.assertEqual(res['result'], {'header': [['NOMBRE', 'VARCHAR'], ['SOCIOS', 'NUMERIC']],
+                                         'rows': [['Futbol Club Barcelona', 80000], ['Real Madrid CF', 70000]]})
+        self.assertEqual(sorted(res['db']), ['CLUB', 'JUGADOR'])
+        self.assertEqual(res['db']['CLUB']['header'], [['CIF', 'CHARACTER'], ['NOMBRE', 'CHARACTER VARYING'],
+                                                       ['NUM_SOCIOS', 'NUMERIC']])
+        self.assertEqual(res['db']['JUGADOR']['rows'], [[1, '11111111X', 1000.5]])
+
+        res = executor.execute_select_test(init_db, "SELECT 'a' || 'b' AS c FROM DUAL")
+        self.assertEqual(res['result']['rows'], [['ab']])
+        self.assertIsNone(res['db'])
+        self.assertEqual(postgres_value(memoryview(b'\x0a\xff')), '0AFF')
+        res = executor.execute_select_test(init_db, 'CREATE VIEW V AS SELECT * FROM Club')
+        self.assertEqual(res['result'], {'header': [], 'rows': []})
+
+        # Errors in the user code
+        excp = self.assert_executor_exception(
+            lambda: executor.execute_select_test(init_db, 'SELECT *\nFROM Club\nWHERE Nombre ='),
+            OracleStatusCode.EXECUTE_USER_CODE)
+        self.assertEqual(excp.position[0], 2)
+        self.assert_executor_exception(lambda: executor.execute_select_test(init_db, 'SELECT * FROM Nada'),
+                                       OracleStatusCode.EXECUTE_USER_CODE)
+        self.assert_executor_exception(lambda: executor.execute_select_test(init_db, 'SELECT 1 FROM DUAL; SELECT 2'),
+                                       OracleStatusCode.NUMBER_STATEMENTS)
+        for stmt in ['COMMIT', 'SET statement_timeout = 0', 'ALTER SESSION SET NLS_LANGUAGE = SPANISH']:
+            self.assert_executor_exception(lambda stmt=stmt: executor.execute_select_test(init_db, stmt),
+                                           OracleStatusCode.EXECUTE_USER_CODE)
+
+        # Time limit exceeded: too many rows or columns, and too slow queries
+        max_rows = int(os.environ['ORACLE_MAX_ROWS'])
+        self.assert_executor_exception(
+            lambda: executor.execute_select_test(init_db, f'SELECT * FROM generate_series(0, {max_rows})'),
+            OracleStatusCode.TLE_USER_CODE)
+        many_cols = 'SELECT ' + ', '.join(['1'] * (int(os.environ['ORACLE_MAX_COLS']) + 1)) + ' FROM DUAL'
+        self.assert_executor_exception(lambda: executor.execute_select_test(init_db, many_cols),
+                                       OracleStatusCode.TLE_USER_CODE)
+        stmt_timeout = executor.stmt_timeout
+        try:
+            executor.stmt_timeout = 100
+            self.assert_executor_exception(
+                lambda: executor.execute_select_test(init_db, 'SELECT pg_sleep(1) FROM DUAL'),
+                OracleStatusCode.TLE_USER_CODE)
+            # The statement is cancelled even if the user code disables the timeout
+            self.assert_executor_exception(
+                lambda: executor.execute_select_test(
+                    init_db, "SELECT set_config('statement_timeout', '0', true), pg_sleep(1) FROM DUAL"),
+                OracleStatusCode.TLE_USER_CODE)
+        finally:
+            executor.stmt_timeout = stmt_timeout
+
+        # The user code runs without privileges
+        self.assert_executor_exception(
+            lambda: executor.execute_select_test(init_db, "SELECT pg_read_file('/etc/passwd') FROM DUAL"),
+            OracleStatusCode.EXECUTE_USER_CODE)
+
+    def test_roles(self):
+        """The executor refuses to judge with privileged PostgreSQL users"""
+        previous = os.environ.get('POSTGRES_JUDGE_USER')
+        try:
+            os.environ['POSTGRES_JUDGE_USER'] = os.environ['PG_USER']
+            with self.assertRaises(ImproperlyConfigured):
+                PostgresExecutor()
+        finally:
+            if previous is None:
+                del os.environ['POSTGRES_JUDGE_USER']
+            else:
+                os.environ['POSTGRES_JUDGE_USER'] = previous
+
+        executor = PostgresExecutor.get()
+        sandbox_params = executor.sandbox_params
+        try:
+            # The user of Django is a superuser
+            executor.sandbox_params = dict(sandbox_params, user=os.environ['PG_USER'], password=os.environ['PG_PASS'])
+            with self.assertRaises(ImproperlyConfigured):
+                executor.check_roles()
+        finally:
+            executor.sandbox_params = sandbox_params
+
+    def test_sandboxes(self):
+        """Sandboxes are recycled with a rollback and template databases are evicted in LRU order"""
+        executor = PostgresExecutor.get()
+        max_templates, max_sandboxes = executor.max_templates, executor.max_sandboxes
+        try:
+            executor.max_templates, executor.max_sandboxes = 1, 1
+            executor.execute_dml_test((self.CREATE, self.INSERT), 'DROP TABLE Jugador')
+            template = next(iter(executor.templates.values()))
+            self.assertEqual(len(template['idle']), 1)
+            sandbox = template['idle'][0]
+            # Submissions do not modify the sandbox
+            res = executor.execute_select_test((self.CREATE, self.INSERT), 'SELECT COUNT(*) AS n FROM Jugador')
+            self.assertEqual(res['result']['rows'], [[1]])
+            self.assertIs(template['idle'][0], sandbox)
+
+            # Broken sandboxes are dropped
+            template['idle'][0][1].close()
+            executor.execute_select_test((self.CREATE, self.INSERT), 'SELECT * FROM Club')
+            self.assertIsNot(template['idle'][0], sandbox)
+
+            executor.execute_select_test((self.CREATE, ''), 'SELECT * FROM Club')
+            self.assertEqual(len(executor.templates), 1)
+            self.assertEqual(template['idle'], [])
+        finally:
+            executor.max_templates, executor.max_sandboxes = max_templates, max_sandboxes
+            executor.close()
+        self.assertEqual(len(executor.templates), 0)
+
+        # Concurrent submissions to a new problem build its template only once
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            results = list(pool.map(lambda _: executor.execute_select_test((self.CREATE, self.INSERT),
+                                                                           'SELECT COUNT(*) AS n FROM Club'), range(8)))
+        self.assertEqual([res['result']['rows'] for res in results], [[[2]]] * 8)
+        self.assertEqual(len(executor.templates), 1)
+        self.assertEqual(executor.build_locks, {})
+        executor.close()
+
+        # Errors when building the database of the problem
+        self.assert_executor_exception(
+            lambda: executor.execute_select_test(('CREATE TABLE t (a NUMBER', ''), 'SELECT * FROM t'),
+            OracleStatusCode.EXECUTE_CREATE)
+        self.assert_executor_exception(
+            lambda: executor.execute_select_test(('CREATE TABLE t (a NUMBER PRIMARY KEY);',
+                                                  'INSERT INTO t VALUES (1); INSERT INTO t VALUES (1);'),
+                                                 'SELECT * FROM t'),
+            OracleStatusCode.EXECUTE_INSERT)
+        self.assertEqual(executor.build_locks, {})
+        max_tables = int(os.environ['ORACLE_MAX_TABLES'])
+        create = ' '.join(f'CREATE TABLE t{i} (a NUMBER);' for i in range(max_tables + 1))
+        self.assert_executor_exception(lambda: executor.execute_select_test((create, ''), 'SELECT 1 FROM DUAL',
+                                                                            output_db=True),
+                                       OracleStatusCode.TLE_USER_CODE)
+
+    def test_dml_discriminant(self):
+        """DML and discriminant tests in PostgreSQL"""
+        executor = PostgresExecutor.get()
+        init_db = (self.CREATE, self.INSERT)
+        res = executor.execute_dml_test(init_db, "DELETE FROM Jugador;\nUPDATE Club SET Num_Socios = Num_Socios + 1",
+                                        min_stmt=1, max_stmt=2)
+        self.assertEqual(res['pre']['JUGADOR']['rows'], [[1, '11111111X', 1000.5]])
+        self.assertEqual(res['post']['JUGADOR']['rows'], [])
+        self.assertEqual(sorted(row[2] for row in res['post']['CLUB']['rows']), [70001, 80001])
+        self.assertIsNone(res['fingerprint'])
+        self.assertEqual(executor.execute_dml_test(init_db, 'DELETE FROM Jugador', pre_db=False)['pre'], {})
+
+        self.assert_executor_exception(lambda: executor.execute_dml_test(init_db, 'DELETE FROM Jugador', min_stmt=2,
+                                                                         max_stmt=2),
+                                       OracleStatusCode.NUMBER_STATEMENTS)
+        self.assert_executor_exception(lambda: executor.execute_dml_test(init_db, "DELETE FROM Club"),
+                                       OracleStatusCode.EXECUTE_USER_CODE)
+
+        res = executor.execute_discriminant_test(init_db, "INSERT INTO Club VALUES ('3', 'Otro', 0)",
+                                                 ('SELECT Nombre FROM Club', 'SELECT Nombre FROM Club '
+                                                                             'WHERE Num_Socios > 0'))
+        self.assertEqual(len(res['result_correct']['rows']), 3)
+        self.assertEqual(len(res['result_incorrect']['rows']), 2)
+        self.assert_executor_exception(
+            lambda: executor.execute_discriminant_test(init_db, "INSERT INTO Club VALUES ('3', 'Otro', -1)",
+                                                       ('SELECT * FROM Club', 'SELECT * FROM Club')),
+            OracleStatusCode.EXECUTE_USER_CODE)
+
+        self.assertEqual(executor.run_in_order([lambda: 1, lambda: -2, lambda: 3], failed=lambda res: res < 0),
+                         [1, -2])
+        self.assertEqual(executor.run_in_order([lambda: 1, lambda: 2]), [1, 2])
+
+    def test_problems(self):
+        """Problems of collections that use PostgreSQL are judged in sandboxes"""
+        collection = Collection(name_md='PostgreSQL', description_md='Colección en PostgreSQL',
+                                engine=ExecutionEngine.POSTGRES)
+        collection.save()
+        problem = SelectProblem(title_md='PostgreSQL', text_md='bla', create_sql=self.CREATE, insert_sql=self.INSERT,
+                                collection=collection, author=None, solution='SELECT Nombre FROM Club')
+        problem.clean()
+        problem.save()
+        self.assertIs(problem.executor(), PostgresExecutor.get())
+        self.assertEqual(problem.judge('SELECT Nombre FROM Club ORDER BY CIF DESC', problem.executor())[0],
+                         VerdictCode.AC)
+        self.assertEqual(problem.judge('SELECT CIF FROM Club', problem.executor())[0], VerdictCode.WA)
+
+        problem = DMLProblem(title_md='PostgreSQL', text_md='bla', create_sql=self.CREATE, insert_sql=self.INSERT,
+                             collection=collection, author=None, solution='DELETE FROM Jugador WHERE Sueldo > 1000')
+        problem.clean()
+        problem.save()
+        self.assertEqual(problem.judge('DELETE FROM Jugador', problem.executor())[0], VerdictCode.AC)
+
+        problem = DiscriminantProblem(title_md='PostgreSQL', text_md='bla', create_sql=self.CREATE,
+                                      insert_sql=self.INSERT, collection=collection, author=None,
+                                      correct_query='SELECT * FROM Club',
+                                      incorrect_query='SELECT * FROM Club WHERE Num_Socios > 0')
+        problem.clean()
+        problem.save()
+        self.assertEqual(problem.judge("INSERT INTO Club VALUES ('3', 'Otro', 0)", problem.executor())[0],
+                         VerdictCode.AC)
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright Enrique Martín <emartinm@ucm.es> 2020
+
+Unit tests for the local pre-screening of submissions
+"""
+import os
+
+from django.test import TestCase
+
+from judge.exceptions import ExecutorException
+from judge.judging import judge_code
+from judge.models import SelectProblem, DMLProblem, FunctionProblem, Collection
+from judge.prescreen import prescreen
+from judge.types import OracleStatusCode, VerdictCode, ExecutionEngine
+
+
+class PrescreenTest(TestCase):
+    """Tests for module prescreen"""
+    INITIAL_DB = [{'CLUB': {'header': [['CIF', 'CHAR'], ['NOMBRE', 'VARCHAR2']], 'rows': []},
+                   'JUGADOR': {'header': [['ID', 'NUMBER'], ['CLUB', 'CHAR']], 'rows': []}}]
+
+    def assert_prescreen(self, problem, code, status_code=None, message=None, position=None):
+        """Checks that prescreen accepts 'code' if 'status_code' is None, otherwise that it raises an
+        ExecutorException with that status code, message and position"""
+        if status_code is None:
+            self.assertIsNone(prescreen(problem, code))
+            return
+        with self.assertRaises(ExecutorException) as ctx:
+            prescreen(problem, code)
+        self.assertEqual(ctx.exception.error_code, status_code)
+        if message is not None:
+            self.assertEqual((ctx.exception.message, ctx.exception.position), (message, position))
+
+    def test_select(self):
+        """Wrong number of statements and unknown tables and columns are detected in SELECT problems"""
+        problem = SelectProblem(initial_db=self.INITIAL_DB)
+        self.assert_prescreen(problem, 'SELECT 1 FROM DUAL; SELECT 2 FROM DUAL', OracleStatusCode.NUMBER_STATEMENTS)
+        self.assert_prescreen(problem, '-- Nada', OracleStatusCode.NUMBER_STATEMENTS)
+        self.assert_prescreen(problem, 'SELECT *\nFROM Clubs', OracleStatusCode.EXECUTE_USER_CODE,
+                              'ORA-00942: table or view does not exist', (1, 5))
+        self.assert_prescreen(problem, 'SELECT c.nombres FROM Club c', OracleStatusCode.EXECUTE_USER_CODE,
+                              'ORA-00904: "C"."NOMBRES": invalid identifier', (0, 7))
+        self.assert_prescreen(problem, "SELECT nombre FROM Club WHERE cif = 'x' OR id2 > 1",
+                              OracleStatusCode.EXECUTE_USER_CODE, 'ORA-00904: "ID2": invalid identifier', (0, 43))
+
+        # Code that can be correct, or that only Oracle can assess
+        for code in ['SELECT nombre n FROM Club ORDER BY n', 'SELECT table_name FROM user_tables',
+                     'SELECT sysdate, rownum, dummy FROM dual',
+                     'WITH w(a) AS (SELECT nombre FROM Club) SELECT a FROM w',
+                     'SELECT * FROM Club c WHERE EXISTS (SELECT 1 FROM Jugador c WHERE c.id = 1)',
+                     'SELECT x.nombre FROM (SELECT nombre FROM Club) x', 'SELECT C.Nombre FROM Club c',
+                     'SELECT * FROM otro.Club', 'SELECT FROM Club WHERE', 'SELECT a FROM t WHERE a = 1 +',
+                     'SELECT c.ROWID, c.ORA_ROWSCN FROM Club c', 'SELECT club.rowid FROM Club',
+                     "SELECT * FROM TABLE(sys.odcivarchar2list('a'))",
+                     "SELECT t.column_value FROM TABLE(sys.odcivarchar2list('a')) t"]:
+            self.assert_prescreen(problem, code)
+
+        # Not checked without initial DB or in other engines
+        self.assert_prescreen(SelectProblem(), 'SELECT 1 FROM DUAL; SELECT 2 FROM DUAL')
+        collection = Collection(name_md='PostgreSQL', description_md='Colección en PostgreSQL',
+                                engine=ExecutionEngine.POSTGRES)
+        collection.save()
+        problem.collection = collection
+        self.assert_prescreen(problem, 'SELECT 1 FROM DUAL; SELECT 2 FROM DUAL')
+
+    def test_dml(self):
+        """Only the first DML statement is checked, as Oracle could fail when executing it"""
+        problem = DMLProblem(initial_db=self.INITIAL_DB, min_stmt=1, max_stmt=2)
+        self.assert_prescreen(problem, 'DELETE FROM Club; DELETE FROM Club; DELETE FROM Club',
+                              OracleStatusCode.NUMBER_STATEMENTS)
+        self.assert_prescreen(problem, 'DELETE FROM Equipo', OracleStatusCode.EXECUTE_USER_CODE)
+        self.assert_prescreen(problem, "INSERT INTO Club VALUES ('1', 'a'); DELETE FROM Equipo")
+        self.assert_prescreen(problem, 'CREATE TABLE Equipo (a NUMBER); DELETE FROM Equipo')
+        self.assert_prescreen(FunctionProblem(initial_db=self.INITIAL_DB), 'SELECT * FROM Equipo')
+
+    def test_other_objects(self):
+        """Problems whose creation script defines views, synonyms or other objects are not checked, as those objects
+        are not in the initial DB"""
+        create_sql = 'CREATE TABLE Club (cif CHAR(9), nombre VARCHAR2(40));'
+        problem = SelectProblem(initial_db=self.INITIAL_DB, create_sql=create_sql)
+        self.assert_prescreen(problem, 'SELECT * FROM Equipos', OracleStatusCode.EXECUTE_USER_CODE)
+        for extra in ['CREATE VIEW Equipos AS SELECT * FROM Club;', 'CREATE SYNONYM Equipos FOR Club;',
+                      'CREATE SEQUENCE Equipos;', 'CREATE TABLE (']:
+            problem = SelectProblem(initial_db=self.INITIAL_DB, create_sql=create_sql + extra)
+            self.assert_prescreen(problem, 'SELECT * FROM Equipos')
+            self.assert_prescreen(problem, 'SELECT 1 FROM DUAL; SELECT 2 FROM DUAL', OracleStatusCode.NUMBER_STATEMENTS)
+
+    def test_judge_code(self):
+        """Submissions rejected by the pre-screening obtain VE and RE verdicts without Oracle"""
+        problem = SelectProblem(initial_db=self.INITIAL_DB)
+        try:
+            os.environ['JUDGE_PRESCREEN'] = '1'
+            self.assertEqual(judge_code(problem, 'SELECT 1 FROM DUAL; SELECT 2 FROM DUAL')['verdict'],
+                             VerdictCode.VE)
+            data = judge_code(problem, 'SELECT * FROM Clubs')
+            self.assertEqual((data['verdict'], data['feedback']),
+                             (VerdictCode.RE, 'ORA-00942: table or view does not exist'))
+        finally:
+            del os.environ['JUDGE_PRESCREEN']
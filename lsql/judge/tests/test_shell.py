@@ -15,7 +15,7 @@ from django.contrib.auth.models import Group
 
 from judge.types import VerdictCode
 from judge.models import SelectProblem, DMLProblem, FunctionProblem, ProcProblem, TriggerProblem, Collection, \
-    Problem, Submission
+    Problem, Submission, JudgeJob
 from judge.shell import create_users_from_csv, adapt_db_result_to_list, rejudge, extended_submissions, \
     submissions_per_user, create_users_from_list, is_projection, is_where, is_aggregation, is_order, is_inner_join, \
     is_outer_join, is_group_by, is_set, is_having, is_nested, is_null, is_exists, is_like, keywords, apply_sql_checker
@@ -200,13 +200,25 @@ class ShellTest(TestCase):
 
         file_desc, filename = mkstemp('_rejudge')
         os.close(file_desc)  # To avoid problems when removing the file in Windows
-        rejudge(VerdictCode.IE, filename, tests=True)
+        rejudge(VerdictCode.IE, filename)
         with open(filename, 'r', encoding='utf-8') as summary_file:
             summary = summary_file.read()
             self.assertIn('IE --> AC', summary)
             self.assertIn('IE --> WA', summary)
             self.assertIn('IE --> RE', summary)
             self.assertNotIn('IE --> IE', summary)
+
+        # Submissions are judged directly, also when the submit view uses the judge queue
+        try:
+            os.environ['JUDGE_QUEUE'] = '1'
+            rejudge(VerdictCode.IE, filename)
+        finally:
+            del os.environ['JUDGE_QUEUE']
+        with open(filename, 'r', encoding='utf-8') as summary_file:
+            summary = summary_file.read()
+            for change in ["'IE --> AC': 1", "'IE --> WA': 1", "'IE --> RE': 1"]:
+                self.assertIn(change, summary)
+        self.assertFalse(JudgeJob.objects.exists())
         os.remove(filename)
 
     def test_submission_info_csv(self):
@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright Enrique Martín <emartinm@ucm.es> 2020
+
+Unit tests for the SQLite executor
+"""
+from concurrent.futures import ThreadPoolExecutor
+import functools
+import os
+import sqlite3
+import tempfile
+
+from django.core.exceptions import ValidationError
+from django.test import TestCase
+
+from judge.sqlite_driver import SQLiteExecutor, sqlite_value
+from judge.oracle_driver import OracleExecutor
+from judge.models import Collection, SelectProblem, DMLProblem, DiscriminantProblem, FunctionProblem
+from judge.types import VerdictCode, OracleStatusCode, ExecutionEngine
+from judge.exceptions import ExecutorException
+
+
+class SQLiteTest(TestCase):
+    """Tests for module sqlite_driver"""
+    CREATE = """CREATE TABLE Club(
+                    CIF CHAR(9) PRIMARY KEY,
+                    Nombre VARCHAR2(40) NOT NULL UNIQUE,
+                    Num_Socios NUMBER(10,0) NOT NULL,
+                    CONSTRAINT NumSociosPositivos CHECK (Num_Socios >= 0)
+                );
+                CREATE TABLE Jugador(
+                    ID NUMBER PRIMARY KEY,
+                    Club CHAR(9) REFERENCES Club,
+                    Sueldo NUMBER(8,2)
+                );"""
+    INSERT = """INSERT INTO Club VALUES ('11111111X', 'Real Madrid CF', 70000);
+                INSERT INTO Club VALUES ('11111112X', 'Futbol Club Barcelona', 80000);
+                INSERT INTO Jugador VALUES (1, '11111111X', 1000.5);"""
+
+    def assert_executor_exception(self, function, status_code):
+        """Checks if executing the nullary function raises an ExecutorException with the expected status_code"""
+        with self.assertRaises(ExecutorException) as ctx:
+            function()
+        self.assertEqual(ctx.exception.error_code, status_code)
+        return ctx.exception
+
+    def test_select(self):
+        """SELECT statements are transpiled from Oracle and executed in a copy of the problem database"""
+        executor = SQLiteExecutor.get()
+        init_db = (self.CREATE, self.INSERT)
+        res = executor.execute_select_test(init_db, "SELECT Nombre, NVL(Num_Socios, 0) AS socios FROM Club "
+                                                    "WHERE Num_Socios > 1000 ORDER BY socios DESC", output_db=True)
+        self.assertEqual(res['result'], {'header': [['NOMBRE', 'ANY'], ['SOCIOS', 'ANY']],
+                                         'rows': [['Futbol Club Barcelona', 80000], ['Real Madrid CF', 70000]]})
+        self.assertEqual(sorted(res['db']), ['CLUB', 'JUGADOR'])
+        self.assertEqual(res['db']['CLUB']['header'], [['CIF', 'TEXT'], ['NOMBRE', 'TEXT'], ['NUM_SOCIOS', 'REAL']])
+        self.assertEqual(res['db']['JUGADOR']['rows'], [[1, '11111111X', 1000.5]])
+
+        res = executor.execute_select_test(init_db, "SELECT 'a' || 'b', 3.0 FROM DUAL")
+        self.assertEqual(res['result']['rows'], [['ab', 3]])
+        self.assertIsNone(res['db'])
+        self.assertEqual(sqlite_value(b'\x0a\xff'), '0AFF')
+        res = executor.execute_select_test(init_db, 'CREATE VIEW V AS SELECT * FROM Club')
+        self.assertEqual(res['result'], {'header': [], 'rows': []})
+
+        # Errors in the user code
+        excp = self.assert_executor_exception(
+            lambda: executor.execute_select_test(init_db, 'SELECT *\nFROM Club\nWHERE Nombre ='),
+            OracleStatusCode.EXECUTE_USER_CODE)
+        self.assertEqual(excp.position[0], 2)
+        self.assertNotIn('\x1b', excp.message)
+        self.assert_executor_exception(lambda: executor.execute_select_test(init_db, 'SELECT * FROM Nada'),
+                                       OracleStatusCode.EXECUTE_USER_CODE)
+        self.assert_executor_exception(  # Features of Oracle not supported in SQLite
+            lambda: executor.execute_select_test(init_db, 'SELECT * FROM Club c, Jugador j WHERE c.CIF = j.Club(+)'),
+            OracleStatusCode.EXECUTE_USER_CODE)
+        self.assert_executor_exception(lambda: executor.execute_select_test(init_db, 'SELECT 1 FROM DUAL; SELECT 2'),
+                                       OracleStatusCode.NUMBER_STATEMENTS)
+
+        # Time limit exceeded: too many rows or columns, and too slow queries
+        max_rows = int(os.environ['ORACLE_MAX_ROWS'])
+        many_rows = f'''WITH RECURSIVE r(n) AS (SELECT 1 FROM DUAL UNION ALL SELECT n + 1 FROM r WHERE n <= {max_rows})
+                        SELECT n FROM r'''
+        self.assert_executor_exception(lambda: executor.execute_select_test(init_db, many_rows),
+                                       OracleStatusCode.TLE_USER_CODE)
+        many_cols = 'SELECT ' + ', '.join(['1'] * (int(os.environ['ORACLE_MAX_COLS']) + 1)) + ' FROM DUAL'
+        self.assert_executor_exception(lambda: executor.execute_select_test(init_db, many_cols),
+                                       OracleStatusCode.TLE_USER_CODE)
+        endless = '''WITH RECURSIVE r(n) AS (SELECT 1 FROM DUAL UNION ALL SELECT n + 1 FROM r)
+                     SELECT COUNT(*) FROM r'''
+        self.assert_executor_exception(lambda: executor.execute_select_test(init_db, endless),
+                                       OracleStatusCode.TLE_USER_CODE)
+
+    def test_database_images(self):
+        """The database of each problem is built once, keeping the most recently used ones"""
+        executor = SQLiteExecutor.get()
+        max_images = executor.max_images
+        try:
+            executor.max_images = 1
+            executor.execute_select_test((self.CREATE, self.INSERT), 'SELECT * FROM Club')
+            executor.execute_dml_test((self.CREATE, self.INSERT), "DELETE FROM Jugador")
+            self.assertEqual(len(executor.images), 1)
+            # Submissions do not modify the image
+            res = executor.execute_select_test((self.CREATE, self.INSERT), 'SELECT COUNT(*) FROM Jugador')
+            self.assertEqual(res['result']['rows'], [[1]])
+            executor.execute_select_test((self.CREATE, ''), 'SELECT * FROM Club')
+            self.assertEqual(len(executor.images), 1)
+        finally:
+            executor.max_images = max_images
+
+        # Concurrent submissions to a new problem build its image only once
+        create = self.CREATE + ' CREATE TABLE Otra (a NUMBER);'
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            results = list(pool.map(lambda _: executor.execute_select_test((create, self.INSERT),
+                                                                           'SELECT COUNT(*) FROM Club'), range(8)))
+        self.assertEqual([res['result']['rows'] for res in results], [[[2]]] * 8)
+        self.assertEqual(executor.build_locks, {})
+
+        # Errors when building the database of the problem
+        self.assert_executor_exception(
+            lambda: executor.execute_select_test(('CREATE TABLE t (a NUMBER', ''), 'SELECT * FROM t'),
+            OracleStatusCode.EXECUTE_CREATE)
+        self.assert_executor_exception(
+            lambda: executor.execute_select_test(('CREATE TABLE t (a NUMBER PRIMARY KEY);',
+                                                  'INSERT INTO t VALUES (1); INSERT INTO t VALUES (1);'),
+                                                 'SELECT * FROM t'),
+            OracleStatusCode.EXECUTE_INSERT)
+        self.assertEqual(executor.build_locks, {})
+        max_tables = int(os.environ['ORACLE_MAX_TABLES'])
+        create = ' '.join(f'CREATE TABLE t{i} (a NUMBER);' for i in range(max_tables + 1))
+        self.assert_executor_exception(lambda: executor.execute_select_test((create, ''), 'SELECT 1 FROM DUAL',
+                                                                            output_db=True),
+                                       OracleStatusCode.TLE_USER_CODE)
+
+    def test_dml_discriminant(self):
+        """DML and discriminant tests in SQLite"""
+        executor = SQLiteExecutor.get()
+        init_db = (self.CREATE, self.INSERT)
+        res = executor.execute_dml_test(init_db, "DELETE FROM Jugador;\nUPDATE Club SET Num_Socios = Num_Socios + 1",
+                                        min_stmt=1, max_stmt=2)
+        self.assertEqual(res['pre']['JUGADOR']['rows'], [[1, '11111111X', 1000.5]])
+        self.assertEqual(res['post']['JUGADOR']['rows'], [])
+        self.assertEqual(sorted(row[2] for row in res['post']['CLUB']['rows']), [70001, 80001])
+        self.assertIsNone(res['fingerprint'])
+        self.assertEqual(executor.execute_dml_test(init_db, 'DELETE FROM Jugador', pre_db=False)['pre'], {})
+
+        self.assert_executor_exception(lambda: executor.execute_dml_test(init_db, 'DELETE FROM Jugador', min_stmt=2,
+                                                                         max_stmt=2),
+                                       OracleStatusCode.NUMBER_STATEMENTS)
+        # Foreign keys are checked as in Oracle
+        self.assert_executor_exception(lambda: executor.execute_dml_test(init_db, "DELETE FROM Club"),
+                                       OracleStatusCode.EXECUTE_USER_CODE)
+
+        res = executor.execute_discriminant_test(init_db, "INSERT INTO Club VALUES ('3', 'Otro', 0)",
+                                                 ('SELECT Nombre FROM Club', 'SELECT Nombre FROM Club '
+                                                                             'WHERE Num_Socios > 0'))
+        self.assertEqual(len(res['result_correct']['rows']), 3)
+        self.assertEqual(len(res['result_incorrect']['rows']), 2)
+        self.assert_executor_exception(
+            lambda: executor.execute_discriminant_test(init_db, "INSERT INTO Club VALUES ('3', 'Otro', -1)",
+                                                       ('SELECT * FROM Club', 'SELECT * FROM Club')),
+            OracleStatusCode.EXECUTE_USER_CODE)
+
+        # Tasks are run in sequence, stopping at the first failed one
+        self.assertEqual(executor.run_in_order([lambda: 1, lambda: -2, lambda: 3], failed=lambda res: res < 0),
+                         [1, -2])
+        self.assertEqual(executor.run_in_order([lambda: 1, lambda: 2]), [1, 2])
+
+    def test_forbidden_statements(self):
+        """User code cannot access files of the server or change the configuration of the database"""
+        executor = SQLiteExecutor.get()
+        init_db = (self.CREATE, self.INSERT)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'copy.db')
+            for code in [f"VACUUM INTO '{path}'", f"ATTACH DATABASE '{path}' AS copy", 'PRAGMA foreign_keys = OFF',
+                         f"DELETE FROM Jugador; VACUUM INTO '{path}'"]:
+                self.assert_executor_exception(functools.partial(executor.execute_dml_test, init_db, code),
+                                               OracleStatusCode.EXECUTE_USER_CODE)
+                self.assert_executor_exception(
+                    functools.partial(executor.execute_select_test, init_db, code.split(';')[-1]),
+                    OracleStatusCode.EXECUTE_USER_CODE)
+                self.assert_executor_exception(
+                    functools.partial(executor.execute_discriminant_test, init_db, code, ('SELECT 1 FROM DUAL',) * 2),
+                    OracleStatusCode.EXECUTE_USER_CODE)
+            # The authorizer of the connections also denies them if they get through sqlglot
+            conn = SQLiteExecutor.connect()
+            for code in [f"VACUUM INTO '{path}'", f"ATTACH DATABASE '{path}' AS copy", 'PRAGMA foreign_keys = OFF']:
+                with self.assertRaises(sqlite3.DatabaseError):
+                    conn.execute(code)
+            conn.close()
+            self.assertEqual(os.listdir(directory), [])
+
+    def test_problems(self):
+        """Problems of collections that use SQLite are judged in-process"""
+        collection = Collection(name_md='SQLite', description_md='Colección en SQLite', engine=ExecutionEngine.SQLITE)
+        collection.save()
+        problem = SelectProblem(title_md='SQLite', text_md='bla', create_sql=self.CREATE, insert_sql=self.INSERT,
+                                collection=collection, author=None, solution='SELECT Nombre FROM Club')
+        problem.clean()
+        problem.save()
+        self.assertIs(problem.executor(), SQLiteExecutor.get())
+        self.assertEqual(problem.initial_db[0]['CLUB']['header'][0], ['CIF', 'TEXT'])
+        self.assertEqual(problem.judge('SELECT Nombre FROM Club ORDER BY CIF DESC', problem.executor())[0],
+                         VerdictCode.AC)
+        self.assertEqual(problem.judge('SELECT CIF FROM Club', problem.executor())[0], VerdictCode.WA)
+
+        problem = DMLProblem(title_md='SQLite', text_md='bla', create_sql=self.CREATE, insert_sql=self.INSERT,
+                             collection=collection, author=None, solution='DELETE FROM Jugador WHERE Sueldo > 1000')
+        problem.clean()
+        problem.save()
+        self.assertEqual(problem.judge('DELETE FROM Jugador', problem.executor())[0], VerdictCode.AC)
+        self.assertEqual(problem.judge('DELETE FROM Jugador WHERE Sueldo < 1000', problem.executor())[0],
+                         VerdictCode.WA)
+
+        problem = DiscriminantProblem(title_md='SQLite', text_md='bla', create_sql=self.CREATE,
+                                      insert_sql=self.INSERT, collection=collection, author=None,
+                                      correct_query='SELECT * FROM Club',
+                                      incorrect_query='SELECT * FROM Club WHERE Num_Socios > 0')
+        problem.clean()
+        problem.save()
+        self.assertEqual(problem.judge("INSERT INTO Club VALUES ('3', 'Otro', 0)", problem.executor())[0],
+                         VerdictCode.AC)
+
+        # Types of problems not supported by SQLite use Oracle
+        problem = FunctionProblem(title_md='Oracle', text_md='bla', create_sql='', insert_sql='',
+                                  collection=collection, author=None, calls='f(1)',
+                                  solution='CREATE OR REPLACE FUNCTION f(x NUMBER) RETURN NUMBER IS BEGIN RETURN x; '
+                                           'END;')
+        self.assertIs(problem.executor(), OracleExecutor.get())
+        self.assertIs(SelectProblem(solution='SELECT 1 FROM DUAL').executor(), OracleExecutor.get())
+
+        # The engine cannot change once the collection has problems, as they have been validated with it
+        collection.engine = ExecutionEngine.ORACLE
+        with self.assertRaises(ValidationError):
+            collection.clean()
+        collection.engine = ExecutionEngine.SQLITE
+        collection.clean()
@@ -2,13 +2,15 @@
 """
 Unit tests for the submits
 """
+import asyncio
 import os
 
 from django.test import TestCase, Client
 from django.urls import reverse
 from judge.models import FunctionProblem, ProcProblem, TriggerProblem, \
     NumSubmissionsProblemsAchievementDefinition, ObtainedAchievement, NumSolvedTypeAchievementDefinition, \
-    SelectProblem
+    SelectProblem, Problem, JudgeJob, Submission
+from judge.judging import run_worker, judge_job, judge_code, judge_code_async, purge_done_jobs
 from judge.tests.test_common import create_collection, create_user, create_select_problem, create_dml_problem, \
     create_discriminant_problem, TestPaths
 from judge.types import VerdictCode, ProblemType
@@ -269,3 +271,75 @@ class SubmitTest(TestCase):
         # The user submits a new solution and does not receive any achievement
         response = client.post(submit_select_url, {'code': 'MAL'}, follow=True)  # Validation Error, too short
         self.assertNotIn('achievements', response.json())
+
+    def test_judge_code_async(self):
+        """Submissions judged concurrently in the threads of the async view obtain the same verdicts as in the
+        sync path"""
+        collection = create_collection('Colleccion de prueba XYZ')
+        problem = create_select_problem(collection, 'SelectProblem ABC DEF')
+        codes = [problem.solution, 'SELECT * FROM Nada', 'SELECT 1 FROM DUAL; SELECT 2 FROM DUAL']
+
+        async def judge_all():
+            return await asyncio.gather(*[judge_code_async(problem, code) for code in codes])
+
+        verdicts = [data['verdict'] for data in asyncio.run(judge_all())]
+        self.assertEqual(verdicts, [VerdictCode.AC, VerdictCode.RE, VerdictCode.VE])
+        self.assertEqual(verdicts, [judge_code(problem, code)['verdict'] for code in codes])
+
+    def test_judge_queue(self):
+        """With the judge queue enabled, submissions are judged by workers and their status is polled"""
+        client = Client()
+        collection = create_collection('Colleccion de prueba XYZ')
+        problem = create_select_problem(collection, 'SelectProblem ABC DEF')
+        user = create_user('5555', 'tamara')
+        create_user('5555', 'otro', 'otro@ucm.es')
+        client.login(username='tamara', password='5555')  # nosec B106
+        submit_url = reverse('judge:submit', args=[problem.pk])
+        try:
+            os.environ['JUDGE_QUEUE'] = '1'
+            response = client.post(submit_url, {'code': problem.solution}, follow=True).json()
+            # Validation errors do not need to be queued
+            self.assertEqual(client.post(submit_url, {'code': 'MAL'}, follow=True).json()['verdict'], VerdictCode.VE)
+        finally:
+            del os.environ['JUDGE_QUEUE']
+        self.assertEqual(client.get(response['status']).json(), {'job': response['job'], 'state': 'PENDING'})
+        self.assertEqual(Submission.objects.filter(user=user, verdict_code=VerdictCode.AC).count(), 0)
+
+        self.assertEqual(run_worker(max_jobs=5), 1)
+        status = client.get(response['status']).json()
+        self.assertEqual(status['verdict'], VerdictCode.AC)
+        self.assertNotIn('state', status)
+        job = JudgeJob.objects.get(pk=response['job'])
+        self.assertEqual(job.submission.verdict_code, VerdictCode.AC)
+        self.assertIn('tamara', str(job))
+
+        # Only the author of the submission can see its status
+        client.logout()
+        client.login(username='otro', password='5555')  # nosec B106
+        self.assertEqual(client.get(response['status']).status_code, 404)
+
+        # Running jobs are claimed again after the timeout, and the result of the first worker is discarded
+        job = JudgeJob(code=problem.solution, user=user, problem=problem)
+        job.save()
+        claimed = JudgeJob.claim(300)
+        self.assertEqual(claimed.pk, job.pk)
+        self.assertIsNone(JudgeJob.claim(300))
+        self.assertEqual(JudgeJob.claim(-1).pk, job.pk)
+        self.assertFalse(judge_job(claimed))
+        self.assertEqual(run_worker(max_jobs=1), 0)
+
+        # Unexpected errors when judging are internal errors
+        base_problem = Problem(title_md='Base', text_md='bla', collection=collection)
+        base_problem.save()
+        job = JudgeJob(code='SELECT * FROM test', user=user, problem=base_problem)
+        job.save()
+        self.assertEqual(run_worker(max_jobs=1), 1)
+        job.refresh_from_db()
+        self.assertEqual(job.result['verdict'], VerdictCode.IE)
+        self.assertEqual(job.state, JudgeJob.State.DONE)
+
+        # Judged jobs are deleted after the retention period, keeping their submissions
+        self.assertEqual(purge_done_jobs(3600), 0)
+        self.assertEqual(purge_done_jobs(-1), 2)
+        self.assertFalse(JudgeJob.objects.filter(state=JudgeJob.State.DONE).exists())
+        self.assertEqual(Submission.objects.filter(user=user, verdict_code=VerdictCode.AC).count(), 1)
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright Enrique Martín <emartinm@ucm.es> 2020
+
+Unit tests for the verdict cache
+"""
+import os
+
+from django.test import TestCase
+from django.utils import translation
+
+from judge.judging import judge_code
+from judge.tests.test_common import create_collection, create_select_problem
+from judge.types import VerdictCode
+from judge.verdict_cache import normalize_code, verdict_cache, VerdictCache
+import judge.verdict_cache
+
+
+class VerdictCacheTest(TestCase):
+    """Tests for module verdict_cache"""
+
+    def test_normalize_code(self):
+        """Comments, spacing and case of identifiers are removed, but not the case of literals or the text of
+        expressions that name columns"""
+        self.assertEqual(normalize_code("select  nombre, 'Hola  Mundo' as x -- comentario\n from Club /* c */;"),
+                         normalize_code("SELECT NOMBRE,\n'Hola  Mundo' X FROM club"))
+        self.assertNotEqual(normalize_code("SELECT 'hola' AS x FROM Club"),
+                            normalize_code("SELECT 'HOLA' AS x FROM Club"))
+        self.assertNotEqual(normalize_code('SELECT "a" FROM Club'), normalize_code('SELECT a FROM Club'))
+        self.assertEqual(normalize_code('  SELECT nvl(a,0) FROM t '), 'SELECT nvl(a,0) FROM t')
+        self.assertEqual(normalize_code('SELECT FROM WHERE'), 'SELECT FROM WHERE')
+        function = 'CREATE OR REPLACE FUNCTION f RETURN NUMBER IS BEGIN RETURN 1; END;'
+        self.assertEqual(normalize_code(function), function)
+
+    def test_cache(self):
+        """Answers are reused for equivalent code in the same version of the problem and evicted in LRU order"""
+        collection = create_collection('Colleccion de prueba XYZ')
+        problem = create_select_problem(collection, 'SelectProblem ABC DEF')
+        cache = VerdictCache(max_entries=2)
+        data = {'verdict': VerdictCode.WA, 'title': 'WA', 'message': 'msg', 'feedback': 'f', 'des': ''}
+        cache.put(problem, 'SELECT a FROM t', data)
+        cache.put(problem, 'SELECT b FROM t', {'verdict': VerdictCode.TLE})  # Not cached
+        self.assertEqual(cache.get(problem, 'SELECT a FROM t'), (data, True))
+        self.assertEqual(cache.get(problem, 'select A from T'), (data, False))
+        self.assertEqual(cache.get(problem, 'SELECT b FROM t'), (None, False))
+        with translation.override('en'):
+            self.assertEqual(cache.get(problem, 'SELECT a FROM t'), (None, False))
+
+        cache.put(problem, 'SELECT c FROM t', data)
+        cache.get(problem, 'SELECT a FROM t')
+        cache.put(problem, 'SELECT d FROM t', data)
+        self.assertIsNotNone(cache.get(problem, 'SELECT a FROM t')[0])
+        self.assertIsNone(cache.get(problem, 'SELECT c FROM t')[0])
+
+        # Saving a new version of the problem invalidates its answers
+        problem.solution = 'SELECT * FROM Club'
+        problem.save()
+        self.assertEqual(cache.get(problem, 'SELECT a FROM t'), (None, False))
+
+    def test_judge_code(self):
+        """Resubmissions are answered from the cache"""
+        collection = create_collection('Colleccion de prueba XYZ')
+        problem = create_select_problem(collection, 'SelectProblem ABC DEF')
+        self.assertIsNone(verdict_cache())
+        try:
+            os.environ['JUDGE_VERDICT_CACHE_SIZE'] = '10'
+            cache = verdict_cache()
+            self.assertIs(cache, verdict_cache())
+            data = judge_code(problem, problem.solution)
+            self.assertEqual(data['verdict'], VerdictCode.AC)
+            self.assertEqual(judge_code(problem, problem.solution), data)
+            self.assertEqual(judge_code(problem, f'-- Otra vez\n{problem.solution}')['verdict'], VerdictCode.AC)
+
+            # Runtime errors are judged again if the text of the code is different
+            error = judge_code(problem, 'SELECT * FROM Nada')
+            self.assertEqual(error['verdict'], VerdictCode.RE)
+            self.assertEqual(judge_code(problem, 'SELECT * FROM Nada'), error)
+            self.assertNotEqual(judge_code(problem, '\n\nSELECT * FROM Nada')['position'], error['position'])
+            self.assertEqual(len(cache.entries), 2)
+        finally:
+            del os.environ['JUDGE_VERDICT_CACHE_SIZE']
+            judge.verdict_cache.VERDICT_CACHE = None
@@ -70,6 +70,13 @@ class ProblemType(IntEnum):
         return f'ProblemType.{self.name}'
 
 
+class ExecutionEngine(models.TextChoices):  # pylint: disable=too-many-ancestors
+    """DBMS used to judge the problems of a collection"""
+    ORACLE = 'ORACLE', 'Oracle'
+    SQLITE = 'SQLITE', 'SQLite'
+    POSTGRES = 'POSTGRES', 'PostgreSQL'
+
+
 @unique
 class OracleStatusCode(IntEnum):
     """Status code returned by the DB executor"""
@@ -89,6 +96,7 @@ class OracleStatusCode(IntEnum):
     COMPILATION_ERROR = 13
     TLE_USER_CODE = 14
     EXECUTE_DISCRIMINANT_SELECT = 15
+    TLE_PLAN_COST = 16  # Estimated cost of the plan too high (see oracle_db.check_plan_cost)
 
 
 class DesMessageType(IntEnum):
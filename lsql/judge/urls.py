@@ -18,6 +18,7 @@ urlpatterns = [
     path('collection/<int:collection_id>', views.show_collection, name='collection'),
     path('problem/<int:problem_id>', views.show_problem, name='problem'),
     path('submit/<int:problem_id>', views.submit, name='submit'),
+    path('submission_status/<int:job_id>', views.submission_status, name='submission_status'),
     path('hint/<int:problem_id>', views.get_hint, name='hint'),
     path('problem/<int:problem_id>/create_insert', views.download, name='create_insert'),
     path('submission/', views.show_submissions, name='submissions'),
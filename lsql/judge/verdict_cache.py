@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright Enrique Martín <emartinm@ucm.es> 2020
+
+In-process LRU cache of the verdicts of the submissions, so that resubmissions of the same code (up to comments,
+spacing and case) do not need to be judged again
+"""
+from collections import OrderedDict
+import copy
+import os
+import threading
+
+import sqlglot
+from sqlglot import exp, ErrorLevel
+from django.utils import translation
+
+from .oracle_sql import content_hash
+from .types import VerdictCode
+
+# Verdicts that only depend on the code and the problem (TLE and IE depend on the load of the server)
+CACHED_VERDICTS = (VerdictCode.AC, VerdictCode.WA, VerdictCode.RE, VerdictCode.VE)
+
+
+def normalize_code(code):
+    """
+    Canonical form of the code of a submission: the sqlglot rendering of its statements without comments and with
+    unquoted identifiers in lowercase. Oracle names the columns of expressions without alias after their text, so
+    if some SELECT has one of them (or the code cannot be parsed, as PL/SQL) the code is only stripped
+    :return: str
+    """
+    try:
+        statements = [stmt for stmt in sqlglot.parse(code, read='oracle', error_level=ErrorLevel.RAISE) if stmt]
+        if any(isinstance(stmt, exp.Command) for stmt in statements) or \
+                any(not isinstance(column, (exp.Column, exp.Star, exp.Alias))
+                    for stmt in statements if isinstance(stmt, exp.Query) for column in stmt.selects):
+            return code.strip()
+        return ';\n'.join(stmt.sql(dialect='oracle', normalize=True, comments=False,
+                                   unsupported_level=ErrorLevel.RAISE) for stmt in statements)
+    except sqlglot.errors.SqlglotError:
+        return code.strip()
+
+
+def problem_version(problem):
+    """Hash of all the fields of the problem (and the engine of its collection), so it changes when the problem is
+    saved with a different setup, solution or configuration"""
+    fields = [str(field.value_from_object(problem)) for field in problem._meta.concrete_fields]  # pylint: disable=W0212
+    engine = problem.collection.engine if problem.collection_id is not None else None
+    return content_hash(*fields, engine)
+
+
+class VerdictCache:
+    """LRU cache with at most 'max_entries' answers of submissions, keyed by the version of the problem, the language
+    of the messages and the normalized code"""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()  # key -> (code, data)
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def key(problem, code):
+        """Key of the answer to 'code' in 'problem'"""
+        return content_hash(str(problem.pk), problem_version(problem), translation.get_language(),
+                            normalize_code(code))
+
+    def get(self, problem, code):
+        """
+        Cached answer to a submission with the same normalized code
+        :return: (data, same_code), where 'same_code' is True if the cached answer was obtained for exactly the same
+                 code, or (None, False) if there is no cached answer
+        """
+        key = self.key(problem, code)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None, False
+            self.entries.move_to_end(key)
+        cached_code, data = entry
+        return copy.deepcopy(data), cached_code == code
+
+    def put(self, problem, code, data):
+        """Stores the answer to a submission if its verdict does not depend on the load of the server"""
+        if data['verdict'] not in CACHED_VERDICTS:
+            return
+        key = self.key(problem, code)
+        with self.lock:
+            self.entries[key] = (code, copy.deepcopy(data))
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+
+VERDICT_CACHE = None  # VerdictCache of the process, created on first use
+
+
+def verdict_cache():
+    """VerdictCache with JUDGE_VERDICT_CACHE_SIZE entries, or None if JUDGE_VERDICT_CACHE_SIZE is not greater than 0"""
+    global VERDICT_CACHE  # pylint: disable=global-statement
+    max_entries = int(os.environ.get('JUDGE_VERDICT_CACHE_SIZE', 0))
+    if max_entries <= 0:
+        return None
+    if VERDICT_CACHE is None:
+        VERDICT_CACHE = VerdictCache(max_entries)
+    return VERDICT_CACHE
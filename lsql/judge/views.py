@@ -5,14 +5,16 @@ Functions that process HTTP connections
 """
 from datetime import timedelta, datetime
 import io
+import os
 
+from asgiref.sync import sync_to_async
 from logzero import logger
 from pyexcel_ods3 import save_data
 
 from django.http import HttpResponseRedirect, JsonResponse, HttpResponseForbidden, FileResponse
 from django.http.response import HttpResponse, HttpResponseNotFound
 from django.urls import reverse
-from django.shortcuts import render, get_object_or_404
+from django.shortcuts import render, get_object_or_404, aget_object_or_404
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import Group
 from django.contrib.auth.decorators import login_required
@@ -23,15 +25,16 @@ from django.template.exceptions import TemplateDoesNotExist
 from django.template.loader import render_to_string
 from django.views.decorators.http import require_POST
 
-from .exceptions import ExecutorException
-from .feedback import compile_error_to_html_table, filter_expected_db
+from .admission import JudgePriority, admission_control
+from .exceptions import AdmissionRejected
+from .feedback import filter_expected_db
 from .forms import SubmitForm, ResultStaffForm, ResultStudentForm, ShowSubmissionsForm, DownloadRankingForm, \
     CollectionFilterForm
 from .models import Collection, Problem, Submission, ObtainedAchievement, AchievementDefinition, \
-    NumSubmissionsProblemsAchievementDefinition, Hint, UsedHint
-from .oracle_driver import OracleExecutor
-from .types import VerdictCode, OracleStatusCode, ProblemType
+    Hint, UsedHint, JudgeJob
+from .types import VerdictCode, ProblemType
 from .statistics import submissions_by_day, submission_count, participation_per_group
+from .judging import judge_code_async, store_submission
 
 # TRANSLATIONS #
 # To translate the code to another language you need to create the translation file:
@@ -50,8 +53,8 @@ from .statistics import submissions_by_day, submission_count, participation_per_
 ####################
 
 def get_subclass_problem(problem_id):
-    """Look for problem 'pk' in the different child classes of Problem"""
-    queryset = Problem.objects.filter(pk=problem_id).select_subclasses()
+    """Look for problem 'pk' in the different child classes of Problem, together with its collection"""
+    queryset = Problem.objects.filter(pk=problem_id).select_subclasses().select_related('collection')
     return None if len(queryset) == 0 else queryset[0]
 
 
@@ -63,24 +66,6 @@ def first_day_of_course(init_course: datetime) -> datetime:
     return first_day
 
 
-def check_if_get_achievement(user, verdict):
-    """Check if the user get some achievement and return a list of obtained achievements"""
-    obtained_achievements = []
-    if verdict == VerdictCode.AC:
-        for ach in AchievementDefinition.objects.all().select_subclasses():
-            if ach.check_and_save(user):
-                obtained_achievements.append(ach)
-
-    # If the verdict != AC (correct) only can get a NumSubmissionsProblemsAchievementDefinition
-    else:
-        # pylint false positive E1133
-        for ach in NumSubmissionsProblemsAchievementDefinition.objects.all():  # pylint: disable=E1133
-            if ach.check_and_save(user):
-                obtained_achievements.append(ach)
-
-    return obtained_achievements
-
-
 ##############
 #   Views    #
 ##############
@@ -235,6 +220,13 @@ def show_problem(request, problem_id):
     # Filter the expected result to display it
     problem.show_added, problem.show_modified, problem.show_removed = filter_expected_db(problem.expected_result[0],
                                                                                          problem.initial_db[0])
+    if problem.problem_type() in (ProblemType.PROC, ProblemType.TRIGGER):
+        # Expected result of each test case
+        problem.expected_cases = []
+        for (name, code), expected_db in zip(problem.test_cases(), problem.expected_result):
+            added, modified, removed = filter_expected_db(expected_db, problem.initial_db[0])
+            problem.expected_cases.append({'name': name, 'code': code.strip(), 'show_added': added,
+                                           'show_modified': modified, 'show_removed': removed})
     # Extends problem with hint information
     problem.available_hints = Hint.objects.filter(problem=problem).order_by('num_submit').count()
     problem.used_hints = UsedHint.objects.filter(user=request.user).filter(hint_definition__problem=problem)
@@ -341,25 +333,6 @@ def download(_, problem_id):
     return response
 
 
-def extend_dictionary_with_des(data, problem, code):
-    """ Extend the data that answers a submission with DES feedback (if needed) """
-    if problem.problem_type() in [ProblemType.SELECT, ProblemType.DML]:
-        messages_raw = problem.get_des_messages_solution(code)
-        # Extends the snippet to mark the position of the error and also extract line and column
-        messages = []
-        for (error_code, msg, snippet) in messages_raw:
-            if snippet and problem.problem_type() == ProblemType.SELECT:
-                len_last_line = len(snippet.strip().split('\n')[-1])
-                num_line = len(snippet.strip().split('\n'))
-                snippet += '.'*len_last_line + '^^^'
-                line_col = (num_line, len_last_line)
-            else:
-                line_col = None
-            messages.append((error_code, msg, snippet, line_col))
-        # We strip to avoid submitting empty strings
-        data['des'] = render_to_string('feedback_des.html', {'des_msgs': messages}).strip()
-
-
 def first_message_from_errordict(errordict):
     """ Returns the first error message from an ErrorDict as a string 'key: message' """
     key = list(errordict.keys())[0]
@@ -367,77 +340,72 @@ def first_message_from_errordict(errordict):
     return f'{key}: {line}'
 
 
+def judge_priority(request, user):
+    """ Priority of a submission in the admission control: staff before students. Batch clients that submit again
+        old submissions ask for the lowest priority with the header X-Judge-Priority (shell.rejudge does not use
+        the submit view, so it is never rejected by the admission control) """
+    if request.headers.get('X-Judge-Priority') == 'rejudge':
+        return JudgePriority.REJUDGE
+    return JudgePriority.STAFF if user.is_staff else JudgePriority.STUDENT
+
+
 @login_required
 @require_POST
 # pylint does not understand the dynamic attributes in VerdictCode (TextChoices), so we need to disable
 # no-member warning in this specific function
 # pylint: disable=no-member
-def submit(request, problem_id):
+async def submit(request, problem_id):
     """ Process a user submission. The POST request contains the following parameters:
          * code: (string, required): code to be assessed
+        If the judge queue is enabled (JUDGE_QUEUE), valid submissions are stored in the queue and the answer
+        contains the URL of their status (see submission_status). Otherwise, the submission is judged in a thread
+        (see judge_code_async) so that an ASGI server can wait for many submissions at the same time
     """
     # Error 404 if there is no Problem 'pk'
-    general_problem = get_object_or_404(Problem, pk=problem_id)
-    problem = get_subclass_problem(problem_id)
+    general_problem = await aget_object_or_404(Problem, pk=problem_id)
+    user = await request.auser()
     submit_form = SubmitForm(request.POST)
-    data = {'verdict': VerdictCode.IE, 'title': VerdictCode.IE.label,
-            'message': VerdictCode.IE.message(), 'feedback': '', 'des': ''}
-    code = ''
-    if submit_form.is_valid():
-        try:
-            # AC or WA
-            code = submit_form.cleaned_data['code']
-            logger.debug('Checking submission to problem PK=%s. Code: %s', problem_id, code)
-            data['verdict'], data['feedback'] = problem.judge(code, OracleExecutor.get())
-            data['title'] = data['verdict'].label
-            data['message'] = data['verdict'].message()
-            extend_dictionary_with_des(data, problem, code)  # Check DES if needed
-        except ExecutorException as excp:
-            # Exceptions when judging: RE, TLE, VE or IE
-            if excp.error_code == OracleStatusCode.EXECUTE_USER_CODE:
-                data['verdict'] = VerdictCode.RE
-                data['title'] = VerdictCode.RE.label
-                data['message'] = VerdictCode.RE.message()
-                data['feedback'] = (f'{excp.statement} --> {excp.message}'
-                                    if problem.problem_type() == ProblemType.FUNCTION else excp.message)
-                data['position'] = excp.position
-                data['position_msg'] = _('Posición: línea {row}, columna {col}')\
-                    .format(row=excp.position[0]+1, col=excp.position[1]+1)
-                extend_dictionary_with_des(data, problem, code)  # Check DES if needed
-            elif excp.error_code == OracleStatusCode.TLE_USER_CODE:
-                data['verdict'] = VerdictCode.TLE
-                data['title'] = VerdictCode.TLE.label
-                data['message'] = VerdictCode.TLE.message()
-                extend_dictionary_with_des(data, problem, code)  # Check DES if needed
-            elif excp.error_code == OracleStatusCode.NUMBER_STATEMENTS:
-                data['verdict'] = VerdictCode.VE
-                data['title'] = VerdictCode.VE.label
-                data['message'] = VerdictCode.VE.message(problem)
-                data['feedback'] = ''  # Feedback not needed
-            elif excp.error_code == OracleStatusCode.COMPILATION_ERROR:
-                data['verdict'] = VerdictCode.WA
-                data['title'] = VerdictCode.WA.label
-                data['message'] = VerdictCode.WA.message()
-                data['feedback'] = compile_error_to_html_table(excp.message)
-    else:
-        data['verdict'] = VerdictCode.VE
-        data['title'] = VerdictCode.VE.label
-        data['message'] = first_message_from_errordict(submit_form.errors)
-
-    submission = Submission(code=code[:5000], verdict_code=data['verdict'], verdict_message=data['message'],
-                            user=request.user, problem=general_problem)
-    submission.save()
-
-    # Look for obtained achievements
-    achievement_list = check_if_get_achievement(request.user, data['verdict'])
-    if achievement_list:
-        context = {'achievement_list': achievement_list, 'user': request.user.pk}
-        html = render_to_string('achievement_notice.html', context)
-        data['achievements'] = html
-    logger.debug('Stored submission %s', submission)
+    if not submit_form.is_valid():
+        data = {'verdict': VerdictCode.VE, 'title': VerdictCode.VE.label,
+                'message': first_message_from_errordict(submit_form.errors), 'feedback': '', 'des': ''}
+        await sync_to_async(store_submission)(user, general_problem, '', data)
+        return JsonResponse(data)
+
+    code = submit_form.cleaned_data['code']
+    if int(os.environ.get('JUDGE_QUEUE', 0)) > 0:
+        job = JudgeJob(code=code, user=user, problem=general_problem, language=request.LANGUAGE_CODE)
+        await job.asave()
+        logger.debug('Queued submission to problem PK=%s as job %s', problem_id, job.pk)
+        return JsonResponse({'job': job.pk, 'status': reverse('judge:submission_status', args=[job.pk])})
+
+    problem = await sync_to_async(get_subclass_problem)(problem_id)
+    admission = admission_control()
+    try:
+        if admission is None:
+            data = await judge_code_async(problem, code)
+        else:
+            async with admission.admitted(user.pk, judge_priority(request, user)):
+                data = await judge_code_async(problem, code)
+    except AdmissionRejected as excp:
+        # The submission is not stored, as it has not been judged
+        data = {'title': _('Demasiados envíos'), 'retry_after': excp.retry_after,
+                'message': _('Hay demasiados envíos esperando a ser corregidos. Vuelve a enviar tu solución dentro '
+                             'de {seconds} segundos').format(seconds=excp.retry_after)}
+        return JsonResponse(data, status=429, headers={'Retry-After': str(excp.retry_after)})
+    await sync_to_async(store_submission)(user, general_problem, code, data)
     return JsonResponse(data)
 
 
+@login_required
+def submission_status(request, job_id):
+    """ State of a submission in the judge queue: {'job': id, 'state': state} while it has not been judged, and the
+        same answer as submit once it has been judged """
+    job = get_object_or_404(JudgeJob, pk=job_id, user=request.user)
+    if job.state != JudgeJob.State.DONE:
+        return JsonResponse({'job': job.pk, 'state': job.state})
+    return JsonResponse(job.result)
+
+
 @login_required
 def password_change_done(request):
     """ Password change confirmation """